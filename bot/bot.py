@@ -7,11 +7,21 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from telegram.error import TimedOut, NetworkError, InvalidToken
 from loguru import logger
+from typing import Dict, Optional
+import asyncio
 import httpx
 
 from config import settings
 from services.database import DatabaseService
 from services.calculator import CostCalculator
+from services.cache import ParamsCache, ResultStore
+from services.extractor import RuleExtractor
+from services.prompts import PromptBuilder
+from services.llm_health import ModelHealth
+from services.llm_limiter import LLMLimiter
+from services.variants import VARIANT_PARAMS
+from services.templates import TemplateEngine
+from services.batch import BatchEngine
 from services.ai_agent import AIAgent
 import time
 
@@ -22,11 +32,38 @@ class SmetaBot:
     def __init__(self):
         """Инициализация бота"""
         self.db = DatabaseService(settings.supabase_url, settings.supabase_service_role_key)
-        self.calculator = CostCalculator(self.db)
-        self.ai = AIAgent(settings.openrouter_api_key, settings.openrouter_model)
+        self.calculator = CostCalculator(
+            self.db,
+            coeff_cache_size=settings.coeff_cache_size,
+            result_store=ResultStore(settings.result_cache_path, settings.result_cache_memory_size),
+            trace_enabled=settings.calc_trace,
+            index_period=settings.price_index_period or None,
+        )
+        self.ai = AIAgent(
+            settings.openrouter_api_key,
+            settings.openrouter_model,
+            params_cache=ParamsCache(
+                settings.params_cache_path, settings.params_cache_memory_size, settings.params_cache_ttl
+            ),
+            extractor=RuleExtractor() if settings.local_extractor else None,
+            prompt_builder=PromptBuilder(settings.prompt_examples) if settings.compact_prompt else None,
+            base_url=settings.openrouter_base_url,
+            health=ModelHealth(
+                settings.llm_hedge_initial_delay, settings.llm_hedge_min_delay, settings.llm_hedge_max_delay
+            ) if settings.llm_hedging else None,
+            fallback_model=settings.openrouter_fallback_model,
+            limiter=LLMLimiter(
+                settings.llm_max_concurrency, settings.llm_rate_limit, settings.llm_burst
+            ) if settings.llm_max_concurrency > 0 else None,
+        )
+        self.templates = TemplateEngine(self.calculator)
+        self.batch = BatchEngine(self.calculator, self.ai)
         
-        # Хранилище контекста пользователей (для уточняющих вопросов)
+        # Хранилище контекста пользователей (уточняющие вопросы и состояние расчета);
+        # запись живет session_ttl после последнего обращения, не больше session_max записей
         self.user_context = {}
+        # Спекулятивный поиск: догадка совпала с ответом LLM / не совпала
+        self.prefetch_stats = {"hit": 0, "miss": 0}
         # Кэш авторизации: (user_id, username_lower) -> (allowed, expires_at)
         self.auth_cache = {}
         
@@ -49,6 +86,7 @@ class SmetaBot:
             .get_updates_read_timeout(45.0)
             .get_updates_write_timeout(30.0)
             .get_updates_pool_timeout(30.0)
+            .post_init(self._post_init)
             .build()
         )
 
@@ -59,6 +97,15 @@ class SmetaBot:
         app.add_error_handler(self._handle_ptb_error)
         return app
 
+    async def _post_init(self, app: Application) -> None:
+        """Предкомпиляция планов расчета для всего каталога расценок."""
+        if self.calculator.plans is None:
+            return
+        try:
+            await self.calculator.plans.precompile()
+        except Exception as e:
+            logger.error(f"Не удалось предкомпилировать планы расчета: {e}")
+
     async def _handle_ptb_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Глобальный обработчик ошибок PTB для контроля шумных сетевых логов."""
         err = context.error
@@ -67,6 +114,23 @@ class SmetaBot:
             return
         logger.exception(f"Необработанная ошибка PTB: {err}")
     
+    def _touch_session(self, user_id: int) -> dict:
+        """Продлевает сессию пользователя на session_ttl"""
+        ctx = self.user_context[user_id]
+        ctx['expires_at'] = time.time() + settings.session_ttl
+        return ctx
+
+    def _prune_sessions(self) -> None:
+        """Удаляет истекшие сессии и самые старые сверх session_max (вместе с состоянием расчета)"""
+        now = time.time()
+        for user_id in [uid for uid, ctx in self.user_context.items() if ctx.get('expires_at', 0) <= now]:
+            del self.user_context[user_id]
+        excess = len(self.user_context) - settings.session_max
+        if excess > 0:
+            oldest = sorted(self.user_context, key=lambda uid: self.user_context[uid].get('expires_at', 0))
+            for user_id in oldest[:excess]:
+                del self.user_context[user_id]
+
     async def check_auth(self, user_id: int, username: str | None) -> bool:
         """Проверка авторизации пользователя (по таблице telegram_users)"""
         key = (user_id, (username or "").lower())
@@ -146,11 +210,12 @@ class SmetaBot:
         if not await self._ensure_auth(update):
             return
         
+        self._prune_sessions()
         if user_id not in self.user_context:
             await query.edit_message_text("❌ Сессия истекла. Начните новый запрос.")
             return
         
-        ctx = self.user_context[user_id]
+        ctx = self._touch_session(user_id)
         
         # Парсим callback data: param_name:value
         if ':' in data:
@@ -164,8 +229,19 @@ class SmetaBot:
             
             # Сохраняем параметр
             ctx['params'][param_name] = value
+            self._apply_variant(ctx, param_name, value)
             logger.info(f"Пользователь {user_id} выбрал {param_name}={value}")
             
+            # Результат уже показан — пересчитываем только затронутые части и показываем разницу
+            if ctx.get('calculated') and ctx.get('state'):
+                # выбранный вариант категории мог сменить строку расценки (_apply_variant)
+                diff = await self.calculator.recalculate(ctx['state'], {param_name: value}, work=ctx['work'])
+                await query.message.reply_text(self.ai.format_diff(diff), parse_mode="Markdown")
+                return
+            
+            # Идут уточнения — ответ применяется к первому расчету инкрементально
+            await self._sync_state(ctx)
+            
             # Проверяем, есть ли еще недостающие параметры
             missing = self.ai.get_missing_parameters(ctx['params'], ctx['params'].get('work_type', ''))
             
@@ -187,8 +263,9 @@ class SmetaBot:
         logger.info(f"Получено сообщение от {user_id}: {user_message}")
         
         try:
+            self._prune_sessions()
             # Проверяем, ожидаем ли ответ на уточняющий вопрос
-            if user_id in self.user_context and self.user_context[user_id].get('waiting_for'):
+            if user_id in self.user_context and self._touch_session(user_id).get('waiting_for'):
                 # Если пользователь прислал новый запрос вместо ответа — сбрасываем ожидание
                 if self._looks_like_new_request(user_message):
                     self.user_context.pop(user_id, None)
@@ -199,8 +276,28 @@ class SmetaBot:
             # Показываем, что бот работает
             await update.message.reply_text("⏳ Анализирую запрос...")
             
-            # 1. Извлекаем параметры через AI
-            params = await self.ai.extract_parameters(user_message)
+            # 0. Типовая смета по шаблону — без LLM, все строки одним пакетом
+            estimate = await self.templates.from_message(user_message)
+            if estimate is not None:
+                self.user_context.pop(user_id, None)
+                await update.message.reply_text(self.ai.format_estimate(estimate), parse_mode="Markdown")
+                return
+            
+            # 0.1. Список работ — параметры всех пунктов одним вызовом, расчет одним пакетом
+            batch = await self.batch.from_message(user_message, user_id=user_id)
+            if batch is not None:
+                self.user_context.pop(user_id, None)
+                await update.message.reply_text(self.ai.format_batch(batch), parse_mode="Markdown")
+                return
+            
+            # 1. Извлекаем параметры через AI; поиск по локальной догадке идет параллельно
+            prefetch = self._start_prefetch(user_message)
+            try:
+                params = await self.ai.extract_parameters(user_message, user_id=user_id)
+            except BaseException:
+                self._drop_prefetch(prefetch)
+                raise
+            prefetched = await self._take_prefetch(prefetch, params)
 
             if not params.get("work_type"):
                 await update.message.reply_text(
@@ -217,7 +314,8 @@ class SmetaBot:
                 category=params.get("category"),
                 territory=params.get("territory_type"),
                 height_section=params.get("height_section"),
-                column=params.get("column")
+                column=params.get("column"),
+                prefetched=prefetched,
             )
             
             if not search_result.found:
@@ -229,7 +327,7 @@ class SmetaBot:
             works = search_result.works
             
             # 3. Выбираем лучшую работу (передаем params для фильтрации по категории)
-            selected_work = await self.ai.select_best_work(user_message, works, params)
+            selected_work = await self.ai.select_best_work(user_message, works, params, user_id=user_id)
             
             if not selected_work:
                 await update.message.reply_text("❌ Не удалось выбрать подходящую работу.")
@@ -242,11 +340,23 @@ class SmetaBot:
                 'original_message': user_message,
                 'waiting_for': None
             }
+            self._touch_session(user_id)
             
             # 5. Проверяем, нужны ли уточнения
             missing = self.ai.get_missing_parameters(params, params.get('work_type', ''))
+            # Категория не указана, а у строки есть категории — предлагаем варианты с ценами
+            if not params.get('category') and (selected_work.get('params') or {}).get('category'):
+                missing.insert(0, {
+                    'param': 'category',
+                    'question': '📊 Категория сложности не указана. Выберите вариант:',
+                    'options': [],
+                    'required': True,
+                    'affects': 'Строка расценки'
+                })
             
             if missing:
+                # Первый расчет по известным параметрам; ответы пересчитывают только затронутое
+                await self._start_state(self.user_context[user_id])
                 # Задаем уточняющий вопрос
                 await self._ask_clarification(update.message, user_id, missing[0])
             else:
@@ -260,6 +370,49 @@ class SmetaBot:
                 "Попробуйте еще раз или обратитесь к администратору."
             )
 
+    def _start_prefetch(self, user_message: str) -> Optional[tuple]:
+        """
+        Запускает загрузку кандидатов поиска по локальной догадке (тип работ, масштаб),
+        пока параметры извлекаются LLM
+
+        Returns:
+            (query, scale, задача) или None, если догадки нет
+        """
+        guess = self.ai.guess_parameters(user_message)
+        if not guess:
+            return None
+        query, scale = guess["work_type"], guess.get("scale") or None
+        task = asyncio.create_task(self.db.fetch_search_candidates(query, scale))
+        return query, scale, task
+
+    async def _take_prefetch(self, prefetch: Optional[tuple], params: Dict):
+        """Кандидаты спекулятивного поиска, если тип работ и масштаб совпали с ответом LLM"""
+        if prefetch is None:
+            return None
+        query, scale, task = prefetch
+        if (params.get("work_type"), params.get("scale") or None) != (query, scale):
+            self._drop_prefetch(prefetch)
+            self.prefetch_stats["miss"] += 1
+            logger.info(f"Спекулятивный поиск не пригодился: {query}, {scale} "
+                        f"(совпадений {self.prefetch_stats['hit']}/{sum(self.prefetch_stats.values())})")
+            return None
+        try:
+            candidates = await task
+        except Exception as e:
+            logger.error(f"Ошибка спекулятивного поиска: {e}")
+            return None
+        self.prefetch_stats["hit"] += 1
+        return candidates
+    
+    @staticmethod
+    def _drop_prefetch(prefetch: Optional[tuple]) -> None:
+        """Отменяет ненужный спекулятивный поиск; его ошибка не попадет в лог как необработанная"""
+        if prefetch is None:
+            return
+        task = prefetch[2]
+        task.cancel()
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
     @staticmethod
     def _looks_like_new_request(message: str) -> bool:
         """Грубая эвристика: отличает новый расчет от короткого ответа (1/2/да/нет)."""
@@ -286,7 +439,29 @@ class SmetaBot:
     async def _ask_clarification(self, message, user_id: int, param_info: dict):
         """Задает уточняющий вопрос с inline-кнопками"""
         ctx = self.user_context[user_id]
+        
+        # Для категории и типа территории считаем все варианты сразу — кнопки с ценами
+        comparison = None
+        if param_info['param'] in VARIANT_PARAMS:
+            comparison = await self._price_variants(ctx, param_info)
+            if comparison is not None:
+                param_info = {**param_info, 'options': [
+                    (str(i), f"{v.label} — {v.total_cost:,.0f} руб", v.value)
+                    for i, v in enumerate(comparison.variants, 1)
+                ]}
+        if not param_info['options']:
+            # Спросить нечего (у строки нет вариантов) — остаемся на выбранной строке
+            own = (ctx['work'].get('params') or {}).get(param_info['param'])
+            if own is not None:
+                ctx['params'][param_info['param']] = own
+            missing = self.ai.get_missing_parameters(ctx['params'], ctx['params'].get('work_type', ''))
+            if missing:
+                await self._ask_clarification(message, user_id, missing[0])
+            else:
+                await self._perform_calculation(message, user_id)
+            return
         ctx['waiting_for'] = param_info['param']
+        ctx['options'] = [value for _, _, value in param_info['options']]
         
         # Создаем inline-кнопки
         keyboard = []
@@ -300,10 +475,40 @@ class SmetaBot:
         work = ctx['work']
         text = f"📋 *Работа:* {work['work_title']}\n"
         text += f"📏 *Объем:* {ctx['params'].get('quantity', '?')} {work.get('unit', '')}\n\n"
+        if comparison is not None:
+            text += self.ai.format_variants(comparison) + "\n"
         text += f"❓ *{param_info['question']}*"
         
         await message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
     
+    async def _price_variants(self, ctx: dict, param_info: dict):
+        """Считает все варианты параметра; None — если считать нечего или расчет не удался"""
+        params = ctx['params']
+        values = [value for _, _, value in param_info['options']] or None
+        try:
+            comparison = await self.calculator.price_variants(
+                work=ctx['work'],
+                quantity=params.get('quantity') or 1,
+                params=params,
+                param=param_info['param'],
+                values=values,
+                work_stage=params.get('work_stage') or 'обе'
+            )
+        except Exception as e:
+            logger.error(f"Ошибка расчета вариантов {param_info['param']}: {e}")
+            return None
+        if len(comparison.variants) < 2:
+            return None
+        ctx['variants'] = {v.value: v.work for v in comparison.variants}
+        return comparison
+    
+    @staticmethod
+    def _apply_variant(ctx: dict, param_name: str, value) -> None:
+        """Выбранный вариант категории — другая строка расценки"""
+        work = (ctx.get('variants') or {}).get(value)
+        if work is not None and param_name == 'category':
+            ctx['work'] = work
+    
     async def _handle_clarification_response(self, update: Update, user_message: str):
         """Обрабатывает текстовый ответ на уточняющий вопрос"""
         user_id = update.effective_user.id
@@ -334,6 +539,14 @@ class SmetaBot:
             elif any(kw in msg_lower for kw in ['2', 'нет', 'без']):
                 value = False
         
+        elif param_name == 'category':
+            options = ctx.get('options') or []
+            text = msg_lower.upper()
+            if text.isdigit() and 1 <= int(text) <= len(options):
+                value = options[int(text) - 1]
+            elif text in options:
+                value = text
+        
         elif param_name == 'work_stage':
             if any(kw in msg_lower for kw in ['1', 'обе', 'полн', 'все']):
                 value = 'обе'
@@ -351,8 +564,11 @@ class SmetaBot:
         
         # Сохраняем параметр
         ctx['params'][param_name] = value
+        self._apply_variant(ctx, param_name, value)
         ctx['waiting_for'] = None
         logger.info(f"Пользователь {user_id} ответил {param_name}={value}")
+        # Ответ применяется к первому расчету инкрементально
+        await self._sync_state(ctx)
         
         # Проверяем, есть ли еще недостающие параметры
         missing = self.ai.get_missing_parameters(ctx['params'], ctx['params'].get('work_type', ''))
@@ -365,74 +581,127 @@ class SmetaBot:
             await update.message.reply_text("⏳ Выполняю расчет...")
             await self._perform_calculation(update.message, user_id)
     
-    async def _perform_calculation(self, message, user_id: int):
-        """Выполняет расчет и отправляет результат"""
-        ctx = self.user_context[user_id]
+    async def _prepare_work(self, ctx: dict) -> tuple:
+        """
+        Объем и этап расчета; недостающие цены строки (единая цена, соседняя строка)
+
+        Returns:
+            (quantity, work_stage)
+        """
         params = ctx['params']
         work = ctx['work']
+        # Определяем объем
+        quantity = params.get('quantity', 1)
+        if quantity is None:
+            quantity = 1
         
-        try:
-            # Определяем объем
-            quantity = params.get('quantity', 1)
-            if quantity is None:
-                quantity = 1
-            
-            # Определяем этап работ
-            work_stage = params.get('work_stage', 'обе')
-            
-            # Если работа хранит единую цену (price), подставляем ее в нужный этап
-            if work_stage in ['полевые', 'обе'] and not work.get('price_field') and work.get('price'):
-                work['price_field'] = work['price']
-            if work_stage in ['камеральные', 'обе'] and not work.get('price_office') and work.get('price'):
-                work['price_office'] = work['price']
+        # Определяем этап работ
+        work_stage = params.get('work_stage', 'обе')
+        
+        # Если работа хранит единую цену (price), подставляем ее в нужный этап
+        if work_stage in ['полевые', 'обе'] and not work.get('price_field') and work.get('price'):
+            work['price_field'] = work['price']
+        if work_stage in ['камеральные', 'обе'] and not work.get('price_office') and work.get('price'):
+            work['price_office'] = work['price']
 
-            # Проверяем, есть ли нужные цены в выбранной работе
-            # Если нет - ищем дополнительную работу с нужной ценой
-            if work_stage in ['полевые', 'обе'] and not work.get('price_field'):
-                # Ищем работу с полевой ценой
-                logger.warning(f"Работа {work.get('work_title')} не имеет полевой цены, ищем...")
-                works = await self.db.search_works(
-                    query=params.get('work_type', ''),
-                    scale=params.get('scale'),
-                    category=params.get('category'),
-                    territory=params.get('territory_type')
-                )
-                for w in works:
-                    if w.get('price_field') or w.get('price'):
-                        work['price_field'] = w.get('price_field') or w.get('price')
-                        logger.info(f"Найдена полевая цена: {w['price_field']}")
-                        break
-            
-            if work_stage in ['камеральные', 'обе'] and not work.get('price_office'):
-                # Ищем работу с камеральной ценой
-                logger.warning(f"Работа {work.get('work_title')} не имеет камеральной цены, ищем...")
-                works = await self.db.search_works(
-                    query=params.get('work_type', ''),
-                    scale=params.get('scale'),
-                    category=params.get('category'),
-                    territory=params.get('territory_type')
-                )
-                for w in works:
-                    if w.get('price_office') or w.get('price'):
-                        work['price_office'] = w.get('price_office') or w.get('price')
-                        logger.info(f"Найдена камеральная цена: {w['price_office']}")
-                        break
-            
-            # Выполняем расчет
-            calculation = await self.calculator.calculate_full(
-                work=work,
+        # Проверяем, есть ли нужные цены в выбранной работе
+        # Если нет - ищем дополнительную работу с нужной ценой
+        if work_stage in ['полевые', 'обе'] and not work.get('price_field'):
+            # Ищем работу с полевой ценой
+            logger.warning(f"Работа {work.get('work_title')} не имеет полевой цены, ищем...")
+            works = await self.db.search_works(
+                query=params.get('work_type', ''),
+                scale=params.get('scale'),
+                category=params.get('category'),
+                territory=params.get('territory_type')
+            )
+            for w in works:
+                if w.get('price_field') or w.get('price'):
+                    work['price_field'] = w.get('price_field') or w.get('price')
+                    logger.info(f"Найдена полевая цена: {w['price_field']}")
+                    break
+        
+        if work_stage in ['камеральные', 'обе'] and not work.get('price_office'):
+            # Ищем работу с камеральной ценой
+            logger.warning(f"Работа {work.get('work_title')} не имеет камеральной цены, ищем...")
+            works = await self.db.search_works(
+                query=params.get('work_type', ''),
+                scale=params.get('scale'),
+                category=params.get('category'),
+                territory=params.get('territory_type')
+            )
+            for w in works:
+                if w.get('price_office') or w.get('price'):
+                    work['price_office'] = w.get('price_office') or w.get('price')
+                    logger.info(f"Найдена камеральная цена: {w['price_office']}")
+                    break
+        return quantity, work_stage
+
+    async def _start_state(self, ctx: dict) -> None:
+        """Первый расчет до уточнений: ответы затем пересчитываются инкрементально"""
+        try:
+            quantity, work_stage = await self._prepare_work(ctx)
+            ctx['state'] = await self.calculator.start_session(
+                work=ctx['work'],
                 quantity=quantity,
-                params=params,
+                params=ctx['params'],
                 work_stage=work_stage
             )
+        except Exception as e:
+            logger.warning(f"Предварительный расчет не выполнен: {e}")
+            ctx['state'] = None
+
+    async def _sync_state(self, ctx: dict):
+        """
+        Применяет к состоянию расчета уточненные параметры и выбранную строку
+        (CostCalculator.recalculate — только затронутые K1/K2/K3 и надбавки)
+
+        Returns:
+            Состояние или None, если его нет (или пересчет не удался — нужен полный расчет)
+        """
+        state = ctx.get('state')
+        if state is None:
+            return None
+        try:
+            quantity, work_stage = await self._prepare_work(ctx)
+            changes = {k: v for k, v in ctx['params'].items() if state.params.get(k) != v}
+            changes.update(quantity=quantity, work_stage=work_stage)
+            diff = await self.calculator.recalculate(state, changes, work=ctx['work'])
+        except Exception as e:
+            logger.warning(f"Инкрементальный пересчет не выполнен: {e}")
+            ctx['state'] = None
+            return None
+        if diff['changed_params']:
+            logger.info(f"Уточнения {sorted(diff['changed_params'])}: пересчитаны {diff['evaluated'] or 'только суммы'}")
+        return state
+
+    async def _perform_calculation(self, message, user_id: int):
+        """Выполняет расчет и отправляет результат"""
+        ctx = self.user_context[user_id]
+        
+        try:
+            # Первый расчет уже сделан до уточнений — применяем только ответы
+            state = await self._sync_state(ctx)
+            if state is None:
+                quantity, work_stage = await self._prepare_work(ctx)
+                # Выполняем расчет (состояние сохраняется для пересчета при уточнениях)
+                state = await self.calculator.start_session(
+                    work=ctx['work'],
+                    quantity=quantity,
+                    params=ctx['params'],
+                    work_stage=work_stage
+                )
+            calculation = state.result
             
             # Форматируем ответ
             response = await self.ai.format_response(calculation)
             
             await message.reply_text(response, parse_mode="Markdown")
             
-            # Очищаем контекст
-            del self.user_context[user_id]
+            # Сохраняем состояние: повторный выбор в кнопках уточнения пересчитает результат
+            ctx['state'] = state
+            ctx['calculated'] = True
+            ctx['waiting_for'] = None
             
         except Exception as e:
             logger.error(f"Ошибка расчета: {e}")
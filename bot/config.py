@@ -16,6 +16,22 @@ class Settings(BaseSettings):
     # OpenRouter AI
     openrouter_api_key: str
     openrouter_model: str = "anthropic/claude-3.5-sonnet"
+    # Адрес API: для нагрузочных замеров без OpenRouter — локальная заглушка
+    # scripts/llm_stub.py, например http://127.0.0.1:8089/v1
+    openrouter_base_url: str = "https://openrouter.ai/api/v1"
+    # Резервная (более дешевая) модель для дублирующих запросов ("" — дубль в ту же модель)
+    openrouter_fallback_model: str = ""
+    # Дублирующий запрос, если ответа нет дольше p95 задержки модели;
+    # задержка до первых замеров и ее границы, сек
+    llm_hedging: bool = True
+    llm_hedge_initial_delay: float = 8.0
+    llm_hedge_min_delay: float = 2.0
+    llm_hedge_max_delay: float = 20.0
+    # Общий допуск запросов к LLM: одновременных запросов (0 — без очереди),
+    # запросов в секунду (0 — без ограничения) и запросов подряд без ожидания
+    llm_max_concurrency: int = 8
+    llm_rate_limit: float = 2.0
+    llm_burst: int = 5
     
     # Supabase Database
     supabase_url: str
@@ -29,6 +45,32 @@ class Settings(BaseSettings):
     # Webhook (для деплоя)
     webhook_url: str = ""
     
+    # Калькулятор: размер кэша наборов коэффициентов K1/K2/K3
+    coeff_cache_size: int = 1024
+    # Кэш готовых результатов расчета: файл SQLite ("" — только в памяти) и размер LRU
+    result_cache_path: str = "data/results.sqlite"
+    result_cache_memory_size: int = 256
+    # Сессия пользователя (уточнения и состояние расчета): срок жизни после
+    # последнего сообщения, сек, и максимум хранимых сессий
+    session_ttl: float = 3600.0
+    session_max: int = 1000
+    # Трассировка шагов расчета (время и запросы к БД) в результате и в логе
+    calc_trace: bool = False
+    # Период индекса изменения стоимости для итога в текущих ценах
+    # ("latest" — последний опубликованный, "2025Q3", "" — без индекса)
+    price_index_period: str = "latest"
+    # Кэш параметров, извлеченных LLM: файл SQLite ("" — только в памяти),
+    # размер LRU и срок жизни записи, сек (0 — бессрочно)
+    params_cache_path: str = "data/params.sqlite"
+    params_cache_memory_size: int = 512
+    params_cache_ttl: float = 7 * 24 * 3600.0
+    # Разбор типовых запросов без LLM (services/extractor.py)
+    local_extractor: bool = True
+    # Компактный промпт extract_parameters (services/prompts.py): только нужные
+    # разделы параметров и prompt_examples похожих примеров; False — полный промпт
+    compact_prompt: bool = True
+    prompt_examples: int = 6
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
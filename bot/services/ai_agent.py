@@ -7,57 +7,139 @@ from typing import Dict, List, Optional, Tuple
 from openai import AsyncOpenAI, APITimeoutError, APIConnectionError, RateLimitError
 from loguru import logger
 import asyncio
+import copy
+import hashlib
 import json
+import random
 import re
+import time
 import httpx
 
+from .cache import ParamsCache
+from .extractor import FLAG_KEYWORDS, REQUIRED_FIELDS, RuleExtractor, split_works
+from .llm_health import ModelHealth, backoff_delay
+from .llm_limiter import PRIORITY_FOLLOWUP, PRIORITY_NEW, LLMLimiter, current_request, llm_request
+from .prompts import PromptBuilder, prompt_version
+from .ranking import decisive, rank_works
+
+# Временные сбои, после которых запрос повторяется
+TRANSIENT_ERRORS = (
+    APITimeoutError,
+    APIConnectionError,
+    RateLimitError,
+    httpx.TimeoutException,
+    httpx.NetworkError,
+    TimeoutError,
+)
+RETRY_ATTEMPTS = 3
+
 
 class AIAgent:
     """AI-агент на базе OpenRouter"""
     
-    def __init__(self, api_key: str, model: str):
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        params_cache: Optional[ParamsCache] = None,
+        extractor: Optional[RuleExtractor] = None,
+        prompt_builder: Optional[PromptBuilder] = None,
+        base_url: str = "https://openrouter.ai/api/v1",
+        health: Optional[ModelHealth] = None,
+        fallback_model: Optional[str] = None,
+        limiter: Optional[LLMLimiter] = None
+    ):
         """
         Инициализация AI-агента
         
         Args:
             api_key: API ключ OpenRouter
             model: Модель для использования
+            params_cache: Кэш извлеченных параметров (None — каждый запрос идет в LLM)
+            extractor: Локальный разбор типовых запросов (None — всегда LLM)
+            prompt_builder: Компактный промпт извлечения (None — полный промпт)
+            base_url: Адрес OpenAI-совместимого API (локальная заглушка scripts/llm_stub.py для замеров)
+            health: Задержки и сбои моделей для хеджирования запросов (None — без дублей)
+            fallback_model: Модель для дублирующих запросов и замены деградировавшей основной
+            limiter: Общий допуск запросов к API (None — без очереди)
         """
         self.client = AsyncOpenAI(
             api_key=api_key,
-            base_url="https://openrouter.ai/api/v1",
+            base_url=base_url,
             timeout=45.0,
             max_retries=1,
         )
         self.model = model
-        logger.info(f"AI-агент инициализирован: {model}")
+        self.params_cache = params_cache
+        self.extractor = extractor
+        self.prompt_builder = prompt_builder
+        # Сколько раз select_best_work выбрал работу без LLM и с LLM
+        self.selection_stats = {"local": 0, "llm": 0}
+        # Одинаковые запросы к LLM в полете: (op_name, хэш промпта, модель) -> задача
+        self._inflight: Dict[Tuple[str, str, str], asyncio.Future] = {}
+        # upstream — вызовы OpenRouter, saved — вызовы, дождавшиеся чужого ответа
+        self.coalesce_stats = {"upstream": 0, "saved": 0}
+        # Токены по usage ответов OpenRouter (cached — из кэша префикса провайдера)
+        self.token_stats = {"calls": 0, "prompt": 0, "completion": 0, "cached": 0}
+        self.health = health
+        self.fallback_model = fallback_model or None
+        # hedged — отправлено дублей, hedge_won — дубль ответил первым
+        self.hedge_stats = {"hedged": 0, "hedge_won": 0, "skipped": 0}
+        self.limiter = limiter
+        self._random = random.Random()
+        # Версия промпта в ключе кэша: правка промпта не отдает старые ответы
+        if prompt_builder is not None:
+            self._prompt_version = prompt_version()
+        else:
+            self._prompt_version = hashlib.sha256(self._extract_prompt("").encode("utf-8")).hexdigest()[:12]
+        logger.info(f"AI-агент инициализирован: {model} ({base_url})")
 
     async def _chat_json(self, prompt: str, op_name: str) -> Dict:
+        """
+        Вызов LLM с объединением одинаковых запросов в полете
+        Параллельные вызовы с тем же op_name, промптом и моделью (пересланное
+        коллегами сообщение, повторная отправка) ждут один запрос к OpenRouter.
+        Ошибка запроса получают все ожидающие.
+        """
+        key = (op_name, hashlib.sha256(prompt.encode("utf-8")).hexdigest(), self.model)
+        task = self._inflight.get(key)
+        leader = task is None
+        if leader:
+            self.coalesce_stats["upstream"] += 1
+            task = asyncio.ensure_future(self._request_json(prompt, op_name))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget_inflight(key, done))
+        else:
+            self.coalesce_stats["saved"] += 1
+            logger.info(f"{op_name}: ожидание такого же запроса в полете "
+                        f"(сэкономлено вызовов {self.coalesce_stats['saved']})")
+        # Отмена одного ожидающего не отменяет общий запрос
+        result = await asyncio.shield(task)
+        # Каждый ожидающий получает свою копию ответа
+        return result if leader else copy.deepcopy(result)
+
+    def _forget_inflight(self, key: Tuple[str, str, str], task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # ошибка уже передана ожидающим; если все отменились — не логировать как потерянную
+        if not task.cancelled():
+            task.exception()
+
+    async def _request_json(self, prompt: str, op_name: str) -> Dict:
         """Устойчивый вызов OpenRouter с ретраями на сетевые/временные сбои."""
         last_error = None
-        retry_delays = [1, 2, 4]
 
-        for attempt, delay in enumerate(retry_delays, start=1):
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
             try:
-                response = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    response_format={"type": "json_object"},
-                    timeout=45.0,
-                )
-                return json.loads(response.choices[0].message.content)
-            except (
-                APITimeoutError,
-                APIConnectionError,
-                RateLimitError,
-                httpx.TimeoutException,
-                httpx.NetworkError,
-                TimeoutError,
-            ) as e:
+                return await self._hedged_attempt(prompt, op_name)
+            except TRANSIENT_ERRORS as e:
                 last_error = e
+                if attempt == RETRY_ATTEMPTS:
+                    break
+                delay = backoff_delay(attempt, rng=self._random)
                 logger.warning(
-                    f"{op_name}: временный сбой AI ({attempt}/{len(retry_delays)}): {e}. "
-                    f"Повтор через {delay} сек."
+                    f"{op_name}: временный сбой AI ({attempt}/{RETRY_ATTEMPTS}): {e}. "
+                    f"Повтор через {delay:.1f} сек."
                 )
                 await asyncio.sleep(delay)
             except Exception as e:
@@ -65,19 +147,247 @@ class AIAgent:
                 break
 
         raise last_error if last_error else RuntimeError(f"{op_name}: неизвестная ошибка AI")
-    
-    async def extract_parameters(self, user_message: str) -> Dict:
+
+    async def _hedged_attempt(self, prompt: str, op_name: str) -> Dict:
+        """
+        Одна попытка: если основной запрос не ответил за p95 задержки модели,
+        отправляется дубль (в резервную модель, если задана) и берется первый
+        успешный ответ; второй запрос отменяется. Дубль отправляется, только
+        если LLMLimiter дает место без ожидания.
+        """
+        if self.health is None:
+            return await self._complete(self.model, prompt, op_name)
+
+        primary, backup = self.health.order(self.model, self.fallback_model)
+        delay = self.health.hedge_delay(primary)
+        first = asyncio.ensure_future(self._complete(primary, prompt, op_name))
+        pending = {first}
+        error = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            if self.limiter is not None and not self.limiter.try_slot():
+                self.hedge_stats["skipped"] += 1
+                logger.info(f"{op_name}: {primary} не ответила за {delay:.1f} сек, "
+                            f"но свободных мест в LLMLimiter нет — без дублирующего запроса")
+                return await first
+            self.hedge_stats["hedged"] += 1
+            logger.info(f"{op_name}: {primary} не ответила за {delay:.1f} сек — дублирующий запрос в {backup}")
+            second = asyncio.ensure_future(self._complete(backup, prompt, op_name, admitted=True))
+            if self.limiter is not None:
+                # место освобождается и при отмене дубля до его старта
+                second.add_done_callback(lambda _: self.limiter.release())
+            pending.add(second)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_stats["hedge_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _complete(self, model: str, prompt: str, op_name: str, admitted: bool = False) -> Dict:
+        """
+        Запрос к модели после допуска LLMLimiter (место и токен на каждый запрос
+        к API; повтор после паузы снова встает в очередь)
+
+        Args:
+            admitted: Место уже выдано вызывающим (дубль _hedged_attempt)
+        """
+        if self.limiter is None or admitted:
+            return await self._send(model, prompt, op_name)
+        user_id, priority = current_request()
+        async with self.limiter.slot(user_id, priority):
+            return await self._send(model, prompt, op_name)
+
+    async def _send(self, model: str, prompt: str, op_name: str) -> Dict:
+        """Запрос к модели с учетом задержки и сбоев в ModelHealth"""
+        started = time.monotonic()
+        try:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"},
+                timeout=45.0,
+            )
+            self._count_tokens(op_name, response)
+            result = json.loads(response.choices[0].message.content)
+        except asyncio.CancelledError:
+            # проигравший дубль: модель отвечает не быстрее, чем прошло времени
+            if self.health is not None:
+                self.health.record_slow(model, time.monotonic() - started)
+            raise
+        except Exception:
+            if self.health is not None:
+                self.health.record(model, time.monotonic() - started, ok=False)
+            raise
+        if self.health is not None:
+            self.health.record(model, time.monotonic() - started, ok=True)
+        return result
+
+    def _count_tokens(self, op_name: str, response) -> None:
+        """Учет токенов вызова по usage ответа (если провайдер его вернул)"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.token_stats["calls"] += 1
+        self.token_stats["prompt"] += prompt_tokens
+        self.token_stats["completion"] += completion_tokens
+        self.token_stats["cached"] += cached
+        logger.info(f"{op_name}: токенов prompt {prompt_tokens} (из кэша {cached}), ответ {completion_tokens}")
+
+    async def extract_parameters(
+        self, user_message: str, user_id: Optional[int] = None
+    ) -> Dict:
         """
         Извлекает параметры работ из сообщения пользователя
         Включает ВСЕ параметры для коэффициентов K1, K2, K3
+        Типовой запрос разбирается локально (extractor), LLM — только если
+        обязательные поля не найдены уверенно
         
         Args:
             user_message: Сообщение пользователя
+            user_id: Пользователь (очередь LLMLimiter)
             
         Returns:
             Словарь с параметрами
         """
-        prompt = f"""Извлеки параметры из запроса пользователя о геодезических/топографических работах.
+        if self.extractor is not None:
+            local = self.extractor.extract(user_message)
+            if local.confident:
+                flat_result = self._sanitize_params(user_message, local.params)
+                logger.info(f"Параметры без LLM (уверенность {local.score:.2f}): {flat_result}")
+                return flat_result
+            logger.info(f"Локальный разбор неполон ({', '.join(local.missing)}) — запрос к LLM")
+
+        cache_key = None
+        if self.params_cache is not None:
+            cache_key = self.params_cache.make_key(user_message, self.model, self._prompt_version)
+            cached = self.params_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Параметры из кэша (hit ratio {self.params_cache.hit_ratio:.0%}): {cached}")
+                return cached
+
+        if self.prompt_builder is not None:
+            built = self.prompt_builder.build(user_message)
+            prompt = built.text
+            logger.info(f"Компактный промпт: ~{built.tokens} токенов, разделы {built.sections or '-'}, "
+                        f"примеров {len(built.examples)}")
+        else:
+            prompt = self._extract_prompt(user_message)
+
+        try:
+            with llm_request(user_id, PRIORITY_NEW):
+                result = await self._chat_json(prompt, "extract_parameters")
+            
+            # Если AI вернул вложенные словари - разворачиваем в плоский
+            flat_result = self._flatten_params(result)
+            flat_result = self._sanitize_params(user_message, flat_result)
+            
+            logger.info(f"Извлечены параметры: {flat_result}")
+            if cache_key is not None:
+                self.params_cache.put(cache_key, flat_result, self.model)
+            return flat_result
+            
+        except Exception as e:
+            logger.error(f"Ошибка извлечения параметров: {e}")
+            return {}
+
+    async def extract_batch(self, user_message: str, user_id: Optional[int] = None) -> List[Tuple[str, Dict]]:
+        """
+        Параметры каждой работы из сообщения-списка («1) топосъемка 1:500 97 га 2) нивелирование ...»)
+        Пункты, разобранные локально уверенно или найденные в кэше, в LLM не идут;
+        остальные извлекаются одним запросом.
+        
+        Args:
+            user_message: Сообщение пользователя
+            user_id: Пользователь (очередь LLMLimiter)
+            
+        Returns:
+            [(текст пункта, параметры)] в порядке списка; [] — сообщение не список работ
+        """
+        common, items = split_works(user_message)
+        if not items:
+            return []
+        contexts = [f"{common}\n{item}" if common else item for item in items]
+        results: List[Optional[Dict]] = [None] * len(items)
+        keys: List[Optional[str]] = [None] * len(items)
+
+        shared = {}
+        if self.extractor is not None and common:
+            # общие условия («промпредприятие, Магадан») дополняют каждый пункт
+            shared = {k: v for k, v in self.extractor.extract(common).params.items()
+                      if v is not None and k not in REQUIRED_FIELDS}
+        for i, item in enumerate(items):
+            if self.extractor is not None:
+                local = self.extractor.extract(item)
+                if local.confident:
+                    params = {**local.params, **{k: v for k, v in shared.items() if local.params.get(k) is None}}
+                    results[i] = self._sanitize_params(contexts[i], params)
+                    continue
+            if self.params_cache is not None:
+                keys[i] = self.params_cache.make_key(contexts[i], self.model, self._prompt_version)
+                results[i] = self.params_cache.get(keys[i])
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        logger.info(f"Список из {len(items)} работ: без LLM {len(items) - len(pending)}, в LLM {len(pending)}")
+        if pending:
+            prompt = self._batch_prompt(common, [items[i] for i in pending])
+            try:
+                with llm_request(user_id, PRIORITY_NEW):
+                    result = await self._chat_json(prompt, "extract_batch")
+                works = result.get("works") if isinstance(result, dict) else None
+                if not isinstance(works, list):
+                    works = []
+            except Exception as e:
+                logger.error(f"Ошибка извлечения параметров списка: {e}")
+                works = []
+            for n, i in enumerate(pending):
+                raw = works[n] if n < len(works) and isinstance(works[n], dict) else {}
+                results[i] = self._sanitize_params(contexts[i], self._flatten_params(raw)) if raw else {}
+                if raw and keys[i] is not None:
+                    self.params_cache.put(keys[i], results[i], self.model)
+        return list(zip(items, results))
+
+    def _batch_prompt(self, common: str, items: List[str]) -> str:
+        """Промпт извлечения параметров списка работ: схема одной работы и массив works"""
+        listing = "\n".join(f"{n}) {item}" for n, item in enumerate(items, start=1))
+        message = f"{common}\n{listing}" if common else listing
+        if self.prompt_builder is not None:
+            prompt = self.prompt_builder.build(message).text
+        else:
+            prompt = self._extract_prompt(message)
+        return prompt + f"""
+
+В запросе {len(items)} работ (пронумерованы). Верни JSON {{"works": [...]}}: {len(items)} объектов с полями
+выше, по одному на каждую работу в том же порядке. Условия из начала запроса относятся ко всем работам."""
+
+    def guess_parameters(self, user_message: str) -> Optional[Dict]:
+        """
+        Параметры локального разбора, даже неуверенного (для спекулятивного поиска
+        до ответа LLM); None — локальный разбор отключен или тип работ не найден
+        """
+        if self.extractor is None:
+            return None
+        local = self.extractor.extract(user_message)
+        if not local.params.get("work_type"):
+            return None
+        return self._sanitize_params(user_message, local.params)
+
+    def _extract_prompt(self, user_message: str) -> str:
+        """Промпт извлечения параметров (extract_parameters)"""
+        return f"""Извлеки параметры из запроса пользователя о геодезических/топографических работах.
 
 Запрос: "{user_message}"
 
@@ -170,20 +480,6 @@ class AIAgent:
 - "железных дорог III-IV категории (II кат.сложности)" → category: "II" (НЕ "III"! "III-IV" - это категория дороги)
 - "автодорог I-II категории, III категория сложности" → category: "III" (категория сложности в конце)
 - "ЛЭП 110 кВ, II категория" → category: "II" (категория сложности)"""
-
-        try:
-            result = await self._chat_json(prompt, "extract_parameters")
-            
-            # Если AI вернул вложенные словари - разворачиваем в плоский
-            flat_result = self._flatten_params(result)
-            flat_result = self._sanitize_params(user_message, flat_result)
-            
-            logger.info(f"Извлечены параметры: {flat_result}")
-            return flat_result
-            
-        except Exception as e:
-            logger.error(f"Ошибка извлечения параметров: {e}")
-            return {}
     
     def _flatten_params(self, params: Dict) -> Dict:
         """Разворачивает вложенные словари в плоский"""
@@ -206,21 +502,6 @@ class AIAgent:
         def has_any(keywords: List[str]) -> bool:
             return any(k in text for k in keywords)
 
-        rules = {
-            "use_computer": ["компьютер", "компьютерн", "cad", "гис", "gis", "цифров"],
-            "dual_format": ["два носителя", "двух видах", "магнитн", "бумажн", "цифровой и бумажный"],
-            "color_plan": ["в цвете", "цветной", "цвета", "цвет"],
-            "intermediate_materials": ["промежуточ"],
-            "classified_materials": ["ограниченного", "секрет", "дсп", "служебн"],
-            "artificial_lighting": ["искусственн", "освещ"],
-            "special_regime": ["погран", "полигон", "аэродром", "спецрежим", "режим"],
-            "night_time": ["ноч", "ночное", "ночью"],
-            "no_field_allowance": ["без полевого", "без командировочных", "без полевого довольствия"],
-            "office_in_field_camp": ["экспедицион", "в экспедиционных условиях"],
-            "use_satellite": ["спутник", "gps", "gnss", "глонасс"],
-            "no_center": ["без закладки центра", "без закладки центров"],
-        }
-
         sanitized = dict(params)
         if "height_section" in sanitized and sanitized["height_section"] is not None:
             try:
@@ -275,7 +556,7 @@ class AIAgent:
                     preferred = [v for v in values if v > 1.5]
                     chosen = preferred[-1] if preferred else values[-1]
                     sanitized["quantity"] = chosen
-        for key, keywords in rules.items():
+        for key, keywords in FLAG_KEYWORDS.items():
             if sanitized.get(key) is True and not has_any(keywords):
                 sanitized[key] = None
 
@@ -506,14 +787,17 @@ class AIAgent:
         logger.warning("determine_addons() устарел - надбавки берутся из БД")
         return []
     
-    async def select_best_work(self, user_request: str, found_works: List[Dict], params: Optional[Dict] = None) -> Optional[Dict]:
+    async def select_best_work(
+        self, user_request: str, found_works: List[Dict], params: Optional[Dict] = None, user_id: Optional[int] = None
+    ) -> Optional[Dict]:
         """
         Выбирает наиболее подходящую работу из найденных
         
         Args:
             user_request: Запрос пользователя
             found_works: Список найденных работ
-            params: Извлеченные параметры (для фильтрации по категории)
+            params: Извлеченные параметры (для ранжирования по категории, масштабу и т.д.)
+            user_id: Пользователь (очередь LLMLimiter; выбор — продолжение начатого запроса)
             
         Returns:
             Выбранная работа или None
@@ -524,14 +808,20 @@ class AIAgent:
         if len(found_works) == 1:
             return found_works[0]
         
-        # Если указана категория сложности - фильтруем по ней
-        if params and params.get('category'):
-            requested_category = params['category']
-            matching_works = [w for w in found_works if w.get('params', {}).get('category') == requested_category]
-            if matching_works:
-                if len(matching_works) == 1:
-                    return matching_works[0]
-                found_works = matching_works  # Продолжаем выбор среди отфильтрованных
+        # Локальное ранжирование: LLM выбирает только среди равных кандидатов
+        ranked = rank_works(user_request, found_works, params)
+        selected, tied = decisive(ranked)
+        self.selection_stats["local" if selected is not None else "llm"] += 1
+        total = sum(self.selection_stats.values())
+        if selected is not None:
+            logger.info(
+                f"Работа выбрана без LLM ({ranked[0].score:.2f} против {ranked[1].score:.2f}, "
+                f"быстрый путь {self.selection_stats['local']}/{total})"
+            )
+            return selected
+        logger.info(f"Равные кандидаты: {len(tied)} из {len(found_works)} — выбор LLM "
+                    f"(быстрый путь {self.selection_stats['local']}/{total})")
+        found_works = [item.work for item in tied]
 
         # Формируем список для AI с параметрами
         works_list = []
@@ -567,7 +857,8 @@ class AIAgent:
 Верни JSON с полем "index" (номер выбранной работы, начиная с 1)."""
 
         try:
-            result = await self._chat_json(prompt, "select_best_work")
+            with llm_request(user_id, PRIORITY_FOLLOWUP):
+                result = await self._chat_json(prompt, "select_best_work")
             index = result.get("index", 1) - 1
             
             if 0 <= index < len(found_works):
@@ -725,13 +1016,158 @@ class AIAgent:
         # Если есть индекс пересчета
         if calc.get('price_index'):
             text += f"""
-📈 *С учетом индекса {calc['price_index']['year']}:*
+📈 *С учетом индекса {calc['price_index'].get('period', calc['price_index']['year'])}:*
 • Индекс: {calc['price_index']['value']}
 • *ИТОГО в текущих ценах: {calc['total_with_index']:,.2f} руб*
 """
         
         return text
     
+    def format_diff(self, diff: Dict) -> str:
+        """
+        Форматирует разницу пересчета после уточнения параметра
+        
+        Args:
+            diff: Результат CostCalculator.recalculate
+            
+        Returns:
+            Отформатированный текст изменений
+        """
+        text = "🔄 *Пересчет после уточнения*\n\n"
+        
+        for param, (old, new) in diff.get('changed_params', {}).items():
+            text += f"• {param}: {old if old is not None else '—'} → {new if new is not None else '—'}\n"
+        if diff.get('changed_params'):
+            text += "\n"
+        
+        stage_titles = {'field': '🏕 Полевые', 'office': '🖥 Камеральные'}
+        for stage, changes in diff.get('stages', {}).items():
+            text += f"*{stage_titles.get(stage, stage)}:*\n"
+            for key, (old, new) in changes.items():
+                if key == 'total':
+                    text += f"  - Итого: {old or 0:,.2f} → {new or 0:,.2f} руб\n"
+                else:
+                    text += f"  - {key}: {old} → {new}\n"
+        
+        addons = diff.get('addons', {})
+        if addons.get('added') or addons.get('removed') or addons.get('changed'):
+            text += "➕ *Надбавки:*\n"
+            for addon in addons.get('added', []):
+                text += f"  + {addon['name']}: {addon['amount']:,.2f} руб\n"
+            for addon in addons.get('removed', []):
+                text += f"  − {addon['name']}: {addon['amount']:,.2f} руб\n"
+            for addon in addons.get('changed', []):
+                text += f"  - {addon['name']}: {addon['old']:,.2f} → {addon['new']:,.2f} руб\n"
+        
+        total = diff.get('total_cost', {})
+        delta = total.get('delta', 0)
+        sign = '+' if delta > 0 else ''
+        text += f"""━━━━━━━━━━━━━━━━━━━━━
+✅ *ИТОГО: {total.get('new', 0):,.2f} руб* ({sign}{delta:,.2f})
+"""
+        return text
+    
+    def format_variants(self, comparison) -> str:
+        """
+        Форматирует сравнение вариантов неоднозначного параметра
+        
+        Args:
+            comparison: Результат CostCalculator.price_variants
+            
+        Returns:
+            Таблица вариантов с итоговой стоимостью и разницей с самым дешевым
+        """
+        text = "💰 *Стоимость по вариантам:*\n"
+        for row in comparison.rows():
+            delta = f" (+{row['delta']:,.2f})" if row['delta'] > 0 else " ✅"
+            text += f"• {row['label']}: {row['total_cost']:,.2f} руб{delta}\n"
+        if comparison.missing:
+            text += f"_Нет расценок для: {', '.join(comparison.missing)}_\n"
+        return text
+    
+    def format_estimate(self, estimate) -> str:
+        """
+        Форматирует смету по шаблону
+        
+        Args:
+            estimate: Результат TemplateEngine.from_message / price
+            
+        Returns:
+            Строки сметы по разделам с итогом (или вопрос о недостающих значениях)
+        """
+        from .templates import missing_labels
+        
+        text = f"📋 *Шаблон: {estimate.template.name}*\n\n"
+        if estimate.missing:
+            text += "Для расчета укажите в запросе: " + ", ".join(missing_labels(estimate.missing)) + "\n"
+            text += f"_Например: {estimate.template.name} 12 га_"
+            return text
+        
+        section = None
+        for line, calc in zip(estimate.lines, estimate.result['lines']):
+            if line.section_name != section:
+                section = line.section_name
+                text += f"*{section}*\n"
+            cost = f"{calc['total_cost']:,.2f} руб" if calc else "не рассчитано"
+            text += f"• {line.title} — {line.quantity:g} {line.unit}: {cost}\n"
+        
+        if estimate.result.get('errors'):
+            text += "\n⚠️ *ОШИБКИ:*\n"
+            for error in estimate.result['errors']:
+                text += f"• {error}\n"
+        
+        text += f"""━━━━━━━━━━━━━━━━━━━━━
+✅ *ИТОГО: {estimate.result['total_cost']:,.2f} руб*
+"""
+        if estimate.result.get('price_index'):
+            text += f"""
+📈 *С учетом индекса {estimate.result['price_index']['period']}:*
+• Индекс: {estimate.result['price_index']['value']}
+• *ИТОГО в текущих ценах: {estimate.result['total_with_index']:,.2f} руб*
+"""
+        return text
+    
+    def format_batch(self, estimate) -> str:
+        """
+        Форматирует смету по списку работ из одного сообщения
+        
+        Args:
+            estimate: Результат BatchEngine.from_message
+            
+        Returns:
+            Строки сметы с итогом; нераспознанные пункты — с причиной
+        """
+        text = f"📋 *Смета по списку: {len(estimate.lines)} работ*\n\n"
+        results = iter(estimate.result['lines'] if estimate.result else [])
+        for n, line in enumerate(estimate.lines, start=1):
+            if line.work is None:
+                text += f"{n}. {line.text} — ⚠️ {line.error}\n"
+                continue
+            calc = next(results)
+            cost = f"{calc['total_cost']:,.2f} руб" if calc else "не рассчитано"
+            quantity = line.params.get('quantity')
+            unit = line.params.get('unit') or line.work.get('unit') or ''
+            text += f"{n}. {line.work.get('work_title')} — {quantity:g} {unit}: {cost}\n"
+        
+        if estimate.result is None:
+            return text + "\n❌ Ни одну работу не удалось рассчитать."
+        
+        if estimate.result.get('errors'):
+            text += "\n⚠️ *ОШИБКИ:*\n"
+            for error in estimate.result['errors']:
+                text += f"• {error}\n"
+        
+        text += f"""━━━━━━━━━━━━━━━━━━━━━
+✅ *ИТОГО: {estimate.result['total_cost']:,.2f} руб*
+"""
+        if estimate.result.get('price_index'):
+            text += f"""
+📈 *С учетом индекса {estimate.result['price_index']['period']}:*
+• Индекс: {estimate.result['price_index']['value']}
+• *ИТОГО в текущих ценах: {estimate.result['total_with_index']:,.2f} руб*
+"""
+        return text
+    
     def format_clarification_question(self, missing_params: List[Dict]) -> str:
         """
         Форматирует вопрос для уточнения параметров
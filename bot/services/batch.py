@@ -0,0 +1,133 @@
+"""
+Смета по списку работ из одного сообщения («1) топосъемка ... 2) нивелирование ...»)
+Параметры всех пунктов извлекаются одним вызовом (AIAgent.extract_batch),
+строки расценок ищутся параллельно, расчет — одним пакетом
+(CostCalculator.calculate_batch), как для шаблонов смет.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+
+@dataclass
+class BatchLine:
+    """Пункт списка: текст, параметры и выбранная строка расценки (или причина, почему нет)"""
+    text: str
+    params: Dict
+    work: Optional[Dict] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchEstimate:
+    """Смета по списку: пункты и итог пакетного расчета (только для пунктов со строкой)"""
+    lines: List[BatchLine] = field(default_factory=list)
+    result: Optional[Dict] = None
+
+    @property
+    def priced_lines(self) -> List[BatchLine]:
+        return [line for line in self.lines if line.work is not None]
+
+
+class BatchEngine:
+    """Поиск строк и пакетный расчет списка работ"""
+
+    def __init__(self, calculator, ai):
+        """
+        Args:
+            calculator: CostCalculator (пакетный расчет и сервис БД)
+            ai: AIAgent (извлечение параметров списка и выбор строки)
+        """
+        self.calculator = calculator
+        self.db = calculator.db
+        self.ai = ai
+
+    async def from_message(self, text: str, user_id: Optional[int] = None, index_period=None) -> Optional[BatchEstimate]:
+        """
+        Смета по сообщению-списку работ
+
+        Returns:
+            BatchEstimate или None, если сообщение не список работ или строки
+            расценок нашлись меньше чем для двух пунктов (тогда сообщение
+            разбирается как одиночный запрос)
+        """
+        extracted = await self.ai.extract_batch(text, user_id=user_id)
+        if not extracted:
+            return None
+        lines = [BatchLine(item, params) for item, params in extracted]
+        await self.select(lines, user_id)
+        if sum(line.work is not None for line in lines) < 2:
+            logger.info(f"Список работ: строки расценок найдены меньше чем для двух пунктов из {len(lines)} "
+                        f"— разбор как одного запроса")
+            return None
+        return await self.price(lines, user_id, index_period, selected=True)
+
+    async def select(self, lines: List[BatchLine], user_id: Optional[int] = None) -> None:
+        """Подбирает строки расценок для всех пунктов параллельно"""
+        await asyncio.gather(*(self._select(line, user_id) for line in lines))
+
+    async def price(
+        self, lines: List[BatchLine], user_id: Optional[int] = None, index_period=None, selected: bool = False
+    ) -> BatchEstimate:
+        """
+        Подбирает строки расценок для всех пунктов и считает их одним пакетом
+
+        Args:
+            selected: Строки уже подобраны (select)
+        """
+        estimate = BatchEstimate(lines=lines)
+        if not selected:
+            await self.select(lines, user_id)
+        priced = estimate.priced_lines
+        if not priced:
+            return estimate
+        estimate.result = await self.calculator.calculate_batch(
+            [{
+                "work": line.work,
+                "quantity": line.params["quantity"],
+                "params": line.params,
+                "work_stage": line.params.get("work_stage") or 'обе',
+            } for line in priced],
+            index_period=index_period,
+        )
+        logger.info(f"Список работ: рассчитано {len(priced)} из {len(lines)}, "
+                    f"итого {estimate.result['total_cost']:,.2f} руб")
+        return estimate
+
+    async def _select(self, line: BatchLine, user_id: Optional[int]) -> None:
+        params = line.params
+        if not params.get("work_type"):
+            line.error = "не распознан тип работ"
+            return
+        quantity = self.db._to_float(params.get("quantity"))
+        if quantity is None:
+            line.error = "не указан объем"
+            return
+        params["quantity"] = quantity
+
+        search = await self.db.search_works_v2(
+            query=params["work_type"],
+            scale=params.get("scale"),
+            category=params.get("category"),
+            territory=params.get("territory_type"),
+            height_section=params.get("height_section"),
+            column=params.get("column"),
+        )
+        if not search.found:
+            line.error = search.errors[0] if search.errors else "строка расценки не найдена"
+            return
+        work = await self.ai.select_best_work(line.text, search.works, params, user_id=user_id)
+        if not work:
+            line.error = "не удалось выбрать строку расценки"
+            return
+        work = dict(work)
+        # Единая цена строки — в нужный этап (как в SmetaBot._perform_calculation)
+        work_stage = params.get("work_stage") or 'обе'
+        if work_stage in ('полевые', 'обе') and not work.get('price_field') and work.get('price'):
+            work['price_field'] = work['price']
+        if work_stage in ('камеральные', 'обе') and not work.get('price_office') and work.get('price'):
+            work['price_office'] = work['price']
+        line.work = work
@@ -0,0 +1,344 @@
+"""
+Кэши сервисов: ограниченный LRU в памяти, хранилище результатов расчетов
+и кэш параметров, извлеченных LLM из сообщений
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from loguru import logger
+
+
+class LRUCache:
+    """Кэш с вытеснением давно неиспользуемых записей и счетчиками попаданий"""
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        Args:
+            maxsize: Максимальное число записей (0 — кэш отключен)
+        """
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        """Возвращает значение и помечает запись как недавно использованную"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение, вытесняя самые старые записи сверх maxsize"""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hit_ratio, 4),
+        }
+
+
+def _connect(path: str, schema: str, label: str) -> Optional[sqlite3.Connection]:
+    """Открывает SQLite (создает каталог и таблицу); None, если файл недоступен"""
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute(schema)
+        conn.commit()
+        return conn
+    except Exception as e:
+        logger.error(f"{label} на диске недоступен ({path}): {e}")
+        return None
+
+
+class ResultStore:
+    """
+    Кэш результатов calculate_full с адресацией по содержимому
+    
+    Ключ — sha256 канонического JSON входных данных (строка расценки, объем,
+    нормализованные параметры, этап, версия каталога). Два уровня:
+    LRU в памяти (JSON-строки) и SQLite на диске, который переживает перезапуск.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_size: int = 256):
+        """
+        Args:
+            path: Файл SQLite (None или "" — только память)
+            memory_size: Размер LRU в памяти
+        """
+        self.memory = LRUCache(memory_size)
+        self.path = path or None
+        self._conn: Optional[sqlite3.Connection] = None
+        self.disk_hits = 0
+        if self.path:
+            self._conn = _connect(
+                self.path,
+                "CREATE TABLE IF NOT EXISTS calc_results ("
+                "key TEXT PRIMARY KEY, catalog_version TEXT, payload TEXT NOT NULL, created_at REAL NOT NULL)",
+                "Кэш результатов",
+            )
+
+    @staticmethod
+    def make_key(work: Dict, quantity: Any, params: Dict, work_stage: str, catalog_version: str) -> str:
+        """
+        Стабильный ключ расчета
+        
+        Args:
+            work: Строка расценки (учитываются id, таблица, раздел, цены и параметры)
+            quantity: Объем (лучше точная дробь money.ratio — 10 и 10.0 совпадут)
+            params: Нормализованные параметры пользователя
+            work_stage: Этап работ
+            catalog_version: Версия каталога норм (DatabaseService.catalog_fingerprint)
+        """
+        payload = {
+            "work": {
+                key: work.get(key)
+                for key in ("id", "table_no", "section", "price_field", "price_office", "price", "params")
+            },
+            "quantity": quantity,
+            "params": params,
+            "work_stage": work_stage,
+            "catalog": catalog_version,
+        }
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Результат по ключу (новая копия) или None"""
+        payload = self.memory.get(key)
+        if payload is None and self._conn is not None:
+            try:
+                row = self._conn.execute("SELECT payload FROM calc_results WHERE key = ?", (key,)).fetchone()
+            except Exception as e:
+                logger.error(f"Ошибка чтения кэша результатов: {e}")
+                row = None
+            if row:
+                payload = row[0]
+                self.disk_hits += 1
+                self.memory.put(key, payload)
+        return json.loads(payload) if payload is not None else None
+
+    def put(self, key: str, result: Dict, catalog_version: Optional[str] = None) -> None:
+        """Сохраняет результат в оба уровня"""
+        try:
+            payload = json.dumps(result, ensure_ascii=False, default=str)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Результат расчета не сериализуется, в кэш не сохранен: {e}")
+            return
+        self.memory.put(key, payload)
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calc_results (key, catalog_version, payload, created_at) VALUES (?, ?, ?, ?)",
+                (key, catalog_version, payload, time.time()),
+            )
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи кэша результатов: {e}")
+
+    def prune(self, keep_version: str) -> int:
+        """Удаляет с диска результаты прежних версий каталога, возвращает число удаленных"""
+        self.memory.clear()
+        if self._conn is None:
+            return 0
+        try:
+            cursor = self._conn.execute("DELETE FROM calc_results WHERE catalog_version IS NOT ?", (keep_version,))
+            self._conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша результатов: {e}")
+            return 0
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {**self.memory.stats(), "disk_hits": self.disk_hits, "path": self.path}
+
+
+class ParamsCache:
+    """
+    Кэш параметров, извлеченных LLM из сообщения (AIAgent.extract_parameters)
+
+    Ключ — sha256 нормализованного текста сообщения, модели и версии промпта;
+    значение — уже развернутые и очищенные параметры. Как ResultStore, два
+    уровня: LRU в памяти и SQLite на диске. Записи старше ttl не отдаются.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_size: int = 512, ttl: float = 7 * 24 * 3600.0):
+        """
+        Args:
+            path: Файл SQLite (None или "" — только память)
+            memory_size: Размер LRU в памяти
+            ttl: Срок жизни записи, сек (0 — без ограничения)
+        """
+        self.memory = LRUCache(memory_size)
+        self.path = path or None
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.expired = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        if self.path:
+            self._conn = _connect(
+                self.path,
+                "CREATE TABLE IF NOT EXISTS extracted_params ("
+                "key TEXT PRIMARY KEY, model TEXT, payload TEXT NOT NULL, created_at REAL NOT NULL)",
+                "Кэш параметров",
+            )
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Текст сообщения без различий регистра, ё/е, кавычек и пробелов"""
+        text = str(message or "").lower().replace("ё", "е")
+        text = re.sub(r"[«»\"“”„]", '"', text)
+        return re.sub(r"\s+", " ", text).strip(" .!?;")
+
+    @classmethod
+    def make_key(cls, message: str, model: str, prompt_version: str = "") -> str:
+        """Ключ кэша для сообщения, модели и версии промпта"""
+        canonical = json.dumps([cls.normalize(message), model, prompt_version], ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _fresh(self, created_at: float) -> bool:
+        return not self.ttl or time.time() - created_at < self.ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Параметры по ключу (новая копия) или None (нет записи или истек ttl)"""
+        entry = self.memory.get(key)
+        if entry is None and self._conn is not None:
+            try:
+                row = self._conn.execute(
+                    "SELECT created_at, payload FROM extracted_params WHERE key = ?", (key,)
+                ).fetchone()
+            except Exception as e:
+                logger.error(f"Ошибка чтения кэша параметров: {e}")
+                row = None
+            if row:
+                entry = (row[0], row[1])
+                if self._fresh(entry[0]):
+                    self.disk_hits += 1
+                    self.memory.put(key, entry)
+        if entry is not None and not self._fresh(entry[0]):
+            self.expired += 1
+            self._delete(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(entry[1])
+
+    def put(self, key: str, params: Dict, model: Optional[str] = None) -> None:
+        """Сохраняет параметры в оба уровня (пустой результат не кэшируется)"""
+        if not params:
+            return
+        try:
+            payload = json.dumps(params, ensure_ascii=False, default=str)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Параметры не сериализуются, в кэш не сохранены: {e}")
+            return
+        created_at = time.time()
+        self.memory.put(key, (created_at, payload))
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extracted_params (key, model, payload, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, payload, created_at),
+            )
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи кэша параметров: {e}")
+
+    def _delete(self, key: str) -> None:
+        self.memory.pop(key)
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("DELETE FROM extracted_params WHERE key = ?", (key,))
+            self._conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша параметров: {e}")
+
+    def prune(self) -> int:
+        """Удаляет с диска записи старше ttl, возвращает число удаленных"""
+        self.memory.clear()
+        if self._conn is None or not self.ttl:
+            return 0
+        try:
+            cursor = self._conn.execute(
+                "DELETE FROM extracted_params WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша параметров: {e}")
+            return 0
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "expired": self.expired,
+            "hit_ratio": round(self.hit_ratio, 4),
+            "path": self.path,
+        }
@@ -0,0 +1,141 @@
+"""
+Состояние расчета в рамках сессии пользователя
+Хранит промежуточные результаты calculate_full (регион, K1/K2/K3 по этапам,
+семейства надбавок) вместе с параметрами, от которых они зависят. При уточнении
+одного параметра пересчитываются только затронутые части, а результат
+сравнивается с предыдущим (diff_results).
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# Этапы и их ключи в результате calculate_full
+STAGE_KEYS = (("field", "field_calculation"), ("office", "office_calculation"))
+
+
+@dataclass
+class CalculationState:
+    """Зависимости и промежуточные результаты расчета одной работы"""
+    work: Dict
+    quantity: float
+    params: Dict
+    work_stage: str = 'обе'
+    result: Optional[Dict] = None
+    catalog_version: Optional[int] = None
+    # (сигнатура региональных параметров, ключи, добавленные enrich_params_with_region)
+    region: Optional[Tuple[tuple, Dict]] = None
+    # (этап, 'K1'|'K2'|'K3') → (сигнатура параметров, (запись, итоговые коэффициенты, ошибки))
+    coefficients: Dict[Tuple[str, str], tuple] = field(default_factory=dict)
+    # семейство надбавок → (входы, надбавки), см. DatabaseService.get_addons_by_conditions
+    addons: Dict[str, tuple] = field(default_factory=dict)
+    # шаги, пересчитанные последним расчетом ('region', 'field.K1', 'addons.internal', ...)
+    evaluated: List[str] = field(default_factory=list)
+
+    def replace_work(self, work: Dict) -> Optional[Dict]:
+        """
+        Переключает расчет на другую строку расценки; K1/K2/K3 и надбавки,
+        подобранные для прежней строки, сбрасываются
+
+        Returns:
+            Прежняя строка или None, если строка та же
+        """
+        if work is self.work or (work.get('id') is not None and work.get('id') == self.work.get('id')):
+            return None
+        old, self.work = self.work, work
+        self.coefficients.clear()
+        self.addons.clear()
+        return old
+
+    def apply_changes(self, changes: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+        """
+        Применяет уточненные параметры (None — удалить параметр)
+        quantity и work_stage меняют объем и этап расчета
+
+        Returns:
+            {параметр: (старое значение, новое значение)} только для реально измененных
+        """
+        changed = {}
+        for key, value in changes.items():
+            if key == 'quantity':
+                old = self.quantity
+                if value is not None and value != old:
+                    self.quantity = value
+                    self.params['quantity'] = value
+                    changed[key] = (old, value)
+                continue
+            if key == 'work_stage':
+                old = self.work_stage
+                if value and value != old:
+                    self.work_stage = value
+                    self.params['work_stage'] = value
+                    changed[key] = (old, value)
+                continue
+            old = self.params.get(key)
+            if old == value:
+                continue
+            if value is None:
+                self.params.pop(key, None)
+            else:
+                self.params[key] = value
+            changed[key] = (old, value)
+        return changed
+
+
+def diff_results(previous: Dict, current: Dict, changed_params: Optional[Dict] = None, evaluated: Optional[List[str]] = None) -> Dict:
+    """
+    Разница двух результатов calculate_full
+
+    Args:
+        previous: Предыдущий результат
+        current: Новый результат
+        changed_params: Измененные параметры {ключ: (было, стало)}
+        evaluated: Пересчитанные шаги
+
+    Returns:
+        Словарь с изменениями итога, этапов (сумма и K1/K2/K3) и надбавок
+    """
+    old_total = previous.get('total_cost') or 0
+    new_total = current.get('total_cost') or 0
+    diff = {
+        'changed_params': dict(changed_params or {}),
+        'evaluated': list(evaluated or []),
+        'total_cost': {'old': old_total, 'new': new_total, 'delta': round(new_total - old_total, 2)},
+        'stages': {},
+        'addons': {'added': [], 'removed': [], 'changed': []},
+    }
+
+    for stage, key in STAGE_KEYS:
+        old_stage = previous.get(key) or {}
+        new_stage = current.get(key) or {}
+        if not old_stage and not new_stage:
+            continue
+        stage_diff = {}
+        if old_stage.get('total') != new_stage.get('total'):
+            stage_diff['total'] = (old_stage.get('total'), new_stage.get('total'))
+        old_coeffs = old_stage.get('coefficients') or {}
+        new_coeffs = new_stage.get('coefficients') or {}
+        for factor in sorted(set(old_coeffs) | set(new_coeffs)):
+            old_value = (old_coeffs.get(factor) or {}).get('value')
+            new_value = (new_coeffs.get(factor) or {}).get('value')
+            if old_value != new_value:
+                stage_diff[factor] = (old_value, new_value)
+        if stage_diff:
+            diff['stages'][stage] = stage_diff
+
+    old_addons = {a['code']: a for a in previous.get('addons_applied') or []}
+    new_addons = {a['code']: a for a in current.get('addons_applied') or []}
+    for code, addon in new_addons.items():
+        if code not in old_addons:
+            diff['addons']['added'].append(addon)
+        elif old_addons[code].get('amount') != addon.get('amount'):
+            diff['addons']['changed'].append({
+                'code': code,
+                'name': addon.get('name'),
+                'old': old_addons[code].get('amount'),
+                'new': addon.get('amount'),
+            })
+    for code, addon in old_addons.items():
+        if code not in new_addons:
+            diff['addons']['removed'].append(addon)
+
+    return diff
@@ -9,10 +9,18 @@
 - K3: Коэффициенты условий производства из п.8 и п.14 ОУ (район, режим, период и т.д.)
 """
 
+import copy
 from typing import Dict, List, Optional
-from decimal import Decimal, ROUND_HALF_UP
+from decimal import Decimal
 from loguru import logger
 
+from . import money
+from .cache import LRUCache, ResultStore
+from .calc_state import CalculationState, diff_results
+from .trace import CalculationTrace, NULL_TRACE
+from .plan import CalculationPlan, PlanRegistry
+from .indices import Period, parse_period, period_label
+
 
 class CostCalculator:
     """
@@ -26,21 +34,46 @@ class CostCalculator:
     ВСЕ КОЭФФИЦИЕНТЫ БЕРУТСЯ ТОЛЬКО ИЗ БД!
     """
     
-    def __init__(self, db_service):
+    COEFF_FACTORS = ('K1', 'K2', 'K3')
+    
+    def __init__(
+        self,
+        db_service,
+        coeff_cache_size: int = 1024,
+        result_store: Optional[ResultStore] = None,
+        trace_enabled: bool = False,
+        index_period: Optional[Period] = None
+    ):
         """
         Инициализация калькулятора
         
         Args:
             db_service: Сервис для работы с БД
+            coeff_cache_size: Размер кэша наборов коэффициентов (0 — без кэша)
+            result_store: Кэш готовых результатов calculate_full (None — без кэша)
+            trace_enabled: Трассировка шагов расчета по умолчанию (см. calculate_full)
+            index_period: Период индекса изменения стоимости по умолчанию
+                ("2025Q3", "latest"; None — итог только в базисных ценах)
         """
         self.db = db_service
+        self._coeff_cache = LRUCache(coeff_cache_size)
+        self._coeff_cache_version = None
+        self.result_store = result_store
+        self.trace_enabled = trace_enabled
+        self.index_period = index_period
+        # Планы расчета строк расценок (None — правила каждый раз из БД)
+        self.plans: Optional[PlanRegistry] = PlanRegistry(db_service)
     
     async def calculate_full(
         self,
         work: Dict,
         quantity: float,
         params: Dict,
-        work_stage: str = 'обе'
+        work_stage: str = 'обе',
+        state: Optional[CalculationState] = None,
+        trace: Optional[bool] = None,
+        index_period: Optional[Period] = None,
+        index_work_type: Optional[str] = None
     ) -> Dict:
         """
         Полный расчет стоимости работ с учетом полевых и камеральных
@@ -50,10 +83,23 @@ class CostCalculator:
             quantity: Объем работ
             params: Параметры для определения коэффициентов
             work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            state: Состояние сессии (см. start_session) — неизменившиеся
+                части расчета берутся из него, а новые сохраняются
+            trace: Замерить время и запросы к БД по шагам (секция 'trace' результата
+                и одна строка в логе). None — по настройке trace_enabled
+            index_period: Период индекса изменения стоимости ("2025Q3", (2025, 3),
+                "latest"); итог в текущих ценах — в total_with_index. None — по
+                настройке index_period
+            index_work_type: Тип работ индекса (None — по документу строки расценки)
             
         Returns:
             Детальный расчет стоимости
         """
+        if trace is None:
+            trace = self.trace_enabled
+        if index_period is None:
+            index_period = self.index_period
+        tracer = CalculationTrace(self.db) if trace else NULL_TRACE
         try:
             # Обработка None для work_stage и params
             if work_stage is None:
@@ -61,40 +107,51 @@ class CostCalculator:
             if params is None:
                 params = {}
             
-            # Обогащаем параметры данными по регионам
             # Нормализуем строковые "None" и числовые строки
-            for key in [
-                "altitude",
-                "altitude_m",
-                "unfavorable_months",
-                "salary_coeff",
-                "distance_to_base",
-                "distance_to_base_km",
-                "external_distance",
-                "external_distance_km",
-                "expedition_duration",
-                "expedition_duration_months",
-                "height_section",
-            ]:
-                if key in params and isinstance(params[key], str):
-                    if params[key].strip().lower() == "none":
-                        params[key] = None
-                    else:
-                        try:
-                            params[key] = float(params[key].replace(",", "."))
-                        except Exception:
-                            pass
+            with tracer.step('normalize'):
+                self._normalize_params(params)
+            
+            # Готовый результат для тех же входных данных и версии каталога
+            store_key = None
+            cached = None
+            if self.result_store is not None:
+                with tracer.step('result_store') as step:
+                    await self.db.refresh_catalog_version()
+                    await self.db.refresh_region_stamp()
+                    store_key = self.result_store.make_key(
+                        work, money.ratio(quantity), params, work_stage, self.db.catalog_fingerprint
+                    )
+                    cached = self.result_store.get(store_key)
+                    step['cached'] = cached is not None
+            if cached is not None:
+                logger.info(f"calculate_full: результат из кэша ({store_key[:12]})")
+                cached = await self._apply_price_index(
+                    cached, work, index_period, index_work_type, params.get('region_name'), tracer
+                )
+                if state is not None:
+                    state.result = cached
+                return self._attach_trace(cached, tracer)
 
-            params = await self.db.enrich_params_with_region(params)
+            # Обогащаем параметры данными по регионам
+            with tracer.step('region'):
+                params = await self._enrich_region(params, state)
             
             logger.info(f"calculate_full: work={work.get('work_title')}, quantity={quantity}, work_stage={work_stage}")
             logger.info(f"calculate_full: params={params}")
             
-            qty = Decimal(str(quantity))
+            qty = money.ratio(quantity)
             table_no = work.get('table_no')
-            merged_params = {**(work.get('params') or {}), **params}
-            if work.get("section") is not None and "section" not in merged_params:
-                merged_params["section"] = work.get("section")
+            merged_params = self._merge_work_params(work, params)
+            
+            plan = None
+            if self.plans is not None:
+                with tracer.step('plan'):
+                    plan = await self.plans.get(work)
+            # Документ строки определяет движок правил K1/K2/K3 (services/rules.py)
+            if plan is not None:
+                doc_code = plan.engine.doc_code
+            else:
+                doc_code = (await self.db.get_rule_engine(work.get('doc_id'))).doc_code
             
             result = {
                 'work': {
@@ -108,7 +165,7 @@ class CostCalculator:
                     'price_office': float(work.get('price_office') or 0),
                     'params': work.get('params', {})  # Параметры работы (категория сложности и т.д.)
                 },
-                'quantity': float(qty),
+                'quantity': money.to_float(qty),
                 'params': merged_params,
                 'field_calculation': None,
                 'office_calculation': None,
@@ -120,7 +177,6 @@ class CostCalculator:
                 'warnings': []
             }
             
-            total = Decimal(0)
             total_coeffs = []
             justification_parts = []
             
@@ -130,18 +186,21 @@ class CostCalculator:
                 justification_parts.append(work.get('section'))
             
             # Расчет полевых работ
-            field_total = Decimal(0)
+            field_total = 0  # копейки
             if work_stage in ['полевые', 'обе']:
                 field_calc = await self._calculate_stage(
                     work=work,
                     quantity=qty,
                     params=merged_params,
                     stage='field',
-                    table_no=table_no
+                    table_no=table_no,
+                    state=state,
+                    tracer=tracer,
+                    plan=plan,
+                    doc_code=doc_code
                 )
                 result['field_calculation'] = field_calc
-                field_total = Decimal(str(field_calc['total']))
-                total += field_total
+                field_total = field_calc['total_kopecks']
                 if field_calc.get('total_coeffs'):
                     total_coeffs = field_calc['total_coeffs']
                 
@@ -153,18 +212,21 @@ class CostCalculator:
                     result['errors'].extend(field_calc['errors'])
             
             # Расчет камеральных работ
-            office_total = Decimal(0)
+            office_total = 0  # копейки
             if work_stage in ['камеральные', 'обе']:
                 office_calc = await self._calculate_stage(
                     work=work,
                     quantity=qty,
                     params=merged_params,
                     stage='office',
-                    table_no=table_no
+                    table_no=table_no,
+                    state=state,
+                    tracer=tracer,
+                    plan=plan,
+                    doc_code=doc_code
                 )
                 result['office_calculation'] = office_calc
-                office_total = Decimal(str(office_calc['total']))
-                total += office_total
+                office_total = office_calc['total_kopecks']
                 if office_calc.get('total_coeffs'):
                     total_coeffs = office_calc['total_coeffs']
                 
@@ -176,63 +238,378 @@ class CostCalculator:
                     result['errors'].extend(office_calc['errors'])
             
             # Надбавки из БД (применяются к сумме полевых + камеральных)
-            params_with_office = {**merged_params, 'office_cost': float(office_total)}
-            params_with_office['base_cost_thousand'] = (float(field_total + office_total) / 1000.0)
-            # 1) Считаем надбавки один раз, чтобы получить внутренний транспорт
+            params_with_office = {**merged_params, 'office_cost': money.from_kopecks(office_total)}
+            params_with_office['base_cost_thousand'] = (field_total + office_total) / (money.KOPECKS_IN_RUBLE * 1000.0)
+            # Надбавки считаются за один проход в порядке зависимостей:
+            # внутренний транспорт → внешний и орг/ликв от (полевые + внутренний) → остальные
             addons = await self._calculate_addons_from_db(
                 params_with_office,
-                float(field_total),
-                internal_transport_cost=0.0,
+                money.from_kopecks(field_total),
+                state=state,
+                tracer=tracer,
             )
-
-            # 2) Если есть внутренний транспорт, пересчитываем надбавки,
-            #    чтобы внешний транспорт и орг/ликв считались от (полевые + внутренний)
-            internal_transport_cost = 0.0
-            for a in addons:
-                if a.get('code', '').startswith('INTERNAL_T4_'):
-                    internal_transport_cost += float(a.get('amount') or 0.0)
-
-            if internal_transport_cost > 0:
-                addons = await self._calculate_addons_from_db(
-                    params_with_office,
-                    float(field_total),
-                    internal_transport_cost=internal_transport_cost,
-                )
             result['addons_applied'] = addons
             
-            total_addons = sum(Decimal(str(a['amount'])) for a in addons)
-            total += total_addons
+            # суммы надбавок уже округлены до копейки (см. money: вторая точка округления)
+            total_addons = sum(money.to_kopecks(a['amount']) for a in addons)
+            total = field_total + office_total + total_addons
             
-            # Применяем коэффициенты apply_to=total после надбавок
-            if total_coeffs:
-                for coeff in total_coeffs:
-                    total *= Decimal(str(coeff['value']))
-                result['total_coefficients'] = total_coeffs
-                coeff_names = ', '.join([c['code'] for c in total_coeffs if c.get('code')])
-                if coeff_names:
-                    justification_parts.append(f"Итоговые коэффициенты: {coeff_names}")
+            # Применяем коэффициенты apply_to=total после надбавок (одно округление)
+            with tracer.step('total_coefficients'):
+                if total_coeffs:
+                    total = money.scale(total, money.product(c['value'] for c in total_coeffs))
+                    result['total_coefficients'] = total_coeffs
+                    coeff_names = ', '.join([c['code'] for c in total_coeffs if c.get('code')])
+                    if coeff_names:
+                        justification_parts.append(f"Итоговые коэффициенты: {coeff_names}")
             
             if addons:
                 addon_names = ', '.join([a['code'] for a in addons])
                 justification_parts.append(f"Надбавки: {addon_names}")
             
-            result['total_cost'] = float(total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+            result['total_cost'] = money.from_kopecks(total)
             result['justification'] = '; '.join(justification_parts)
             
             logger.info(f"Расчет завершен: {result['total_cost']} руб")
-            return result
+            if store_key is not None and not result['errors']:
+                self.result_store.put(store_key, result, self.db.catalog_fingerprint)
+            # Индекс применяется поверх базисного результата (в кэше — базисные цены)
+            result = await self._apply_price_index(
+                result, work, index_period, index_work_type, merged_params.get('region_name'), tracer
+            )
+            if state is not None:
+                state.result = result
+            return self._attach_trace(result, tracer)
             
         except Exception as e:
             logger.error(f"Ошибка расчета: {e}")
             raise
     
+    @staticmethod
+    def _attach_trace(result: Dict, tracer) -> Dict:
+        """Добавляет секцию trace в результат и пишет ее одной строкой в лог"""
+        if tracer is NULL_TRACE:
+            return result
+        data = tracer.to_dict()
+        logger.info(tracer.log_line(data))
+        return {**result, 'trace': data}
+    
+    async def _apply_price_index(
+        self,
+        result: Dict,
+        work: Dict,
+        period: Optional[Period],
+        work_type: Optional[str],
+        region: Optional[str] = None,
+        tracer=NULL_TRACE
+    ) -> Dict:
+        """Добавляет в результат индекс периода (price_index) и итог в текущих ценах (total_with_index)"""
+        if period is None:
+            return result
+        with tracer.step('price_index'):
+            try:
+                index = await self.get_price_index(period, work=work, work_type=work_type, region=region)
+            except ValueError as e:
+                return {**result, 'warnings': [*result.get('warnings', []), str(e)]}
+        if index is None:
+            warning = f"Нет индекса изменения стоимости на период {period}"
+            return {**result, 'warnings': [*result.get('warnings', []), warning]}
+        return {
+            **result,
+            'price_index': index.to_dict(),
+            'total_with_index': self._indexed_total(result['total_cost'], index.value),
+        }
+    
+    @staticmethod
+    def _indexed_total(total_cost: float, index_value: float) -> float:
+        """Итог в текущих ценах: базисный итог × индекс (одно округление до копеек)"""
+        return money.from_kopecks(money.scale(money.to_kopecks(total_cost), money.ratio(index_value)))
+    
+    async def _index_work_type(self, work: Optional[Dict], work_type: Optional[str]) -> Optional[str]:
+        """Тип работ индекса: явный или по документу строки расценки (RuleEngine.work_type)"""
+        if work_type or work is None:
+            return work_type
+        return (await self.db.get_rule_engine(work.get('doc_id'))).work_type
+    
+    async def get_price_index(
+        self,
+        period: Period = "latest",
+        work: Optional[Dict] = None,
+        work_type: Optional[str] = None,
+        region: Optional[str] = None
+    ):
+        """
+        Индекс изменения стоимости, действующий в периоде
+        
+        Args:
+            period: Период ("2025Q3", (2025, 3), "latest")
+            work: Строка расценки (тип работ — по ее документу)
+            work_type: Тип работ ("ИГДИ", "ИГИ"); важнее work
+            region: Регион (региональный индекс, если есть)
+            
+        Returns:
+            PriceIndex или None (нет индекса или таблица недоступна)
+            
+        Raises:
+            ValueError: Период не распознан
+        """
+        parse_period(period)
+        table = await self.db.get_inflation_indices()
+        if table is None:
+            return None
+        return table.lookup(period, await self._index_work_type(work, work_type), region)
+    
+    async def compare_price_indices(
+        self,
+        periods: List[Period],
+        total_cost: Optional[float] = None,
+        work: Optional[Dict] = None,
+        work_type: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Индексы нескольких периодов рядом (таблица индексов загружается один раз)
+        
+        Args:
+            periods: Периоды ("2024Q1", "2025Q3", ...)
+            total_cost: Базисный итог расчета — для итога в текущих ценах по каждому периоду
+            work: Строка расценки (тип работ — по ее документу)
+            work_type: Тип работ ("ИГДИ", "ИГИ"); важнее work
+            region: Регион
+            
+        Returns:
+            Строки в порядке periods: запрошенный период, индекс и период его действия,
+            источник, total_with_index (если задан total_cost)
+        """
+        parsed = [parse_period(period) for period in periods]
+        table = await self.db.get_inflation_indices()
+        if table is None:
+            return []
+        indices = table.compare(periods, await self._index_work_type(work, work_type), region)
+        rows = []
+        for period, requested, index in zip(periods, parsed, indices):
+            row = {
+                'requested': period_label(*requested) if requested else str(period),
+                'index': index.to_dict() if index else None,
+            }
+            if total_cost is not None:
+                row['total_with_index'] = self._indexed_total(total_cost, index.value) if index else None
+            rows.append(row)
+        return rows
+    
+    async def calculate_batch(
+        self,
+        lines: List[Dict],
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        index_period: Optional[Period] = None,
+        index_work_type: Optional[str] = None
+    ) -> Dict:
+        """
+        Расчет нескольких строк сметы за один проход
+        Региональные данные подбираются один раз на смету, K1/K2/K3 — через планы
+        и кэш наборов коэффициентов (общий для всех строк)
+        
+        Args:
+            lines: Строки сметы {'work', 'quantity', 'params' (параметры строки),
+                'work_stage' (необязательно)}
+            params: Общие параметры сметы (регион, тип территории, ...)
+            work_stage: Этап работ по умолчанию
+            index_period: Период индекса изменения стоимости (None — по настройке index_period)
+            index_work_type: Тип работ индекса (None — по документу первой строки)
+            
+        Returns:
+            {'lines': результаты calculate_full по порядку строк (None — строка не посчитана),
+             'total_cost', 'errors', 'warnings', 'price_index' и 'total_with_index' —
+             если применен индекс}
+        """
+        params = self._normalize_params(dict(params or {}))
+        if index_period is None:
+            index_period = self.index_period
+        region = None
+        results = []
+        errors = []
+        total = 0
+        for line in lines:
+            work = line['work']
+            line_params = {**params, **(line.get('params') or {})}
+            state = CalculationState(
+                work=work,
+                quantity=line['quantity'],
+                params=line_params,
+                work_stage=line.get('work_stage') or work_stage,
+                region=region,
+            )
+            try:
+                result = await self.calculate_full(
+                    work, line['quantity'], dict(line_params), state.work_stage,
+                    state=state, index_period=index_period, index_work_type=index_work_type
+                )
+            except Exception as e:
+                errors.append(f"{work.get('work_title')}: {e}")
+                results.append(None)
+                continue
+            region = state.region
+            results.append(result)
+            errors.extend(result.get('errors') or [])
+            total += money.to_kopecks(result['total_cost'])
+        
+        batch = {
+            'lines': results,
+            'total_cost': money.from_kopecks(total),
+            'errors': errors,
+            'warnings': [],
+        }
+        if lines:
+            batch = await self._apply_price_index(
+                batch, lines[0]['work'], index_period, index_work_type, params.get('region_name')
+            )
+        logger.info(f"calculate_batch: {len(lines)} строк, итого {batch['total_cost']} руб")
+        return batch
+    
+    async def sweep(
+        self,
+        works: Dict[str, Dict],
+        quantities: List[float],
+        regions: Optional[List[Optional[str]]] = None,
+        distances: Optional[List[Optional[float]]] = None,
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        index_period: Optional[Period] = None,
+        index_work_type: Optional[str] = None
+    ):
+        """
+        Перебор вариантов «что если»: объем × категория × регион × расстояние до базы
+        Правила разрешаются один раз, сетка считается векторно (см. services/sweep.py)
+        
+        Args:
+            works: Строки расценок по категориям (DatabaseService.get_work_variants)
+            quantities: Объемы работ
+            regions: Названия регионов (None — без региональных условий)
+            distances: Расстояния от базы до участка, км (None — без внутреннего транспорта)
+            params: Общие параметры расчета
+            work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            index_period: Период индекса изменения стоимости (None — по настройке index_period)
+            index_work_type: Тип работ индекса (None — по документу строки расценки)
+            
+        Returns:
+            SweepResult (таблица вариантов, выгрузка в CSV через to_csv)
+        """
+        from .sweep import CostSweep
+        
+        return await CostSweep(self).run(
+            works,
+            quantities,
+            regions=regions or [None],
+            distances=distances or [None],
+            params=params,
+            work_stage=work_stage,
+            index_period=index_period if index_period is not None else self.index_period,
+            index_work_type=index_work_type,
+        )
+    
+    async def price_variants(
+        self,
+        work: Dict,
+        quantity: float,
+        params: Dict,
+        param: str,
+        values: Optional[List[str]] = None,
+        work_stage: str = 'обе'
+    ):
+        """
+        Расчет всех значений неоднозначного параметра за один проход
+        (категории I–IV — разные строки таблицы, тип территории — одна строка)
+        
+        Args:
+            work: Данные работы из БД
+            quantity: Объем работ
+            params: Параметры расчета
+            param: Параметр ('category', 'territory_type', ...)
+            values: Значения (по умолчанию — все из VARIANT_PARAMS)
+            work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            
+        Returns:
+            VariantComparison (таблица вариантов с ценами, см. services/variants.py)
+        """
+        from .variants import VariantPricer
+        
+        return await VariantPricer(self).price(work, quantity, params, param, values=values, work_stage=work_stage)
+    
+    async def solve_quantity(
+        self,
+        work: Dict,
+        budget: float,
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        step: float = 0.01
+    ):
+        """
+        Обратный расчет: максимальный объем работ, который укладывается в бюджет
+        Правила разрешаются один раз, calculate_full не вызывается (см. services/solver.py)
+        
+        Args:
+            work: Данные работы из БД
+            budget: Бюджет (итоговая стоимость), руб.
+            params: Параметры расчета
+            work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            step: Точность объема (ответ кратен шагу)
+            
+        Returns:
+            BudgetSolution (объем, его стоимость, полоса, число оценок)
+        """
+        from .solver import BudgetSolver
+        
+        return await BudgetSolver(self).solve(work, budget, params=params, work_stage=work_stage, step=step)
+    
+    # Числовые параметры, которые могут прийти строкой ("None", "2,5")
+    NUMERIC_PARAM_KEYS = (
+        "altitude",
+        "altitude_m",
+        "unfavorable_months",
+        "salary_coeff",
+        "distance_to_base",
+        "distance_to_base_km",
+        "external_distance",
+        "external_distance_km",
+        "expedition_duration",
+        "expedition_duration_months",
+        "height_section",
+    )
+    
+    @classmethod
+    def _normalize_params(cls, params: Dict) -> Dict:
+        """Нормализует строковые "None" и числовые строки (изменяет params на месте)"""
+        for key in cls.NUMERIC_PARAM_KEYS:
+            if key in params and isinstance(params[key], str):
+                if params[key].strip().lower() == "none":
+                    params[key] = None
+                else:
+                    try:
+                        params[key] = float(params[key].replace(",", "."))
+                    except Exception:
+                        pass
+        return params
+    
+    @staticmethod
+    def _merge_work_params(work: Dict, params: Dict) -> Dict:
+        """Параметры строки расценки, дополненные параметрами пользователя"""
+        merged_params = {**(work.get('params') or {}), **params}
+        if work.get("section") is not None and "section" not in merged_params:
+            merged_params["section"] = work.get("section")
+        return merged_params
+    
     async def _calculate_stage(
         self,
         work: Dict,
-        quantity: Decimal,
+        quantity: money.Ratio,
         params: Dict,
         stage: str,
-        table_no: int
+        table_no: int,
+        state: Optional[CalculationState] = None,
+        tracer=NULL_TRACE,
+        plan: Optional[CalculationPlan] = None,
+        doc_code: Optional[str] = None
     ) -> Dict:
         """
         Расчет стоимости для одного этапа (полевые или камеральные)
@@ -240,73 +617,212 @@ class CostCalculator:
         
         Args:
             work: Данные работы
-            quantity: Объем
+            quantity: Объем (точная дробь, см. money.ratio)
             params: Параметры
             stage: 'field' или 'office'
             table_no: Номер таблицы
+            state: Состояние сессии для повторного использования K1/K2/K3
+            tracer: Трассировка (шаги <этап>.K1/K2/K3)
+            plan: План строки — правила берутся из него, без запросов к БД
+            doc_code: Код документа строки (движок правил без плана)
             
         Returns:
             Расчет для этапа
         """
         # Базовая цена
         if stage == 'field':
-            base_price = Decimal(str(work.get('price_field') or 0))
+            base_price = money.ratio(work.get('price_field') or 0)
         else:
-            base_price = Decimal(str(work.get('price_office') or 0))
-        
-        base_cost = base_price * quantity
+            base_price = money.ratio(work.get('price_office') or 0)
         
         # Получаем коэффициенты ТОЛЬКО из БД
-        coefficients, total_coeffs, errors = await self._get_coefficients_from_db(params, table_no, stage)
+        coefficients, total_coeffs, errors = await self._get_coefficients_from_db(
+            params, table_no, stage, state=state, tracer=tracer, plan=plan, doc_code=doc_code
+        )
         
-        # Применяем коэффициенты
-        total = base_cost
-        for code, info in coefficients.items():
-            total *= Decimal(str(info['value']))
+        # Применяем коэффициенты: цена × объем × K1 × K2 × K3, округление один раз
+        factor = money.product(info['value'] for info in coefficients.values())
+        total = money.line_cost(base_price, quantity, factor)
         
         return {
             'stage': stage,
-            'base_price': float(base_price),
-            'base_cost': float(base_cost.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)),
+            'base_price': money.to_float(base_price),
+            'base_cost': money.from_kopecks(money.line_cost(base_price, quantity)),
             'coefficients': coefficients,
-            'total': float(total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)),
+            'total': money.from_kopecks(total),
+            'total_kopecks': total,
             'errors': errors,
             'total_coeffs': total_coeffs
         }
     
-    async def _get_coefficients_from_db(self, params: Dict, table_no: int, stage: str) -> tuple:
+    async def _get_coefficients_from_db(
+        self,
+        params: Dict,
+        table_no: int,
+        stage: str,
+        state: Optional[CalculationState] = None,
+        tracer=NULL_TRACE,
+        plan: Optional[CalculationPlan] = None,
+        doc_code: Optional[str] = None
+    ) -> tuple:
         """
-        Получает коэффициенты K1, K2, K3 ТОЛЬКО из базы данных
-        БЕЗ FALLBACK - при ошибке возвращает понятное сообщение
+        Коэффициенты K1, K2, K3 с кэшированием
+        Ключ кэша: (версия каталога, table_no, stage, значения только тех параметров,
+        которые читают условия правил). Изменение объема, комментариев или
+        посторонних флагов не приводит к повторному подбору коэффициентов.
         
         Args:
             params: Параметры работ
             table_no: Номер таблицы (например 9)
             stage: 'field' или 'office'
+            state: Состояние сессии — из него берутся K1/K2/K3, параметры
+                которых не изменились с прошлого расчета
+            tracer: Трассировка (шаг на каждый коэффициент, cached — без запросов к БД)
+            plan: План строки: ключи параметров и подмножества правил без запросов к БД
+            doc_code: Код документа norm_docs (при плане берется из него)
             
         Returns:
             Tuple[словарь коэффициентов этапа, список итоговых коэффициентов, список ошибок]
         """
+        if plan is not None:
+            doc_code = plan.engine.doc_code
+            factor_keys = plan.stages[stage].param_keys
+        else:
+            factor_keys = await self.db.get_coefficient_param_keys(table_no, stage, doc_code)
+        if factor_keys is None:
+            with tracer.step(f"{stage}.coefficients"):
+                return await self._resolve_coefficients(params, table_no, stage, doc_code)
+
+        version = self.db.catalog_version
+        if version != self._coeff_cache_version:
+            self._coeff_cache.clear()
+            self._coeff_cache_version = version
+        if state is not None and state.catalog_version != version:
+            state.coefficients.clear()
+            state.catalog_version = version
+
+        signatures = {
+            factor: self._params_signature(params, factor_keys[factor])
+            for factor in self.COEFF_FACTORS
+        }
+        cache_key = (doc_code, table_no, stage) + tuple(signatures[factor] for factor in self.COEFF_FACTORS)
+        parts = self._coeff_cache.get(cache_key)
+        if parts is not None:
+            for factor in self.COEFF_FACTORS:
+                with tracer.step(f"{stage}.{factor}") as step:
+                    step['cached'] = True
+        else:
+            parts = {}
+            for factor in self.COEFF_FACTORS:
+                with tracer.step(f"{stage}.{factor}") as step:
+                    previous = state.coefficients.get((stage, factor)) if state is not None else None
+                    if previous is not None and previous[0] == signatures[factor]:
+                        parts[factor] = previous[1]
+                        step['cached'] = True
+                        continue
+                    parts[factor] = await self._resolve_factor(factor, params, table_no, stage, plan, doc_code)
+                if state is not None:
+                    state.evaluated.append(f"{stage}.{factor}")
+            if not any(part[2] for part in parts.values()):
+                # Ошибки БД не кэшируем — следующий расчет повторит запрос
+                self._coeff_cache.put(cache_key, parts)
+
+        if state is not None:
+            for factor in self.COEFF_FACTORS:
+                state.coefficients[(stage, factor)] = (signatures[factor], parts[factor])
+        return copy.deepcopy(self._combine_factors(parts))
+    
+    @classmethod
+    def _params_signature(cls, params: Dict, keys: frozenset) -> tuple:
+        """Хэшируемый срез параметров по ключам (None и отсутствие ключа равнозначны)"""
+        return tuple(sorted(
+            (key, cls._freeze(params[key]))
+            for key in keys
+            if params.get(key) is not None
+        ))
+    
+    @classmethod
+    def _freeze(cls, value):
+        if isinstance(value, dict):
+            return tuple(sorted((k, cls._freeze(v)) for k, v in value.items()))
+        if isinstance(value, (list, tuple, set)):
+            return tuple(cls._freeze(v) for v in value)
+        return value
+    
+    @classmethod
+    def _combine_factors(cls, parts: Dict[str, tuple]) -> tuple:
+        """Собирает результаты K1/K2/K3 в (коэффициенты, итоговые коэффициенты, ошибки)"""
         coefficients = {}
-        errors = []
         total_coeffs = []
+        errors = []
+        for factor in cls.COEFF_FACTORS:
+            entry, factor_total_coeffs, factor_errors = parts[factor]
+            coefficients[factor] = entry
+            total_coeffs.extend(factor_total_coeffs)
+            errors.extend(factor_errors)
+        return coefficients, total_coeffs, errors
+    
+    async def _resolve_coefficients(self, params: Dict, table_no: int, stage: str, doc_code: Optional[str] = None) -> tuple:
+        """
+        Получает коэффициенты K1, K2, K3 ТОЛЬКО из базы данных (без кэша)
+        
+        Returns:
+            Tuple[словарь коэффициентов этапа, список итоговых коэффициентов, список ошибок]
+        """
+        parts = {}
+        for factor in self.COEFF_FACTORS:
+            parts[factor] = await self._resolve_factor(factor, params, table_no, stage, doc_code=doc_code)
+        return self._combine_factors(parts)
+    
+    async def _resolve_factor(
+        self,
+        factor: str,
+        params: Dict,
+        table_no: int,
+        stage: str,
+        plan: Optional[CalculationPlan] = None,
+        doc_code: Optional[str] = None
+    ) -> tuple:
+        """Подбирает один из коэффициентов K1/K2/K3 этапа (по плану строки, если он есть)"""
+        if factor == 'K1':
+            return await self._resolve_k1(params, table_no, stage, plan, doc_code)
+        if factor == 'K2':
+            return await self._resolve_k2(params, stage, plan, doc_code)
+        return await self._resolve_k3(params, stage, plan, doc_code)
+    
+    async def _resolve_k1(
+        self,
+        params: Dict,
+        table_no: int,
+        stage: str,
+        plan: Optional[CalculationPlan] = None,
+        doc_code: Optional[str] = None
+    ) -> tuple:
+        """
+        K1 - Коэффициенты из примечаний к таблицам (из БД)
+        БЕЗ FALLBACK - при ошибке возвращает понятное сообщение
         
-        # ========================================
-        # K1 - Коэффициенты из примечаний к таблицам (из БД)
-        # ========================================
-        k1_value = Decimal('1.0')
+        Returns:
+            Tuple[запись K1, итоговые коэффициенты (всегда пусто), список ошибок]
+        """
+        errors = []
+        k1_value = money.ONE
         k1_reasons = []
         k1_sources = []
         k1_notes = []
         
         try:
-            k1_coeffs = await self.db.get_k1_coefficients(table_no, params, stage=stage)
-            
-            # Фильтруем по exclusive_group
-            k1_coeffs = self.db._filter_by_exclusive_group(k1_coeffs, params)
+            if plan is not None:
+                # План уже учитывает exclusive_group своих правил
+                k1_coeffs = plan.match('K1', stage, params)
+            else:
+                k1_coeffs = await self.db.get_k1_coefficients(table_no, params, stage=stage, doc_code=doc_code)
+                
+                # Фильтруем по exclusive_group
+                k1_coeffs = self.db._filter_by_exclusive_group(k1_coeffs, params)
             
             for coeff in k1_coeffs:
-                k1_value *= Decimal(str(coeff['value']))
+                k1_value = money.mul(k1_value, money.ratio(coeff['value']))
                 k1_reasons.append(coeff['name'])
                 source_ref = coeff.get('source_ref', {})
                 if source_ref.get('section'):
@@ -325,17 +841,29 @@ class CostCalculator:
             k1_reasons.append('ОШИБКА: данные не получены из БД')
             k1_sources.append(f'табл. {table_no}')
         
-        coefficients['K1'] = {
-            'value': float(k1_value),
+        entry = {
+            'value': money.to_float(k1_value),
             'reason': '; '.join(k1_reasons) if k1_reasons else 'Базовый',
             'source': ', '.join(k1_sources) if k1_sources else f'табл. {table_no}',
             'notes': sorted(set(k1_notes))
         }
+        return entry, [], errors
+    
+    async def _resolve_k2(
+        self,
+        params: Dict,
+        stage: str,
+        plan: Optional[CalculationPlan] = None,
+        doc_code: Optional[str] = None
+    ) -> tuple:
+        """
+        K2 - Коэффициенты из п.15 ОУ (из БД)
         
-        # ========================================
-        # K2 - Коэффициенты из п.15 ОУ (из БД)
-        # ========================================
-        k2_value = Decimal('1.0')
+        Returns:
+            Tuple[запись K2, итоговые коэффициенты (всегда пусто), список ошибок]
+        """
+        errors = []
+        k2_value = money.ONE
         k2_reasons = []
         k2_sources = []
         
@@ -345,21 +873,18 @@ class CostCalculator:
         
         if should_apply_k2:
             try:
-                k2_coeffs = await self.db.get_k2_coefficients(params)
+                if plan is not None:
+                    k2_coeffs = plan.match('K2', stage, params)
+                else:
+                    k2_coeffs = await self.db.get_k2_coefficients(params, doc_code=doc_code)
                 
                 for coeff in k2_coeffs:
-                    k2_value *= Decimal(str(coeff['value']))
+                    k2_value = money.mul(k2_value, money.ratio(coeff['value']))
                     k2_reasons.append(coeff['name'])
                     source_ref = coeff.get('source_ref', {})
                     if source_ref.get('section'):
                         k2_sources.append(source_ref['section'])
                         
-            except ValueError as ve:
-                # Конфликт коэффициентов
-                error_msg = str(ve)
-                logger.error(error_msg)
-                errors.append(error_msg)
-                k2_reasons.append(f'ОШИБКА: {error_msg}')
             except Exception as e:
                 error_msg = f"K2 коэффициенты не получены из БД: {e}"
                 logger.error(error_msg)
@@ -369,21 +894,37 @@ class CostCalculator:
         if not k2_reasons:
             k2_reasons.append('Базовый (условия не заданы)')
         
-        coefficients['K2'] = {
-            'value': float(k2_value),
+        entry = {
+            'value': money.to_float(k2_value),
             'reason': '; '.join(k2_reasons),
             'source': ', '.join(k2_sources) if k2_sources else 'ОУ п.15'
         }
+        return entry, [], errors
+    
+    async def _resolve_k3(
+        self,
+        params: Dict,
+        stage: str,
+        plan: Optional[CalculationPlan] = None,
+        doc_code: Optional[str] = None
+    ) -> tuple:
+        """
+        K3 - Коэффициенты условий производства (п.8, п.14 ОУ)
         
-        # ========================================
-        # K3 - Коэффициенты условий производства (п.8, п.14 ОУ)
-        # ========================================
-        k3_value = Decimal('1.0')
+        Returns:
+            Tuple[запись K3, итоговые коэффициенты (apply_to=total), список ошибок]
+        """
+        errors = []
+        total_coeffs = []
+        k3_value = money.ONE
         k3_reasons = []
         k3_sources = []
         
         try:
-            k3_coeffs = await self.db.get_k3_coefficients(params)
+            if plan is not None:
+                k3_coeffs = plan.match('K3', stage, params)
+            else:
+                k3_coeffs = await self.db.get_k3_coefficients(params, doc_code=doc_code)
             
             for coeff in k3_coeffs:
                 apply_to = coeff.get('apply_to', 'field')
@@ -398,13 +939,13 @@ class CostCalculator:
                     continue
                 
                 if stage == 'field' and apply_to == 'field':
-                    k3_value *= Decimal(str(coeff['value']))
+                    k3_value = money.mul(k3_value, money.ratio(coeff['value']))
                     k3_reasons.append(coeff['name'])
                     source_ref = coeff.get('source_ref', {})
                     if source_ref.get('section'):
                         k3_sources.append(source_ref['section'])
                 elif stage == 'office' and apply_to == 'office':
-                    k3_value *= Decimal(str(coeff['value']))
+                    k3_value = money.mul(k3_value, money.ratio(coeff['value']))
                     k3_reasons.append(coeff['name'])
                     source_ref = coeff.get('source_ref', {})
                     if source_ref.get('section'):
@@ -419,19 +960,20 @@ class CostCalculator:
         if not k3_reasons:
             k3_reasons.append('Условия объекта не заданы')
         
-        coefficients['K3'] = {
-            'value': float(k3_value),
+        entry = {
+            'value': money.to_float(k3_value),
             'reason': '; '.join(k3_reasons),
             'source': ', '.join(k3_sources) if k3_sources else 'ОУ п.8, п.14'
         }
-        
-        return coefficients, total_coeffs, errors
+        return entry, total_coeffs, errors
     
     async def _calculate_addons_from_db(
         self,
         params: Dict,
         field_cost: float,
-        internal_transport_cost: float = 0.0
+        internal_transport_cost: Optional[float] = None,
+        state: Optional[CalculationState] = None,
+        tracer=NULL_TRACE
     ) -> List[Dict]:
         """
         Рассчитывает надбавки из БД
@@ -439,18 +981,33 @@ class CostCalculator:
         Args:
             params: Параметры работ
             field_cost: Стоимость полевых работ
+            internal_transport_cost: Стоимость внутреннего транспорта.
+                По умолчанию берется из надбавки табл.4 того же прохода
+            state: Состояние сессии — семейства надбавок с прежними параметрами
+                и базой не пересчитываются
+            tracer: Трассировка (шаг на каждое семейство надбавок)
             
         Returns:
             Список надбавок с суммами
         """
         try:
+            memo = state.addons if state is not None else None
+            before = dict(memo) if memo is not None else {}
+            
             # Получаем надбавки из БД по условиям
             addons = await self.db.get_addons_by_conditions(
                 params,
                 field_cost,
-                internal_transport_cost=internal_transport_cost
+                internal_transport_cost=internal_transport_cost,
+                memo=memo,
+                trace=tracer
             )
             
+            if memo is not None:
+                state.evaluated.extend(
+                    f"addons.{family}" for family, entry in memo.items() if before.get(family) is not entry
+                )
+            
             if not addons:
                 logger.warning("Надбавки не найдены в БД, проверьте параметры")
             
@@ -460,6 +1017,78 @@ class CostCalculator:
             logger.error(f"Ошибка получения надбавок из БД: {e}")
             return []
     
+    async def _enrich_region(self, params: Dict, state: Optional[CalculationState] = None) -> Dict:
+        """
+        Региональные данные (enrich_params_with_region) с повторным использованием
+        в сессии, пока региональные параметры не изменились
+        """
+        if state is None:
+            return await self.db.enrich_params_with_region(params)
+        signature = tuple(params.get(key) for key in self.db.REGION_PARAM_KEYS)
+        if state.region is not None and state.region[0] == signature:
+            return {**params, **state.region[1]}
+        enriched = await self.db.enrich_params_with_region(params)
+        added = {key: value for key, value in enriched.items() if params.get(key) != value}
+        state.region = (signature, added)
+        state.evaluated.append('region')
+        return enriched
+    
+    async def start_session(
+        self,
+        work: Dict,
+        quantity: float,
+        params: Dict,
+        work_stage: str = 'обе'
+    ) -> CalculationState:
+        """
+        Расчет с сохранением состояния для последующих уточнений (recalculate)
+        
+        Returns:
+            Состояние; результат расчета — в state.result
+        """
+        state = CalculationState(
+            work=work,
+            quantity=quantity,
+            params=dict(params or {}),
+            work_stage=work_stage or 'обе',
+        )
+        await self.calculate_full(work, quantity, dict(state.params), state.work_stage, state=state)
+        return state
+    
+    async def recalculate(self, state: CalculationState, changes: Dict, work: Optional[Dict] = None) -> Dict:
+        """
+        Пересчет после уточнения параметров: заново подбираются только
+        K1/K2/K3 и семейства надбавок, чьи параметры или база изменились
+        
+        Args:
+            state: Состояние из start_session (обновляется на месте)
+            changes: Уточненные параметры {ключ: значение}, None — удалить
+            work: Новая строка расценки (выбран другой вариант категории);
+                K1/K2/K3 и надбавки прежней строки при этом не переиспользуются
+            
+        Returns:
+            Разница с предыдущим результатом (см. calc_state.diff_results);
+            новый результат — в state.result
+        """
+        previous = state.result or {}
+        changed = state.apply_changes(changes)
+        old_work = state.replace_work(work) if work is not None else None
+        if old_work is not None:
+            changed['work'] = (old_work.get('work_title'), work.get('work_title'))
+        state.evaluated = []
+        if not changed and state.result is not None:
+            return diff_results(previous, state.result, changed, [])
+        
+        current = await self.calculate_full(
+            state.work,
+            state.quantity,
+            dict(state.params),
+            state.work_stage,
+            state=state,
+        )
+        logger.info(f"Пересчет по {sorted(changed)}: пересчитаны {state.evaluated or 'только суммы'}")
+        return diff_results(previous, current, changed, state.evaluated)
+    
     # Старый метод для обратной совместимости
     async def calculate(
         self,
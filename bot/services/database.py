@@ -4,11 +4,17 @@
 """
 
 from typing import List, Dict, Optional, Any, Tuple
+import hashlib
 import re
+import time
 from dataclasses import dataclass, field
 from supabase import create_client, Client
 from loguru import logger
 
+from .trace import NULL_TRACE
+from .piecewise import PIECEWISE_FAMILIES, compile_schedules
+from .rule_groups import RuleGroups, filter_exclusive
+
 
 @dataclass
 class SearchResult:
@@ -46,9 +52,98 @@ class SearchResult:
         return msg
 
 
+@dataclass
+class SearchCandidates:
+    """
+    Строки norm_items, найденные по терминам запроса (сетевая часть search_works_v2)
+    Фильтрация по параметрам выполняется локально, поэтому кандидатов можно
+    загрузить заранее, зная только тип работ и масштаб.
+    """
+    query: str
+    scale: Optional[str]
+    limit: int
+    search_terms: List[str] = field(default_factory=list)
+    works: List[Dict] = field(default_factory=list)
+
+    def matches(self, query: str, scale: Optional[str], limit: int) -> bool:
+        return (self.query, self.scale, self.limit) == (query, scale or None, limit)
+
+
 class DatabaseService:
     """Сервис для работы с Supabase"""
     
+    # Коэффициенты к орг./ликв. в зависимости от стоимости полевых работ (п.13):
+    # (стоимость полевых до, руб; коэффициент). Свыше последнего порога — 1.0
+    ORG_LIQ_COST_BANDS = ((30000, 2.5), (75000, 2.0), (150000, 1.5))
+    
+    # Какие параметры расчета читают условия K1/K2/K3 (ключ conditions → ключи params).
+    # Ключи conditions, которых здесь нет, считаются одноименными параметрами.
+    COEFF_CONDITION_PARAMS = {
+        "territory_type": ("territory_type", "territory"),
+        "territory": ("territory_type", "territory"),
+        "section_min": ("section",),
+        "section_max": ("section",),
+        "scale": ("scale", "work_scale"),
+        "scale_min": ("scale", "work_scale"),
+        "scale_max": ("scale", "work_scale"),
+        "height_section": ("height_section", "relief_section"),
+        "area_min": ("area_ha",),
+        "area_max": ("area_ha",),
+        "strip_width_min": ("strip_width_m",),
+        "strip_width_max": ("strip_width_m",),
+        "restricted_materials": ("classified_materials", "restricted_materials"),
+        "artificial_light": ("artificial_lighting", "artificial_light"),
+        "computer_tech": ("use_computer", "computer_tech"),
+        "dual_media": ("dual_format", "dual_media"),
+        "altitude_min": ("altitude_m", "altitude"),
+        "altitude_max": ("altitude_m", "altitude"),
+        "unfavorable_months_min": ("unfavorable_months",),
+        "unfavorable_months_max": ("unfavorable_months",),
+        "night_work": ("night_time", "night_work"),
+        "radioactivity_msv_per_year_min": ("radioactivity_msv_per_year",),
+        "radioactivity_coeff_range": (),
+        "table_no": (),
+        "applies_to_addon": (),
+    }
+    # Параметры, влияющие на K1/K2/K3 помимо conditions (условия включения K2/K3)
+    COEFF_GATE_PARAMS = {
+        "K1": (),
+        "K2": (
+            "intermediate_materials",
+            "classified_materials",
+            "restricted_materials",
+            "artificial_lighting",
+            "artificial_light",
+            "color_plan",
+            "use_computer",
+            "computer_tech",
+            "dual_format",
+            "dual_media",
+        ),
+        "K3": ("apply_conditions_as_addons", "desert_coeff"),
+    }
+    # Какие параметры читает каждое семейство надбавок (в порядке расчета)
+    ADDON_FAMILY_PARAMS = {
+        "internal": ("distance_to_base_km", "distance_to_base"),
+        "external": ("external_distance_km", "external_distance", "expedition_duration_months", "expedition_duration"),
+        "org_liq": ("region_type", "expedition_duration_months", "expedition_duration"),
+        "conditional": (
+            "apply_conditions_as_addons", "unfavorable_months", "salary_coeff",
+            "altitude", "special_regime", "intermediate_materials",
+        ),
+        "piecewise": ("include_program", "include_registration", "include_report"),
+    }
+    # Параметры, от которых зависит enrich_params_with_region (заданные пользователем имеют приоритет)
+    REGION_PARAM_KEYS = ("region_code", "region_name", "salary_coeff", "unfavorable_months", "desert_coeff", "region_type")
+    # Таблицы enrich_params_with_region: их содержимое входит в catalog_fingerprint
+    REGION_TABLES = ("regional_coeffs", "regional_unfavorable_periods", "regional_desert_coeffs", "regional_zone_lists")
+    # Как часто (сек) сверять версию каталога норм (norm_docs.version/updated_at)
+    CATALOG_CHECK_INTERVAL = 300.0
+    # Число запросов к таблицам с момента создания сервиса (для трассировки расчета)
+    query_count = 0
+    # Реестр движков правил по документам (см. rule_engines)
+    _rule_engines = None
+    
     def __init__(self, url: str, key: str):
         """
         Инициализация подключения к Supabase
@@ -58,7 +153,35 @@ class DatabaseService:
             key: Service role key для полного доступа
         """
         self.client: Client = create_client(url, key)
+        self._init_catalog_state()
         logger.info(f"Подключение к Supabase: {url}")
+    
+    def _table(self, name: str):
+        """Запрос к таблице Supabase с учетом в query_count"""
+        self.query_count += 1
+        return self.client.table(name)
+    
+    def _init_catalog_state(self) -> None:
+        """Сбрасывает версию каталога норм и производные от него кэши"""
+        self._catalog_generation = 0
+        self._catalog_stamp = None
+        self._region_stamp = None
+        self._region_checked_at = 0.0
+        self._catalog_checked_at = 0.0
+        # Правила norm_coeffs по коду документа и коды документов по id (из norm_docs)
+        self._coeff_rules: Dict[str, List[Dict]] = {}
+        self._doc_codes: Dict[str, str] = {}
+        self._coeff_param_keys: Dict[Tuple[str, int, str], Dict[str, frozenset]] = {}
+        # Ранжированные exclusive_group правил документа (services/rule_groups.py)
+        self._rule_groups: Dict[str, RuleGroups] = {}
+        # Таблица индексов изменения стоимости (services/indices.py)
+        self._inflation_indices = None
+        # Шаблоны смет со строками (services/templates.py)
+        self._estimate_templates = None
+        # Шкалы формульных надбавок табл.78-80 (services/piecewise.py)
+        self._piecewise_schedules = None
+        # Названия регионов regional_coeffs (распознавание региона в запросе)
+        self._region_names: Optional[List[str]] = None
 
     def has_telegram_user(self, telegram_id: int, username: Optional[str]) -> bool:
         """
@@ -68,11 +191,11 @@ class DatabaseService:
             if username:
                 uname = username.lstrip("@")
                 # Ищем по username без учета регистра или по ID
-                query = self.client.table("telegram_users").select("id").or_(
+                query = self._table("telegram_users").select("id").or_(
                     f"telegram_id.eq.{telegram_id},username.ilike.{uname}"
                 )
             else:
-                query = self.client.table("telegram_users").select("id").eq("telegram_id", telegram_id)
+                query = self._table("telegram_users").select("id").eq("telegram_id", telegram_id)
             response = query.limit(1).execute()
             return bool(response.data)
         except Exception as e:
@@ -170,28 +293,28 @@ class DatabaseService:
 
         try:
             if region_code and not enriched.get("salary_coeff"):
-                resp = self.client.table("regional_coeffs").select("*").eq("region_code", region_code).execute()
+                resp = self._table("regional_coeffs").select("*").eq("region_code", region_code).execute()
                 if resp.data:
                     enriched["salary_coeff"] = resp.data[0].get("salary_coeff")
 
             if region_name:
                 if not enriched.get("salary_coeff"):
-                    resp = self.client.table("regional_coeffs").select("*").ilike("region_name", f"%{region_name}%").execute()
+                    resp = self._table("regional_coeffs").select("*").ilike("region_name", f"%{region_name}%").execute()
                     if resp.data:
                         enriched["salary_coeff"] = resp.data[0].get("salary_coeff")
 
                 if not enriched.get("unfavorable_months"):
-                    resp = self.client.table("regional_unfavorable_periods").select("*").ilike("region_name", f"%{region_name}%").execute()
+                    resp = self._table("regional_unfavorable_periods").select("*").ilike("region_name", f"%{region_name}%").execute()
                     if resp.data:
                         enriched["unfavorable_months"] = resp.data[0].get("duration_months")
 
                 if not enriched.get("desert_coeff"):
-                    resp = self.client.table("regional_desert_coeffs").select("*").ilike("region_name", f"%{region_name}%").execute()
+                    resp = self._table("regional_desert_coeffs").select("*").ilike("region_name", f"%{region_name}%").execute()
                     if resp.data:
                         enriched["desert_coeff"] = resp.data[0].get("coeff")
 
                 if not enriched.get("region_type"):
-                    resp = self.client.table("regional_zone_lists").select("*").ilike("region_name", f"%{region_name}%").execute()
+                    resp = self._table("regional_zone_lists").select("*").ilike("region_name", f"%{region_name}%").execute()
                     if resp.data:
                         zone_types = {r.get("zone_type") for r in resp.data}
                         if "far_north" in zone_types:
@@ -214,7 +337,8 @@ class DatabaseService:
         territory: Optional[str] = None,
         height_section: Optional[float] = None,
         column: Optional[str] = None,
-        limit: int = 10
+        limit: int = 10,
+        prefetched: Optional[SearchCandidates] = None
     ) -> SearchResult:
         """
         Улучшенный поиск работ с детальной информацией об ошибках
@@ -225,37 +349,19 @@ class DatabaseService:
             category: Категория сложности
             territory: Тип территории
             limit: Максимальное количество результатов
+            prefetched: Кандидаты, загруженные заранее (fetch_search_candidates);
+                используются, если загружены для тех же query, scale и limit
             
         Returns:
             SearchResult с работами или детальными ошибками
         """
         result = SearchResult()
         
-        # 1. Расширяем запрос синонимами
-        search_terms = await self._expand_query_with_synonyms(query)
-        result.search_terms_used = search_terms[:5]  # Показываем первые 5
-        
-        # 2. Добавляем масштаб в поиск если указан
-        if scale:
-            search_terms.append(scale)
-        
-        # 3. Ищем работы по всем терминам
-        all_works = []
-        seen_ids = set()
-        
-        for term in search_terms:
-            try:
-                response = self.client.table("norm_items").select(
-                    "id, work_title, unit, price, price_field, price_office, table_no, section, params"
-                ).ilike("work_title", f"%{term}%").limit(limit * 2).execute()
-                
-                for item in response.data:
-                    if item['id'] not in seen_ids:
-                        seen_ids.add(item['id'])
-                        all_works.append(item)
-                        
-            except Exception as e:
-                logger.error(f"Ошибка поиска по термину '{term}': {e}")
+        # 1-3. Кандидаты по терминам запроса (синонимы и масштаб)
+        if prefetched is None or not prefetched.matches(query, scale, limit):
+            prefetched = await self.fetch_search_candidates(query, scale, limit)
+        result.search_terms_used = prefetched.search_terms[:5]  # Показываем первые 5
+        all_works = prefetched.works
         
         if not all_works:
             result.errors.append(f"Не найдены работы по запросу '{query}'")
@@ -416,6 +522,40 @@ class DatabaseService:
         logger.info(f"Найдено работ (v2): {len(result.works)} по запросу '{query}'")
         return result
     
+    async def fetch_search_candidates(self, query: str, scale: Optional[str] = None, limit: int = 10) -> SearchCandidates:
+        """
+        Строки norm_items по запросу, синонимам и масштабу (без фильтра по параметрам)
+        
+        Args:
+            query: Поисковый запрос (тип работ)
+            scale: Масштаб (добавляется как термин поиска)
+            limit: Максимальное количество результатов search_works_v2
+        """
+        # 1. Расширяем запрос синонимами
+        search_terms = await self._expand_query_with_synonyms(query)
+        candidates = SearchCandidates(query=query, scale=scale or None, limit=limit, search_terms=list(search_terms))
+        
+        # 2. Добавляем масштаб в поиск если указан
+        if scale:
+            search_terms.append(scale)
+        
+        # 3. Ищем работы по всем терминам
+        seen_ids = set()
+        for term in search_terms:
+            try:
+                response = self._table("norm_items").select(
+                    "id, doc_id, work_title, unit, price, price_field, price_office, table_no, section, params"
+                ).ilike("work_title", f"%{term}%").limit(limit * 2).execute()
+                
+                for item in response.data:
+                    if item['id'] not in seen_ids:
+                        seen_ids.add(item['id'])
+                        candidates.works.append(item)
+                        
+            except Exception as e:
+                logger.error(f"Ошибка поиска по термину '{term}': {e}")
+        return candidates
+    
     async def _expand_query_with_synonyms(self, query: str) -> List[str]:
         """Расширяет запрос синонимами из БД"""
         terms = [query]
@@ -433,7 +573,7 @@ class DatabaseService:
         
         # Ищем синонимы в БД
         try:
-            response = self.client.table("work_synonyms").select("main_term, synonyms").execute()
+            response = self._table("work_synonyms").select("main_term, synonyms").execute()
             
             for row in response.data:
                 main_term = row.get('main_term', '').lower()
@@ -466,7 +606,7 @@ class DatabaseService:
     async def _get_available_work_types(self) -> List[str]:
         """Получает список доступных типов работ"""
         try:
-            response = self.client.table("norm_items").select("work_title").limit(100).execute()
+            response = self._table("norm_items").select("work_title").limit(100).execute()
             
             # Извлекаем уникальные типы
             types = set()
@@ -542,8 +682,8 @@ class DatabaseService:
         
         for search_term in search_variants:
             try:
-                query_builder = self.client.table("norm_items").select(
-                    "id, work_title, unit, price, price_field, price_office, table_no, section, params"
+                query_builder = self._table("norm_items").select(
+                    "id, doc_id, work_title, unit, price, price_field, price_office, table_no, section, params"
                 )
                 
                 # Поиск по названию работы
@@ -594,7 +734,7 @@ class DatabaseService:
             Данные работы или None
         """
         try:
-            response = self.client.table("norm_items").select("*").eq("id", work_id).execute()
+            response = self._table("norm_items").select("*").eq("id", work_id).execute()
             
             if response.data:
                 return response.data[0]
@@ -604,6 +744,75 @@ class DatabaseService:
             logger.error(f"Ошибка получения работы {work_id}: {e}")
             return None
     
+    async def get_works_by_ids(self, work_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Строки расценок по списку ID одним запросом
+        
+        Args:
+            work_ids: UUID строк norm_items
+            
+        Returns:
+            Словарь {id: строка расценки} (ненайденные ID отсутствуют)
+        """
+        ids = list(dict.fromkeys(i for i in work_ids if i))
+        if not ids:
+            return {}
+        try:
+            response = self._table("norm_items").select(
+                "id, doc_id, work_title, unit, price, price_field, price_office, table_no, section, params"
+            ).in_("id", ids).execute()
+        except Exception as e:
+            logger.error(f"Ошибка получения работ {ids}: {e}")
+            return {}
+        return {item["id"]: item for item in response.data or []}
+    
+    async def get_work_variants(self, work: Dict, param_key: str, values: Optional[List[str]] = None) -> Dict[str, Dict]:
+        """
+        Находит строки той же таблицы, отличающиеся от work только параметром param_key
+        (например, та же съемка 1:500 для категорий I–IV)
+        
+        Args:
+            work: Исходная работа
+            param_key: Варьируемый параметр строки (category, territory, ...)
+            values: Нужные значения параметра (по умолчанию — все найденные)
+            
+        Returns:
+            Словарь {значение параметра: строка расценки}
+        """
+        variants = {}
+        base_params = {k: v for k, v in (work.get('params') or {}).items() if k != param_key}
+        own_value = (work.get('params') or {}).get(param_key)
+        if own_value is not None:
+            variants[str(own_value)] = work
+        
+        if work.get('table_no') is None:
+            return variants
+        
+        try:
+            query = self._table("norm_items").select(
+                "id, doc_id, work_title, unit, price, price_field, price_office, table_no, section, params"
+            ).eq("table_no", work.get('table_no'))
+            # Номера таблиц в разных документах совпадают
+            if work.get('doc_id') is not None:
+                query = query.eq("doc_id", work.get('doc_id'))
+            response = query.execute()
+        except Exception as e:
+            logger.error(f"Ошибка получения вариантов работы {work.get('id')}: {e}")
+            return variants
+        
+        for item in response.data:
+            item_params = item.get('params') or {}
+            value = item_params.get(param_key)
+            if value is None or str(value) in variants:
+                continue
+            if {k: v for k, v in item_params.items() if k != param_key} != base_params:
+                continue
+            variants[str(value)] = item
+        
+        if values is not None:
+            variants = {str(v): variants[str(v)] for v in values if str(v) in variants}
+        return variants
+    
     async def get_coefficients(
         self,
         apply_to: Optional[str] = None,
@@ -620,7 +829,7 @@ class DatabaseService:
             Список коэффициентов
         """
         try:
-            query_builder = self.client.table("norm_coeffs").select("*")
+            query_builder = self._table("norm_coeffs").select("*")
             
             if apply_to:
                 query_builder = query_builder.eq("apply_to", apply_to)
@@ -653,7 +862,7 @@ class DatabaseService:
             Список надбавок
         """
         try:
-            query_builder = self.client.table("norm_addons").select("*")
+            query_builder = self._table("norm_addons").select("*")
             
             if base_type:
                 query_builder = query_builder.eq("base_type", base_type)
@@ -681,7 +890,7 @@ class DatabaseService:
             Список синонимов
         """
         try:
-            response = self.client.table("work_synonyms").select("*").or_(
+            response = self._table("work_synonyms").select("*").or_(
                 f"main_term.ilike.%{term}%,synonyms.cs.{{{term}}}"
             ).execute()
             
@@ -697,6 +906,7 @@ class DatabaseService:
         table_no: int,
         params: Dict,
         stage: str = "field",
+        doc_code: Optional[str] = None,
     ) -> List[Dict]:
         """
         Получить K1 коэффициенты из примечаний к таблице
@@ -704,6 +914,7 @@ class DatabaseService:
         Args:
             table_no: Номер таблицы (например 9)
             params: Параметры работ (territory_type, has_underground_comms и т.д.)
+            doc_code: Код документа norm_docs (None — СБЦ ИГДИ-2004)
             
         Returns:
             Список подходящих коэффициентов K1
@@ -712,21 +923,16 @@ class DatabaseService:
             if table_no is None:
                 logger.info("K1 коэффициенты не запрошены: table_no не указан")
                 return []
-            doc_resp = self.client.table("norm_docs").select("id").eq("code", "SBC_IGDI_2004").execute()
+            engine = self.rule_engines.get(doc_code)
+            doc_resp = self._table("norm_docs").select("id").eq("code", engine.doc_code).execute()
             if not doc_resp.data:
-                logger.warning("Документ SBC_IGDI_2004 не найден для K1")
+                logger.warning(f"Документ {engine.doc_code} не найден для K1")
                 return []
             doc_id = doc_resp.data[0]["id"]
-            scale = self._normalize_scale(params.get("scale") or params.get("work_scale"))
-            height_section = self._to_float(params.get("height_section") or params.get("relief_section"))
-            # territory_type (из параметров пользователя) имеет приоритет над territory (из строки работы)
-            territory = self._normalize_territory(params.get("territory_type") or params.get("territory"))
-            area_ha = self._to_float(params.get("area_ha"))
-            strip_width_m = self._to_float(params.get("strip_width_m"))
 
             # Получаем табличные коэффициенты (apply_to=price/field/office) и фильтруем по table_no
             response = (
-                self.client.table("norm_coeffs")
+                self._table("norm_coeffs")
                 .select("*")
                 .eq("doc_id", doc_id)
                 .in_("apply_to", ["price", "field", "office"])
@@ -737,251 +943,319 @@ class DatabaseService:
                 logger.info(f"K1 коэффициенты (apply_to=price) не найдены для doc_id={doc_id}")
                 return []
 
-            matching = []
-            for coeff in response.data:
-                conditions = coeff.get("conditions", {})
-                source_ref = coeff.get("source_ref", {})
-                apply_to = coeff.get("apply_to", "price")
-
-                coeff_table_no = conditions.get("table_no") or source_ref.get("table")
-                # K1 всегда должен быть привязан к конкретной таблице.
-                # Коэффициенты без явной привязки к таблице не применяем,
-                # чтобы не «подмешивать» нерелевантные правила.
-                if coeff_table_no is None:
-                    continue
-                if int(coeff_table_no) != int(table_no):
-                    continue
+            matching = engine.match_k1(response.data, table_no, params, stage)
+            
+            logger.info(f"Найдено K1 коэффициентов для таблицы {table_no}: {len(matching)}")
+            return matching
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения K1 коэффициентов: {e}")
+            return []
+    
+    @classmethod
+    def match_k1_rules(cls, rules: List[Dict], table_no: int, params: Dict, stage: str = "field") -> List[Dict]:
+        """
+        Отбор K1 из уже загруженных правил (без запросов к БД)
+        
+        Args:
+            rules: Строки norm_coeffs документа
+            table_no: Номер таблицы
+            params: Параметры работ
+            stage: 'field' или 'office'
+            
+        Returns:
+            Подходящие коэффициенты K1 (до фильтра exclusive_group)
+        """
+        scale = cls._normalize_scale(params.get("scale") or params.get("work_scale"))
+        height_section = cls._to_float(params.get("height_section") or params.get("relief_section"))
+        # territory_type (из параметров пользователя) имеет приоритет над territory (из строки работы)
+        territory = cls._normalize_territory(params.get("territory_type") or params.get("territory"))
+        area_ha = cls._to_float(params.get("area_ha"))
+        strip_width_m = cls._to_float(params.get("strip_width_m"))
+
+        matching = []
+        for coeff in rules:
+            conditions = coeff.get("conditions", {})
+            source_ref = coeff.get("source_ref", {})
+            apply_to = coeff.get("apply_to", "price")
+            if apply_to not in ("price", "field", "office"):
+                continue
 
-                match = True
-                reasons = []
+            coeff_table_no = conditions.get("table_no") or source_ref.get("table")
+            # K1 всегда должен быть привязан к конкретной таблице.
+            # Коэффициенты без явной привязки к таблице не применяем,
+            # чтобы не «подмешивать» нерелевантные правила.
+            if coeff_table_no is None:
+                continue
+            if int(coeff_table_no) != int(table_no):
+                continue
+
+            match = True
+            reasons = []
+
+            if apply_to == "field" and stage != "field":
+                match = False
+                reasons.append("apply_to_stage")
+            if apply_to == "office" and stage != "office":
+                match = False
+                reasons.append("apply_to_stage")
 
-                if apply_to == "field" and stage != "field":
+            if "territory_type" in conditions:
+                cond_territory = cls._normalize_territory(conditions.get("territory_type"))
+                if cls._normalize_territory(params.get("territory_type") or params.get("territory")) != cond_territory:
                     match = False
-                    reasons.append("apply_to_stage")
-                if apply_to == "office" and stage != "office":
+                    reasons.append("territory_type")
+            if "territory" in conditions:
+                cond_territory = cls._normalize_territory(conditions.get("territory"))
+                if cls._normalize_territory(territory) != cond_territory:
                     match = False
-                    reasons.append("apply_to_stage")
-
-                if "territory_type" in conditions:
-                    cond_territory = self._normalize_territory(conditions.get("territory_type"))
-                    if self._normalize_territory(params.get("territory_type") or params.get("territory")) != cond_territory:
-                        match = False
-                        reasons.append("territory_type")
-                if "territory" in conditions:
-                    cond_territory = self._normalize_territory(conditions.get("territory"))
-                    if self._normalize_territory(territory) != cond_territory:
-                        match = False
-                        reasons.append("territory")
+                    reasons.append("territory")
 
-                if "has_underground_comms" in conditions:
-                    if not self._match_bool(params.get("has_underground_comms"), conditions.get("has_underground_comms")):
-                        match = False
-                        reasons.append("has_underground_comms")
+            if "has_underground_comms" in conditions:
+                if not cls._match_bool(params.get("has_underground_comms"), conditions.get("has_underground_comms")):
+                    match = False
+                    reasons.append("has_underground_comms")
 
-                if "has_detailed_wells_sketches" in conditions:
-                    if not self._match_bool(params.get("has_detailed_wells_sketches"), conditions.get("has_detailed_wells_sketches")):
-                        match = False
-                        reasons.append("has_detailed_wells_sketches")
+            if "has_detailed_wells_sketches" in conditions:
+                if not cls._match_bool(params.get("has_detailed_wells_sketches"), conditions.get("has_detailed_wells_sketches")):
+                    match = False
+                    reasons.append("has_detailed_wells_sketches")
 
-                if "update_mode" in conditions:
-                    if not self._match_bool(params.get("update_mode"), conditions.get("update_mode")):
-                        match = False
-                        reasons.append("update_mode")
+            if "update_mode" in conditions:
+                if not cls._match_bool(params.get("update_mode"), conditions.get("update_mode")):
+                    match = False
+                    reasons.append("update_mode")
 
-                if "use_satellite" in conditions:
-                    if not self._match_bool(params.get("use_satellite"), conditions.get("use_satellite")):
-                        match = False
-                        reasons.append("use_satellite")
+            if "use_satellite" in conditions:
+                if not cls._match_bool(params.get("use_satellite"), conditions.get("use_satellite")):
+                    match = False
+                    reasons.append("use_satellite")
 
-                if "no_center" in conditions:
-                    if not self._match_bool(params.get("no_center"), conditions.get("no_center")):
-                        match = False
-                        reasons.append("no_center")
+            if "no_center" in conditions:
+                if not cls._match_bool(params.get("no_center"), conditions.get("no_center")):
+                    match = False
+                    reasons.append("no_center")
 
-                if "section" in conditions:
-                    try:
-                        if int(params.get("section")) != int(conditions.get("section")):
-                            match = False
-                            reasons.append("section")
-                    except Exception:
+            if "section" in conditions:
+                try:
+                    if int(params.get("section")) != int(conditions.get("section")):
                         match = False
                         reasons.append("section")
-                if "section_min" in conditions or "section_max" in conditions:
-                    try:
-                        section_val = int(params.get("section")) if params.get("section") is not None else None
-                    except Exception:
-                        section_val = None
-                    if not self._match_range(section_val, conditions.get("section_min"), conditions.get("section_max")):
-                        match = False
-                        reasons.append("section_range")
+                except Exception:
+                    match = False
+                    reasons.append("section")
+            if "section_min" in conditions or "section_max" in conditions:
+                try:
+                    section_val = int(params.get("section")) if params.get("section") is not None else None
+                except Exception:
+                    section_val = None
+                if not cls._match_range(section_val, conditions.get("section_min"), conditions.get("section_max")):
+                    match = False
+                    reasons.append("section_range")
 
-                if "special_object" in conditions:
-                    if params.get("special_object") != conditions["special_object"]:
-                        match = False
-                        reasons.append("special_object")
+            if "special_object" in conditions:
+                if params.get("special_object") != conditions["special_object"]:
+                    match = False
+                    reasons.append("special_object")
 
-                if "measurement_drawings" in conditions:
-                    if not self._match_bool(params.get("measurement_drawings"), conditions.get("measurement_drawings")):
-                        match = False
-                        reasons.append("measurement_drawings")
+            if "measurement_drawings" in conditions:
+                if not cls._match_bool(params.get("measurement_drawings"), conditions.get("measurement_drawings")):
+                    match = False
+                    reasons.append("measurement_drawings")
 
-                if "red_lines" in conditions:
-                    if not self._match_bool(params.get("red_lines"), conditions.get("red_lines")):
-                        match = False
-                        reasons.append("red_lines")
+            if "red_lines" in conditions:
+                if not cls._match_bool(params.get("red_lines"), conditions.get("red_lines")):
+                    match = False
+                    reasons.append("red_lines")
 
-                if "analytic_coords" in conditions:
-                    if not self._match_bool(params.get("analytic_coords"), conditions.get("analytic_coords")):
-                        match = False
-                        reasons.append("analytic_coords")
+            if "analytic_coords" in conditions:
+                if not cls._match_bool(params.get("analytic_coords"), conditions.get("analytic_coords")):
+                    match = False
+                    reasons.append("analytic_coords")
 
-                if "scale" in conditions:
-                    if self._normalize_scale(conditions.get("scale")) != scale:
-                        match = False
-                        reasons.append("scale")
-                if "scale_min" in conditions or "scale_max" in conditions:
-                    scale_val = self._scale_to_int(scale)
-                    min_scale = self._scale_to_int(conditions.get("scale_min"))
-                    max_scale = self._scale_to_int(conditions.get("scale_max"))
-                    if not self._match_range(scale_val, min_scale, max_scale):
-                        match = False
-                        reasons.append("scale_range")
-
-                if "height_section" in conditions:
-                    cond_hs = self._to_float(conditions.get("height_section"))
-                    if cond_hs is not None and height_section is not None:
-                        if abs(cond_hs - height_section) > 1e-6:
-                            match = False
-                            reasons.append("height_section")
-                    elif cond_hs is not None and height_section is None:
+            if "scale" in conditions:
+                if cls._normalize_scale(conditions.get("scale")) != scale:
+                    match = False
+                    reasons.append("scale")
+            if "scale_min" in conditions or "scale_max" in conditions:
+                scale_val = cls._scale_to_int(scale)
+                min_scale = cls._scale_to_int(conditions.get("scale_min"))
+                max_scale = cls._scale_to_int(conditions.get("scale_max"))
+                if not cls._match_range(scale_val, min_scale, max_scale):
+                    match = False
+                    reasons.append("scale_range")
+
+            if "height_section" in conditions:
+                cond_hs = cls._to_float(conditions.get("height_section"))
+                if cond_hs is not None and height_section is not None:
+                    if abs(cond_hs - height_section) > 1e-6:
                         match = False
                         reasons.append("height_section")
+                elif cond_hs is not None and height_section is None:
+                    match = False
+                    reasons.append("height_section")
 
-                if "area_min" in conditions or "area_max" in conditions:
-                    if not self._match_range(area_ha, conditions.get("area_min"), conditions.get("area_max")):
-                        match = False
-                        reasons.append("area_range")
+            if "area_min" in conditions or "area_max" in conditions:
+                if not cls._match_range(area_ha, conditions.get("area_min"), conditions.get("area_max")):
+                    match = False
+                    reasons.append("area_range")
 
-                if "strip_width_min" in conditions or "strip_width_max" in conditions:
-                    if not self._match_range(strip_width_m, conditions.get("strip_width_min"), conditions.get("strip_width_max")):
-                        match = False
-                        reasons.append("strip_width_range")
+            if "strip_width_min" in conditions or "strip_width_max" in conditions:
+                if not cls._match_range(strip_width_m, conditions.get("strip_width_min"), conditions.get("strip_width_max")):
+                    match = False
+                    reasons.append("strip_width_range")
 
-                if "vertical_survey" in conditions:
-                    if not self._match_bool(params.get("vertical_survey"), conditions.get("vertical_survey")):
-                        match = False
-                        reasons.append("vertical_survey")
+            if "vertical_survey" in conditions:
+                if not cls._match_bool(params.get("vertical_survey"), conditions.get("vertical_survey")):
+                    match = False
+                    reasons.append("vertical_survey")
 
-                if "tree_survey" in conditions:
-                    if not self._match_bool(params.get("tree_survey"), conditions.get("tree_survey")):
-                        match = False
-                        reasons.append("tree_survey")
+            if "tree_survey" in conditions:
+                if not cls._match_bool(params.get("tree_survey"), conditions.get("tree_survey")):
+                    match = False
+                    reasons.append("tree_survey")
 
-                if match:
-                    matching.append(coeff)
-                # no match, skip
-            
-            logger.info(f"Найдено K1 коэффициентов для таблицы {table_no}: {len(matching)}")
-            return matching
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения K1 коэффициентов: {e}")
-            return []
+            if match:
+                matching.append(coeff)
+            # no match, skip
+
+        return matching
     
     async def get_k2_coefficients(
         self,
-        params: Dict
+        params: Dict,
+        doc_code: Optional[str] = None
     ) -> List[Dict]:
         """
         Получить K2 коэффициенты из п.15 ОУ
         
         Args:
             params: Параметры работ (use_computer, dual_format, color_plan и т.д.)
+            doc_code: Код документа norm_docs (None — СБЦ ИГДИ-2004)
             
         Returns:
             Список подходящих коэффициентов K2
         """
         try:
             # K2 применяем только если есть хотя бы один явный признак из п.15 ОУ
-            if not any([
-                params.get("intermediate_materials"),
-                params.get("classified_materials") or params.get("restricted_materials"),
-                params.get("artificial_lighting") or params.get("artificial_light"),
-                params.get("color_plan"),
-                params.get("use_computer") or params.get("computer_tech"),
-                params.get("dual_format") or params.get("dual_media"),
-            ]):
+            if not self._k2_requested(params):
+                return []
+            engine = self.rule_engines.get(doc_code)
+            if not engine.k2_sections:
                 return []
 
-            doc_resp = self.client.table("norm_docs").select("id").eq("code", "SBC_IGDI_2004").execute()
+            doc_resp = self._table("norm_docs").select("id").eq("code", engine.doc_code).execute()
             if not doc_resp.data:
-                logger.warning("Документ SBC_IGDI_2004 не найден для K2")
+                logger.warning(f"Документ {engine.doc_code} не найден для K2")
                 return []
             doc_id = doc_resp.data[0]["id"]
 
-            response = self.client.table("norm_coeffs").select("*").eq("doc_id", doc_id).eq("apply_to", "office").execute()
+            response = self._table("norm_coeffs").select("*").eq("doc_id", doc_id).eq("apply_to", "office").execute()
             if not response.data:
                 return []
 
-            matching = []
-            for coeff in response.data:
-                conditions = coeff.get("conditions", {})
-                source_ref = coeff.get("source_ref", {}) or {}
-                if source_ref.get("source") != "rtf_2004":
-                    # Игнорируем записи из "note"/не-RTF, у них другая схема условий
-                    continue
-
-                # K2 — это только коэффициенты по п.15 ОУ.
-                # Исключаем офисные коэффициенты из других разделов (например, п.14).
-                section = str(source_ref.get("section", ""))
-                if not section.startswith("п.15"):
-                    continue
-
-                match = True
-
-                if "intermediate_materials" in conditions:
-                    if not self._match_bool(params.get("intermediate_materials"), conditions.get("intermediate_materials")):
-                        match = False
-                if "restricted_materials" in conditions:
-                    if not self._match_bool(params.get("classified_materials") or params.get("restricted_materials"), conditions.get("restricted_materials")):
-                        match = False
-                if "artificial_light" in conditions:
-                    if not self._match_bool(params.get("artificial_lighting") or params.get("artificial_light"), conditions.get("artificial_light")):
-                        match = False
-                if "color_plan" in conditions:
-                    if not self._match_bool(params.get("color_plan"), conditions.get("color_plan")):
-                        match = False
-                if "computer_tech" in conditions:
-                    if not self._match_bool(params.get("use_computer") or params.get("computer_tech"), conditions.get("computer_tech")):
-                        match = False
-                if "dual_media" in conditions:
-                    if not self._match_bool(params.get("dual_format") or params.get("dual_media"), conditions.get("dual_media")):
-                        match = False
-
-                if match:
-                    matching.append(coeff)
-
-            # Фильтруем по exclusive_group
-            matching = self._filter_by_exclusive_group(matching, params)
+            matching = engine.match_k2(response.data, params)
 
             logger.info(f"Найдено K2 коэффициентов: {len(matching)}")
             return matching
             
-        except ValueError:
-            raise  # Пробрасываем ошибку конфликта
         except Exception as e:
             logger.error(f"Ошибка получения K2 коэффициентов: {e}")
             return []
     
+    @staticmethod
+    def _k2_requested(params: Dict) -> bool:
+        """Есть ли хотя бы один явный признак из п.15 ОУ"""
+        return any([
+            params.get("intermediate_materials"),
+            params.get("classified_materials") or params.get("restricted_materials"),
+            params.get("artificial_lighting") or params.get("artificial_light"),
+            params.get("color_plan"),
+            params.get("use_computer") or params.get("computer_tech"),
+            params.get("dual_format") or params.get("dual_media"),
+        ])
+    
+    @classmethod
+    def match_k2_rules(
+        cls,
+        rules: List[Dict],
+        params: Dict,
+        source: Optional[str] = "rtf_2004",
+        sections: Tuple[str, ...] = ("п.15",),
+        groups: Optional[RuleGroups] = None
+    ) -> List[Dict]:
+        """
+        Отбор K2 (п.15 ОУ) из уже загруженных правил (без запросов к БД)
+        
+        Args:
+            rules: Строки norm_coeffs документа
+            params: Параметры работ
+            source: source_ref.source правил ОУ документа
+            sections: Префиксы разделов ОУ с коэффициентами K2
+            groups: Предвычисленные группы правил документа (выбор без перегруппировки)
+            
+        Returns:
+            Подходящие коэффициенты K2 после фильтра exclusive_group
+        """
+        if not cls._k2_requested(params):
+            return []
+
+        matching = []
+        for coeff in rules:
+            if coeff.get("apply_to") != "office":
+                continue
+            conditions = coeff.get("conditions", {})
+            source_ref = coeff.get("source_ref", {}) or {}
+            if source_ref.get("source") != source:
+                # Игнорируем записи из "note"/не-RTF, у них другая схема условий
+                continue
+
+            # K2 — это только коэффициенты по п.15 ОУ.
+            # Исключаем офисные коэффициенты из других разделов (например, п.14).
+            section = str(source_ref.get("section", ""))
+            if not section.startswith(tuple(sections)):
+                continue
+
+            match = True
+
+            if "intermediate_materials" in conditions:
+                if not cls._match_bool(params.get("intermediate_materials"), conditions.get("intermediate_materials")):
+                    match = False
+            if "restricted_materials" in conditions:
+                if not cls._match_bool(params.get("classified_materials") or params.get("restricted_materials"), conditions.get("restricted_materials")):
+                    match = False
+            if "artificial_light" in conditions:
+                if not cls._match_bool(params.get("artificial_lighting") or params.get("artificial_light"), conditions.get("artificial_light")):
+                    match = False
+            if "color_plan" in conditions:
+                if not cls._match_bool(params.get("color_plan"), conditions.get("color_plan")):
+                    match = False
+            if "computer_tech" in conditions:
+                if not cls._match_bool(params.get("use_computer") or params.get("computer_tech"), conditions.get("computer_tech")):
+                    match = False
+            if "dual_media" in conditions:
+                if not cls._match_bool(params.get("dual_format") or params.get("dual_media"), conditions.get("dual_media")):
+                    match = False
+
+            if match:
+                matching.append(coeff)
+
+        # Фильтруем по exclusive_group
+        if groups is not None:
+            return groups.select(matching)
+        return cls._filter_by_exclusive_group(matching, params)
+    
     async def get_k3_coefficients(
         self,
-        params: Dict
+        params: Dict,
+        doc_code: Optional[str] = None
     ) -> List[Dict]:
         """
         Получить K3 коэффициенты условий производства (п.8, п.14 ОУ)
         
         Args:
             params: Параметры работ (altitude, unfavorable_months, region_type, salary_coeff и т.д.)
+            doc_code: Код документа norm_docs (None — СБЦ ИГДИ-2004)
             
         Returns:
             Список подходящих коэффициентов K3
@@ -990,412 +1264,504 @@ class DatabaseService:
             if params.get('apply_conditions_as_addons'):
                 logger.info("K3 коэффициенты пропущены: условия будут учтены как надбавки")
                 return []
-            matching = []
+            engine = self.rule_engines.get(doc_code)
 
-            doc_resp = self.client.table("norm_docs").select("id").eq("code", "SBC_IGDI_2004").execute()
+            doc_resp = self._table("norm_docs").select("id").eq("code", engine.doc_code).execute()
             if not doc_resp.data:
-                logger.warning("Документ SBC_IGDI_2004 не найден для K3")
+                logger.warning(f"Документ {engine.doc_code} не найден для K3")
                 return []
             doc_id = doc_resp.data[0]["id"]
 
-            altitude = self._to_float(params.get("altitude_m") or params.get("altitude"))
-            unfavorable_months = self._to_float(params.get("unfavorable_months"))
-            salary_coeff = self._to_float(params.get("salary_coeff"))
-            region_type = params.get("region_type")
-            radioactivity = self._to_float(params.get("radioactivity_msv_per_year"))
-
-            response = self.client.table("norm_coeffs").select("*").eq("doc_id", doc_id).in_("apply_to", ["field", "office", "total"]).execute()
-            for coeff in response.data:
-                conditions = coeff.get("conditions", {})
-                source_ref = coeff.get("source_ref", {}) or {}
-                if source_ref.get("source") != "rtf_2004":
-                    # Игнорируем записи из "note"/не-RTF, у них другая схема условий
-                    continue
-                section = str(source_ref.get("section", ""))
+            response = self._table("norm_coeffs").select("*").eq("doc_id", doc_id).in_("apply_to", ["field", "office", "total"]).execute()
+            matching = engine.match_k3(response.data, params)
 
-                # K3 относится только к п.8 и п.14 ОУ.
-                # Исключаем коэффициенты из таблиц и примечаний (например, табл.9).
-                if section and not (section.startswith("п.8") or section.startswith("п.14")):
-                    continue
-                if not section:
-                    # Без явного раздела - пропускаем, чтобы не подмешивать нерелевантные правила
-                    continue
-                if not conditions:
-                    # Без условий коэффициент не должен применяться автоматически
-                    continue
-                # Если в условиях есть неподдерживаемые ключи — пропускаем,
-                # чтобы не применять "чужие" коэффициенты.
-                allowed_keys = {
-                    "altitude_min",
-                    "altitude_max",
-                    "unfavorable_months_min",
-                    "unfavorable_months_max",
-                    "salary_coeff",
-                    "region_type",
-                    "special_regime",
-                    "night_work",
-                    "no_field_allowance",
-                    "office_in_field_camp",
-                    "radioactivity_msv_per_year_min",
-                    "radioactivity_coeff_range",
-                }
-                if any(k not in allowed_keys for k in conditions.keys()):
-                    continue
-                match = True
+            logger.info(f"Найдено K3 коэффициентов: {len(matching)}")
+            return matching
+            
+        except Exception as e:
+            logger.error(f"Ошибка получения K3 коэффициентов: {e}")
+            return []
+    
+    @classmethod
+    def match_k3_rules(
+        cls,
+        rules: List[Dict],
+        params: Dict,
+        source: Optional[str] = "rtf_2004",
+        sections: Tuple[str, ...] = ("п.8", "п.14")
+    ) -> List[Dict]:
+        """
+        Отбор K3 (п.8, п.14 ОУ) из уже загруженных правил (без запросов к БД)
+        Включает коэффициент пустынных районов из params (Приложение 1)
+        
+        Args:
+            rules: Строки norm_coeffs документа
+            params: Параметры работ
+            source: source_ref.source правил ОУ документа
+            sections: Префиксы разделов ОУ с коэффициентами K3
+            
+        Returns:
+            Подходящие коэффициенты K3
+        """
+        if params.get('apply_conditions_as_addons'):
+            return []
 
-                if "altitude_min" in conditions or "altitude_max" in conditions:
-                    if not self._match_range(altitude, conditions.get("altitude_min"), conditions.get("altitude_max")):
-                        match = False
+        altitude = cls._to_float(params.get("altitude_m") or params.get("altitude"))
+        unfavorable_months = cls._to_float(params.get("unfavorable_months"))
+        salary_coeff = cls._to_float(params.get("salary_coeff"))
+        region_type = params.get("region_type")
+        radioactivity = cls._to_float(params.get("radioactivity_msv_per_year"))
 
-                if "unfavorable_months_min" in conditions or "unfavorable_months_max" in conditions:
-                    if not self._match_range(unfavorable_months, conditions.get("unfavorable_months_min"), conditions.get("unfavorable_months_max")):
-                        match = False
+        matching = []
+        for coeff in rules:
+            if coeff.get("apply_to") not in ("field", "office", "total"):
+                continue
+            conditions = coeff.get("conditions", {})
+            source_ref = coeff.get("source_ref", {}) or {}
+            if source_ref.get("source") != source:
+                # Игнорируем записи из "note"/не-RTF, у них другая схема условий
+                continue
+            section = str(source_ref.get("section", ""))
 
-                if "salary_coeff" in conditions:
-                    cond_salary = self._to_float(conditions.get("salary_coeff"))
-                    if cond_salary is not None and salary_coeff is not None:
-                        if abs(cond_salary - salary_coeff) > 1e-6:
-                            match = False
-                    elif cond_salary is not None and salary_coeff is None:
-                        match = False
+            # K3 относится только к п.8 и п.14 ОУ.
+            # Исключаем коэффициенты из таблиц и примечаний (например, табл.9).
+            if section and not section.startswith(tuple(sections)):
+                continue
+            if not section:
+                # Без явного раздела - пропускаем, чтобы не подмешивать нерелевантные правила
+                continue
+            if not conditions:
+                # Без условий коэффициент не должен применяться автоматически
+                continue
+            # Если в условиях есть неподдерживаемые ключи — пропускаем,
+            # чтобы не применять "чужие" коэффициенты.
+            allowed_keys = {
+                "altitude_min",
+                "altitude_max",
+                "unfavorable_months_min",
+                "unfavorable_months_max",
+                "salary_coeff",
+                "region_type",
+                "special_regime",
+                "night_work",
+                "no_field_allowance",
+                "office_in_field_camp",
+                "radioactivity_msv_per_year_min",
+                "radioactivity_coeff_range",
+            }
+            if any(k not in allowed_keys for k in conditions.keys()):
+                continue
+            match = True
 
-                if "region_type" in conditions:
-                    if (region_type or "").lower() != str(conditions.get("region_type")).lower():
-                        match = False
+            if "altitude_min" in conditions or "altitude_max" in conditions:
+                if not cls._match_range(altitude, conditions.get("altitude_min"), conditions.get("altitude_max")):
+                    match = False
 
-                if "special_regime" in conditions:
-                    if not self._match_bool(params.get("special_regime"), conditions.get("special_regime")):
-                        match = False
+            if "unfavorable_months_min" in conditions or "unfavorable_months_max" in conditions:
+                if not cls._match_range(unfavorable_months, conditions.get("unfavorable_months_min"), conditions.get("unfavorable_months_max")):
+                    match = False
 
-                if "night_work" in conditions:
-                    if not self._match_bool(params.get("night_time") or params.get("night_work"), conditions.get("night_work")):
+            if "salary_coeff" in conditions:
+                cond_salary = cls._to_float(conditions.get("salary_coeff"))
+                if cond_salary is not None and salary_coeff is not None:
+                    if abs(cond_salary - salary_coeff) > 1e-6:
                         match = False
+                elif cond_salary is not None and salary_coeff is None:
+                    match = False
 
-                if "no_field_allowance" in conditions:
-                    if not self._match_bool(params.get("no_field_allowance"), conditions.get("no_field_allowance")):
-                        match = False
+            if "region_type" in conditions:
+                if (region_type or "").lower() != str(conditions.get("region_type")).lower():
+                    match = False
 
-                if "office_in_field_camp" in conditions:
-                    if not self._match_bool(params.get("office_in_field_camp"), conditions.get("office_in_field_camp")):
-                        match = False
+            if "special_regime" in conditions:
+                if not cls._match_bool(params.get("special_regime"), conditions.get("special_regime")):
+                    match = False
 
-                if "radioactivity_msv_per_year_min" in conditions:
-                    if radioactivity is None or radioactivity < self._to_float(conditions.get("radioactivity_msv_per_year_min")):
-                        match = False
+            if "night_work" in conditions:
+                if not cls._match_bool(params.get("night_time") or params.get("night_work"), conditions.get("night_work")):
+                    match = False
 
-                if match:
-                    matching.append(coeff)
-
-            # Пустынные и безводные районы (Приложение 1)
-            desert_coeff = self._to_float(params.get("desert_coeff"))
-            if desert_coeff:
-                matching.append({
-                    "code": "DESERT_COEFF",
-                    "name": "Пустынные и безводные районы",
-                    "value": desert_coeff,
-                    "apply_to": "field",
-                    "source_ref": {"appendix": 1}
-                })
-                matching.append({
-                    "code": "DESERT_COEFF_OFFICE",
-                    "name": "Пустынные и безводные районы (кам.)",
-                    "value": desert_coeff,
-                    "apply_to": "office",
-                    "source_ref": {"appendix": 1}
-                })
+            if "no_field_allowance" in conditions:
+                if not cls._match_bool(params.get("no_field_allowance"), conditions.get("no_field_allowance")):
+                    match = False
 
-            logger.info(f"Найдено K3 коэффициентов: {len(matching)}")
-            return matching
+            if "office_in_field_camp" in conditions:
+                if not cls._match_bool(params.get("office_in_field_camp"), conditions.get("office_in_field_camp")):
+                    match = False
+
+            if "radioactivity_msv_per_year_min" in conditions:
+                if radioactivity is None or radioactivity < cls._to_float(conditions.get("radioactivity_msv_per_year_min")):
+                    match = False
+
+            if match:
+                matching.append(coeff)
+
+        # Пустынные и безводные районы (Приложение 1)
+        desert_coeff = cls._to_float(params.get("desert_coeff"))
+        if desert_coeff:
+            matching.append({
+                "code": "DESERT_COEFF",
+                "name": "Пустынные и безводные районы",
+                "value": desert_coeff,
+                "apply_to": "field",
+                "source_ref": {"appendix": 1}
+            })
+            matching.append({
+                "code": "DESERT_COEFF_OFFICE",
+                "name": "Пустынные и безводные районы (кам.)",
+                "value": desert_coeff,
+                "apply_to": "office",
+                "source_ref": {"appendix": 1}
+            })
+
+        return matching
+    
+    @property
+    def catalog_version(self) -> int:
+        """Поколение каталога норм: растет при каждой инвалидации"""
+        return self._catalog_generation
+    
+    @property
+    def catalog_fingerprint(self) -> str:
+        """
+        Версия каталога, устойчивая между перезапусками: версии документов
+        norm_docs (version/updated_at), содержимое региональных таблиц
+        (REGION_TABLES) + локальное поколение инвалидаций
+        """
+        digest = hashlib.sha1(repr((self._catalog_stamp, self._region_stamp)).encode("utf-8")).hexdigest()[:16]
+        return f"{digest}:{self._catalog_generation}"
+    
+    def invalidate_catalog(self) -> None:
+        """Сбрасывает кэши, производные от каталога норм (после загрузки новых правил)"""
+        self._catalog_generation += 1
+        self._coeff_rules = {}
+        self._coeff_param_keys = {}
+        self._rule_groups = {}
+        self._inflation_indices = None
+        self._estimate_templates = None
+        self._piecewise_schedules = None
+        logger.info(f"Каталог норм инвалидирован, поколение {self._catalog_generation}")
+    
+    async def refresh_catalog_version(self, force: bool = False) -> int:
+        """
+        Сверяет версии документов в norm_docs и инвалидирует каталог при изменении
+        Проверка выполняется не чаще CATALOG_CHECK_INTERVAL секунд
+        
+        Args:
+            force: Проверить немедленно
+            
+        Returns:
+            Текущее поколение каталога
+        """
+        now = time.monotonic()
+        if not force and self._catalog_stamp is not None and now - self._catalog_checked_at < self.CATALOG_CHECK_INTERVAL:
+            return self._catalog_generation
+        self._catalog_checked_at = now
+        try:
+            resp = self._table("norm_docs").select("*").execute()
+            stamp = tuple(sorted(
+                (str(d.get("code")), str(d.get("version")), str(d.get("updated_at")))
+                for d in (resp.data or [])
+            ))
+            self._doc_codes = {d.get("id"): d.get("code") for d in (resp.data or []) if d.get("code")}
+        except Exception as e:
+            logger.error(f"Ошибка проверки версии каталога норм: {e}")
+            return self._catalog_generation
+        if self._catalog_stamp is not None and stamp != self._catalog_stamp:
+            self.invalidate_catalog()
+        self._catalog_stamp = stamp
+        return self._catalog_generation
+    
+    async def refresh_region_stamp(self, force: bool = False) -> None:
+        """
+        Обновляет отпечаток содержимого REGION_TABLES (у них нет версий) для
+        catalog_fingerprint; нужен ключам ResultStore, результаты которых
+        зависят от данных enrich_params_with_region
+        Проверка выполняется не чаще CATALOG_CHECK_INTERVAL секунд
+        """
+        now = time.monotonic()
+        if not force and self._region_stamp is not None and now - self._region_checked_at < self.CATALOG_CHECK_INTERVAL:
+            return
+        self._region_checked_at = now
+        try:
+            digest = hashlib.sha1()
+            for table in self.REGION_TABLES:
+                rows = self._table(table).select("*").execute().data or []
+                digest.update(repr((table, sorted(repr(sorted(row.items())) for row in rows))).encode("utf-8"))
+        except Exception as e:
+            logger.error(f"Ошибка проверки региональных таблиц: {e}")
+            return
+        self._region_stamp = digest.hexdigest()
+    
+    @property
+    def rule_engines(self):
+        """Реестр движков правил по документам (services/rules.py, создается при первом обращении)"""
+        if self._rule_engines is None:
+            from .rules import RuleEngineRegistry
+            self._rule_engines = RuleEngineRegistry()
+        return self._rule_engines
+    
+    async def get_rule_engine(self, doc_id: Optional[str] = None):
+        """
+        Движок правил документа строки расценки
+        
+        Args:
+            doc_id: norm_items.doc_id (None — СБЦ ИГДИ-2004)
+        """
+        if doc_id is None:
+            return self.rule_engines.get()
+        await self.refresh_catalog_version()
+        if doc_id not in self._doc_codes:
+            await self.refresh_catalog_version(force=True)
+        return self.rule_engines.get(self._doc_codes.get(doc_id))
+    
+    async def load_coeff_rules(self, doc_code: Optional[str] = None) -> Optional[List[Dict]]:
+        """
+        Все правила norm_coeffs документа (хранятся до инвалидации каталога)
+        
+        Args:
+            doc_code: Код документа norm_docs (None — СБЦ ИГДИ-2004)
+        
+        Returns:
+            Строки norm_coeffs или None, если загрузить не удалось
+        """
+        doc_code = self.rule_engines.get(doc_code).doc_code
+        rules = self._coeff_rules.get(doc_code)
+        if rules is not None:
+            return rules
+        try:
+            doc_resp = self._table("norm_docs").select("id").eq("code", doc_code).execute()
+            if not doc_resp.data:
+                logger.warning(f"Документ {doc_code} не найден для правил коэффициентов")
+                return None
+            response = (
+                self._table("norm_coeffs")
+                .select("*")
+                .eq("doc_id", doc_resp.data[0]["id"])
+                .in_("apply_to", ["price", "field", "office", "total"])
+                .execute()
+            )
+            rules = self._coeff_rules[doc_code] = response.data or []
+        except Exception as e:
+            logger.error(f"Ошибка загрузки правил коэффициентов: {e}")
+            return None
+        groups = self._rule_groups[doc_code] = RuleGroups(rules, doc_code, self.rule_engines.get(doc_code))
+        groups.log_issues()
+        return rules
+    
+    def rule_groups(self, doc_code: Optional[str] = None) -> Optional[RuleGroups]:
+        """Exclusive_group правил документа (после load_coeff_rules, иначе None)"""
+        return self._rule_groups.get(self.rule_engines.get(doc_code).doc_code)
+    
+    @classmethod
+    def rule_param_keys(cls, rules_by_factor: Dict[str, List[Dict]]) -> Dict[str, frozenset]:
+        """
+        Ключи params, которые читают правила каждого из K1/K2/K3
+        (conditions через COEFF_CONDITION_PARAMS + условия включения)
+        """
+        result = {factor: set(gate) for factor, gate in cls.COEFF_GATE_PARAMS.items()}
+        for factor, rules in rules_by_factor.items():
+            for coeff in rules:
+                for cond_key in coeff.get("conditions") or {}:
+                    result[factor].update(cls.COEFF_CONDITION_PARAMS.get(cond_key, (cond_key,)))
+        return {factor: frozenset(values) for factor, values in result.items()}
+    
+    async def get_coefficient_param_keys(
+        self,
+        table_no: Optional[int],
+        stage: str,
+        doc_code: Optional[str] = None
+    ) -> Optional[Dict[str, frozenset]]:
+        """
+        Ключи параметров, от которых зависят K1, K2 и K3 для таблицы и этапа
+        Выводятся из conditions правил norm_coeffs (и условий включения K2/K3),
+        поэтому объем, комментарии и посторонние флаги в них не попадают.
+        
+        Args:
+            table_no: Номер таблицы
+            stage: 'field' или 'office'
+            doc_code: Код документа norm_docs (None — СБЦ ИГДИ-2004)
             
+        Returns:
+            {'K1': frozenset, 'K2': frozenset, 'K3': frozenset} или None,
+            если правила не удалось загрузить
+        """
+        await self.refresh_catalog_version()
+        engine = self.rule_engines.get(doc_code)
+        cache_key = (engine.doc_code, table_no, stage)
+        keys = self._coeff_param_keys.get(cache_key)
+        if keys is not None:
+            return keys
+        rules = await self.load_coeff_rules(engine.doc_code)
+        if rules is None:
+            return None
+
+        rules_by_factor = {factor: [] for factor in self.COEFF_GATE_PARAMS}
+        for coeff in rules:
+            for factor in engine.rule_factors(coeff, table_no):
+                rules_by_factor[factor].append(coeff)
+        keys = self.rule_param_keys(rules_by_factor)
+        self._coeff_param_keys[cache_key] = keys
+        return keys
+    
+    async def get_inflation_indices(self):
+        """
+        Индексы изменения стоимости inflation_indices (загружаются один раз,
+        сбрасываются вместе с каталогом норм)
+        
+        Returns:
+            InflationIndexTable или None, если загрузить не удалось
+        """
+        await self.refresh_catalog_version()
+        if self._inflation_indices is not None:
+            return self._inflation_indices
+        try:
+            response = self._table("inflation_indices").select(
+                "period_year, period_quarter, period_month, index_value, work_type, region, source_document"
+            ).execute()
         except Exception as e:
-            logger.error(f"Ошибка получения K3 коэффициентов: {e}")
+            logger.error(f"Ошибка загрузки индексов изменения стоимости: {e}")
+            return None
+        from .indices import InflationIndexTable
+        self._inflation_indices = InflationIndexTable(response.data or [])
+        logger.info(f"Загружено индексов изменения стоимости: {len(self._inflation_indices)}")
+        return self._inflation_indices
+    
+    async def get_region_names(self) -> List[str]:
+        """Названия регионов из regional_coeffs (загружаются один раз)"""
+        if self._region_names is not None:
+            return self._region_names
+        try:
+            response = self._table("regional_coeffs").select("region_name").execute()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки списка регионов: {e}")
             return []
+        self._region_names = sorted({r["region_name"] for r in response.data or [] if r.get("region_name")})
+        return self._region_names
+    
+    async def get_estimate_templates(self) -> List[Dict]:
+        """
+        Шаблоны смет estimate_templates со строками template_sections
+        (загружаются двумя запросами, сбрасываются вместе с каталогом норм)
+        
+        Returns:
+            Шаблоны; строки шаблона — в "sections" по возрастанию section_no
+        """
+        await self.refresh_catalog_version()
+        if self._estimate_templates is not None:
+            return self._estimate_templates
+        try:
+            templates = self._table("estimate_templates").select("*").execute().data or []
+            sections = []
+            if templates:
+                sections = self._table("template_sections").select("*").in_(
+                    "template_id", [t["id"] for t in templates]
+                ).execute().data or []
+        except Exception as e:
+            logger.error(f"Ошибка загрузки шаблонов смет: {e}")
+            return []
+        by_template: Dict[str, List[Dict]] = {}
+        for row in sorted(sections, key=lambda r: r.get("section_no") or 0):
+            by_template.setdefault(row.get("template_id"), []).append(row)
+        self._estimate_templates = [{**t, "sections": by_template.get(t["id"], [])} for t in templates]
+        logger.info(f"Загружено шаблонов смет: {len(self._estimate_templates)}")
+        return self._estimate_templates
+    
+    async def get_catalog_works(self, page_size: int = 1000) -> List[Dict]:
+        """
+        Все строки расценок norm_items (постранично) — для предкомпиляции планов расчета
+        
+        Returns:
+            Список строк (id, таблица, раздел, цены, параметры)
+        """
+        works = []
+        start = 0
+        try:
+            while True:
+                response = self._table("norm_items").select(
+                    "id, doc_id, work_title, unit, price, price_field, price_office, table_no, section, params"
+                ).range(start, start + page_size - 1).execute()
+                rows = response.data or []
+                works.extend(rows)
+                if len(rows) < page_size:
+                    break
+                start += page_size
+        except Exception as e:
+            logger.error(f"Ошибка загрузки каталога расценок: {e}")
+        return works
     
     async def get_addons_by_conditions(
         self,
         params: Dict,
         field_cost: float,
-        internal_transport_cost: float = 0
+        internal_transport_cost: Optional[float] = None,
+        memo: Optional[Dict] = None,
+        trace=None
     ) -> List[Dict]:
         """
-        Получить надбавки по условиям из БД
+        Получить надбавки по условиям из БД за один проход
+        
+        Надбавки считаются в порядке зависимостей, каждая ступень передает базу следующей:
+        внутренний транспорт (табл.4) → внешний транспорт на (полевые + внутренний) (табл.5) →
+        организация/ликвидация (п.13) → дополнительные надбавки → формульные (табл.78-80)
         
         Args:
             params: Параметры работ
             field_cost: Стоимость полевых работ
-            internal_transport_cost: Стоимость внутреннего транспорта (для внешнего)
+            internal_transport_cost: Стоимость внутреннего транспорта (для внешнего).
+                Если не задана — берется сумма надбавки табл.4 из этого же прохода
+            memo: Результаты семейств из предыдущего расчета {семейство: (входы, надбавки)}.
+                Семейство пересчитывается, только если изменились его параметры
+                (ADDON_FAMILY_PARAMS) или база; словарь обновляется на месте
+            trace: Трассировка расчета (services.trace) — шаг на каждое семейство
             
         Returns:
             Список надбавок с рассчитанными суммами
         """
+        trace = trace or NULL_TRACE
         try:
             addons = []
-            base_field_plus_internal = field_cost + internal_transport_cost
-            apply_conditions_as_addons = params.get('apply_conditions_as_addons', False)
             office_cost = params.get('office_cost', 0) or 0
             base_cost_thousand = params.get('base_cost_thousand')
             if base_cost_thousand is None:
                 base_cost_thousand = (field_cost + office_cost) / 1000.0
             
             # 1. Внутренний транспорт (табл.4, п.9)
-            distance_to_base = self._to_float(params.get('distance_to_base_km') or params.get('distance_to_base'))
-            
-            if distance_to_base is not None:
-                response = self.client.table("norm_addons").select("*").like(
-                    "code", "INTERNAL_T4_%"
-                ).execute()
-                
-                for addon in response.data:
-                    conditions = addon.get('conditions', {})
-                    dist_min = conditions.get('distance_from_base_km_min')
-                    dist_max = conditions.get('distance_from_base_km_max')
-                    cost_min = conditions.get('field_cost_thousand_min')
-                    cost_max = conditions.get('field_cost_thousand_max')
-                    field_cost_thousand = field_cost / 1000.0
-                    
-                    if self._match_range(distance_to_base, dist_min, dist_max):
-                        if self._match_range(field_cost_thousand, cost_min, cost_max):
-                            addon_amount = field_cost * addon['value']
-                            addons.append({
-                                'code': addon['code'],
-                                'name': addon['name'],
-                                'calc_type': addon['calc_type'],
-                                'rate': addon['value'],
-                                'base': field_cost,
-                                'amount': round(addon_amount, 2),
-                                'source_ref': addon.get('source_ref', {})
-                            })
-                            break  # Только одна надбавка внутреннего транспорта
-            
-            # 2. Внешний транспорт (табл.5, п.10)
-            external_distance = self._to_float(params.get('external_distance_km') or params.get('external_distance'))
-            expedition_duration = self._to_float(params.get('expedition_duration_months') or params.get('expedition_duration'))
+            internal_addons = await self._addon_family(
+                memo, trace, "internal", params, (field_cost,),
+                lambda: self._internal_transport_addons(params, field_cost),
+            )
+            addons.extend(internal_addons)
+            if internal_transport_cost is None:
+                internal_transport_cost = sum(a['amount'] for a in internal_addons)
+            base_field_plus_internal = field_cost + internal_transport_cost
             
-            if external_distance and expedition_duration:
-                response = self.client.table("norm_addons").select("*").like(
-                    "code", "EXTERNAL_T5_%"
-                ).execute()
-                
-                for addon in response.data:
-                    conditions = addon.get('conditions', {})
-                    dist_min = conditions.get('distance_oneway_km_min')
-                    dist_max = conditions.get('distance_oneway_km_max')
-                    dur_min = conditions.get('duration_months_min')
-                    dur_max = conditions.get('duration_months_max')
-                    
-                    if self._match_range(external_distance, dist_min, dist_max):
-                        if self._match_range(expedition_duration, dur_min, dur_max):
-                            addon_amount = base_field_plus_internal * addon['value']
-                            addons.append({
-                                'code': addon['code'],
-                                'name': addon['name'],
-                                'calc_type': addon['calc_type'],
-                                'rate': addon['value'],
-                                'base': base_field_plus_internal,
-                                'amount': round(addon_amount, 2),
-                                'source_ref': addon.get('source_ref', {})
-                            })
-                            break
+            # 2. Внешний транспорт (табл.5, п.10) — от (полевые + внутренний транспорт)
+            addons.extend(await self._addon_family(
+                memo, trace, "external", params, (base_field_plus_internal,),
+                lambda: self._external_transport_addons(params, base_field_plus_internal),
+            ))
             
-            # 3. Организация и ликвидация (п.13) — стандартно при наличии полевых работ
-            if field_cost > 0:
-                response = self.client.table("norm_addons").select("*").eq(
-                    "code", "ORG_LIQ_6PCT"
-                ).execute()
-                
-                if response.data:
-                    addon = response.data[0]
-                    # Проверяем коэффициенты к орг.ликвидации
-                    org_liq_rate = addon['value']
-
-                    # Коэффициенты в зависимости от стоимости (п.13)
-                    cost_coeff = 1.0
-                    if field_cost <= 30000 or params.get('region_type') == 'far_north':
-                        cost_coeff = 2.5
-                    elif field_cost <= 75000:
-                        cost_coeff = 2.0
-                    elif field_cost <= 150000:
-                        cost_coeff = 1.5
-
-                    # Коэффициенты по длительности (табл.6)
-                    duration_coeff = 1.0
-                    if expedition_duration:
-                        resp = self.client.table("norm_coeffs").select("*").like(
-                            "code", "ORG_LIQ_DURATION_%"
-                        ).execute()
-                        for coeff in resp.data:
-                            conditions = coeff.get('conditions', {})
-                            if conditions.get('applies_to_addon') != 'ORG_LIQ_6PCT':
-                                continue
-                            if self._match_range(expedition_duration, conditions.get('duration_months_min'), conditions.get('duration_months_max')):
-                                duration_coeff = coeff.get('value', 1.0)
-                                break
-
-                    org_liq_rate = org_liq_rate * cost_coeff * duration_coeff
-                    addon_amount = base_field_plus_internal * org_liq_rate
-                    addons.append({
-                        'code': addon['code'],
-                        'name': addon['name'],
-                        'calc_type': addon['calc_type'],
-                        'rate': org_liq_rate,
-                        'base': base_field_plus_internal,
-                        'amount': round(addon_amount, 2),
-                        'source_ref': addon.get('source_ref', {})
-                    })
+            # 3. Организация и ликвидация (п.13) — от той же базы
+            addons.extend(await self._addon_family(
+                memo, trace, "org_liq", params, (field_cost, base_field_plus_internal),
+                lambda: self._org_liq_addons(params, field_cost, base_field_plus_internal),
+            ))
             
             # 4. Дополнительные надбавки (не стандартные) применяются только если явно запрошены
             if params.get('apply_conditions_as_addons'):
-                # Сезонное удорожание
-                unfavorable_months = params.get('unfavorable_months')
-                if unfavorable_months:
-                    response = self.client.table("norm_addons").select("*").like(
-                        "code", "SEASONAL_ADDON_%"
-                    ).execute()
-                    for addon in response.data:
-                        conditions = addon.get('conditions', {})
-                        months_min = conditions.get('unfavorable_months_min', 0)
-                        months_max = conditions.get('unfavorable_months_max', 12)
-                        if months_min <= unfavorable_months <= months_max:
-                            addon_amount = field_cost * addon['value']
-                            addons.append({
-                                'code': addon['code'],
-                                'name': addon['name'],
-                                'calc_type': addon['calc_type'],
-                                'rate': addon['value'],
-                                'base': field_cost,
-                                'amount': round(addon_amount, 2),
-                                'source_ref': addon.get('source_ref', {})
-                            })
-                            break
-
-                # Региональное удорожание
-                salary_coeff = params.get('salary_coeff')
-                if salary_coeff and salary_coeff > 1.0:
-                    response = self.client.table("norm_addons").select("*").like(
-                        "code", "REGIONAL_ADDON_%"
-                    ).execute()
-                    best_match = None
-                    best_diff = float('inf')
-                    for addon in response.data:
-                        conditions = addon.get('conditions', {})
-                        addon_salary = conditions.get('salary_coeff', 1.0)
-                        diff = abs(addon_salary - salary_coeff)
-                        if diff < best_diff:
-                            best_diff = diff
-                            best_match = addon
-                    if best_match:
-                        subtotal = field_cost + params.get('office_cost', 0) + sum(a['amount'] for a in addons)
-                        addon_amount = subtotal * best_match['value']
-                        addons.append({
-                            'code': best_match['code'],
-                            'name': best_match['name'],
-                            'calc_type': best_match['calc_type'],
-                            'rate': best_match['value'],
-                            'base': subtotal,
-                            'amount': round(addon_amount, 2),
-                            'source_ref': best_match.get('source_ref', {})
-                        })
-
-                # Горное удорожание
-                altitude = params.get('altitude')
-                if altitude and altitude >= 1500:
-                    response = self.client.table("norm_addons").select("*").like(
-                        "code", "MOUNTAIN_ADDON_%"
-                    ).execute()
-                    for addon in response.data:
-                        conditions = addon.get('conditions', {})
-                        alt_min = conditions.get('altitude_min', 0)
-                        alt_max = conditions.get('altitude_max', 999999)
-                        if alt_min <= altitude < alt_max:
-                            addon_amount = field_cost * addon['value']
-                            addons.append({
-                                'code': addon['code'],
-                                'name': addon['name'],
-                                'calc_type': addon['calc_type'],
-                                'rate': addon['value'],
-                                'base': field_cost,
-                                'amount': round(addon_amount, 2),
-                                'source_ref': addon.get('source_ref', {})
-                            })
-                            break
-
-                # Спецрежим удорожание
-                if params.get('special_regime'):
-                    response = self.client.table("norm_addons").select("*").eq(
-                        "code", "SPECIAL_REGIME_ADDON"
-                    ).execute()
-                    if response.data:
-                        addon = response.data[0]
-                        addon_amount = field_cost * addon['value']
-                        addons.append({
-                            'code': addon['code'],
-                            'name': addon['name'],
-                            'calc_type': addon['calc_type'],
-                            'rate': addon['value'],
-                            'base': field_cost,
-                            'amount': round(addon_amount, 2),
-                            'source_ref': addon.get('source_ref', {})
-                        })
-
-                # Промежуточные материалы
-                if params.get('intermediate_materials'):
-                    response = self.client.table("norm_addons").select("*").eq(
-                        "code", "INTERMEDIATE_MATERIALS_ADDON"
-                    ).execute()
-                    if response.data:
-                        addon = response.data[0]
-                        total_work_cost = field_cost + params.get('office_cost', 0)
-                        addon_amount = total_work_cost * addon['value']
-                        addons.append({
-                            'code': addon['code'],
-                            'name': addon['name'],
-                            'calc_type': addon['calc_type'],
-                            'rate': addon['value'],
-                            'base': total_work_cost,
-                            'amount': round(addon_amount, 2),
-                            'source_ref': addon.get('source_ref', {})
-                        })
-
+                applied = list(addons)
+                addons.extend(await self._addon_family(
+                    memo, trace, "conditional", params,
+                    (field_cost, office_cost, tuple(a['amount'] for a in applied)),
+                    lambda: self._conditional_addons(params, field_cost, office_cost, applied),
+                ))
+            
             # 5. Формульные надбавки (табл.78-80) — только по явному запросу
-            include_program = params.get('include_program') or False
-            include_report = params.get('include_report') or False
-            include_registration = params.get('include_registration') or False
-            if include_program or include_report or include_registration:
-                response = self.client.table("norm_addons").select("*").like(
-                    "code", "PROGRAM_T78_%"
-                ).execute()
-                response2 = self.client.table("norm_addons").select("*").like(
-                    "code", "REPORT_T79_%"
-                ).execute()
-                response3 = self.client.table("norm_addons").select("*").like(
-                    "code", "REGISTRATION_T80_%"
-                ).execute()
-                piecewise = (response.data or []) + (response2.data or []) + (response3.data or [])
-                for addon in piecewise:
-                    code = addon.get('code', '')
-                    if code.startswith('PROGRAM_') and not include_program:
-                        continue
-                    if code.startswith('REPORT_') and not include_report:
-                        continue
-                    if code.startswith('REGISTRATION_') and not include_registration:
-                        continue
-                    conditions = addon.get('conditions', {})
-                    min_th = conditions.get('base_cost_thousand_min')
-                    max_th = conditions.get('base_cost_thousand_max')
-                    if not self._match_range(base_cost_thousand, min_th, max_th):
-                        continue
-                    fixed = conditions.get('fixed_amount')
-                    percent_over = conditions.get('percent_over')
-                    amount = self._piecewise_amount(base_cost_thousand, fixed, percent_over, min_th)
-                    addons.append({
-                        'code': addon['code'],
-                        'name': addon['name'],
-                        'calc_type': addon['calc_type'],
-                        'rate': addon['value'],
-                        'base': base_cost_thousand * 1000.0,
-                        'amount': round(amount, 2),
-                        'source_ref': addon.get('source_ref', {})
-                    })
+            addons.extend(await self._addon_family(
+                memo, trace, "piecewise", params, (base_cost_thousand,),
+                lambda: self._piecewise_addons(params, base_cost_thousand),
+            ))
             
             logger.info(f"Найдено надбавок по условиям: {len(addons)}")
             return addons
@@ -1404,9 +1770,228 @@ class DatabaseService:
             logger.error(f"Ошибка получения надбавок: {e}")
             return []
     
-    def _filter_by_exclusive_group(self, coefficients: List[Dict], params: Dict) -> List[Dict]:
+    async def _addon_family(self, memo: Optional[Dict], trace, family: str, params: Dict, inputs: tuple, compute) -> List[Dict]:
+        """
+        Надбавки одного семейства: из memo, если параметры семейства и база не изменились
+        
+        Args:
+            memo: Словарь результатов семейств (None — всегда считать заново)
+            trace: Трассировка расчета (шаг addons.<семейство>)
+            family: Ключ ADDON_FAMILY_PARAMS
+            inputs: Базы расчета семейства (суммы предыдущих ступеней)
+            compute: Функция без аргументов, возвращающая корутину расчета
+        """
+        with trace.step(f"addons.{family}") as step:
+            if memo is None:
+                return await compute()
+            signature = (tuple(params.get(key) for key in self.ADDON_FAMILY_PARAMS[family]), inputs)
+            cached = memo.get(family)
+            if cached is not None and cached[0] == signature:
+                step["cached"] = True
+                return cached[1]
+            addons = await compute()
+            memo[family] = (signature, addons)
+            return addons
+    
+    async def _addon_rows(self, code_prefix: str) -> List[Dict]:
+        """Строки norm_addons семейства с кодом code_prefix*"""
+        response = self._table("norm_addons").select("*").like(
+            "code", f"{code_prefix}%"
+        ).execute()
+        return response.data or []
+    
+    async def _addon_row(self, code: str) -> Optional[Dict]:
+        """Строка norm_addons с точным кодом"""
+        response = self._table("norm_addons").select("*").eq("code", code).execute()
+        return response.data[0] if response.data else None
+    
+    @staticmethod
+    def _addon_entry(addon: Dict, rate: float, base: float, amount: float) -> Dict:
+        """Формирует запись о примененной надбавке"""
+        return {
+            'code': addon['code'],
+            'name': addon['name'],
+            'calc_type': addon['calc_type'],
+            'rate': rate,
+            'base': base,
+            # округление надбавки до копейки — точка округления денежного ядра (services/money.py)
+            'amount': round(amount, 2),
+            'source_ref': addon.get('source_ref', {})
+        }
+    
+    async def _internal_transport_addons(self, params: Dict, field_cost: float) -> List[Dict]:
+        """Внутренний транспорт (табл.4, п.9) — от стоимости полевых работ"""
+        distance_to_base = self._to_float(params.get('distance_to_base_km') or params.get('distance_to_base'))
+        if distance_to_base is None:
+            return []
+        
+        field_cost_thousand = field_cost / 1000.0
+        for addon in await self._addon_rows("INTERNAL_T4_"):
+            conditions = addon.get('conditions', {})
+            if not self._match_range(distance_to_base, conditions.get('distance_from_base_km_min'), conditions.get('distance_from_base_km_max')):
+                continue
+            if not self._match_range(field_cost_thousand, conditions.get('field_cost_thousand_min'), conditions.get('field_cost_thousand_max')):
+                continue
+            # Только одна надбавка внутреннего транспорта
+            return [self._addon_entry(addon, addon['value'], field_cost, field_cost * addon['value'])]
+        return []
+    
+    async def _external_transport_addons(self, params: Dict, base_field_plus_internal: float) -> List[Dict]:
+        """Внешний транспорт (табл.5, п.10) — от (полевые + внутренний транспорт)"""
+        external_distance = self._to_float(params.get('external_distance_km') or params.get('external_distance'))
+        expedition_duration = self._to_float(params.get('expedition_duration_months') or params.get('expedition_duration'))
+        if not (external_distance and expedition_duration):
+            return []
+        
+        for addon in await self._addon_rows("EXTERNAL_T5_"):
+            conditions = addon.get('conditions', {})
+            if not self._match_range(external_distance, conditions.get('distance_oneway_km_min'), conditions.get('distance_oneway_km_max')):
+                continue
+            if not self._match_range(expedition_duration, conditions.get('duration_months_min'), conditions.get('duration_months_max')):
+                continue
+            return [self._addon_entry(addon, addon['value'], base_field_plus_internal, base_field_plus_internal * addon['value'])]
+        return []
+    
+    async def _org_liq_addons(self, params: Dict, field_cost: float, base_field_plus_internal: float) -> List[Dict]:
+        """Организация и ликвидация (п.13) — стандартно при наличии полевых работ"""
+        if field_cost <= 0:
+            return []
+        
+        addon = await self._addon_row("ORG_LIQ_6PCT")
+        if not addon:
+            return []
+        
+        # Проверяем коэффициенты к орг.ликвидации
+        cost_coeff = self._org_liq_cost_coeff(field_cost, params)
+        duration_coeff = await self._org_liq_duration_coeff(params)
+        
+        org_liq_rate = addon['value'] * cost_coeff * duration_coeff
+        return [self._addon_entry(addon, org_liq_rate, base_field_plus_internal, base_field_plus_internal * org_liq_rate)]
+    
+    @classmethod
+    def _org_liq_cost_coeff(cls, field_cost: float, params: Dict) -> float:
+        """Коэффициент к орг./ликв. в зависимости от стоимости полевых работ (п.13)"""
+        if params.get('region_type') == 'far_north':
+            return cls.ORG_LIQ_COST_BANDS[0][1]
+        for cost_max, coeff in cls.ORG_LIQ_COST_BANDS:
+            if field_cost <= cost_max:
+                return coeff
+        return 1.0
+    
+    async def _org_liq_duration_coeff(self, params: Dict) -> float:
+        """Коэффициент к орг./ликв. по длительности экспедиции (табл.6)"""
+        expedition_duration = self._to_float(params.get('expedition_duration_months') or params.get('expedition_duration'))
+        if not expedition_duration:
+            return 1.0
+        resp = self._table("norm_coeffs").select("*").like(
+            "code", "ORG_LIQ_DURATION_%"
+        ).execute()
+        for coeff in resp.data:
+            conditions = coeff.get('conditions', {})
+            if conditions.get('applies_to_addon') != 'ORG_LIQ_6PCT':
+                continue
+            if self._match_range(expedition_duration, conditions.get('duration_months_min'), conditions.get('duration_months_max')):
+                return coeff.get('value', 1.0)
+        return 1.0
+    
+    async def _conditional_addons(self, params: Dict, field_cost: float, office_cost: float, applied: List[Dict]) -> List[Dict]:
+        """
+        Дополнительные надбавки (сезонные, районные, горные, спецрежим, промежуточные материалы)
+        
+        Args:
+            applied: Уже рассчитанные надбавки предыдущих ступеней (входят в базу районной надбавки)
+        """
+        addons = []
+        
+        # Сезонное удорожание
+        unfavorable_months = params.get('unfavorable_months')
+        if unfavorable_months:
+            for addon in await self._addon_rows("SEASONAL_ADDON_"):
+                conditions = addon.get('conditions', {})
+                months_min = conditions.get('unfavorable_months_min', 0)
+                months_max = conditions.get('unfavorable_months_max', 12)
+                if months_min <= unfavorable_months <= months_max:
+                    addons.append(self._addon_entry(addon, addon['value'], field_cost, field_cost * addon['value']))
+                    break
+        
+        # Региональное удорожание
+        salary_coeff = params.get('salary_coeff')
+        if salary_coeff and salary_coeff > 1.0:
+            best_match = None
+            best_diff = float('inf')
+            for addon in await self._addon_rows("REGIONAL_ADDON_"):
+                conditions = addon.get('conditions', {})
+                addon_salary = conditions.get('salary_coeff', 1.0)
+                diff = abs(addon_salary - salary_coeff)
+                if diff < best_diff:
+                    best_diff = diff
+                    best_match = addon
+            if best_match:
+                subtotal = field_cost + office_cost + sum(a['amount'] for a in applied) + sum(a['amount'] for a in addons)
+                addons.append(self._addon_entry(best_match, best_match['value'], subtotal, subtotal * best_match['value']))
+        
+        # Горное удорожание
+        altitude = params.get('altitude')
+        if altitude and altitude >= 1500:
+            for addon in await self._addon_rows("MOUNTAIN_ADDON_"):
+                conditions = addon.get('conditions', {})
+                alt_min = conditions.get('altitude_min', 0)
+                alt_max = conditions.get('altitude_max', 999999)
+                if alt_min <= altitude < alt_max:
+                    addons.append(self._addon_entry(addon, addon['value'], field_cost, field_cost * addon['value']))
+                    break
+        
+        # Спецрежим удорожание
+        if params.get('special_regime'):
+            addon = await self._addon_row("SPECIAL_REGIME_ADDON")
+            if addon:
+                addons.append(self._addon_entry(addon, addon['value'], field_cost, field_cost * addon['value']))
+        
+        # Промежуточные материалы
+        if params.get('intermediate_materials'):
+            addon = await self._addon_row("INTERMEDIATE_MATERIALS_ADDON")
+            if addon:
+                total_work_cost = field_cost + office_cost
+                addons.append(self._addon_entry(addon, addon['value'], total_work_cost, total_work_cost * addon['value']))
+        
+        return addons
+    
+    async def _piecewise_addons(self, params: Dict, base_cost_thousand: float) -> List[Dict]:
+        """Формульные надбавки (табл.78-80): программа, отчет, регистрация"""
+        include_program = params.get('include_program') or False
+        include_report = params.get('include_report') or False
+        include_registration = params.get('include_registration') or False
+        if not (include_program or include_report or include_registration):
+            return []
+        
+        schedules = await self.get_piecewise_schedules()
+        addons = []
+        for flag, prefix in PIECEWISE_FAMILIES:
+            if not params.get(flag):
+                continue
+            for addon, amount in schedules[prefix].lookup(base_cost_thousand):
+                addons.append(self._addon_entry(addon, addon['value'], base_cost_thousand * 1000.0, amount))
+        return addons
+    
+    async def get_piecewise_schedules(self):
+        """
+        Шкалы формульных надбавок табл.78-80, скомпилированные из norm_addons
+        (загружаются один раз, сбрасываются вместе с каталогом норм)
+        
+        Returns:
+            {префикс семейства: PiecewiseSchedule}
+        """
+        await self.refresh_catalog_version()
+        if self._piecewise_schedules is None:
+            rows = {prefix: await self._addon_rows(prefix) for _, prefix in PIECEWISE_FAMILIES}
+            self._piecewise_schedules = compile_schedules(rows)
+        return self._piecewise_schedules
+    
+    @staticmethod
+    def _filter_by_exclusive_group(coefficients: List[Dict], params: Dict) -> List[Dict]:
         """
         Фильтрует коэффициенты по exclusive_group - из одной группы выбирается только один
+        (для правил загруженного документа быстрее RuleGroups.select)
         
         Args:
             coefficients: Список коэффициентов
@@ -1415,21 +2000,4 @@ class DatabaseService:
         Returns:
             Отфильтрованный список
         """
-        result = []
-        grouped = {}
-        nongrouped = []
-
-        for coeff in coefficients:
-            group = coeff.get('exclusive_group')
-            if not group:
-                nongrouped.append(coeff)
-                continue
-            grouped.setdefault(group, []).append(coeff)
-
-        for group, items in grouped.items():
-            # Выбираем максимальный коэффициент в группе
-            best = max(items, key=lambda c: float(c.get('value') or 0))
-            result.append(best)
-
-        result.extend(nongrouped)
-        return result
+        return filter_exclusive(coefficients)
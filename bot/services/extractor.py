@@ -0,0 +1,305 @@
+"""
+Разбор типовых запросов без LLM
+Большая часть сообщений — шаблонные строки смет («топоплан 1:500 92 га
+промпредприятие сечение 0,5 II категория»). Регулярные выражения скомпилированы
+один раз, ключевые слова каждого параметра собраны в одно чередование (один
+проход по тексту на параметр). Результат — тот же словарь, что возвращает
+AIAgent.extract_parameters, и уверенность по каждому полю: LLM нужен, только
+если обязательные поля не найдены однозначно.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Поля ответа LLM (промпт AIAgent._extract_prompt); ненайденные — None
+PARAM_FIELDS = (
+    "work_type", "quantity", "unit", "scale", "height_section", "work_stage",
+    "territory_type", "has_underground_comms", "has_detailed_wells_sketches", "measurement_drawings",
+    "special_object", "update_mode", "category", "use_satellite",
+    "use_computer", "dual_format", "color_plan", "intermediate_materials", "classified_materials",
+    "artificial_lighting",
+    "altitude", "unfavorable_months", "salary_coeff", "region_type", "special_regime", "night_time",
+    "no_field_allowance",
+    "distance_to_base", "external_distance", "expedition_duration", "include_org_liq",
+    "apply_conditions_as_addons",
+)
+
+# Флаги и слова-триггеры в тексте (они же обнуляют флаги LLM без триггера, см. _sanitize_params)
+FLAG_KEYWORDS = {
+    "use_computer": ["компьютер", "компьютерн", "cad", "гис", "gis", "цифров"],
+    "dual_format": ["два носителя", "двух видах", "магнитн", "бумажн", "цифровой и бумажный"],
+    "color_plan": ["в цвете", "цветной", "цвета", "цвет"],
+    "intermediate_materials": ["промежуточ"],
+    "classified_materials": ["ограниченного", "секрет", "дсп", "служебн"],
+    "artificial_lighting": ["искусственн", "освещ"],
+    "special_regime": ["погран", "полигон", "аэродром", "спецрежим", "режим"],
+    "night_time": ["ноч", "ночное", "ночью"],
+    "no_field_allowance": ["без полевого", "без командировочных", "без полевого довольствия"],
+    "office_in_field_camp": ["экспедицион", "в экспедиционных условиях"],
+    "use_satellite": ["спутник", "gps", "gnss", "глонасс"],
+    "no_center": ["без закладки центра", "без закладки центров"],
+}
+
+# Флаги K1, которых нет в FLAG_KEYWORDS
+K1_FLAG_PATTERNS = {
+    "has_underground_comms": r"подземн\w*\s+коммуникац",
+    "has_detailed_wells_sketches": r"эстакад|колодц",
+    "measurement_drawings": r"обмерн\w*\s+чертеж",
+    "update_mode": r"\bобновлени\w*",
+}
+
+# Стандартные типы работ (как в промпте) в порядке проверки: узкие раньше общих
+WORK_TYPES = (
+    ("проверка полноты планов", r"проверк\w*\s+полноты"),
+    ("привязка скважин", r"привязк\w*[^.;]{0,40}скважин"),
+    ("привязка выработок", r"привязк\w*[^.;]{0,40}выработ"),
+    ("выдача координат", r"выдач\w*\s+координат"),
+    ("опорная сеть", r"опорн\w*\s+(?:геодезическ\w*\s+)?сет"),
+    ("нивелирование", r"нивелир"),
+    ("трассирование", r"трассирован"),
+    ("изыскания трасс", r"изыскани\w*\s+трасс"),
+    ("бурение", r"\bбурени"),
+    ("топографическая съемка", r"топоплан|топосъемк|топографическ\w*\s+(?:съемк|план)|инженерно-топограф"),
+)
+
+# Типы работ, для которых без масштаба строку расценки не выбрать
+SCALE_WORK_TYPES = frozenset({"топографическая съемка"})
+REQUIRED_FIELDS = ("work_type", "quantity", "unit")
+# Порог уверенности поля для ответа без LLM
+CONFIDENT = 0.9
+
+TERRITORY_WORDS = (
+    ("промпредприятие", r"пром\.?\s*предприят\w*|промпредприят\w*|промплощадк\w*"),
+    ("незастроенная", r"незастроенн\w*"),
+    ("застроенная", r"застроенн\w*"),
+)
+
+_ROMAN = {"i": "I", "ii": "II", "iii": "III", "iv": "IV", "ш": "III", "1": "I", "2": "II", "3": "III", "4": "IV"}
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_UNITS = {"га": "га", "км": "км", "м": "м", "дм": "дм профиля", "пункт": "пункт", "скважин": "скважина"}
+
+_SCALE_RE = re.compile(r"(?<![\d.,])1\s*:\s*(\d{3,5})(?!\d)")
+_HEIGHT_RE = re.compile(r"сечени\w*(?:\s+рельефа)?\s*[-–:]?\s*" + _NUMBER + r"\s*(?:м(?![\w]))?")
+_ALTITUDE_RE = re.compile(
+    r"(?:высот\w*\s+над\s+уровнем\s+моря|горн\w*\s+район\w*|высокогор\w*)\s*"
+    r"(?:до\s+|св\.?\s*|более\s+)?(\d{3,4})\s*м(?![\w])"
+)
+_MONTHS_RE = re.compile(r"неблагоприятн\w*\s+период\w*\s*[-–:]?\s*" + _NUMBER + r"\s*(?:мес\w*)?")
+_SALARY_RE = re.compile(r"районн\w*\s+коэффициент\w*\s*[-–:]?\s*(\d[.,]\d{1,2})")
+_DISTANCE_RE = re.compile(r"(?:расстояни\w*\s+)?от\s+баз\w*\s*(?:до\s+объекта\s*)?[-–:]?\s*" + _NUMBER + r"\s*км(?![\w])")
+# Класс/разряд сети — характеристика работы, а не объем и не категория
+_GRADE_RE = re.compile(r"(?<!\w)(?:iv|iii|ii|i|\d)\s*-?\s*(?:й\s+)?(?:разряд|класс)\w*|(?:разряд|класс)\w*\s*(?:iv|iii|ii|i|\d)(?!\w)")
+# Категория дороги: «III-IV категории», «I категории дороги»
+_ROAD_CATEGORY_RE = re.compile(
+    r"(?<!\w)(?:iv|iii|ii|i)\s*[-–]\s*(?:iv|iii|ii|i)\s*категори\w*|(?<!\w)(?:iv|iii|ii|i)\s*категори\w*\s+(?:ж/д\s+|железн\w*\s+|авто)?дорог\w*"
+)
+_CATEGORY_RES = (
+    re.compile(r"(?<!\w)(iv|iii|ii|i|ш|[1-4])\s*-?\s*(?:я\s+)?кат(?:\.|егори\w*)?(?:\s*сложност\w*)?"),
+    re.compile(r"категори\w*(?:\s+сложност\w*)?\s*[-–:]?\s*(iv|iii|ii|i|ш|[1-4])(?!\w)"),
+)
+_QUANTITY_RES = (
+    re.compile(r"(?<![\w.,:])" + _NUMBER + r"\s*(га|км|пункт\w*|скважин\w*|дм|м)(?!\w)"),
+    re.compile(r"(?<!\w)(га|км|пункт\w*|скважин\w*)\s+" + _NUMBER + r"(?![\w.,:])"),
+)
+# Числа-ограничения («участки до 5 га») — не объем работ
+_LIMIT_BEFORE_RE = re.compile(r"(?:до|от|св\.?|свыше|более|менее|не более|не менее)\s*$")
+# Номер пункта списка работ: «1) », «2. » в начале строки или после пробела/«;»
+_ITEM_MARK_RE = re.compile(r"(?:^|(?<=[\s;,]))(\d{1,2})[.)]\s+(?=\D)", re.MULTILINE)
+# Маркер строки списка: «- », «• », «* »
+_BULLET_RE = re.compile(r"^\s*[-–•*]\s*")
+# Строка называет тип работ (пункт списка без нумерации и маркеров)
+_WORK_TYPE_RE = re.compile("|".join(pattern for _, pattern in WORK_TYPES))
+
+
+def _to_float(raw: str) -> float:
+    return float(raw.replace(",", "."))
+
+
+def _unit(raw: str) -> str:
+    for prefix, unit in _UNITS.items():
+        if raw.startswith(prefix) and (prefix not in ("м", "дм") or raw == prefix):
+            return unit
+    return raw
+
+
+def _alternation(keywords: List[str]) -> re.Pattern:
+    """Одно регулярное выражение на список слов (длинные варианты раньше)"""
+    return re.compile("|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
+
+@dataclass
+class Extraction:
+    """Параметры локального разбора и уверенность по полям (0..1)"""
+    params: Dict
+    confidence: Dict[str, float] = field(default_factory=dict)
+    required: Tuple[str, ...] = REQUIRED_FIELDS
+
+    @property
+    def missing(self) -> List[str]:
+        """Обязательные поля, найденные неуверенно или не найденные"""
+        return [name for name in self.required if self.confidence.get(name, 0.0) < CONFIDENT]
+
+    @property
+    def confident(self) -> bool:
+        return not self.missing
+
+    @property
+    def score(self) -> float:
+        """Уверенность ответа — минимальная по обязательным полям"""
+        return min((self.confidence.get(name, 0.0) for name in self.required), default=1.0)
+
+
+class RuleExtractor:
+    """Извлечение параметров из типового запроса регулярными выражениями"""
+
+    def __init__(self):
+        self._flags = {name: _alternation(words) for name, words in FLAG_KEYWORDS.items()}
+        self._k1_flags = {name: re.compile(pattern) for name, pattern in K1_FLAG_PATTERNS.items()}
+        self._work_types = [(work_type, re.compile(pattern)) for work_type, pattern in WORK_TYPES]
+        self._territories = [(value, re.compile(pattern)) for value, pattern in TERRITORY_WORDS]
+
+    def extract(self, message: str) -> Extraction:
+        """
+        Разбирает сообщение
+
+        Returns:
+            Extraction: params со всеми PARAM_FIELDS (как ответ LLM до _sanitize_params)
+        """
+        text = str(message or "").lower().replace("ё", "е")
+        params: Dict = {name: None for name in PARAM_FIELDS}
+        confidence: Dict[str, float] = {}
+        # Найденные фрагменты (масштаб, сечение, класс...) вырезаются, чтобы их числа не стали объемом
+        masked = text
+
+        def take(regex: re.Pattern) -> List[re.Match]:
+            nonlocal masked
+            found = list(regex.finditer(masked))
+            for m in found:
+                masked = masked[:m.start()] + " " * (m.end() - m.start()) + masked[m.end():]
+            return found
+
+        work_types = [work_type for work_type, regex in self._work_types if regex.search(text)]
+        if work_types:
+            params["work_type"] = work_types[0]
+            confidence["work_type"] = 1.0 if len(work_types) == 1 else 0.6
+
+        scales = {f"1:{m.group(1)}" for m in take(_SCALE_RE)}
+        if scales:
+            params["scale"] = sorted(scales, key=lambda s: int(s[2:]))[0]
+            confidence["scale"] = 1.0 if len(scales) == 1 else 0.5
+
+        self._single(take(_HEIGHT_RE), "height_section", params, confidence)
+        self._single(take(_ALTITUDE_RE), "altitude", params, confidence)
+        self._single(take(_MONTHS_RE), "unfavorable_months", params, confidence)
+        self._single(take(_SALARY_RE), "salary_coeff", params, confidence)
+        self._single(take(_DISTANCE_RE), "distance_to_base", params, confidence)
+        take(_GRADE_RE)
+        take(_ROAD_CATEGORY_RE)
+
+        categories = [_ROMAN[m.group(1)] for regex in _CATEGORY_RES for m in take(regex)]
+        if categories:
+            params["category"] = categories[-1]
+            confidence["category"] = 1.0 if len(set(categories)) == 1 else 0.5
+
+        self._quantity(masked, params, confidence)
+
+        for value, regex in self._territories:
+            if regex.search(text):
+                params["territory_type"] = value
+                break
+        for name, regex in self._k1_flags.items():
+            if regex.search(text):
+                params[name] = True
+        for name, regex in self._flags.items():
+            if regex.search(text):
+                params[name] = True
+        # Спутниковые системы (K1=1.3) — только для плановых сетей
+        if params.get("use_satellite") and "высотн" in text:
+            params["use_satellite"] = False
+
+        field_stage, office_stage = "полев" in text, "камеральн" in text
+        if field_stage != office_stage:
+            params["work_stage"] = "полевые" if field_stage else "камеральные"
+
+        required = REQUIRED_FIELDS + (("scale",) if params["work_type"] in SCALE_WORK_TYPES else ())
+        return Extraction(params=params, confidence=confidence, required=required)
+
+    @staticmethod
+    def _single(found: List[re.Match], name: str, params: Dict, confidence: Dict[str, float]) -> None:
+        values = []
+        for m in found:
+            raw = next(g for g in m.groups() if g is not None)
+            values.append(_to_float(raw))
+        if values:
+            params[name] = values[0]
+            confidence[name] = 1.0 if len(set(values)) == 1 else 0.5
+
+    @staticmethod
+    def _quantity(masked: str, params: Dict, confidence: Dict[str, float]) -> None:
+        """Объем и единица: единственная пара «число единица» вне ограничений («до 5 га»)"""
+        pairs = []
+        for index, regex in enumerate(_QUANTITY_RES):
+            for m in regex.finditer(masked):
+                number, unit = (m.group(1), m.group(2)) if index == 0 else (m.group(2), m.group(1))
+                if _LIMIT_BEFORE_RE.search(masked[max(0, m.start() - 12):m.start()]):
+                    continue
+                pairs.append((m.start(), _to_float(number), _unit(unit)))
+        if not pairs:
+            return
+        pairs.sort()
+        distinct = {(value, unit) for _, value, unit in pairs}
+        # «пункт 15 ... 15 пунктов» — одно и то же; разные объемы — решает LLM
+        _, value, unit = pairs[-1]
+        params["quantity"] = int(value) if value.is_integer() else value
+        params["unit"] = unit
+        score = 1.0 if len(distinct) == 1 else 0.5
+        confidence["quantity"] = confidence["unit"] = score
+
+
+def _names_work(text: str) -> bool:
+    """Текст называет тип работ из WORK_TYPES"""
+    return _WORK_TYPE_RE.search(text.lower().replace("ё", "е")) is not None
+
+
+def split_works(message: str) -> Tuple[str, List[str]]:
+    """
+    Список работ в одном сообщении («1) топосъемка 1:500 97 га 2) нивелирование ... 12 км»)
+
+    Пункты — нумерация 1, 2, 3... по порядку (в строку или по строкам), если не
+    меньше двух пунктов называют тип работ (WORK_TYPES), строки с маркерами (-, •)
+    или, без них, строки с типом работ, если таких строк не меньше двух.
+    Текст до первого пункта и остальные строки — общие условия.
+
+    Returns:
+        (общие условия, пункты); меньше двух пунктов — не список
+    """
+    marks, expected = [], 1
+    for m in _ITEM_MARK_RE.finditer(message):
+        if int(m.group(1)) == expected:
+            marks.append(m)
+            expected += 1
+    if len(marks) >= 2:
+        items = [
+            message[m.end():marks[i + 1].start() if i + 1 < len(marks) else len(message)].strip(" \t\n;,.")
+            for i, m in enumerate(marks)
+        ]
+        items = [item for item in items if item]
+        # нумерованные признаки одной работы («1. Площадь 50 га 2. Масштаб 1:500») — не список
+        if sum(_names_work(item) for item in items) < 2:
+            return "", []
+        return message[:marks[0].start()].strip(" \t\n:;,."), items
+
+    lines = []
+    for line in message.splitlines():
+        bullet = _BULLET_RE.match(line) is not None
+        line = _BULLET_RE.sub("", line).strip(" \t;,.")
+        if line:
+            lines.append((line, bullet, _names_work(line)))
+    # пункты — строки с маркерами, а без маркеров — строки с типом работ
+    marked = any(bullet for _, bullet, _ in lines)
+    items = [line for line, bullet, work in lines if (bullet if marked else work)]
+    if len(items) >= 2:
+        common = [line for line, bullet, work in lines if not (bullet if marked else work)]
+        return " ".join(common).strip(" :"), items
+    return "", []
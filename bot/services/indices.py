@@ -0,0 +1,170 @@
+"""
+Индексы изменения сметной стоимости (inflation_indices)
+Базисная стоимость по СБЦ (цены 2001/2004) пересчитывается в текущие цены
+умножением на индекс квартала по письму Минстроя. Таблица индексов загружается
+один раз и хранится отсортированными массивами периодов: индекс на период
+ищется бинарным поиском (последний опубликованный не позже запрошенного квартала).
+"""
+
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Тип работ для индексов, общих для всех видов изысканий
+ALL_WORK_TYPES = "все"
+
+# Период: "2025Q3", "2025 Q3", "2025-3", "2025" (IV квартал), (2025, 3) или "latest"
+Period = Union[str, int, Tuple[int, int]]
+
+_PERIOD_RE = re.compile(r"^\s*(\d{4})\s*(?:[-/.]?\s*[QqКк]?\s*([1-4]))?\s*$")
+_ROMAN_QUARTERS = ("I", "II", "III", "IV")
+
+
+def period_key(year: int, quarter: int) -> int:
+    """Сквозной номер квартала (для сравнения и бинарного поиска)"""
+    return int(year) * 4 + int(quarter) - 1
+
+
+def parse_period(period: Period) -> Optional[Tuple[int, int]]:
+    """
+    Год и квартал из описания периода
+
+    Returns:
+        (год, квартал); None для "latest" (последний опубликованный индекс)
+
+    Raises:
+        ValueError: Период не распознан
+    """
+    if isinstance(period, (tuple, list)) and len(period) == 2:
+        year, quarter = int(period[0]), int(period[1])
+    elif isinstance(period, int):
+        year, quarter = period, 4
+    elif isinstance(period, str) and period.strip().lower() in ("latest", "текущий"):
+        return None
+    else:
+        match = _PERIOD_RE.match(str(period))
+        if not match:
+            raise ValueError(f"Не распознан период индекса: {period!r}")
+        year, quarter = int(match.group(1)), int(match.group(2) or 4)
+    if not 1 <= quarter <= 4:
+        raise ValueError(f"Квартал должен быть от 1 до 4: {period!r}")
+    return year, quarter
+
+
+def period_label(year: int, quarter: int) -> str:
+    """Подпись периода: «III кв. 2025»"""
+    return f"{_ROMAN_QUARTERS[quarter - 1]} кв. {year}"
+
+
+@dataclass(frozen=True)
+class PriceIndex:
+    """Индекс изменения стоимости, действующий с квартала"""
+    year: int
+    quarter: int
+    value: float
+    work_type: str
+    region: Optional[str] = None
+    source: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return period_label(self.year, self.quarter)
+
+    def to_dict(self) -> Dict:
+        return {
+            "year": self.year,
+            "quarter": self.quarter,
+            "period": self.label,
+            "value": self.value,
+            "work_type": self.work_type,
+            "region": self.region,
+            "source": self.source,
+        }
+
+
+class InflationIndexTable:
+    """
+    Таблица индексов: по (тип работ, регион) — отсортированные номера кварталов
+    и индексы. Поиск на период — bisect, O(log n).
+    """
+
+    def __init__(self, rows: Iterable[Dict]):
+        """
+        Args:
+            rows: Строки inflation_indices
+        """
+        series: Dict[Tuple[str, Optional[str]], Dict[int, PriceIndex]] = {}
+        for row in rows:
+            index = self._from_row(row)
+            if index is None:
+                continue
+            series.setdefault((index.work_type, index.region), {})[period_key(index.year, index.quarter)] = index
+        self._keys: Dict[Tuple[str, Optional[str]], List[int]] = {}
+        self._values: Dict[Tuple[str, Optional[str]], List[PriceIndex]] = {}
+        for series_key, by_period in series.items():
+            ordered = sorted(by_period)
+            self._keys[series_key] = ordered
+            self._values[series_key] = [by_period[k] for k in ordered]
+
+    @staticmethod
+    def _from_row(row: Dict) -> Optional[PriceIndex]:
+        if row.get("period_year") is None or row.get("index_value") is None:
+            return None
+        quarter = row.get("period_quarter")
+        if quarter is None:
+            # Месячный индекс относится к своему кварталу, годовой — к началу года
+            month = row.get("period_month")
+            quarter = (int(month) - 1) // 3 + 1 if month else 1
+        return PriceIndex(
+            year=int(row["period_year"]),
+            quarter=int(quarter),
+            value=float(row["index_value"]),
+            work_type=str(row.get("work_type") or ALL_WORK_TYPES),
+            region=row.get("region") or None,
+            source=row.get("source_document"),
+        )
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._keys.values())
+
+    def _candidates(self, work_type: Optional[str], region: Optional[str]) -> List[Tuple[str, Optional[str]]]:
+        """Ряды индексов в порядке предпочтения: свой тип работ и регион → общие"""
+        work_types = [work_type] if work_type and work_type != ALL_WORK_TYPES else []
+        work_types.append(ALL_WORK_TYPES)
+        regions = [region, None] if region else [None]
+        return [(wt, reg) for wt in work_types for reg in regions if (wt, reg) in self._keys]
+
+    def lookup(
+        self,
+        period: Period = "latest",
+        work_type: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> Optional[PriceIndex]:
+        """
+        Индекс, действующий в периоде: последний опубликованный не позже квартала
+
+        Args:
+            period: Период (см. parse_period)
+            work_type: Тип работ ("ИГДИ", "ИГИ", ...); затем — индексы "все"
+            region: Регион (региональный индекс предпочтительнее общего)
+
+        Returns:
+            PriceIndex или None, если индекса на период нет
+        """
+        parsed = parse_period(period)
+        for series_key in self._candidates(work_type, region):
+            keys = self._keys[series_key]
+            pos = len(keys) if parsed is None else bisect_right(keys, period_key(*parsed))
+            if pos:
+                return self._values[series_key][pos - 1]
+        return None
+
+    def compare(
+        self,
+        periods: Sequence[Period],
+        work_type: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> List[Optional[PriceIndex]]:
+        """Индексы нескольких периодов (в порядке periods)"""
+        return [self.lookup(period, work_type, region) for period in periods]
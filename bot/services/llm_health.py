@@ -0,0 +1,108 @@
+"""
+Здоровье моделей LLM и параметры хеджирования запросов (AIAgent._request_json)
+По каждой модели хранится окно последних задержек и сглаженная доля успешных
+ответов. p95 задержки задает момент дублирующего (хеджирующего) запроса,
+оценка здоровья — какая модель получает основной запрос.
+"""
+
+import math
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Optional, Tuple
+
+# Окно задержек на модель и минимум замеров для p95
+WINDOW = 50
+MIN_SAMPLES = 5
+# Сглаживание доли успехов и период полувосстановления после сбоев, сек
+SUCCESS_ALPHA = 0.3
+RECOVERY_HALF_LIFE = 120.0
+# p95, при котором модель считается медленной (оценка снижается пропорционально)
+SLOW_P95 = 15.0
+# Ниже этой оценки основной запрос уходит на резервную модель
+DEGRADED = 0.5
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 8.0,
+                  rng: Optional[random.Random] = None) -> float:
+    """Экспоненциальная пауза перед повтором с полным джиттером: 0..min(cap, base*2^(attempt-1))"""
+    rng = rng or random
+    return rng.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+@dataclass
+class ModelStats:
+    """Замеры одной модели"""
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=WINDOW))
+    success: float = 1.0
+    updated: float = 0.0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+class ModelHealth:
+    """Оценка моделей по задержкам и сбоям"""
+
+    def __init__(self, initial_delay: float = 8.0, min_delay: float = 2.0, max_delay: float = 20.0):
+        """
+        Args:
+            initial_delay: Задержка хеджирования, пока замеров мало, сек
+            min_delay, max_delay: Границы задержки хеджирования, сек
+        """
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.models: Dict[str, ModelStats] = {}
+
+    def _stats(self, model: str) -> ModelStats:
+        return self.models.setdefault(model, ModelStats())
+
+    def record(self, model: str, latency: float, ok: bool) -> None:
+        """Завершенный вызов: задержка и успех/сбой"""
+        stats = self._stats(model)
+        if ok:
+            stats.latencies.append(latency)
+        stats.success = self._success(stats) + SUCCESS_ALPHA * ((1.0 if ok else 0.0) - self._success(stats))
+        stats.updated = time.monotonic()
+
+    def record_slow(self, model: str, elapsed: float) -> None:
+        """Отмененный проигравший вызов: задержка не меньше elapsed"""
+        self._stats(model).latencies.append(elapsed)
+
+    @staticmethod
+    def _success(stats: ModelStats) -> float:
+        # без новых сбоев доля успехов возвращается к 1
+        if stats.success >= 1.0:
+            return 1.0
+        decay = 0.5 ** ((time.monotonic() - stats.updated) / RECOVERY_HALF_LIFE)
+        return 1.0 - (1.0 - stats.success) * decay
+
+    def score(self, model: str) -> float:
+        """Оценка 0..1: доля успехов, сниженная при p95 выше SLOW_P95"""
+        stats = self._stats(model)
+        p95 = stats.p95()
+        latency_factor = min(1.0, SLOW_P95 / p95) if p95 else 1.0
+        return self._success(stats) * latency_factor
+
+    def hedge_delay(self, model: str) -> float:
+        """Через сколько секунд отправлять дублирующий запрос"""
+        p95 = self._stats(model).p95()
+        delay = self.initial_delay if p95 is None else p95
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def order(self, primary: str, fallback: Optional[str]) -> Tuple[str, str]:
+        """
+        (модель основного запроса, модель хеджирующего)
+        Без резервной модели дубль идет в ту же модель; деградировавшая основная
+        модель уступает место резервной и получает только дубли.
+        """
+        if not fallback or fallback == primary:
+            return primary, primary
+        if self.score(primary) < DEGRADED and self.score(fallback) > self.score(primary):
+            return fallback, primary
+        return primary, fallback
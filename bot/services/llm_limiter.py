@@ -0,0 +1,185 @@
+"""
+Глобальный допуск запросов к LLM (AIAgent._complete, место на каждый запрос к API)
+Ограничивает число одновременных запросов и их частоту (token bucket), а
+очередь обслуживает по кругу пользователей, чтобы всплеск от одного чата не
+задерживал остальных. Продолжение уже начатого диалога (выбор работы,
+уточнения) обслуживается раньше новых запросов.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Hashable, Optional, Tuple
+
+from loguru import logger
+
+# Приоритеты: меньше — раньше
+PRIORITY_FOLLOWUP = 0
+PRIORITY_NEW = 1
+
+# Пользователь и приоритет текущего вызова LLM: задаются в AIAgent вокруг
+# _chat_json и доходят до _complete (объединенный запрос — от первого вызова)
+_REQUEST: ContextVar[Tuple[Optional[Hashable], int]] = ContextVar("llm_request", default=(None, PRIORITY_NEW))
+
+# Ожидание, после которого допуск пишется в лог, сек
+SLOW_WAIT = 1.0
+
+
+@contextmanager
+def llm_request(user_id: Optional[Hashable], priority: int = PRIORITY_NEW):
+    """Пользователь и приоритет для вызовов LLM внутри блока"""
+    token = _REQUEST.set((user_id, priority))
+    try:
+        yield
+    finally:
+        _REQUEST.reset(token)
+
+
+def current_request() -> Tuple[Optional[Hashable], int]:
+    return _REQUEST.get()
+
+
+class LLMLimiter:
+    """Допуск к LLM: лимит параллельности, token bucket и честная очередь"""
+
+    def __init__(self, max_concurrency: int = 8, rate: float = 2.0, burst: int = 5):
+        """
+        Args:
+            max_concurrency: Одновременных запросов к API
+            rate: Запросов в секунду в среднем (0 — без ограничения частоты)
+            burst: Запросов подряд без ожидания (емкость bucket)
+        """
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.active = 0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # приоритет -> пользователь -> ожидающие (порядок пользователей — очередь круга)
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[asyncio.Future]]"] = {}
+        self._waits: Deque[float] = deque(maxlen=500)
+        self.stats = {"admitted": 0, "queued": 0, "max_depth": 0, "wait_max": 0.0}
+
+    @property
+    def depth(self) -> int:
+        """Сколько вызовов ждут допуска"""
+        return sum(len(waiters) for users in self._queues.values() for waiters in users.values())
+
+    def wait_p95(self) -> float:
+        """p95 ожидания допуска по последним вызовам, сек"""
+        if not self._waits:
+            return 0.0
+        ordered = sorted(self._waits)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[Hashable] = None, priority: int = PRIORITY_NEW):
+        """Место для одного запроса к API; ждет очереди, если лимиты исчерпаны"""
+        started = time.monotonic()
+        if not self.depth and self._free():
+            self._take()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(priority, OrderedDict()).setdefault(user_id, deque()).append(waiter)
+            self.stats["queued"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.depth)
+            self._dispatch()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # место уже выдано — вернуть следующему
+                    self._release()
+                else:
+                    self._forget(priority, user_id, waiter)
+                raise
+        wait = time.monotonic() - started
+        self._waits.append(wait)
+        self.stats["admitted"] += 1
+        self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+        if wait >= SLOW_WAIT:
+            logger.info(f"Допуск к LLM через {wait:.1f} сек (пользователь {user_id}, приоритет {priority}, "
+                        f"в очереди {self.depth}, активно {self.active})")
+        try:
+            yield
+        finally:
+            self._release()
+
+    def try_slot(self) -> bool:
+        """
+        Место без ожидания (дублирующий запрос): выдается, только если очередь
+        пуста и лимиты не исчерпаны; освобождается release()
+        """
+        if self.depth or not self._free():
+            return False
+        self._take()
+        self._waits.append(0.0)
+        self.stats["admitted"] += 1
+        return True
+
+    def release(self) -> None:
+        """Освобождает место, выданное try_slot"""
+        self._release()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _free(self) -> bool:
+        self._refill()
+        return self.active < self.max_concurrency and (self.rate <= 0 or self._tokens >= 1.0)
+
+    def _take(self) -> None:
+        self.active += 1
+        if self.rate > 0:
+            self._tokens -= 1.0
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        """Первый ожидающий: высший приоритет, затем следующий по кругу пользователь"""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_id, waiters = next(iter(users.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        while self.depth and self._free():
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self._take()
+            waiter.set_result(None)
+        if self.depth and self.active < self.max_concurrency and self._timer is None:
+            # мест хватает, но bucket пуст — разбудить, когда появится токен
+            delay = (1.0 - self._tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def _forget(self, priority: int, user_id: Optional[Hashable], waiter: asyncio.Future) -> None:
+        users = self._queues.get(priority)
+        if users is None or user_id not in users:
+            return
+        waiters = users[user_id]
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            del users[user_id]
@@ -0,0 +1,113 @@
+"""
+Денежное ядро калькулятора: суммы в целых копейках, коэффициенты — точные дроби
+Округление до копейки выполняется в трех фиксированных точках:
+- итог строки этапа: цена × объем × K1 × K2 × K3 (ROUND_HALF_UP);
+- каждая надбавка: сумма округляется при расчете надбавки
+  (DatabaseService, round(…, 2) по float) и в итог входит уже округленной —
+  итог надбавок равен сумме показанных строк, а не округленной точной сумме;
+- итог расчета: (полевые + камеральные + надбавки) × итоговые коэффициенты
+  (ROUND_HALF_UP).
+
+Так же округляются строки в эталонных сметах (smeta_examples/*.xlsx).
+"""
+
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Iterable, Tuple
+
+# Дробь в виде (числитель, знаменатель), знаменатель > 0
+Ratio = Tuple[int, int]
+
+ONE: Ratio = (1, 1)
+KOPECKS_IN_RUBLE = 100
+
+
+@lru_cache(maxsize=8192)
+def _ratio_cached(value: Any) -> Ratio:
+    if isinstance(value, str):
+        value = value.strip().replace(",", ".")
+    return Decimal(str(value)).as_integer_ratio()
+
+
+def ratio(value: Any) -> Ratio:
+    """
+    Переводит число (int/float/str/Decimal) в точную десятичную дробь
+    Готовая дробь (Ratio) возвращается как есть
+
+    float берется по его кратчайшему десятичному представлению (str),
+    т.е. 1.15 → 23/20, а не двоичное приближение.
+    """
+    if value is None:
+        return (0, 1)
+    if value.__class__ is tuple:
+        return value
+    return _ratio_cached(value)
+
+
+def mul(*ratios: Ratio) -> Ratio:
+    """Произведение дробей без округления"""
+    num, den = 1, 1
+    for n, d in ratios:
+        num *= n
+        den *= d
+    return num, den
+
+
+def product(values: Iterable[Any]) -> Ratio:
+    """Произведение коэффициентов (числа в любом виде) без округления"""
+    num, den = 1, 1
+    for value in values:
+        n, d = ratio(value)
+        num *= n
+        den *= d
+    return num, den
+
+
+def round_div(num: int, den: int) -> int:
+    """Целочисленное деление с округлением half-up (от нуля), как ROUND_HALF_UP"""
+    if den < 0:
+        num, den = -num, -den
+    if num < 0:
+        return -((-num * 2 + den) // (den * 2))
+    return (num * 2 + den) // (den * 2)
+
+
+def to_kopecks(value: Any) -> int:
+    """Сумма в рублях → целые копейки (half-up)"""
+    num, den = ratio(value)
+    return round_div(num * KOPECKS_IN_RUBLE, den)
+
+
+def from_kopecks(kopecks: int) -> float:
+    """Целые копейки → рубли (float для результата расчета)"""
+    return kopecks / KOPECKS_IN_RUBLE
+
+
+def scale(kopecks: int, factor: Ratio) -> int:
+    """Сумма в копейках × дробь с одним округлением до копейки"""
+    return round_div(kopecks * factor[0], factor[1])
+
+
+def line_cost(price: Any, quantity: Any, factor: Ratio = ONE) -> int:
+    """
+    Стоимость строки в копейках: цена × объем × коэффициенты
+
+    Args:
+        price: Базовая цена за единицу (руб)
+        quantity: Объем работ
+        factor: Произведение коэффициентов (см. product)
+
+    Returns:
+        Стоимость в копейках, округленная один раз
+    """
+    p_num, p_den = ratio(price)
+    q_num, q_den = ratio(quantity)
+    return round_div(
+        p_num * q_num * factor[0] * KOPECKS_IN_RUBLE,
+        p_den * q_den * factor[1],
+    )
+
+
+def to_float(value: Ratio) -> float:
+    """Дробь → float (для отображения коэффициентов)"""
+    return value[0] / value[1]
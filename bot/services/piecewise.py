@@ -0,0 +1,197 @@
+"""
+Формульные надбавки табл.78-80 (программа, отчет, регистрация)
+Строки семейства norm_addons — полосы по базовой стоимости (тыс. руб.):
+fixed_amount + (база − нижняя граница) × percent_over. При загрузке полосы
+компилируются в отсортированные массивы границ, фиксированных сумм и ставок,
+и сумма для базы находится одним bisect и одним умножением-сложением.
+"""
+
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+# Флаг запроса и префикс кодов семейства (в порядке применения)
+PIECEWISE_FAMILIES = (
+    ("include_program", "PROGRAM_T78_"),
+    ("include_report", "REPORT_T79_"),
+    ("include_registration", "REGISTRATION_T80_"),
+)
+
+
+def round_amounts(values) -> np.ndarray:
+    """
+    Поэлементный round(x, 2) — как сумма надбавки в DatabaseService._addon_entry
+    np.round округляет x × 100 и на суммах вида …,xx5 расходится с round
+    (107569.97499… → .98 вместо .97); такие элементы округляются через round.
+    """
+    values = np.asarray(values, dtype=float)
+    result = np.round(values, 2)
+    scaled = values * 100.0
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-4
+    for index in zip(*np.nonzero(near_half)):
+        result[index] = round(float(values[index]), 2)
+    return result
+
+
+@dataclass(frozen=True)
+class PiecewiseSchedule:
+    """
+    Шкала одного семейства: полосы по возрастанию нижней границы
+
+    Границы включаются с обеих сторон (как DatabaseService._match_range), поэтому
+    на общей границе соседних полос применяются обе. Если полосы перекрываются
+    или вырождены в точку, bisect неприменим и полосы перебираются целиком.
+    """
+    prefix: str
+    rows: Tuple[Dict, ...]
+    # Позиция строки в выдаче БД (порядок надбавок в результате)
+    order: np.ndarray
+    lo: np.ndarray
+    hi: np.ndarray
+    fixed: np.ndarray
+    percent: np.ndarray
+    has_percent: np.ndarray
+    threshold: np.ndarray
+    # Нижние границы списком (для bisect без преобразования массива)
+    bounds: Tuple[float, ...] = ()
+    bisectable: bool = True
+
+    @classmethod
+    def compile(cls, prefix: str, rows: List[Dict]) -> "PiecewiseSchedule":
+        """Компилирует строки norm_addons семейства в массивы полос"""
+        bands = []
+        for position, row in enumerate(rows):
+            cond = row.get("conditions") or {}
+            lo = cond.get("base_cost_thousand_min")
+            hi = cond.get("base_cost_thousand_max")
+            percent = cond.get("percent_over")
+            bands.append((
+                -np.inf if lo is None else float(lo),
+                np.inf if hi is None else float(hi),
+                float(cond.get("fixed_amount") or 0.0),
+                np.nan if percent is None else float(percent),
+                float(lo or 0.0),
+                position,
+                row,
+            ))
+        # Стабильная сортировка: строки с одинаковой границей сохраняют порядок БД
+        bands.sort(key=lambda band: band[0])
+        lo = np.array([b[0] for b in bands], dtype=float)
+        hi = np.array([b[1] for b in bands], dtype=float)
+        percent = np.array([b[3] for b in bands], dtype=float)
+        bisectable = bool(
+            np.all(lo < hi) and np.all(hi[:-1] <= lo[1:])
+        ) if len(bands) else True
+        if not bisectable:
+            logger.warning(f"Полосы {prefix}* перекрываются — надбавка считается перебором полос")
+        return cls(
+            prefix=prefix,
+            rows=tuple(b[6] for b in bands),
+            order=np.array([b[5] for b in bands], dtype=int),
+            lo=lo,
+            hi=hi,
+            fixed=np.array([b[2] for b in bands], dtype=float),
+            percent=np.nan_to_num(percent),
+            has_percent=~np.isnan(percent),
+            threshold=np.array([b[4] for b in bands], dtype=float),
+            bounds=tuple(lo.tolist()),
+            bisectable=bisectable,
+        )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def breakpoints(self) -> np.ndarray:
+        """Границы полос, тыс. руб. (конечные, по возрастанию)"""
+        bounds = np.concatenate((self.lo, self.hi))
+        return np.unique(bounds[np.isfinite(bounds)])
+
+    def bands(self, base_thousand: float) -> List[int]:
+        """Полосы, в которые попадает база (в порядке строк БД)"""
+        if not self.bisectable:
+            matched = [i for i in range(len(self.rows)) if self.lo[i] <= base_thousand <= self.hi[i]]
+        else:
+            i = bisect_right(self.bounds, base_thousand) - 1
+            matched = []
+            if i >= 0 and base_thousand <= self.hi[i]:
+                matched.append(i)
+            # Общая граница с предыдущей полосой (верхняя граница включается)
+            if i >= 1 and self.hi[i - 1] >= base_thousand:
+                matched.append(i - 1)
+        return sorted(matched, key=lambda i: self.order[i])
+
+    def amount(self, i: int, base_thousand: float) -> float:
+        """Сумма полосы: fixed + (база − порог) × 1000 × percent"""
+        if not self.has_percent[i]:
+            return float(self.fixed[i])
+        over = max(base_thousand - float(self.threshold[i]), 0.0) * 1000.0
+        return float(self.fixed[i]) + (over * float(self.percent[i]))
+
+    def lookup(self, base_thousand: float) -> List[Tuple[Dict, float]]:
+        """Строки norm_addons и суммы (без округления) для базы"""
+        return [(self.rows[i], self.amount(i, base_thousand)) for i in self.bands(base_thousand)]
+
+    def total(self, base_thousand: np.ndarray, start: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Векторный вариант: сумма надбавок семейства (каждая округлена до копеек)
+        для массива баз (для пакетного расчета и перебора)
+
+        Args:
+            base_thousand: Базовая стоимость, тыс. руб.
+            start: Накопленная сумма предыдущих надбавок — суммы прибавляются к ней
+                по одной в порядке строк БД (тот же порядок сложения, что при переборе)
+        """
+        base = np.asarray(base_thousand, dtype=float)
+        result = np.zeros(base.shape) if start is None else start
+        if not len(self.rows):
+            return result
+        if not self.bisectable:
+            for i in np.argsort(self.order):
+                in_band = (base >= self.lo[i]) & (base <= self.hi[i])
+                result = result + np.where(in_band, self._rounded(i, base), 0.0)
+            return result
+        idx = np.searchsorted(self.lo, base, side="right") - 1
+        safe = np.maximum(idx, 0)
+        current = (idx >= 0) & (base <= self.hi[safe])
+        prev = np.maximum(idx - 1, 0)
+        boundary = (idx >= 1) & (self.hi[prev] >= base)
+        # Полоса и предыдущая полоса на общей границе — в порядке строк БД
+        first = np.where(boundary & (self.order[prev] < self.order[safe]), prev, safe)
+        second = np.where(first == safe, prev, safe)
+        first_on = np.where(first == safe, current, boundary)
+        second_on = np.where(first == safe, boundary, current)
+        result = result + np.where(first_on, self._rounded(first, base), 0.0)
+        result = result + np.where(second_on, self._rounded(second, base), 0.0)
+        return result
+
+    def _rounded(self, i, base: np.ndarray) -> np.ndarray:
+        over = np.maximum(base - self.threshold[i], 0.0) * 1000.0
+        amount = np.where(self.has_percent[i], self.fixed[i] + (over * self.percent[i]), self.fixed[i])
+        return round_amounts(amount)
+
+
+def compile_schedules(rows_by_prefix: Dict[str, List[Dict]]) -> Dict[str, PiecewiseSchedule]:
+    """Шкалы семейств PIECEWISE_FAMILIES по строкам norm_addons"""
+    return {
+        prefix: PiecewiseSchedule.compile(prefix, rows_by_prefix.get(prefix) or [])
+        for _, prefix in PIECEWISE_FAMILIES
+    }
+
+
+def piecewise_total(
+    schedules: Dict[str, PiecewiseSchedule],
+    params: Dict,
+    base_thousand: np.ndarray
+) -> np.ndarray:
+    """Сумма формульных надбавок запрошенных семейств для массива баз"""
+    base = np.asarray(base_thousand, dtype=float)
+    total = np.zeros(base.shape)
+    for flag, prefix in PIECEWISE_FAMILIES:
+        schedule: Optional[PiecewiseSchedule] = schedules.get(prefix)
+        if params.get(flag) and schedule is not None:
+            total = schedule.total(base, start=total)
+    return total
@@ -0,0 +1,223 @@
+"""
+Скомпилированные планы расчета для строк расценок norm_items
+План фиксирует то, что для строки не зависит от запроса пользователя:
+цены этапов, подмножества правил K1/K2/K3 (примечания ее таблицы и разделы ОУ
+документа, см. services/rules.py), exclusive_group этих правил и ключи
+параметров, от которых зависит подбор. Правила, которые никогда не выигрывают
+в своей группе (services/rule_groups.py), в план не попадают.
+Выполнение плана — отбор правил из небольших подмножеств без запросов к БД.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from . import money
+from .database import DatabaseService
+from .rule_groups import GROUPED_FACTORS, RuleGroups
+from .rules import RuleEngine
+
+# Этапы плана и соответствующие цены строки
+PLAN_STAGES = (("field", "price_field"), ("office", "price_office"))
+
+
+@dataclass(frozen=True)
+class StagePlan:
+    """План одного этапа (полевые/камеральные)"""
+    stage: str
+    price: money.Ratio
+    rules: Dict[str, Tuple[Dict, ...]]
+    param_keys: Dict[str, frozenset]
+    exclusive_groups: Dict[str, frozenset]
+
+    @property
+    def has_price(self) -> bool:
+        return self.price[0] != 0
+
+
+@dataclass(frozen=True)
+class CalculationPlan:
+    """План расчета строки расценки (собирается CalculationPlan.compile)"""
+    work_id: Optional[str]
+    table_no: Optional[int]
+    prices: Tuple
+    stages: Dict[str, StagePlan]
+    catalog_version: int
+    engine: RuleEngine
+    groups: Optional[RuleGroups] = None
+
+    @staticmethod
+    def _prices(work: Dict) -> Tuple:
+        return tuple(work.get(key) for _, key in PLAN_STAGES)
+
+    @classmethod
+    def compile(
+        cls,
+        work: Dict,
+        rules: List[Dict],
+        catalog_version: int,
+        engine: RuleEngine,
+        groups: Optional[RuleGroups] = None
+    ) -> "CalculationPlan":
+        """
+        Компилирует план строки расценки
+
+        Args:
+            work: Строка norm_items
+            rules: Все правила norm_coeffs документа (DatabaseService.load_coeff_rules)
+            catalog_version: Поколение каталога, для которого собран план
+            engine: Движок правил документа строки
+            groups: Группы правил документа (DatabaseService.rule_groups)
+        """
+        table_no = work.get("table_no")
+        by_factor: Dict[str, List[Dict]] = {"K1": [], "K2": [], "K3": []}
+        for coeff in rules:
+            for factor in engine.rule_factors(coeff, table_no):
+                by_factor[factor].append(coeff)
+        if groups is not None:
+            # правила, которые никогда не выигрывают в группе, — только там, где
+            # победителя выбирает groups.select (K3 групп не учитывает)
+            for factor in GROUPED_FACTORS:
+                by_factor[factor] = list(groups.prune(by_factor[factor]))
+
+        prices = cls._prices(work)
+        stages = {}
+        for (stage, _), price in zip(PLAN_STAGES, prices):
+            stage_rules = {
+                # табличные правила с apply_to другого этапа в этом этапе не выбираются
+                "K1": tuple(c for c in by_factor["K1"] if c.get("apply_to") in ("price", stage)),
+                "K2": tuple(by_factor["K2"]) if stage == "office" else (),
+                "K3": tuple(by_factor["K3"]),
+            }
+            stages[stage] = StagePlan(
+                stage=stage,
+                price=money.ratio(price or 0),
+                rules=stage_rules,
+                param_keys=DatabaseService.rule_param_keys(stage_rules),
+                exclusive_groups={
+                    factor: frozenset(c["exclusive_group"] for c in subset if c.get("exclusive_group"))
+                    for factor, subset in stage_rules.items()
+                },
+            )
+        return cls(
+            work_id=work.get("id"),
+            table_no=table_no,
+            prices=prices,
+            stages=stages,
+            catalog_version=catalog_version,
+            engine=engine,
+            groups=groups,
+        )
+
+    def matches(self, work: Dict) -> bool:
+        """План собран для этой строки с теми же ценами (бот может подставить цену из другой строки)"""
+        return work.get("id") == self.work_id and self._prices(work) == self.prices
+
+    def match(self, factor: str, stage: str, params: Dict) -> List[Dict]:
+        """
+        Подходящие правила K1/K2/K3 этапа (с учетом exclusive_group)
+
+        Args:
+            factor: 'K1', 'K2' или 'K3'
+            stage: 'field' или 'office'
+            params: Параметры работ
+        """
+        stage_plan = self.stages[stage]
+        rules = stage_plan.rules[factor]
+        if factor == "K1":
+            matching = self.engine.match_k1(rules, self.table_no, params, stage) if rules else []
+        elif factor == "K2":
+            # K2 выбирается только для камеральных (п.15 ОУ); exclusive_group учтен в match_k2
+            return self.engine.match_k2(rules, params, groups=self.groups) if stage == "office" else []
+        else:
+            return self.engine.match_k3(rules, params)
+        if stage_plan.exclusive_groups[factor]:
+            if self.groups is not None:
+                return self.groups.select(matching)
+            matching = DatabaseService._filter_by_exclusive_group(matching, params)
+        return matching
+
+
+class PlanRegistry:
+    """Кэш планов по id строки; сбрасывается при смене версии каталога"""
+
+    def __init__(self, db_service):
+        """
+        Args:
+            db_service: Сервис БД (правила, строки расценок, версия каталога)
+        """
+        self.db = db_service
+        self._plans: Dict[str, CalculationPlan] = {}
+        self._version: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def _check_version(self) -> int:
+        version = self.db.catalog_version
+        if version != self._version:
+            self._plans.clear()
+            self._version = version
+        return version
+
+    async def get(self, work: Dict) -> Optional[CalculationPlan]:
+        """
+        План для строки расценки (компилируется при первом обращении)
+
+        Returns:
+            План или None, если правила не удалось загрузить
+        """
+        await self.db.refresh_catalog_version()
+        version = self._check_version()
+        work_id = work.get("id")
+        plan = self._plans.get(work_id) if work_id is not None else None
+        if plan is not None and plan.matches(work):
+            return plan
+
+        engine = await self.db.get_rule_engine(work.get("doc_id"))
+        rules = await self.db.load_coeff_rules(engine.doc_code)
+        if rules is None:
+            return None
+        compiled = CalculationPlan.compile(work, rules, version, engine, self.db.rule_groups(engine.doc_code))
+        # Строку с подставленной ценой не кэшируем, чтобы не вытеснить план каталога
+        if work_id is not None and plan is None:
+            self._plans[work_id] = compiled
+        return compiled
+
+    async def precompile(self, works: Optional[List[Dict]] = None) -> int:
+        """
+        Компилирует планы для всего каталога (при запуске бота)
+
+        Args:
+            works: Строки расценок (по умолчанию — все norm_items)
+
+        Returns:
+            Число скомпилированных планов
+        """
+        started = time.perf_counter()
+        await self.db.refresh_catalog_version(force=True)
+        version = self._check_version()
+        if works is None:
+            works = await self.db.get_catalog_works()
+        count = 0
+        # Движки и правила загружаются только для документов, строки которых есть в каталоге
+        by_doc: Dict[Optional[str], tuple] = {}
+        for work in works:
+            if work.get("id") is None:
+                continue
+            doc_id = work.get("doc_id")
+            if doc_id not in by_doc:
+                engine = await self.db.get_rule_engine(doc_id)
+                rules = await self.db.load_coeff_rules(engine.doc_code)
+                by_doc[doc_id] = (engine, rules, self.db.rule_groups(engine.doc_code))
+            engine, rules, groups = by_doc[doc_id]
+            if rules is None:
+                continue
+            self._plans[work["id"]] = CalculationPlan.compile(work, rules, version, engine, groups)
+            count += 1
+        if works and not count:
+            logger.warning("Планы расчета не скомпилированы: правила коэффициентов недоступны")
+        logger.info(f"Скомпилировано планов расчета: {count} за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return count
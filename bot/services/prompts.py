@@ -0,0 +1,197 @@
+"""
+Компактный промпт extract_parameters (AIAgent._extract_prompt — полный вариант)
+Статическая часть (схема основных полей и правила) одинакова для всех запросов
+и идет первой — провайдер кэширует общий префикс. Далее только разделы
+параметров (K1/K2/K3/надбавки), на которые есть слова в запросе, k самых похожих
+примеров и сам запрос.
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+STATIC_PREFIX = """Извлеки параметры из запроса пользователя о геодезических/топографических работах.
+Верни JSON с полями ниже. Поля из разделов, которых нет в этом промпте, не возвращай.
+
+=== ОСНОВНЫЕ ПАРАМЕТРЫ ===
+- work_type: тип работ - используй СТАНДАРТНЫЕ термины:
+  * "топографическая съемка" - для топопланов, инженерно-топографических планов
+  * "нивелирование" - для высотных работ
+  * "трассирование" - для изысканий трасс
+  * "изыскания трасс" - для ж/д, автодорог, ЛЭП
+  * "бурение" - для буровых работ
+  * "опорная сеть" - для геодезических сетей (плановая, высотная)
+  * "привязка скважин" - для планово-высотной привязки геологических скважин
+  * "привязка выработок" - для привязки горных выработок
+  * "выдача координат" - для выдачи координат и высот исходных пунктов
+- quantity: объем работ (число) или null
+- unit: единица измерения (га, км, пункт, м) или null
+- scale: масштаб (1:500, 1:1000, 1:2000) или null
+- height_section: сечение рельефа (например 0.5, 1.0, 2.0) или null
+- work_stage: этап работ ("полевые", "камеральные", "обе") или null
+- category: категория СЛОЖНОСТИ работ (I, II, III, IV) или null
+
+ВАЖНО:
+1. Для work_type используй СТАНДАРТНЫЕ термины! "инженерно-топографический план" = "топографическая съемка"
+2. Если параметр явно не указан - верни null (без автоматических true)
+3. Не придумывай параметры, которых нет в тексте.
+4. ВНИМАТЕЛЬНО извлекай quantity! "пункт 15" = quantity: 15, "15 пунктов" = quantity: 15, "км 2,00" = quantity: 2.0, unit: "км"
+"""
+
+
+@dataclass(frozen=True)
+class PromptSection:
+    """Раздел параметров: текст и слова запроса, при которых он нужен"""
+    name: str
+    text: str
+    keywords: Tuple[str, ...]
+
+
+SECTIONS = (
+    PromptSection("road", """=== КАТЕГОРИЯ СЛОЖНОСТИ И КАТЕГОРИЯ ДОРОГИ ===
+  * ВАЖНО: НЕ ПУТАТЬ категорию сложности с категорией дороги!
+  * "II кат.сложности", "2 категория сложности", "II категория" (в скобках) → category: "II"
+  * "III-IV категории дороги" → это road_category, НЕ category!""",
+        ("дорог", "автодор", "трасс", "лэп", "кв", "ж/д", "железн")),
+    PromptSection("k1", """=== ПАРАМЕТРЫ ДЛЯ K1 (примечания к таблицам) ===
+- territory_type: тип территории - "застроенная", "незастроенная", "промпредприятие" или null
+- has_underground_comms: съемка подземных коммуникаций (true/false/null)
+- has_detailed_wells_sketches: детальные эскизы колодцев и опор (true/false/null)
+  * для слов «эстакад», «колодцев», «подробное обследование» — has_detailed_wells_sketches=true
+- measurement_drawings: обмерные чертежи зданий и сооружений (true/false/null)
+- special_object: крупные ж/д станции/аэропорты и др. спецобъекты (string/null)
+- update_mode: обновление существующего плана (true/false/null)""",
+        ("застро", "промпред", "промплощ", "завод", "территор", "коммуникац", "подземн", "колод", "эстакад",
+         "опор", "обследован", "обмер", "чертеж", "станци", "аэропорт", "спецобъект", "обновлен", "корректур")),
+    PromptSection("satellite", """=== СПУТНИКОВЫЕ СИСТЕМЫ (K1) ===
+- use_satellite: применение спутниковых систем/GPS/GNSS (true/false/null) - K1=1.3 ТОЛЬКО для ПЛАНОВЫХ опорных сетей!
+  * ВАЖНО: для ВЫСОТНЫХ сетей (нивелирование, IV класс) use_satellite = false!
+  * "плановая опорная сеть спутниковым методом" → use_satellite: true
+  * "высотная опорная сеть IV класс" → use_satellite: false (это нивелирование!)""",
+        ("спутник", "gps", "gnss", "глонасс", "гнсс", "сеть", "сети", "нивелир")),
+    PromptSection("k2", """=== ПАРАМЕТРЫ ДЛЯ K2 (п.15 ОУ) ===
+- use_computer: компьютерные технологии для камеральных (true/false/null)
+- dual_format: два носителя - магнитный + бумажный (true/false/null)
+- color_plan: план в цвете (true/false/null)
+- intermediate_materials: выдача промежуточных материалов (true/false/null)
+- classified_materials: материалы ограниченного пользования (true/false/null)
+- artificial_lighting: искусственное освещение (true/false/null)""",
+        ("компьютер", "цифров", "носител", "бумаж", "магнит", "цвет", "промежуточ", "ограничен", "секрет",
+         "дсп", "освещен")),
+    PromptSection("k3", """=== ПАРАМЕТРЫ ДЛЯ K3 (п.8, п.14 ОУ - условия производства) ===
+- altitude: высота над уровнем моря в метрах (для горных районов) или null
+- unfavorable_months: месяцы неблагоприятного периода (4-5.5, 6-7.5, 8-9.5) или null
+- salary_coeff: районный коэффициент к зарплате (1.15, 1.20, 1.30, 1.40, 1.50, 1.60, 1.70, 1.80, 2.00) или null
+- region_type: тип региона ("far_north", "far_north_equivalent", "south_regions") или null
+- special_regime: спецрежим территории - погранзона, полигон, аэродром (true/false/null)
+- night_time: работы в ночное время (true/false/null)
+- no_field_allowance: без полевого довольствия (true/false/null)""",
+        ("горн", "высот", "уровн", "неблагоприят", "зимн", "сезон", "районн", "коэффициент", "север", "магадан",
+         "якут", "норильск", "чукот", "южн", "погран", "полигон", "аэродром", "режим", "ночн", "довольств")),
+    PromptSection("addons", """=== ПАРАМЕТРЫ ДЛЯ НАДБАВОК ===
+- distance_to_base: расстояние от базы до объекта в км (для внутреннего транспорта) или null
+- external_distance: расстояние внешнего транспорта в км или null
+- expedition_duration: длительность экспедиции в месяцах или null
+- include_org_liq: включать организацию/ликвидацию полевых работ (true/false/null)
+- apply_conditions_as_addons: применять сезонность/районность/горные как отдельные надбавки (true/false/null)""",
+        ("баз", "расстоян", "транспорт", "доезд", "выезд", "экспедиц", "организац", "ликвидац", "надбав")),
+)
+
+# (пример запроса, ответ) — выбираются по сходству с запросом
+EXAMPLES = (
+    ("топоплан 92 га промпредприятие", 'quantity: 92, unit: "га", territory_type: "промпредприятие"'),
+    ("сечение рельефа 2,0", "height_section: 2.0"),
+    ("съемка с подземными коммуникациями", "has_underground_comms: true"),
+    ("детальное обследование эстакад/колодцев", "has_detailed_wells_sketches: true"),
+    ("работы в Магадане", 'region_type: "far_north" (Магадан - Крайний Север)'),
+    ("горный район 2500м", "altitude: 2500"),
+    ("неблагоприятный период 6 месяцев", "unfavorable_months: 6"),
+    ("пункт 15 категория 2", 'quantity: 15, unit: "пункт", category: "II"'),
+    ("1 разряд пункт 15", 'quantity: 15, unit: "пункт" (разряд - это характеристика работы, не количество!)'),
+    ("км 2,00", 'quantity: 2.0, unit: "км"'),
+    ("2 км", 'quantity: 2, unit: "км"'),
+    ("15 пунктов", 'quantity: 15, unit: "пункт"'),
+    ("IV класс пункт 15", 'quantity: 15, unit: "пункт" (класс - характеристика работы)'),
+    ("с применением спутниковых систем", "use_satellite: true (K1=1.3 для полевых!)"),
+    ("спутниковым методом", "use_satellite: true"),
+    ("GPS/GNSS", "use_satellite: true"),
+    ("железных дорог III-IV категории (II кат.сложности)",
+     'category: "II" (НЕ "III"! "III-IV" - это категория дороги)'),
+    ("автодорог I-II категории, III категория сложности", 'category: "III" (категория сложности в конце)'),
+    ("ЛЭП 110 кВ, II категория", 'category: "II" (категория сложности)'),
+)
+
+# Сколько примеров в промпте по умолчанию
+DEFAULT_EXAMPLES = 6
+
+_WORD_RE = re.compile(r"[а-яa-z0-9]+")
+# Оценка токенов без токенизатора: кириллица ~2.5 символа на токен, латиница ~4
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+
+
+def _stems(text: str) -> set:
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return {w[:max(4, len(w) - 2)] if len(w) > 4 else w for w in words}
+
+
+def estimate_tokens(text: str) -> int:
+    """Приблизительное число токенов промпта (для сравнения вариантов без API)"""
+    cyrillic = len(_CYRILLIC_RE.findall(text))
+    return round(cyrillic / 2.5 + (len(text) - cyrillic) / 4)
+
+
+def prompt_version() -> str:
+    """Хэш всех шаблонов: ключ кэша параметров меняется при правке промпта"""
+    parts = [STATIC_PREFIX] + [s.text for s in SECTIONS] + [f"{q}→{a}" for q, a in EXAMPLES]
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+@dataclass
+class BuiltPrompt:
+    """Собранный промпт и что в него вошло"""
+    text: str
+    sections: List[str] = field(default_factory=list)
+    examples: List[str] = field(default_factory=list)
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+class PromptBuilder:
+    """Сборка компактного промпта extract_parameters"""
+
+    def __init__(self, examples: int = DEFAULT_EXAMPLES):
+        self.k = examples
+        self._example_stems = [_stems(query) for query, _ in EXAMPLES]
+        self.static_tokens = estimate_tokens(STATIC_PREFIX)
+
+    def sections_for(self, message: str) -> List[PromptSection]:
+        text = message.lower().replace("ё", "е")
+        return [s for s in SECTIONS if any(k in text for k in s.keywords)]
+
+    def examples_for(self, message: str) -> List[Tuple[str, str]]:
+        """k примеров с наибольшим пересечением основ слов (при равенстве — порядок списка)"""
+        stems = _stems(message)
+        scored = []
+        for i, example_stems in enumerate(self._example_stems):
+            overlap = len(stems & example_stems) / len(example_stems) if example_stems else 0.0
+            scored.append((-overlap, i))
+        scored.sort()
+        return [EXAMPLES[i] for _, i in scored[:self.k]]
+
+    def build(self, message: str) -> BuiltPrompt:
+        sections = self.sections_for(message)
+        examples = self.examples_for(message)
+        parts = [STATIC_PREFIX]
+        parts.extend(s.text + "\n" for s in sections)
+        if examples:
+            parts.append("Примеры:\n" + "\n".join(f'- "{q}" → {a}' for q, a in examples) + "\n")
+        # Запрос в конце: все, что выше, не зависит от текста пользователя
+        parts.append(f'Запрос: "{message}"')
+        return BuiltPrompt(
+            text="\n".join(parts),
+            sections=[s.name for s in sections],
+            examples=[q for q, _ in examples],
+        )
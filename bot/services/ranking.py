@@ -0,0 +1,157 @@
+"""
+Локальное ранжирование найденных строк расценок (AIAgent.select_best_work)
+Кандидаты сравниваются с параметрами запроса: категория сложности, масштаб,
+территория, сечение рельефа, графа, категория дороги и напряжение ЛЭП из текста,
+затем сходство названия и популярность строки. Если лучший кандидат явно
+опережает следующего, LLM не нужен; в LLM уходят только равные кандидаты.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .database import DatabaseService
+
+# Вес совпадения (и штраф несовпадения) параметра строки с параметром запроса
+FACET_WEIGHTS = {
+    "category": 3.0,
+    "scale": 3.0,
+    "road_category": 3.0,
+    "voltage": 2.0,
+    "territory": 2.0,
+    "height_section": 2.0,
+    "column": 2.0,
+}
+# Сходство названия и популярность только упорядочивают, но не решают выбор
+TITLE_WEIGHT = 0.5
+POPULARITY_WEIGHT = 0.25
+# Отрыв лучшего кандидата, при котором выбор делается без LLM
+DECISIVE_MARGIN = 1.0
+
+_ROMAN = r"(?:iv|v|i{1,3})"
+# «III-IV категории дороги», «V категории»: диапазон или V — всегда категория дороги
+_ROAD_RE = re.compile(
+    r"(?<!\w)(" + _ROMAN + r"(?:\s*[-–]\s*" + _ROMAN + r")?)\s*категори\w*"
+)
+_VOLTAGE_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*кв(?!\w)")
+_WORD_RE = re.compile(r"[а-яa-z]{3,}")
+
+
+@dataclass
+class RankedWork:
+    """Кандидат с оценкой и совпавшими/несовпавшими параметрами"""
+    work: Dict
+    score: float
+    matched: List[str] = field(default_factory=list)
+    mismatched: List[str] = field(default_factory=list)
+
+
+def road_category(text: str) -> Optional[str]:
+    """Категория дороги из текста запроса («III-IV», «I-II», «V»)"""
+    lowered = text.lower()
+    for m in _ROAD_RE.finditer(lowered):
+        value = re.sub(r"\s*[-–]\s*", "-", m.group(1)).upper()
+        tail = lowered[m.end():m.end() + 30]
+        if tail.lstrip().startswith("сложност"):
+            continue
+        if "-" in value or value == "V" or "дорог" in tail:
+            return value
+    return None
+
+
+def voltage(text: str) -> Optional[float]:
+    """Напряжение ЛЭП из текста, кВ"""
+    m = _VOLTAGE_RE.search(text.lower())
+    return float(m.group(1).replace(",", ".")) if m else None
+
+
+def _in_voltage_range(value: float, work_voltage: str) -> bool:
+    """Попадает ли напряжение в диапазон строки («35-110», «0.4-20»)"""
+    numbers = [float(n.replace(",", ".")) for n in re.findall(r"\d+(?:[.,]\d+)?", str(work_voltage))]
+    if not numbers:
+        return False
+    return min(numbers) <= value <= max(numbers)
+
+
+def _stems(text: str) -> set:
+    return {w[:max(4, len(w) - 2)] if len(w) > 4 else w for w in _WORD_RE.findall(text.lower().replace("ё", "е"))}
+
+
+def _facets(user_request: str, params: Dict) -> Dict[str, object]:
+    """Параметры запроса, с которыми сравниваются строки"""
+    facets = {
+        "category": params.get("category"),
+        "scale": DatabaseService._normalize_scale(params.get("scale")),
+        "territory": DatabaseService._normalize_territory(params.get("territory_type")),
+        "height_section": DatabaseService._to_float(params.get("height_section")),
+        "column": params.get("column"),
+        "road_category": params.get("road_category") or road_category(user_request),
+        "voltage": DatabaseService._to_float(params.get("voltage")) or voltage(user_request),
+    }
+    return {key: value for key, value in facets.items() if value is not None}
+
+
+def _facet_match(key: str, wanted, work_value) -> bool:
+    if key == "scale":
+        return DatabaseService._normalize_scale(work_value) == wanted
+    if key == "territory":
+        return DatabaseService._normalize_territory(work_value) == wanted
+    if key == "height_section":
+        value = DatabaseService._to_float(work_value)
+        return value is not None and abs(value - wanted) < 1e-6
+    if key == "voltage":
+        return _in_voltage_range(wanted, work_value)
+    return str(work_value).strip().lower() == str(wanted).strip().lower()
+
+
+def rank_works(user_request: str, works: List[Dict], params: Optional[Dict] = None) -> List[RankedWork]:
+    """
+    Оценивает кандидатов и сортирует по убыванию оценки (при равенстве — порядок поиска)
+
+    Args:
+        user_request: Текст запроса
+        works: Найденные строки norm_items
+        params: Извлеченные параметры запроса
+    """
+    facets = _facets(user_request, params or {})
+    request_stems = _stems(user_request)
+    popularity = [float(w.get("popularity_score") or w.get("usage_count") or 0) for w in works]
+    max_popularity = max(popularity, default=0.0)
+
+    ranked = []
+    for work, popular in zip(works, popularity):
+        item = RankedWork(work=work, score=0.0)
+        work_params = work.get("params") or {}
+        for key, wanted in facets.items():
+            work_value = work_params.get(key)
+            if work_value is None:
+                continue
+            if _facet_match(key, wanted, work_value):
+                item.score += FACET_WEIGHTS[key]
+                item.matched.append(key)
+            else:
+                item.score -= FACET_WEIGHTS[key]
+                item.mismatched.append(key)
+        title_stems = _stems(work.get("work_title") or "")
+        if title_stems and request_stems:
+            item.score += TITLE_WEIGHT * len(title_stems & request_stems) / len(title_stems | request_stems)
+        if max_popularity:
+            item.score += POPULARITY_WEIGHT * popular / max_popularity
+        ranked.append(item)
+    ranked.sort(key=lambda item: -item.score)
+    return ranked
+
+
+def decisive(ranked: List[RankedWork], margin: float = DECISIVE_MARGIN) -> Tuple[Optional[Dict], List[RankedWork]]:
+    """
+    Выбор без LLM
+
+    Returns:
+        (строка, если лучший кандидат опережает следующего на margin, иначе None;
+         кандидаты в пределах margin от лучшего — для выбора LLM)
+    """
+    if not ranked:
+        return None, []
+    top = ranked[0].score
+    tied = [item for item in ranked if top - item.score < margin]
+    return (ranked[0].work if len(tied) == 1 else None), tied
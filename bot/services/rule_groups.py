@@ -0,0 +1,304 @@
+"""
+Взаимоисключающие группы правил norm_coeffs и проверка их согласованности
+Из правил с общим exclusive_group применяется одно — с наибольшим value
+(при равенстве — первое в выдаче БД). При загрузке правил документа группы
+ранжируются один раз, и выбор победителя при расчете — поиск ранга по правилу.
+Там же находятся правила, которые никогда не выигрывают в своей группе,
+несовместимые условия и пары правил, применяемые одновременно к одной величине:
+они сообщаются в лог один раз при загрузке каталога, а не в запросах.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Этапы, на которых выбирается правило с данным apply_to
+APPLY_STAGES = {
+    "price": frozenset({"field", "office"}),
+    "field": frozenset({"field"}),
+    "office": frozenset({"office"}),
+    "total": frozenset({"total"}),
+}
+
+# Условия-диапазоны: ключ <измерение>_min / <измерение>_max
+_RANGE_RE = re.compile(r"^(\w+)_(min|max)$")
+_TOP_SECTION_RE = re.compile(r"^п\.\s*\d+")
+# Множители, у которых победитель exclusive_group выбирается RuleGroups.select
+# (K3 отбирается match_k3 без групп)
+GROUPED_FACTORS = frozenset({"K1", "K2"})
+
+
+def filter_exclusive(coefficients: List[Dict]) -> List[Dict]:
+    """
+    Из каждой exclusive_group — правило с наибольшим value (при равенстве — первое)
+
+    Returns:
+        Победители групп в порядке первого появления группы, затем правила без группы
+    """
+    grouped: Dict[str, List[Dict]] = {}
+    nongrouped = []
+    for coeff in coefficients:
+        group = coeff.get("exclusive_group")
+        if not group:
+            nongrouped.append(coeff)
+            continue
+        grouped.setdefault(group, []).append(coeff)
+    result = [max(items, key=lambda c: float(c.get("value") or 0)) for items in grouped.values()]
+    result.extend(nongrouped)
+    return result
+
+
+def _number(dimension: str, value: Any) -> Optional[float]:
+    """Граница диапазона числом (масштаб "1:2000" → 2000)"""
+    if value is None:
+        return None
+    if dimension == "scale":
+        match = re.search(r"1:(\d+)", str(value))
+        return float(match.group(1)) if match else (float(value) if str(value).isdigit() else None)
+    try:
+        return float(str(value).replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _constraints(conditions: Dict) -> Optional[Dict[str, Tuple]]:
+    """
+    Условия правила по измерениям: ("eq", значение) или ("range", нижняя, верхняя)
+
+    Returns:
+        Ограничения или None, если диапазон не удалось разобрать числами
+    """
+    result: Dict[str, Tuple] = {}
+    bounds: Dict[str, Dict[str, Any]] = {}
+    for key, value in conditions.items():
+        match = _RANGE_RE.match(key)
+        if match:
+            bounds.setdefault(match.group(1), {})[match.group(2)] = value
+        else:
+            result[key] = ("eq", value)
+    for dimension, limits in bounds.items():
+        lo, hi = _number(dimension, limits.get("min")), _number(dimension, limits.get("max"))
+        if (lo is None and limits.get("min") is not None) or (hi is None and limits.get("max") is not None):
+            return None
+        result[f"{dimension}_range"] = (
+            "range",
+            float("-inf") if lo is None else lo,
+            float("inf") if hi is None else hi,
+        )
+    return result
+
+
+def _within(inner: Tuple, outer: Tuple) -> bool:
+    """Ограничение inner не шире outer (все, что допускает inner, допускает и outer)"""
+    if inner[0] != outer[0]:
+        return False
+    if inner[0] == "eq":
+        return inner[1] == outer[1]
+    return outer[1] <= inner[1] and inner[2] <= outer[2]
+
+
+def _compatible(a: Tuple, b: Tuple) -> bool:
+    """Ограничения одного измерения допускают общее значение"""
+    if a[0] != b[0]:
+        return True
+    if a[0] == "eq":
+        return a[1] == b[1]
+    return max(a[1], b[1]) <= min(a[2], b[2])
+
+
+@dataclass(frozen=True)
+class RuleIssue:
+    """Несогласованность правил документа"""
+    kind: str  # "dominated", "conflict" или "impossible"
+    codes: Tuple[str, ...]
+    message: str
+
+
+class RuleGroups:
+    """
+    Предвычисленные exclusive_group правил документа
+
+    Ранг правила в группе — (−value, позиция в списке правил), поэтому выбор
+    победителя совпадает с filter_exclusive для подмножеств этого списка
+    (результаты match_k* сохраняют порядок правил).
+    """
+
+    def __init__(self, rules: List[Dict], doc_code: Optional[str] = None, engine=None):
+        """
+        Args:
+            rules: Строки norm_coeffs документа (DatabaseService.load_coeff_rules)
+            doc_code: Код документа (для сообщений)
+            engine: RuleEngine документа — какими K1/K2/K3 выбирается правило
+                (None — любое правило считается выбираемым через группы)
+        """
+        self.doc_code = doc_code
+        self.engine = engine
+        self.rules = rules
+        self.groups: Dict[str, Tuple[Dict, ...]] = {}
+        # id(правила) → (ранг, правило); правило хранится для проверки тождества
+        self._ranks: Dict[int, Tuple[Tuple[float, int], Dict]] = {}
+        members: Dict[str, List[Tuple[Tuple[float, int], Dict]]] = {}
+        for position, coeff in enumerate(rules):
+            group = coeff.get("exclusive_group")
+            if not group:
+                continue
+            rank = (-float(coeff.get("value") or 0), position)
+            self._ranks[id(coeff)] = (rank, coeff)
+            members.setdefault(group, []).append((rank, coeff))
+        for group, ranked in members.items():
+            self.groups[group] = tuple(coeff for _, coeff in sorted(ranked, key=lambda item: item[0]))
+
+        self._parsed = [(coeff, _constraints(coeff.get("conditions") or {})) for coeff in rules]
+        self.issues: List[RuleIssue] = []
+        self._dominated: Dict[int, Dict] = {}
+        self._check_ranges()
+        self._check_dominance()
+        self._check_conflicts()
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    # --- Выбор при расчете ---
+
+    def rank(self, coeff: Dict) -> Optional[Tuple[float, int]]:
+        """Ранг правила в его группе (меньше — сильнее); None для чужих правил"""
+        entry = self._ranks.get(id(coeff))
+        return entry[0] if entry is not None and entry[1] is coeff else None
+
+    def select(self, coefficients: List[Dict]) -> List[Dict]:
+        """
+        Подходящие правила после exclusive_group (то же, что filter_exclusive)
+
+        Правила не из этого документа (строки, загруженные отдельным запросом)
+        отбираются filter_exclusive.
+        """
+        best: Dict[str, Tuple[Tuple[float, int], Dict]] = {}
+        nongrouped = []
+        for coeff in coefficients:
+            group = coeff.get("exclusive_group")
+            if not group:
+                nongrouped.append(coeff)
+                continue
+            rank = self.rank(coeff)
+            if rank is None:
+                return filter_exclusive(coefficients)
+            current = best.get(group)
+            if current is None or rank < current[0]:
+                best[group] = (rank, coeff)
+        return [coeff for _, coeff in best.values()] + nongrouped
+
+    def never_wins(self, coeff: Dict) -> bool:
+        """Правило не выбирается никогда: подходит только вместе с более сильным правилом группы"""
+        return self._dominated.get(id(coeff)) is coeff
+
+    def prune(self, rules) -> Tuple[Dict, ...]:
+        """Подмножество правил без тех, что никогда не выигрывают в своей группе"""
+        return tuple(coeff for coeff in rules if not self.never_wins(coeff))
+
+    # --- Проверки при загрузке ---
+
+    @staticmethod
+    def _scope(coeff: Dict) -> Tuple:
+        """Где правило выбирается: таблица (K1) или раздел ОУ (K2/K3) и источник"""
+        conditions = coeff.get("conditions") or {}
+        source_ref = coeff.get("source_ref") or {}
+        table = conditions.get("table_no") or source_ref.get("table")
+        if table is not None:
+            return ("table", int(table))
+        section = _TOP_SECTION_RE.match(str(source_ref.get("section") or ""))
+        return ("section", source_ref.get("source"), section.group(0) if section else None)
+
+    def _grouped_factors(self, coeff: Dict) -> frozenset:
+        """Множители из GROUPED_FACTORS, которые могут выбрать правило"""
+        if self.engine is None:
+            return GROUPED_FACTORS
+        scope = self._scope(coeff)
+        table_no = scope[1] if scope[0] == "table" else None
+        return GROUPED_FACTORS & frozenset(self.engine.rule_factors(coeff, table_no))
+
+    @staticmethod
+    def _stages(coeff: Dict) -> frozenset:
+        return APPLY_STAGES.get(coeff.get("apply_to") or "price", frozenset())
+
+    def _add(self, kind: str, codes: Tuple[str, ...], message: str) -> None:
+        self.issues.append(RuleIssue(kind=kind, codes=codes, message=message))
+
+    def _check_ranges(self) -> None:
+        for coeff, constraints in self._parsed:
+            for dimension, constraint in (constraints or {}).items():
+                if constraint[0] == "range" and constraint[1] > constraint[2]:
+                    self._add("impossible", (coeff.get("code"),),
+                              f"{coeff.get('code')}: пустой диапазон {dimension[:-6]} "
+                              f"[{constraint[1]:g}; {constraint[2]:g}] — правило не подходит никогда")
+
+    def _check_dominance(self) -> None:
+        """
+        Правило R группы не выигрывает никогда, если более сильное правило S той же
+        группы выбирается там же и подходит при любых параметрах, при которых подходит R
+        (каждое условие S есть у R, с тем же значением или более узким диапазоном).
+        Проверяются только правила, выбираемые через select (GROUPED_FACTORS);
+        правило без условий не вытесняет другие (match_k3 такие правила пропускает).
+        """
+        parsed = {id(coeff): constraints for coeff, constraints in self._parsed}
+        for group, ranked in self.groups.items():
+            for i, weak in enumerate(ranked):
+                weak_cond = parsed[id(weak)]
+                weak_factors = self._grouped_factors(weak)
+                if weak_cond is None or not weak_factors:
+                    continue
+                for strong in ranked[:i]:
+                    strong_cond = parsed[id(strong)]
+                    if (
+                        strong_cond is not None
+                        and strong.get("conditions")
+                        and weak_factors <= self._grouped_factors(strong)
+                        and self._scope(strong) == self._scope(weak)
+                        and self._stages(weak) <= self._stages(strong)
+                        and all(key in weak_cond and _within(weak_cond[key], c) for key, c in strong_cond.items())
+                    ):
+                        self._dominated[id(weak)] = weak
+                        self._add("dominated", (weak.get("code"), strong.get("code")),
+                                  f"{weak.get('code')} ({weak.get('value')}) никогда не выбирается в группе "
+                                  f"{group}: вместе с ним всегда подходит {strong.get('code')} ({strong.get('value')})")
+                        break
+
+    def _check_conflicts(self) -> None:
+        """
+        Правила без общей группы, которые применяются одновременно к одной величине:
+        одинаковые условия или пересекающиеся диапазоны одного измерения
+        (например, соседние диапазоны площади с общей включенной границей)
+        """
+        candidates = [
+            (coeff, constraints, self._scope(coeff), self._stages(coeff))
+            for coeff, constraints in self._parsed
+            if constraints is not None and constraints and not self.never_wins(coeff)
+        ]
+        for i, (a, a_cond, a_scope, a_stages) in enumerate(candidates):
+            for b, b_cond, b_scope, b_stages in candidates[i + 1:]:
+                if a_scope != b_scope or not a_stages & b_stages:
+                    continue
+                if a.get("exclusive_group") and a.get("exclusive_group") == b.get("exclusive_group"):
+                    continue
+                shared = a_cond.keys() & b_cond.keys()
+                if not all(_compatible(a_cond[key], b_cond[key]) for key in shared):
+                    continue
+                ranges = sorted(key for key in shared if a_cond[key][0] == "range")
+                if a_cond == b_cond:
+                    reason = "одинаковые условия"
+                elif ranges:
+                    reason = f"пересекаются диапазоны {', '.join(key[:-6] for key in ranges)}"
+                else:
+                    continue
+                self._add("conflict", (a.get("code"), b.get("code")),
+                          f"{a.get('code')} и {b.get('code')} применяются вместе ({reason}), "
+                          f"но не входят в одну exclusive_group")
+
+    def log_issues(self) -> None:
+        """Сообщает несогласованности правил документа (один раз при загрузке)"""
+        if not self.issues:
+            return
+        logger.warning(f"Правила коэффициентов {self.doc_code}: несогласованностей — {len(self.issues)}")
+        for issue in self.issues:
+            logger.warning(f"  [{issue.kind}] {issue.message}")
@@ -0,0 +1,166 @@
+"""
+Правила подбора коэффициентов K1/K2/K3 по нормативным документам
+Каждый документ norm_docs (СБЦ ИГДИ-2004, геология, экология, ...) может иметь свой
+движок правил: из каких разделов ОУ берутся K2 и K3 и как отбираются правила.
+Движки регистрируются строкой "модуль:Класс" и импортируются только при первом
+обращении к документу, после чего хранятся в реестре.
+"""
+
+import importlib
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from .database import DatabaseService
+
+# Документ по умолчанию (строки расценок без doc_id)
+DEFAULT_DOC_CODE = "SBC_IGDI_2004"
+
+
+class RuleEngine:
+    """
+    Движок правил документа
+
+    Базовый движок знает только K1 — примечания к таблицам, привязанные к table_no.
+    Разделы ОУ для K2 и K3 задают наследники (см. IgdiRuleEngine).
+    """
+
+    doc_code: str = ""
+    # source_ref.source правил ОУ документа
+    source: Optional[str] = None
+    # Префиксы source_ref.section для K2 и K3
+    k2_sections: Tuple[str, ...] = ()
+    k3_sections: Tuple[str, ...] = ()
+    # inflation_indices.work_type индексов документа (None — только общие "все")
+    work_type: Optional[str] = None
+
+    def __init__(self, doc_code: Optional[str] = None):
+        """
+        Args:
+            doc_code: Код документа norm_docs (по умолчанию — doc_code класса)
+        """
+        if doc_code:
+            self.doc_code = doc_code
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.doc_code!r})"
+
+    def rule_factors(self, coeff: Dict, table_no: Optional[int]) -> Tuple[str, ...]:
+        """
+        Какие из K1/K2/K3 могут выбрать правило для таблицы
+        (те же признаки, что в match_k*, без проверки условий)
+        """
+        conditions = coeff.get("conditions") or {}
+        source_ref = coeff.get("source_ref") or {}
+        apply_to = coeff.get("apply_to")
+        section = str(source_ref.get("section", ""))
+        factors = []
+        coeff_table_no = conditions.get("table_no") or source_ref.get("table")
+        if (
+            coeff_table_no is not None
+            and table_no is not None
+            and int(coeff_table_no) == int(table_no)
+            and apply_to in ("price", "field", "office")
+        ):
+            factors.append("K1")
+        if self.source is not None and source_ref.get("source") == self.source:
+            if apply_to == "office" and self.k2_sections and section.startswith(self.k2_sections):
+                factors.append("K2")
+            if apply_to in ("field", "office", "total") and self.k3_sections and section.startswith(self.k3_sections):
+                factors.append("K3")
+        return tuple(factors)
+
+    def match_k1(self, rules: List[Dict], table_no: Optional[int], params: Dict, stage: str = "field") -> List[Dict]:
+        """Подходящие K1 (до фильтра exclusive_group)"""
+        if table_no is None:
+            return []
+        return DatabaseService.match_k1_rules(rules, table_no, params, stage)
+
+    def match_k2(self, rules: List[Dict], params: Dict, groups=None) -> List[Dict]:
+        """Подходящие K2 (после фильтра exclusive_group; groups — RuleGroups документа)"""
+        if not self.k2_sections:
+            return []
+        return DatabaseService.match_k2_rules(
+            rules, params, source=self.source, sections=self.k2_sections, groups=groups
+        )
+
+    def match_k3(self, rules: List[Dict], params: Dict) -> List[Dict]:
+        """Подходящие K3"""
+        if not self.k3_sections:
+            return []
+        return DatabaseService.match_k3_rules(rules, params, source=self.source, sections=self.k3_sections)
+
+
+class IgdiRuleEngine(RuleEngine):
+    """СБЦ на инженерно-геодезические изыскания (2004): K2 — п.15 ОУ, K3 — п.8 и п.14 ОУ"""
+
+    doc_code = "SBC_IGDI_2004"
+    source = "rtf_2004"
+    k2_sections = ("п.15",)
+    k3_sections = ("п.8", "п.14")
+    work_type = "ИГДИ"
+
+
+EngineSpec = Union[str, Callable[[str], RuleEngine]]
+
+
+class RuleEngineRegistry:
+    """
+    Реестр движков правил по коду документа
+
+    Спецификация движка — строка "модуль:Класс" (модуль относительно services
+    начинается с точки) или фабрика doc_code → RuleEngine. Модуль импортируется
+    при первом get() для документа; документы без своего движка получают
+    базовый RuleEngine (только K1).
+    """
+
+    ENGINES: Dict[str, EngineSpec] = {
+        "SBC_IGDI_2004": ".rules:IgdiRuleEngine",
+    }
+
+    def __init__(self, engines: Optional[Dict[str, EngineSpec]] = None):
+        """
+        Args:
+            engines: Дополнительные движки {код документа: спецификация}
+        """
+        self._specs: Dict[str, EngineSpec] = {**self.ENGINES, **(engines or {})}
+        self._engines: Dict[str, RuleEngine] = {}
+
+    def register(self, doc_code: str, spec: EngineSpec) -> None:
+        """Регистрирует движок документа (загруженный ранее движок заменяется)"""
+        self._specs[doc_code] = spec
+        self._engines.pop(doc_code, None)
+
+    @property
+    def loaded(self) -> Tuple[str, ...]:
+        """Коды документов, движки которых уже созданы"""
+        return tuple(self._engines)
+
+    def get(self, doc_code: Optional[str] = None) -> RuleEngine:
+        """
+        Движок документа (создается при первом обращении)
+
+        Args:
+            doc_code: Код документа norm_docs (None — документ по умолчанию)
+        """
+        doc_code = doc_code or DEFAULT_DOC_CODE
+        engine = self._engines.get(doc_code)
+        if engine is not None:
+            return engine
+        spec = self._specs.get(doc_code)
+        if spec is None:
+            logger.warning(f"Для документа {doc_code} нет движка правил, применяются только K1 примечаний к таблицам")
+            engine = RuleEngine(doc_code)
+        else:
+            engine = self._load(spec)(doc_code)
+            logger.info(f"Загружен движок правил {engine!r}")
+        self._engines[doc_code] = engine
+        return engine
+
+    @staticmethod
+    def _load(spec: EngineSpec) -> Callable[[str], RuleEngine]:
+        if not isinstance(spec, str):
+            return spec
+        module_name, _, attr = spec.partition(":")
+        module = importlib.import_module(module_name, package=__package__)
+        return getattr(module, attr)
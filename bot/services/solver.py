@@ -0,0 +1,201 @@
+"""
+Обратный расчет: максимальный объем работ под заданный бюджет
+Правила разрешаются один раз (CostSweep.prepare), дальше стоимость считается
+SweepModel.evaluate без calculate_full. Стоимость кусочно-линейна по объему:
+полосы табл.4 и орг./ликв. (по стоимости полевых) и табл.78-80 (по базовой
+стоимости). Полоса ищется бинарным поиском по границам, объем внутри полосы —
+в замкнутой форме, затем уточняется с учетом округления до копеек.
+"""
+
+import bisect
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from .sweep import CostSweep, SweepModel
+
+
+@dataclass
+class BudgetSolution:
+    """Результат обратного расчета"""
+    budget: float
+    quantity: float
+    total_cost: float
+    feasible: bool
+    # Границы полосы (объем), в которой найден ответ
+    band: tuple = (0.0, 0.0)
+    # Сколько объемов посчитано через SweepModel.evaluate
+    evaluations: int = 0
+    elapsed_ms: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "budget": self.budget,
+            "quantity": self.quantity,
+            "total_cost": self.total_cost,
+            "feasible": self.feasible,
+            "band": list(self.band),
+            "evaluations": self.evaluations,
+            "elapsed_ms": round(self.elapsed_ms, 3),
+        }
+
+
+class BudgetSolver:
+    """Поиск максимального объема, стоимость которого не превышает бюджет"""
+
+    # Сдвиг внутрь полосы, руб. (границы полос включаются в нижнюю полосу)
+    NUDGE_RUB = 0.02
+    # Сколько шагов объема проверяется вниз от оценки в замкнутой форме
+    REFINE_STEPS = 16
+
+    def __init__(self, calculator):
+        """
+        Args:
+            calculator: CostCalculator (источник правил и сервиса БД)
+        """
+        self.calculator = calculator
+        self.evaluations = 0
+
+    async def solve(
+        self,
+        work: Dict,
+        budget: float,
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        step: float = 0.01
+    ) -> BudgetSolution:
+        """
+        Максимальный объем работ для бюджета
+
+        Args:
+            work: Строка расценки
+            budget: Бюджет (итоговая стоимость), руб.
+            params: Параметры расчета (как для calculate_full, включая регион и расстояние до базы)
+            work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            step: Точность объема (ответ кратен шагу)
+
+        Returns:
+            BudgetSolution; feasible=False, если бюджета не хватает даже на минимальный объем
+        """
+        started = time.perf_counter()
+        self.evaluations = 0
+        params = dict(params or {})
+        region = params.get("region_name")
+        distance = self.calculator.db._to_float(params.get("distance_to_base_km") or params.get("distance_to_base"))
+        model = await CostSweep(self.calculator).prepare(
+            {"work": work}, [region], [distance], params, work_stage
+        )
+        solution = self._solve_model(model, float(budget), step)
+        solution.elapsed_ms = (time.perf_counter() - started) * 1000.0
+        logger.info(
+            f"solve: бюджет {budget} → объем {solution.quantity} "
+            f"({solution.evaluations} оценок, {solution.elapsed_ms:.1f} мс)"
+        )
+        return solution
+
+    def _cost(self, model: SweepModel, quantities) -> np.ndarray:
+        """Итоговая стоимость для массива объемов"""
+        q = np.asarray(quantities, dtype=float)
+        self.evaluations += len(q)
+        return model.evaluate(q)[3][:, 0, 0, 0]
+
+    def _solve_model(self, model: SweepModel, budget: float, step: float) -> BudgetSolution:
+        unit_field = float(model.price_field[0] * model.k_field[0, 0])
+        unit_base = unit_field + float(model.price_office[0] * model.k_office[0, 0])
+        k_total = float(model.k_total[0, 0])
+        if unit_base <= 0 or k_total <= 0 or budget <= 0:
+            return BudgetSolution(budget, 0.0, 0.0, False)
+
+        # Надбавки неотрицательны, значит при q_hi стоимость уже не меньше бюджета
+        q_hi = budget / (unit_base * k_total) * (1 + 1e-6) + step
+        edges = self._band_edges(model, unit_field, unit_base, q_hi)
+
+        # Стоимость в начале и конце каждой полосы — одним векторным вызовом.
+        # Точки сдвинуты внутрь на 2 копейки стоимости полевых: после округления
+        # они не попадают на порог (на самом пороге могут действовать обе полосы)
+        nudge = self.NUDGE_RUB / (unit_field if unit_field > 0 else unit_base)
+        starts = np.minimum(edges[:-1] + nudge, edges[1:])
+        ends = np.maximum(edges[1:] - nudge, starts)
+        costs = self._cost(model, np.concatenate([starts, ends]))
+        start_costs, end_costs = costs[:len(starts)], costs[len(starts):]
+
+        # Последняя полоса, которая начинается не дороже бюджета. На границах полос
+        # стоимость может немного упасть (ставки убывают с ростом стоимости), поэтому
+        # ищем по минимуму суффикса — он не убывает и допускает бинарный поиск
+        suffix_min = np.minimum.accumulate(start_costs[::-1])[::-1]
+        band = bisect.bisect_right(suffix_min.tolist(), budget) - 1
+        if band < 0:
+            return BudgetSolution(budget, 0.0, 0.0, False, evaluations=self.evaluations)
+
+        lo, hi = float(starts[band]), float(ends[band])
+        cost_lo, cost_hi = float(start_costs[band]), float(end_costs[band])
+        if cost_hi <= budget or hi <= lo:
+            estimate = hi
+        else:
+            # Внутри полосы стоимость линейна по объему
+            estimate = lo + (budget - cost_lo) * (hi - lo) / (cost_hi - cost_lo)
+
+        quantity, total = self._refine(model, budget, estimate, lo, float(edges[band + 1]), step)
+        if quantity is None:
+            return BudgetSolution(budget, 0.0, 0.0, False, (float(edges[band]), hi), self.evaluations)
+        return BudgetSolution(
+            budget=budget,
+            quantity=quantity,
+            total_cost=total,
+            feasible=True,
+            band=(float(edges[band]), hi),
+            evaluations=self.evaluations,
+        )
+
+    @staticmethod
+    def _band_edges(model: SweepModel, unit_field: float, unit_base: float, q_hi: float) -> np.ndarray:
+        """Границы полос по объему: 0, пороги стоимости полевых и базовой стоимости, q_hi"""
+        bounds: List[np.ndarray] = [np.array([0.0, q_hi])]
+        if unit_field > 0:
+            bounds.append(model.field_thresholds() / unit_field)
+        bounds.append(model.base_thresholds() / unit_base)
+        edges = np.unique(np.concatenate(bounds))
+        return edges[(edges >= 0) & (edges <= q_hi)]
+
+    def _refine(self, model: SweepModel, budget: float, estimate: float, lo: float, hi: float, step: float) -> tuple:
+        """
+        Объем, кратный шагу, рядом с оценкой: наибольший в полосе со стоимостью не выше бюджета
+        Внутри полосы стоимость не убывает, поэтому оценка уточняется бинарным поиском.
+
+        Returns:
+            (объем, стоимость) или (None, None)
+        """
+        decimals = max(0, -int(math.floor(math.log10(step)))) if step < 1 else 0
+        first = max(1, math.ceil(lo / step - 1e-9))
+        last = max(first, math.floor(hi / step + 1e-9) + 1)
+        top = min(max(math.floor(estimate / step + 1e-9) + 1, first), last)
+        window = np.arange(top, max(first, top - self.REFINE_STEPS) - 1, -1)
+        candidates = np.round(window * step, decimals)
+        costs = self._cost(model, candidates)
+        fits = np.nonzero(costs <= budget)[0]
+        if len(fits) and fits[0] > 0:
+            i = fits[0]
+            return float(candidates[i]), float(costs[i])
+
+        # Оценка не попала в окно (округления, скачок на границе) — бинарный поиск
+        if len(fits):
+            # верх окна укладывается в бюджет — ищем выше, до конца полосы
+            low, high = top, last
+            best = (float(candidates[0]), float(costs[0]))
+        else:
+            low, high = first, int(window[-1]) - 1
+            best = None
+        while low <= high:
+            mid = (low + high) // 2
+            q = round(mid * step, decimals)
+            cost = float(self._cost(model, [q])[0])
+            if cost <= budget:
+                best = (q, cost)
+                low = mid + 1
+            else:
+                high = mid - 1
+        return best if best is not None else (None, None)
@@ -0,0 +1,501 @@
+"""
+Движок «что если» для перебора параметров расчета
+Правила коэффициентов и надбавок разрешаются один раз на (категория × регион),
+после чего вся сетка объем × категория × регион × расстояние до базы
+считается векторно через NumPy (broadcasting), без повторных calculate_full.
+Строки этапов и итог считаются в целых копейках с точными дробями цен и
+коэффициентов (как services/money.py), поэтому совпадают с calculate_full
+до копейки; надбавки — в float с округлением каждой, как в DatabaseService.
+"""
+
+import csv
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from . import money
+from .piecewise import PIECEWISE_FAMILIES, PiecewiseSchedule, round_amounts
+
+
+# Порядок дополнительных надбавок такой же, как в DatabaseService._conditional_addons
+CONDITIONAL_FAMILIES = (
+    "SEASONAL_ADDON_",
+    "REGIONAL_ADDON_",
+    "MOUNTAIN_ADDON_",
+    "SPECIAL_REGIME_ADDON",
+    "INTERMEDIATE_MATERIALS_ADDON",
+)
+
+
+def _reduced(value: money.Ratio) -> money.Ratio:
+    divisor = math.gcd(*value)
+    return value[0] // divisor, value[1] // divisor
+
+
+def _ratio_arrays(ratios) -> Tuple[np.ndarray, np.ndarray]:
+    """Массив дробей → (числители, знаменатели) из целых Python (dtype=object, без переполнения)"""
+    if not isinstance(ratios, np.ndarray):
+        # np.asarray развернул бы кортежи во второе измерение
+        items, ratios = list(ratios), np.empty(len(ratios), dtype=object)
+        ratios[:] = items
+    num = np.empty(ratios.shape, dtype=object)
+    den = np.empty(ratios.shape, dtype=object)
+    for index in np.ndindex(ratios.shape):
+        num[index], den[index] = _reduced(ratios[index])
+    return num, den
+
+
+def _round_div(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """Поэлементное money.round_div для неотрицательных сумм → копейки (int64)"""
+    return ((num * 2 + den) // (den * 2)).astype(np.int64)
+
+
+def _scale_kopecks(kopecks: np.ndarray, factor: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Копейки × дробь с одним округлением (поэлементное money.scale)"""
+    return _round_div(kopecks.astype(object) * factor[0], factor[1])
+
+
+def _round_addon(values: np.ndarray) -> np.ndarray:
+    """Округление суммы надбавки как round(amount, 2) в DatabaseService"""
+    return round_amounts(values)
+
+
+def _bound(value, default: float) -> float:
+    return default if value is None else float(value)
+
+
+def _finite_positive(values) -> np.ndarray:
+    """Уникальные конечные положительные значения по возрастанию"""
+    arr = np.asarray(values, dtype=float)
+    return np.unique(arr[np.isfinite(arr) & (arr > 0)])
+
+
+@dataclass
+class SweepResult:
+    """Результат перебора: массивы формы (объем, категория, регион, расстояние)"""
+    quantities: List[float]
+    categories: List[str]
+    regions: List[Optional[str]]
+    distances: List[Optional[float]]
+    field_cost: np.ndarray
+    office_cost: np.ndarray
+    addons_cost: np.ndarray
+    total_cost: np.ndarray
+    missing_categories: List[str] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+    # Индекс изменения стоимости (PriceIndex.to_dict) и итоги в текущих ценах
+    price_index: Optional[Dict] = None
+    total_with_index: Optional[np.ndarray] = None
+
+    COLUMNS = (
+        "quantity",
+        "category",
+        "region",
+        "distance_to_base",
+        "field_cost",
+        "office_cost",
+        "addons_cost",
+        "total_cost",
+    )
+
+    @property
+    def shape(self) -> tuple:
+        return self.total_cost.shape
+
+    @property
+    def columns(self) -> tuple:
+        return self.COLUMNS + (("total_with_index",) if self.total_with_index is not None else ())
+
+    def rows(self) -> List[Dict]:
+        """Плоская таблица: одна строка на вариант"""
+        rows = []
+        for iq, ic, ir, idist in np.ndindex(self.shape):
+            rows.append({
+                "quantity": self.quantities[iq],
+                "category": self.categories[ic],
+                "region": self.regions[ir],
+                "distance_to_base": self.distances[idist],
+                "field_cost": float(self.field_cost[iq, ic, ir, idist]),
+                "office_cost": float(self.office_cost[iq, ic, ir, idist]),
+                "addons_cost": float(self.addons_cost[iq, ic, ir, idist]),
+                "total_cost": float(self.total_cost[iq, ic, ir, idist]),
+            })
+            if self.total_with_index is not None:
+                rows[-1]["total_with_index"] = float(self.total_with_index[iq, ic, ir, idist])
+        return rows
+
+    def to_csv(self, path: str, delimiter: str = ";") -> None:
+        """Выгрузка таблицы вариантов в CSV (по умолчанию с «;» для Excel)"""
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns, delimiter=delimiter)
+            writer.writeheader()
+            for row in self.rows():
+                writer.writerow({k: ("" if v is None else v) for k, v in row.items()})
+
+
+@dataclass
+class AddonTables:
+    """Правила надбавок, развернутые в массивы (не зависят от объема работ)"""
+    # Внутренний транспорт (табл.4): границы расстояния и стоимости полевых (тыс. руб.) и ставки
+    internal: Optional[Dict[str, np.ndarray]] = None
+    # Внешний транспорт (табл.5): одна ставка на весь перебор
+    external_rate: float = 0.0
+    # Организация и ликвидация (п.13): ставка × коэффициент длительности (табл.6)
+    org_liq_rate: Optional[float] = None
+    # Дополнительные надбавки: семейство → ставки по регионам
+    conditional: Dict[str, np.ndarray] = field(default_factory=dict)
+    # Формульные надбавки (табл.78-80): шкалы запрошенных семейств
+    piecewise: List[PiecewiseSchedule] = field(default_factory=list)
+
+
+@dataclass
+class SweepModel:
+    """
+    Разрешенные правила перебора: цены, коэффициенты и надбавки
+    Стоимость для любых объемов считается evaluate без обращений к БД.
+    """
+    categories: List[str]
+    regions: List[Optional[str]]
+    distances: List[Optional[float]]
+    dist: np.ndarray
+    price_field: np.ndarray
+    price_office: np.ndarray
+    k_field: np.ndarray
+    k_office: np.ndarray
+    k_total: np.ndarray
+    far_north: np.ndarray
+    addons: AddonTables
+    org_liq_bands: tuple = ()
+    missing_categories: List[str] = field(default_factory=list)
+    # Точные дроби (числители, знаменатели) для расчета в копейках, форма (категория, регион):
+    # цена × K1 × K2 × K3 этапа и итоговые коэффициенты (k_* — их float для оценок)
+    field_rate: Tuple[np.ndarray, np.ndarray] = ()
+    office_rate: Tuple[np.ndarray, np.ndarray] = ()
+    total_rate: Tuple[np.ndarray, np.ndarray] = ()
+
+    def evaluate(self, quantities) -> tuple:
+        """
+        Стоимость всех вариантов для заданных объемов
+
+        Returns:
+            (полевые, камеральные, надбавки, итого) — массивы формы (объем, категория, регион, расстояние)
+        """
+        q = np.asarray(quantities, dtype=float)
+        q_num, q_den = _ratio_arrays([money.ratio(float(x)) for x in q])
+        q_num, q_den = q_num[:, None, None], q_den[:, None, None]
+        # цена × объем × K в копейках, одно округление (money.line_cost)
+        field_kop = _round_div(q_num * self.field_rate[0][None] * money.KOPECKS_IN_RUBLE, q_den * self.field_rate[1][None])
+        office_kop = _round_div(q_num * self.office_rate[0][None] * money.KOPECKS_IN_RUBLE, q_den * self.office_rate[1][None])
+        field_cost = field_kop / money.KOPECKS_IN_RUBLE
+        office_cost = office_kop / money.KOPECKS_IN_RUBLE
+        addons = self._addons(field_cost, office_cost)
+
+        shape = (len(q), len(self.categories), len(self.far_north), len(self.dist))
+        field4 = np.broadcast_to(field_cost[..., None], shape)
+        office4 = np.broadcast_to(office_cost[..., None], shape)
+        # надбавки уже округлены до копейки каждая — в копейки без потерь
+        subtotal = field_kop[..., None] + office_kop[..., None] + np.rint(addons * money.KOPECKS_IN_RUBLE).astype(np.int64)
+        total_rate = tuple(part[None, :, :, None] for part in self.total_rate)
+        total = _scale_kopecks(subtotal, total_rate) / money.KOPECKS_IN_RUBLE
+        return field4, office4, addons, total
+
+    def field_thresholds(self) -> np.ndarray:
+        """Границы полос по стоимости полевых работ, руб. (табл.4 и орг./ликв.)"""
+        bounds = []
+        if self.addons.internal is not None:
+            for key in ("c_min", "c_max"):
+                bounds.extend(self.addons.internal[key] * 1000.0)
+        if self.addons.org_liq_rate is not None and not self.far_north.all():
+            bounds.extend(float(cost_max) for cost_max, _ in self.org_liq_bands)
+        return _finite_positive(bounds)
+
+    def base_thresholds(self) -> np.ndarray:
+        """Границы полос по базовой стоимости (полевые + камеральные), руб. (табл.78-80)"""
+        bounds = []
+        for schedule in self.addons.piecewise:
+            bounds.extend(schedule.breakpoints * 1000.0)
+        return _finite_positive(bounds)
+
+    def _addons(self, field_cost: np.ndarray, office_cost: np.ndarray) -> np.ndarray:
+        """Надбавки в том же порядке, что DatabaseService.get_addons_by_conditions"""
+        tables = self.addons
+        dist = self.dist
+        f = field_cost[..., None]
+        o = office_cost[..., None]
+        shape = field_cost.shape + dist.shape
+        total = np.zeros(shape)
+
+        # Внутренний транспорт (табл.4): первая подходящая строка по расстоянию и стоимости
+        internal = np.zeros(shape)
+        if tables.internal is not None:
+            t = tables.internal
+            ft = (field_cost / 1000.0)[None, ..., None]
+            by_cost = (ft >= t["c_min"][:, None, None, None, None]) & (ft <= t["c_max"][:, None, None, None, None])
+            by_dist = (dist[None, :] >= t["d_min"][:, None]) & (dist[None, :] <= t["d_max"][:, None])
+            matches = by_cost & by_dist[:, None, None, None, :]
+            first = matches.argmax(axis=0)
+            rate = np.where(matches.any(axis=0), t["rates"][first], 0.0)
+            internal = _round_addon(f * rate)
+        total += internal
+        base_field_plus_internal = f + internal
+
+        # Внешний транспорт (табл.5) — не зависит от сетки, ставка одна
+        if tables.external_rate:
+            total += _round_addon(base_field_plus_internal * tables.external_rate)
+
+        # Организация и ликвидация (п.13): коэффициент по стоимости полевых — векторно
+        if tables.org_liq_rate is not None:
+            cost_coeff = np.ones(field_cost.shape)
+            for cost_max, coeff in reversed(self.org_liq_bands):
+                cost_coeff = np.where(field_cost <= cost_max, coeff, cost_coeff)
+            cost_coeff = np.where(self.far_north[None, None, :], self.org_liq_bands[0][1], cost_coeff)
+            rate = tables.org_liq_rate * cost_coeff
+            amount = _round_addon(base_field_plus_internal * rate[..., None])
+            total += np.where(f > 0, amount, 0.0)
+
+        # Дополнительные надбавки: ставки зависят только от региона
+        for family in CONDITIONAL_FAMILIES:
+            rates = tables.conditional.get(family)
+            if rates is None or not rates.any():
+                continue
+            rate = rates[None, None, :, None]
+            if family == "REGIONAL_ADDON_":
+                base = f + o + total
+            elif family == "INTERMEDIATE_MATERIALS_ADDON":
+                base = f + o
+            else:
+                base = f
+            total = total + _round_addon(base * rate)
+
+        # Формульные надбавки (табл.78-80) от базовой стоимости в тыс. руб.
+        base_thousand = (f + o) / 1000.0
+        for schedule in tables.piecewise:
+            total = schedule.total(base_thousand, start=total)
+
+        return np.broadcast_to(total, shape).copy()
+
+
+class CostSweep:
+    """
+    Перебор вариантов расчета по сетке параметров
+
+    Коэффициенты K1/K2/K3 не зависят от объема и расстояния до базы, поэтому
+    разрешаются один раз на (категория × регион). Надбавки разворачиваются в массивы
+    порогов и ставок и применяются к полевой/камеральной стоимости всей сетки разом.
+    """
+
+    def __init__(self, calculator):
+        """
+        Args:
+            calculator: CostCalculator (источник правил и сервиса БД)
+        """
+        self.calculator = calculator
+        self.db = calculator.db
+
+    async def run(
+        self,
+        works: Dict[str, Dict],
+        quantities: Sequence[float],
+        regions: Sequence[Optional[str]] = (None,),
+        distances: Sequence[Optional[float]] = (None,),
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        overrides: Optional[Dict[str, Dict]] = None,
+        index_period=None,
+        index_work_type: Optional[str] = None
+    ) -> SweepResult:
+        """
+        Считает все варианты объем × категория × регион × расстояние до базы
+
+        Args:
+            works: Строки расценок по категориям {"II": work, "III": work, ...}
+                (см. DatabaseService.get_work_variants)
+            quantities: Объемы работ
+            regions: Названия регионов (region_name); None — без региональных условий
+            distances: Расстояния от базы до участка, км; None — без внутреннего транспорта
+            params: Общие параметры расчета (как для calculate_full)
+            work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            overrides: Параметры отдельных вариантов {категория: {параметр: значение}}
+            index_period: Период индекса изменения стоимости ("2025Q3", "latest");
+                один индекс на всю сетку — по документу первой строки расценки
+            index_work_type: Тип работ индекса (None — по документу строки)
+
+        Returns:
+            SweepResult с массивами стоимостей
+        """
+        started = time.perf_counter()
+        model = await self.prepare(works, regions, distances, params, work_stage, overrides)
+        q = np.asarray([float(x) for x in quantities], dtype=float)
+        field4, office4, addons, total = model.evaluate(q)
+
+        price_index = None
+        total_with_index = None
+        if index_period is not None:
+            work = next(iter(works.values()), None)
+            index = await self.calculator.get_price_index(index_period, work=work, work_type=index_work_type)
+            if index is None:
+                logger.warning(f"sweep: нет индекса изменения стоимости на период {index_period}")
+            else:
+                price_index = index.to_dict()
+                factor = _ratio_arrays([money.ratio(index.value)])
+                kopecks = np.rint(total * money.KOPECKS_IN_RUBLE).astype(np.int64)
+                total_with_index = _scale_kopecks(kopecks, factor) / money.KOPECKS_IN_RUBLE
+
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        logger.info(f"sweep: {total.size} вариантов за {elapsed_ms:.1f} мс")
+        return SweepResult(
+            quantities=[float(x) for x in q],
+            categories=model.categories,
+            regions=model.regions,
+            distances=model.distances,
+            field_cost=np.array(field4),
+            office_cost=np.array(office4),
+            addons_cost=addons,
+            total_cost=total,
+            missing_categories=model.missing_categories,
+            elapsed_ms=elapsed_ms,
+            price_index=price_index,
+            total_with_index=total_with_index,
+        )
+
+    async def prepare(
+        self,
+        works: Dict[str, Dict],
+        regions: Sequence[Optional[str]] = (None,),
+        distances: Sequence[Optional[float]] = (None,),
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        overrides: Optional[Dict[str, Dict]] = None
+    ) -> SweepModel:
+        """
+        Разрешает правила перебора (регионы, цены, K1/K2/K3, надбавки) — все запросы к БД здесь
+
+        Args:
+            works: Строки расценок по категориям
+            regions: Названия регионов; None — без региональных условий
+            distances: Расстояния от базы до участка, км; None — без внутреннего транспорта
+            params: Общие параметры расчета
+            work_stage: Этап работ ('полевые', 'камеральные', 'обе')
+            overrides: Параметры отдельных вариантов {категория: {параметр: значение}},
+                например тип территории для одной и той же строки расценки
+        """
+        params = self.calculator._normalize_params(dict(params or {}))
+        for key in ("region_name", "region_code", "distance_to_base", "distance_to_base_km"):
+            params.pop(key, None)
+
+        categories = [c for c, w in works.items() if w]
+        missing = [c for c, w in works.items() if not w]
+        dist = np.asarray([np.nan if d is None else float(d) for d in distances], dtype=float)
+        do_field = work_stage in ('полевые', 'обе')
+        do_office = work_stage in ('камеральные', 'обе')
+
+        # 1. Параметры регионов (обогащение из приложений) — один раз на регион
+        region_params = []
+        for region in regions:
+            rp = dict(params)
+            if region:
+                rp["region_name"] = region
+            region_params.append(await self.db.enrich_params_with_region(rp))
+        far_north = np.asarray([rp.get("region_type") == "far_north" for rp in region_params])
+
+        # 2. Цены и коэффициенты — один раз на (категория × регион)
+        n_cat, n_reg = len(categories), len(region_params)
+        price_field = np.zeros(n_cat)
+        price_office = np.zeros(n_cat)
+        k_field = np.ones((n_cat, n_reg))
+        k_office = np.ones((n_cat, n_reg))
+        k_total = np.ones((n_cat, n_reg))
+        field_rate = np.empty((n_cat, n_reg), dtype=object)
+        office_rate = np.empty((n_cat, n_reg), dtype=object)
+        total_rate = np.empty((n_cat, n_reg), dtype=object)
+        for ic, category in enumerate(categories):
+            work = works[category]
+            table_no = work.get("table_no")
+            prices = {
+                "field": money.ratio(work.get("price_field") or 0) if do_field else (0, 1),
+                "office": money.ratio(work.get("price_office") or 0) if do_office else (0, 1),
+            }
+            price_field[ic] = money.to_float(prices["field"])
+            price_office[ic] = money.to_float(prices["office"])
+            plan = await self.calculator.plans.get(work) if self.calculator.plans is not None else None
+            doc_code = None if plan is not None else (await self.db.get_rule_engine(work.get("doc_id"))).doc_code
+            for ir, rp in enumerate(region_params):
+                merged = self.calculator._merge_work_params(work, rp)
+                merged.update((overrides or {}).get(category) or {})
+                total_coeffs = []
+                field_rate[ic, ir] = office_rate[ic, ir] = (0, 1)
+                for stage, enabled, target, rate in (
+                    ("field", do_field, k_field, field_rate),
+                    ("office", do_office, k_office, office_rate),
+                ):
+                    if not enabled:
+                        continue
+                    coeffs, stage_total, _ = await self.calculator._get_coefficients_from_db(
+                        merged, table_no, stage, plan=plan, doc_code=doc_code
+                    )
+                    factor = money.product(c["value"] for c in coeffs.values())
+                    target[ic, ir] = money.to_float(factor)
+                    rate[ic, ir] = money.mul(prices[stage], factor)
+                    total_coeffs = stage_total or total_coeffs
+                total_rate[ic, ir] = money.product(c["value"] for c in total_coeffs)
+                k_total[ic, ir] = money.to_float(total_rate[ic, ir])
+
+        # 3. Надбавки — в массивы порогов и ставок
+        return SweepModel(
+            categories=categories,
+            regions=list(regions),
+            distances=list(distances),
+            dist=dist,
+            price_field=price_field,
+            price_office=price_office,
+            k_field=k_field,
+            k_office=k_office,
+            k_total=k_total,
+            far_north=far_north,
+            addons=await self._addon_tables(params, region_params, dist),
+            org_liq_bands=tuple(self.db.ORG_LIQ_COST_BANDS),
+            missing_categories=missing,
+            field_rate=_ratio_arrays(field_rate),
+            office_rate=_ratio_arrays(office_rate),
+            total_rate=_ratio_arrays(total_rate),
+        )
+
+    async def _addon_tables(self, params: Dict, region_params: List[Dict], dist: np.ndarray) -> AddonTables:
+        """Строки надбавок, нужные перебору, в виде массивов (см. SweepModel._addons)"""
+        tables = AddonTables()
+
+        rows = await self.db._addon_rows("INTERNAL_T4_") if not np.isnan(dist).all() else []
+        if rows:
+            cond = [r.get("conditions", {}) for r in rows]
+            tables.internal = {
+                "d_min": np.array([_bound(c.get("distance_from_base_km_min"), -np.inf) for c in cond]),
+                "d_max": np.array([_bound(c.get("distance_from_base_km_max"), np.inf) for c in cond]),
+                "c_min": np.array([_bound(c.get("field_cost_thousand_min"), -np.inf) for c in cond]),
+                "c_max": np.array([_bound(c.get("field_cost_thousand_max"), np.inf) for c in cond]),
+                "rates": np.array([float(r["value"]) for r in rows]),
+            }
+
+        external = await self.db._external_transport_addons(params, 1.0)
+        if external:
+            tables.external_rate = float(external[0]["rate"])
+
+        org_liq = await self.db._addon_row("ORG_LIQ_6PCT")
+        if org_liq:
+            tables.org_liq_rate = float(org_liq["value"]) * await self.db._org_liq_duration_coeff(params)
+
+        if params.get("apply_conditions_as_addons"):
+            rates = {family: np.zeros(len(region_params)) for family in CONDITIONAL_FAMILIES}
+            for ir, rp in enumerate(region_params):
+                for entry in await self.db._conditional_addons(rp, 1.0, 1.0, []):
+                    family = next(fam for fam in CONDITIONAL_FAMILIES if entry["code"].startswith(fam))
+                    rates[family][ir] = entry["rate"]
+            tables.conditional = rates
+
+        if any(params.get(flag) for flag, _ in PIECEWISE_FAMILIES):
+            schedules = await self.db.get_piecewise_schedules()
+            tables.piecewise = [schedules[prefix] for flag, prefix in PIECEWISE_FAMILIES if params.get(flag)]
+        return tables
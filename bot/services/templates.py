@@ -0,0 +1,294 @@
+"""
+Шаблоны смет (estimate_templates / template_sections)
+Типовая смета («топосъемка 1:500 + подземные коммуникации + отчет») хранится
+шаблоном: строки ссылаются на norm_items, объем и параметры строк могут содержать
+плейсхолдеры {area}, {scale}, {category:III}. Шаблон и значения плейсхолдеров
+распознаются в запросе без LLM, строки разворачиваются и считаются одним пакетом
+(CostCalculator.calculate_batch).
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from .variants import ROW_PARAMS
+
+# Плейсхолдер: {имя} или {имя:значение по умолчанию}
+PLACEHOLDER_RE = re.compile(r"\{(\w+)(?::([^{}]*))?\}")
+
+# Значения плейсхолдеров в тексте запроса: (шаблон, преобразование)
+VALUE_PATTERNS = {
+    "area": (r"(\d+(?:[.,]\d+)?)\s*га\b", float),
+    "length": (r"(\d+(?:[.,]\d+)?)\s*км\b", float),
+    "scale": (r"\b1\s*:\s*(\d{3,5})\b", lambda v: f"1:{v}"),
+    "height_section": (r"сечени\w*(?:\s+рельефа)?\s*(\d+(?:[.,]\d+)?)\s*м\b", float),
+    "category": (r"\b(IV|III|II|I)\s*кат", str),
+}
+
+# Тип территории: подстрока → значение (незастроенная проверяется раньше застроенной)
+TERRITORY_WORDS = (
+    ("незастроен", "незастроенная"),
+    ("застроен", "застроенная"),
+    ("промпредприят", "промпредприятие"),
+)
+
+# Параметры запроса, общие для всех строк сметы
+SHARED_PARAMS = ("region_name", "territory_type")
+
+# Подписи плейсхолдеров для вопроса пользователю
+PLACEHOLDER_LABELS = {
+    "area": "площадь, га",
+    "length": "протяженность, км",
+    "scale": "масштаб (1:500)",
+    "height_section": "высота сечения рельефа, м",
+    "category": "категория сложности (I–IV)",
+}
+
+
+def _stem(word: str) -> str:
+    """Грубая основа слова для сопоставления падежных форм"""
+    word = word.lower()
+    return word[:max(4, len(word) - 2)] if len(word) > 4 else word
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[\wё]+", text.lower())
+
+
+def _contains_stems(text_words: List[str], phrase: str) -> bool:
+    """Все слова фразы (по основам) встречаются в тексте"""
+    stems = [_stem(w) for w in _words(phrase) if len(w) >= 3]
+    return bool(stems) and all(any(w.startswith(s) for w in text_words) for s in stems)
+
+
+@dataclass
+class EstimateTemplate:
+    """Шаблон сметы со строками template_sections"""
+    id: str
+    name: str
+    sections: List[Dict]
+    description: Optional[str] = None
+    work_type: Optional[str] = None
+    doc_id: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "EstimateTemplate":
+        return cls(
+            id=row["id"],
+            name=row.get("name") or "",
+            sections=list(row.get("sections") or []),
+            description=row.get("description"),
+            work_type=row.get("work_type"),
+            doc_id=row.get("doc_id"),
+        )
+
+    @property
+    def placeholders(self) -> Dict[str, Optional[str]]:
+        """Плейсхолдеры строк {имя: значение по умолчанию} в порядке появления"""
+        found: Dict[str, Optional[str]] = {}
+        for row in self.sections:
+            texts = [row.get("title") or ""]
+            texts += [v for v in (row.get("default_params") or {}).values() if isinstance(v, str)]
+            for text in texts:
+                for name, default in PLACEHOLDER_RE.findall(text):
+                    if found.get(name) is None:
+                        found[name] = default or None
+        return found
+
+
+@dataclass
+class EstimateLine:
+    """Строка развернутого шаблона"""
+    section_no: int
+    section_name: str
+    title: str
+    unit: str
+    work: Dict
+    quantity: float
+    params: Dict = field(default_factory=dict)
+
+
+@dataclass
+class TemplateEstimate:
+    """Смета по шаблону: строки, итог пакетного расчета, недостающие значения"""
+    template: EstimateTemplate
+    values: Dict[str, Any]
+    lines: List[EstimateLine] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+    result: Optional[Dict] = None
+
+    @property
+    def priced(self) -> bool:
+        return self.result is not None
+
+
+def _substitute(value: Any, values: Dict[str, Any]) -> Any:
+    """
+    Подставляет значения плейсхолдеров: значение целиком из одного плейсхолдера
+    сохраняет тип (число остается числом), встроенные — подставляются строкой
+    """
+    if not isinstance(value, str):
+        return value
+    whole = PLACEHOLDER_RE.fullmatch(value.strip())
+    if whole:
+        name, default = whole.groups()
+        return values.get(name, default)
+    return PLACEHOLDER_RE.sub(lambda m: str(values.get(m.group(1), m.group(2) or m.group(0))), value)
+
+
+class TemplateEngine:
+    """Распознавание, разворачивание и расчет шаблонов смет"""
+
+    def __init__(self, calculator):
+        """
+        Args:
+            calculator: CostCalculator (пакетный расчет и сервис БД)
+        """
+        self.calculator = calculator
+        self.db = calculator.db
+
+    async def templates(self) -> List[EstimateTemplate]:
+        return [EstimateTemplate.from_row(row) for row in await self.db.get_estimate_templates()]
+
+    async def match(self, text: str) -> Optional[EstimateTemplate]:
+        """
+        Шаблон, название которого (по основам слов) целиком есть в запросе;
+        при нескольких — с самым длинным названием
+        """
+        text_words = _words(text)
+        matched = [t for t in await self.templates() if t.sections and _contains_stems(text_words, t.name)]
+        if not matched:
+            return None
+        return max(matched, key=lambda t: len(_words(t.name)))
+
+    async def extract_values(self, text: str) -> Dict[str, Any]:
+        """Значения плейсхолдеров и общие параметры из текста запроса (без LLM)"""
+        values: Dict[str, Any] = {}
+        for name, (pattern, convert) in VALUE_PATTERNS.items():
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                values[name] = convert(match.group(1).replace(",", "."))
+        lowered = text.lower()
+        for word, territory in TERRITORY_WORDS:
+            if word in lowered:
+                values["territory_type"] = territory
+                break
+        region = await self._find_region(text)
+        if region:
+            values["region_name"] = region
+        return values
+
+    async def _find_region(self, text: str) -> Optional[str]:
+        """Регион из regional_coeffs, название которого (по основам слов) есть в запросе"""
+        text_words = _words(text)
+        matched = [name for name in await self.db.get_region_names() if _contains_stems(text_words, name)]
+        return max(matched, key=len) if matched else None
+
+    async def expand(self, template: EstimateTemplate, values: Dict[str, Any]) -> TemplateEstimate:
+        """
+        Разворачивает шаблон в строки сметы
+
+        Объем строки — default_params["quantity"] (обычно плейсхолдер) или default_qty.
+        Параметр строки расценки (категория) с другим значением переключает строку
+        на соседнюю строку той же таблицы.
+        """
+        placeholders = template.placeholders
+        values = {
+            **{name: default for name, default in placeholders.items() if default is not None},
+            **{name: value for name, value in values.items() if value is not None},
+        }
+        estimate = TemplateEstimate(template=template, values=values)
+        estimate.missing = [name for name in placeholders if name not in values]
+        if estimate.missing:
+            return estimate
+
+        works = await self.db.get_works_by_ids([row.get("norm_item_id") for row in template.sections])
+        for row in template.sections:
+            work = works.get(row.get("norm_item_id"))
+            if work is None:
+                logger.warning(f"Шаблон {template.name}: нет строки расценки для «{row.get('title')}»")
+                continue
+            params = {k: _substitute(v, values) for k, v in (row.get("default_params") or {}).items()}
+            quantity = params.pop("quantity", None)
+            quantity = self.db._to_float(quantity if quantity is not None else row.get("default_qty"))
+            work = await self._row_variant(work, params)
+            estimate.lines.append(EstimateLine(
+                section_no=row.get("section_no") or 0,
+                section_name=row.get("section_name") or "",
+                title=_substitute(row.get("title") or work.get("work_title") or "", values),
+                unit=row.get("unit") or work.get("unit") or "",
+                work=work,
+                quantity=quantity or 0.0,
+                params=params,
+            ))
+        return estimate
+
+    async def _row_variant(self, work: Dict, params: Dict) -> Dict:
+        """Строка той же таблицы для параметров строки расценки (категория), если они отличаются"""
+        work_params = work.get("params") or {}
+        for key in ROW_PARAMS:
+            value = params.get(key)
+            if value is None or str(work_params.get(key)) == str(value):
+                continue
+            variants = await self.db.get_work_variants(work, key, [value])
+            if str(value) in variants:
+                work = variants[str(value)]
+            else:
+                logger.warning(f"Нет строки {work.get('work_title')} для {key}={value}, оставлена строка шаблона")
+        return work
+
+    async def price(
+        self,
+        template: EstimateTemplate,
+        values: Dict[str, Any],
+        params: Optional[Dict] = None,
+        work_stage: str = 'обе',
+        index_period=None
+    ) -> TemplateEstimate:
+        """
+        Разворачивает шаблон и считает все строки одним пакетом
+
+        Args:
+            template: Шаблон
+            values: Значения плейсхолдеров (и общие параметры SHARED_PARAMS)
+            params: Дополнительные общие параметры сметы
+            work_stage: Этап работ
+            index_period: Период индекса изменения стоимости
+
+        Returns:
+            TemplateEstimate; если не хватает значений — missing без расчета
+        """
+        estimate = await self.expand(template, values)
+        if estimate.missing:
+            return estimate
+        shared = {key: values[key] for key in SHARED_PARAMS if values.get(key) is not None}
+        shared.update(params or {})
+        estimate.result = await self.calculator.calculate_batch(
+            [{"work": line.work, "quantity": line.quantity, "params": line.params} for line in estimate.lines],
+            shared,
+            work_stage=work_stage,
+            index_period=index_period,
+        )
+        return estimate
+
+    async def from_message(self, text: str) -> Optional[TemplateEstimate]:
+        """
+        Смета по шаблону из одного сообщения пользователя (без LLM)
+
+        Returns:
+            TemplateEstimate (посчитанная или с missing) или None, если шаблон не назван
+        """
+        template = await self.match(text)
+        if template is None:
+            return None
+        values = await self.extract_values(text)
+        logger.info(f"Шаблон «{template.name}»: значения {values}")
+        return await self.price(template, values)
+
+
+def missing_labels(names: List[str]) -> List[str]:
+    """Подписи недостающих плейсхолдеров для вопроса пользователю"""
+    return [PLACEHOLDER_LABELS.get(name, name) for name in names]
+
@@ -0,0 +1,75 @@
+"""
+Трассировка шагов расчета: время и число запросов к БД на каждый шаг
+Включается по запросу (calculate_full(trace=True)), по умолчанию используется
+NULL_TRACE без накладных расходов.
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional
+
+
+class CalculationTrace:
+    """
+    Шаги расчета с временем (мс) и числом запросов к БД
+
+    Запросы считаются по счетчику DatabaseService.query_count, поэтому при
+    параллельных расчетах на одном сервисе в шаг могут попасть чужие запросы.
+    """
+
+    def __init__(self, db_service=None):
+        """
+        Args:
+            db_service: Сервис БД со счетчиком query_count (None — без подсчета запросов)
+        """
+        self._db = db_service
+        self._started = time.perf_counter()
+        self._queries_at_start = self._queries()
+        self.steps: List[Dict] = []
+
+    def _queries(self) -> int:
+        return getattr(self._db, "query_count", 0) if self._db is not None else 0
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[Dict]:
+        """
+        Замеряет шаг; в выданный словарь можно добавить пометки (например cached=True)
+        """
+        info: Dict = {"step": name}
+        queries = self._queries()
+        started = time.perf_counter()
+        try:
+            yield info
+        finally:
+            info["ms"] = round((time.perf_counter() - started) * 1000, 3)
+            info["db_calls"] = self._queries() - queries
+            self.steps.append(info)
+
+    def to_dict(self) -> Dict:
+        """Структурированная секция trace для результата расчета"""
+        return {
+            "total_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "db_calls": self._queries() - self._queries_at_start,
+            "steps": list(self.steps),
+        }
+
+    def log_line(self, data: Optional[Dict] = None) -> str:
+        """Одна компактная строка для лога: trace 12.3ms db=9 | region 1.2ms/2 field.K1 0.4ms/1* ..."""
+        data = data or self.to_dict()
+        parts = [
+            f"{s['step']} {s['ms']:.1f}ms/{s['db_calls']}{'*' if s.get('cached') else ''}"
+            for s in data["steps"]
+        ]
+        return f"trace {data['total_ms']:.1f}ms db={data['db_calls']} | " + " ".join(parts)
+
+
+class _NullTrace:
+    """Заглушка трассировки: шаги не замеряются"""
+
+    steps: List[Dict] = []
+
+    def step(self, name: str):
+        return nullcontext({})
+
+
+NULL_TRACE = _NullTrace()
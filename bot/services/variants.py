@@ -0,0 +1,157 @@
+"""
+Расчет всех вариантов неоднозначного параметра за один проход
+Если из запроса непонятна категория сложности или тип территории, вместо
+вопроса «вслепую» считаются все варианты (через CostSweep — правила разрешаются
+один раз), и пользователь выбирает вариант уже с ценой.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from .sweep import CostSweep
+
+# Параметры, для которых считаются варианты: значения и подписи
+VARIANT_PARAMS = {
+    "category": (
+        ("I", "I категория"),
+        ("II", "II категория"),
+        ("III", "III категория"),
+        ("IV", "IV категория"),
+    ),
+    "territory_type": (
+        ("застроенная", "Застроенная"),
+        ("незастроенная", "Незастроенная"),
+        ("промпредприятие", "Промпредприятие"),
+    ),
+}
+
+# Параметры, которые задают строку расценки (варианты — разные строки norm_items)
+ROW_PARAMS = ("category",)
+
+
+@dataclass
+class PricedVariant:
+    """Один вариант параметра с ценой"""
+    value: str
+    label: str
+    work: Dict
+    field_cost: float
+    office_cost: float
+    addons_cost: float
+    total_cost: float
+
+
+@dataclass
+class VariantComparison:
+    """Сравнение вариантов параметра (по возрастанию значения параметра)"""
+    param: str
+    quantity: float
+    variants: List[PricedVariant]
+    # Значения, для которых нет строки расценки
+    missing: List[str] = field(default_factory=list)
+    elapsed_ms: float = 0.0
+
+    @property
+    def cheapest(self) -> Optional[PricedVariant]:
+        return min(self.variants, key=lambda v: v.total_cost) if self.variants else None
+
+    def get(self, value: str) -> Optional[PricedVariant]:
+        return next((v for v in self.variants if v.value == value), None)
+
+    def rows(self) -> List[Dict]:
+        """Плоская таблица: значение, подпись, строка расценки, стоимости, разница с самым дешевым"""
+        cheapest = self.cheapest
+        return [
+            {
+                "value": v.value,
+                "label": v.label,
+                "work_id": v.work.get("id"),
+                "field_cost": v.field_cost,
+                "office_cost": v.office_cost,
+                "addons_cost": v.addons_cost,
+                "total_cost": v.total_cost,
+                "delta": round(v.total_cost - cheapest.total_cost, 2),
+            }
+            for v in self.variants
+        ]
+
+
+class VariantPricer:
+    """Расчет всех значений параметра одной работы"""
+
+    def __init__(self, calculator):
+        """
+        Args:
+            calculator: CostCalculator (источник правил и сервиса БД)
+        """
+        self.calculator = calculator
+        self.db = calculator.db
+
+    async def price(
+        self,
+        work: Dict,
+        quantity: float,
+        params: Dict,
+        param: str,
+        values: Optional[Sequence[str]] = None,
+        work_stage: str = 'обе'
+    ) -> VariantComparison:
+        """
+        Считает работу для всех значений параметра
+
+        Args:
+            work: Выбранная строка расценки
+            quantity: Объем работ
+            params: Параметры расчета (как для calculate_full)
+            param: Неоднозначный параметр ('category', 'territory_type', ...)
+            values: Значения параметра (по умолчанию — из VARIANT_PARAMS)
+            work_stage: Этап работ
+
+        Returns:
+            VariantComparison; итоги совпадают с calculate_full с точностью до копейки
+        """
+        started = time.perf_counter()
+        labels = dict(VARIANT_PARAMS.get(param, ()))
+        values = list(values) if values is not None else list(labels)
+        params = {k: v for k, v in (params or {}).items() if k != param}
+
+        if param in ROW_PARAMS:
+            # Значения параметра строки — разные строки той же таблицы
+            works = await self.db.get_work_variants(work, param, values)
+            works = {value: works[value] for value in values if value in works}
+        else:
+            works = {value: work for value in values}
+        missing = [value for value in values if value not in works]
+        overrides = {value: {param: value} for value in works}
+
+        region = params.get("region_name")
+        distance = self.db._to_float(params.get("distance_to_base_km") or params.get("distance_to_base"))
+        model = await CostSweep(self.calculator).prepare(
+            works, [region], [distance], params, work_stage, overrides
+        )
+        field_cost, office_cost, addons, total = model.evaluate([float(quantity)])
+
+        variants = [
+            PricedVariant(
+                value=value,
+                label=labels.get(value, str(value)),
+                work=works[value],
+                field_cost=float(field_cost[0, ic, 0, 0]),
+                office_cost=float(office_cost[0, ic, 0, 0]),
+                addons_cost=float(addons[0, ic, 0, 0]),
+                total_cost=float(total[0, ic, 0, 0]),
+            )
+            for ic, value in enumerate(model.categories)
+        ]
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        logger.info(f"Варианты {param}: {len(variants)} за {elapsed_ms:.1f} мс (нет строк: {missing})")
+        return VariantComparison(
+            param=param,
+            quantity=float(quantity),
+            variants=variants,
+            missing=missing,
+            elapsed_ms=elapsed_ms,
+        )
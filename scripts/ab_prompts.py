@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+A/B сравнение полного и компактного промпта extract_parameters (bot/services/prompts.py)
+На корпусе tests/fixtures/messages.py считает оценку токенов обоих вариантов и
+проверяет, что каждое ожидаемое поле описано в компактном промпте. С --live
+оба варианта отправляются в OpenRouter (нужен OPENROUTER_API_KEY) и сравнивается
+совпадение извлеченных полей с ожидаемыми.
+
+Запуск из корня репозитория:
+    python scripts/ab_prompts.py [--live] [--model MODEL] [--examples K]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services.ai_agent import AIAgent  # noqa: E402
+from bot.services.prompts import DEFAULT_EXAMPLES, PromptBuilder, estimate_tokens  # noqa: E402
+from tests.fixtures.messages import MESSAGES  # noqa: E402
+
+
+def offline(builder: PromptBuilder, agent: AIAgent) -> None:
+    full_tokens = compact_tokens = 0
+    uncovered = []
+    for message in MESSAGES:
+        full = agent._extract_prompt(message["text"])
+        compact = builder.build(message["text"])
+        full_tokens += estimate_tokens(full)
+        compact_tokens += compact.tokens
+        for key in message["expected"]:
+            if f"- {key}:" not in compact.text:
+                uncovered.append((key, message["text"]))
+
+    n = len(MESSAGES)
+    print(f"сообщений в корпусе:     {n}")
+    print(f"токенов, полный промпт:  ~{full_tokens / n:.0f} на запрос")
+    print(f"токенов, компактный:     ~{compact_tokens / n:.0f} на запрос "
+          f"({1 - compact_tokens / full_tokens:.0%} меньше), статический префикс ~{builder.static_tokens}")
+    print(f"полей вне промпта:       {len(uncovered)}")
+    for key, text in uncovered:
+        print(f"  {key}: {text}")
+
+
+async def live(builder: PromptBuilder, model: str) -> None:
+    key = os.environ["OPENROUTER_API_KEY"]
+    variants = {"полный": AIAgent(key, model), "компактный": AIAgent(key, model, prompt_builder=builder)}
+    for name, agent in variants.items():
+        correct = total = 0
+        for message in MESSAGES:
+            params = await agent.extract_parameters(message["text"])
+            for field, value in message["expected"].items():
+                total += 1
+                correct += params.get(field) == value
+        stats = agent.token_stats
+        print(f"{name:11} совпало полей {correct}/{total} ({correct / max(total, 1):.0%}), "
+              f"токенов prompt {stats['prompt']} (из кэша {stats['cached']}), ответ {stats['completion']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--live", action="store_true", help="сравнить ответы OpenRouter")
+    parser.add_argument("--model", default=os.environ.get("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet"))
+    parser.add_argument("--examples", type=int, default=DEFAULT_EXAMPLES)
+    args = parser.parse_args()
+
+    builder = PromptBuilder(args.examples)
+    offline(builder, AIAgent("offline", args.model))
+    if args.live:
+        asyncio.run(live(builder, args.model))
+
+
+if __name__ == "__main__":
+    main()
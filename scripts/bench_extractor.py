@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк локального разбора параметров (bot/services/extractor.py)
+Прогоняет корпус tests/fixtures/messages.py: доля сообщений, разобранных без
+запроса к LLM, совпадение с ожидаемыми полями и время разбора.
+
+Запуск из корня репозитория:
+    python scripts/bench_extractor.py [повторов]
+"""
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services.extractor import RuleExtractor  # noqa: E402
+from tests.fixtures.messages import MESSAGES  # noqa: E402
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    extractor = RuleExtractor()
+
+    results = [extractor.extract(message["text"]) for message in MESSAGES]
+    local = [r for r in results if r.confident]
+    wrong = [
+        (message["text"], key)
+        for message, result in zip(MESSAGES, results) if result.confident
+        for key, value in message["expected"].items() if result.params.get(key) != value
+    ]
+
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for message in MESSAGES:
+            extractor.extract(message["text"])
+    elapsed = time.perf_counter() - t0
+    per_message = elapsed / (repeats * len(MESSAGES)) * 1e6
+
+    print(f"сообщений в корпусе:  {len(MESSAGES)}")
+    print(f"без LLM:              {len(local)} ({len(local) / len(MESSAGES):.0%})")
+    print(f"ошибок в полях:       {len(wrong)}")
+    for text, key in wrong:
+        print(f"  {key}: {text}")
+    print(f"разбор сообщения:     {per_message:.0f} мкс (LLM: 3-15 с)")
+    missing = {}
+    for result in results:
+        for name in result.missing:
+            missing[name] = missing.get(name, 0) + 1
+    if missing:
+        print("причины запроса к LLM: " + ", ".join(f"{k} — {v}" for k, v in sorted(missing.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк денежного ядра: Decimal-путь vs целые копейки (bot/services/money.py)
+Считает N строк «цена × объем × K1 × K2 × K3» обоими способами и сверяет результаты.
+
+Запуск из корня репозитория:
+    python scripts/bench_money.py [N]
+"""
+from __future__ import annotations
+
+import random
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services import money  # noqa: E402
+
+COEFFS = [1.0, 1.1, 1.15, 1.2, 1.25, 1.3, 1.5, 1.55, 1.75, 0.5, 0.8]
+CENT = Decimal("0.01")
+
+
+def make_lines(n: int):
+    rnd = random.Random(2004)
+    prices = [round(rnd.uniform(100, 20000), 0) for _ in range(200)]
+    quantities = [rnd.choice([1, 2, 5, 8, 15, 26, 92, 97, 123, 0.5, 2.5, 4.4]) for _ in range(50)]
+    return [
+        (rnd.choice(prices), rnd.choice(quantities), rnd.choice(COEFFS), rnd.choice(COEFFS), rnd.choice(COEFFS))
+        for _ in range(n)
+    ]
+
+
+def run_decimal(lines):
+    out = []
+    for price, qty, k1, k2, k3 in lines:
+        total = Decimal(str(price)) * Decimal(str(qty))
+        for c in (k1, k2, k3):
+            total *= Decimal(str(c))
+        out.append(float(total.quantize(CENT, rounding=ROUND_HALF_UP)))
+    return out
+
+
+def run_kopecks(lines):
+    out = []
+    for price, qty, k1, k2, k3 in lines:
+        out.append(money.from_kopecks(money.line_cost(price, qty, money.product((k1, k2, k3)))))
+    return out
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    lines = make_lines(n)
+
+    t0 = time.perf_counter()
+    dec = run_decimal(lines)
+    t1 = time.perf_counter()
+    kop = run_kopecks(lines)
+    t2 = time.perf_counter()
+
+    mismatches = sum(1 for a, b in zip(dec, kop) if a != b)
+    print(f"строк: {n}")
+    print(f"Decimal:  {t1 - t0:.3f} c")
+    print(f"копейки:  {t2 - t1:.3f} c  (x{(t1 - t0) / (t2 - t1):.2f})")
+    print(f"расхождений: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Локальная замена OpenRouter для нагрузочных тестов и замеров задержек
+Реализует подмножество POST /chat/completions, которое использует
+AIAgent._chat_json (JSON-режим, одно сообщение пользователя). Ответы:
+- извлечение параметров — локальный разбор запроса (RuleExtractor);
+- выбор работы — {"index": 1};
+- остальное — заготовки из --responses (подстрока промпта -> JSON) или {}.
+Задержка, разброс и доли сбоев (зависание до таймаута клиента, 429, 500)
+настраиваются. GET /stats — счетчики запросов.
+
+Запуск из корня репозитория:
+    python scripts/llm_stub.py --port 8089 --latency 1.5 --jitter 1.0 --rate-limit-rate 0.05
+и в .env бота: OPENROUTER_BASE_URL=http://127.0.0.1:8089/v1
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional
+
+from aiohttp import web
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from bot.services.extractor import RuleExtractor  # noqa: E402
+from bot.services.prompts import estimate_tokens  # noqa: E402
+
+_MESSAGE_RE = re.compile(r'^Запрос: "(.*)"$', re.MULTILINE)
+
+
+@dataclass
+class StubConfig:
+    """Поведение заглушки"""
+    latency: float = 0.5           # базовая задержка ответа, сек
+    jitter: float = 0.0            # случайная добавка к задержке, 0..jitter сек
+    timeout_rate: float = 0.0      # доля запросов, которые зависают на hang сек
+    rate_limit_rate: float = 0.0   # доля ответов 429
+    error_rate: float = 0.0        # доля ответов 500
+    hang: float = 120.0            # зависание дольше таймаута клиента (45 сек)
+    seed: Optional[int] = None
+    responses: Dict[str, Dict] = field(default_factory=dict)
+
+
+class LLMStub:
+    """Обработчик запросов и счетчики"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.extractor = RuleExtractor()
+        self.stats = {"requests": 0, "ok": 0, "timeout": 0, "rate_limited": 0, "error": 0}
+
+    def answer(self, prompt: str) -> Dict:
+        for needle, response in self.config.responses.items():
+            if needle in prompt:
+                return response
+        if prompt.startswith("Извлеки параметры"):
+            m = _MESSAGE_RE.search(prompt)
+            return self.extractor.extract(m.group(1)).params if m else {}
+        if '"index"' in prompt:
+            return {"index": 1}
+        return {}
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        body = await request.json()
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        config = self.config
+
+        roll = self.random.random()
+        if roll < config.timeout_rate:
+            self.stats["timeout"] += 1
+            await asyncio.sleep(config.hang)
+            return web.json_response({"error": {"message": "stub timeout"}}, status=504)
+        roll -= config.timeout_rate
+        await asyncio.sleep(config.latency + self.random.uniform(0, config.jitter))
+        if roll < config.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "stub rate limit", "code": 429}}, status=429, headers={"retry-after": "1"}
+            )
+        roll -= config.rate_limit_rate
+        if roll < config.error_rate:
+            self.stats["error"] += 1
+            return web.json_response({"error": {"message": "stub error", "code": 500}}, status=500)
+
+        content = json.dumps(self.answer(prompt), ensure_ascii=False)
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        self.stats["ok"] += 1
+        return web.json_response({
+            "id": f"stub-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+STUB_KEY = web.AppKey("stub", LLMStub)
+
+
+def make_app(config: StubConfig) -> web.Application:
+    stub = LLMStub(config)
+    app = web.Application()
+    app[STUB_KEY] = stub
+    # base_url может быть с /v1 (как у OpenRouter) или без
+    for prefix in ("", "/v1", "/api/v1"):
+        app.router.add_post(f"{prefix}/chat/completions", stub.chat_completions)
+    app.router.add_get("/stats", stub.get_stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang", type=float, default=120.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--responses", help="JSON-файл: подстрока промпта -> ответ")
+    args = parser.parse_args()
+
+    responses = json.loads(Path(args.responses).read_text(encoding="utf-8")) if args.responses else {}
+    config = StubConfig(
+        latency=args.latency, jitter=args.jitter, timeout_rate=args.timeout_rate,
+        rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate, hang=args.hang,
+        seed=args.seed, responses=responses,
+    )
+    web.run_app(make_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
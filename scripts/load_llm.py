@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный замер вызовов LLM (AIAgent.extract_parameters) без OpenRouter
+Шлет сообщения корпуса tests/fixtures/messages.py с заданной параллельностью
+в OpenAI-совместимый API (по умолчанию — локальная заглушка scripts/llm_stub.py)
+и печатает пропускную способность, перцентили задержки, ошибки и число
+запросов, дошедших до сервера (с ретраями).
+
+Запуск из корня репозитория (заглушка уже запущена):
+    python scripts/load_llm.py --requests 200 --concurrency 20 [--base-url URL]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from loguru import logger  # noqa: E402
+
+from bot.services.ai_agent import AIAgent  # noqa: E402
+from tests.fixtures.messages import MESSAGES  # noqa: E402
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def server_stats(base_url: str):
+    root = base_url.split("/v1")[0].split("/api")[0]
+    try:
+        with urllib.request.urlopen(f"{root}/stats", timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+async def run(args) -> None:
+    agent = AIAgent("stub", args.model, base_url=args.base_url)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], 0
+
+    async def one(i: int) -> None:
+        nonlocal failures
+        # номер запроса в тексте: без него одинаковые сообщения объединяются (_chat_json)
+        text = f"{MESSAGES[i % len(MESSAGES)]['text']} #{i}"
+        async with semaphore:
+            t0 = time.perf_counter()
+            params = await agent.extract_parameters(text)
+            latencies.append(time.perf_counter() - t0)
+            failures += not params
+
+    before = server_stats(args.base_url)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - t0
+    after = server_stats(args.base_url)
+
+    print(f"запросов:      {args.requests}, параллельно {args.concurrency}")
+    print(f"время:         {elapsed:.1f} с, {args.requests / elapsed:.1f} запросов/с")
+    print(f"задержка:      p50 {percentile(latencies, 0.5):.2f} с, p95 {percentile(latencies, 0.95):.2f} с, "
+          f"p99 {percentile(latencies, 0.99):.2f} с, max {max(latencies):.2f} с")
+    print(f"без ответа:    {failures}")
+    if before is not None and after is not None:
+        received = {key: after[key] - before.get(key, 0) for key in after}
+        print(f"на сервере:    {received['requests']} запросов (с ретраями), "
+              f"429 — {received['rate_limited']}, 500 — {received['error']}, зависаний — {received['timeout']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8089/v1")
+    parser.add_argument("--model", default="stub")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Мини-каталог норм СБЦ ИГДИ-2004 (табл. 9) для тестов калькулятора
+"""
+
+DOC_ID = "doc-igdi"
+
+
+def _internal(code, d_min, d_max, c_min, c_max, value):
+    return {
+        "code": code, "name": code, "calc_type": "percent", "value": value, "base_type": "field",
+        "conditions": {
+            "distance_from_base_km_min": d_min, "distance_from_base_km_max": d_max,
+            "field_cost_thousand_min": c_min, "field_cost_thousand_max": c_max,
+        },
+        "source_ref": {},
+    }
+
+
+CATALOG = {
+    "norm_docs": [{"id": DOC_ID, "code": "SBC_IGDI_2004"}],
+    "norm_items": [
+        {"id": "t9-ii", "work_title": "План 1:500 II кат.", "unit": "га", "table_no": 9, "section": "5",
+         "price_field": 4632, "price_office": 2558, "params": {"scale": "1:500", "category": "II"}},
+        {"id": "t9-iii", "work_title": "План 1:500 III кат.", "unit": "га", "table_no": 9, "section": "6",
+         "price_field": 5745, "price_office": 3288, "params": {"scale": "1:500", "category": "III"}},
+        {"id": "t9-iv", "work_title": "План 1:500 IV кат.", "unit": "га", "table_no": 9, "section": "7",
+         "price_field": 7212, "price_office": 4119, "params": {"scale": "1:500", "category": "IV"}},
+        {"id": "t9-ii-2000", "work_title": "План 1:2000 II кат.", "unit": "га", "table_no": 9, "section": "9",
+         "price_field": 900, "price_office": 500, "params": {"scale": "1:2000", "category": "II"}},
+    ],
+    "norm_coeffs": [
+        {"code": "T9_INDUSTRIAL", "name": "Промпредприятие", "value": 1.75, "apply_to": "price", "doc_id": DOC_ID,
+         "conditions": {"table_no": 9, "territory_type": "промпредприятие"}, "source_ref": {"table": 9, "note": 4}},
+        {"code": "SALARY_1_7", "name": "Районный 1.7", "value": 1.3, "apply_to": "field", "doc_id": DOC_ID,
+         "conditions": {"salary_coeff": 1.7}, "source_ref": {"source": "rtf_2004", "section": "п.8д"}},
+        {"code": "ORG_LIQ_DURATION_2_4", "name": "Длительность", "value": 0.9, "apply_to": "total",
+         "conditions": {"applies_to_addon": "ORG_LIQ_6PCT", "duration_months_min": 2, "duration_months_max": 4},
+         "source_ref": {}},
+    ],
+    "norm_addons": [
+        _internal("INTERNAL_T4_0_5_0_75", 0, 5, 0, 75, 0.0625),
+        _internal("INTERNAL_T4_0_5_75_150", 0, 5, 75, 150, 0.05),
+        _internal("INTERNAL_T4_0_5_150", 0, 5, 150, None, 0.0375),
+        _internal("INTERNAL_T4_5_100_0_150", 5, 100, 0, 150, 0.15),
+        _internal("INTERNAL_T4_5_100_150", 5, 100, 150, None, 0.1),
+        {"code": "ORG_LIQ_6PCT", "name": "Орг/ликв", "calc_type": "percent", "value": 0.06,
+         "base_type": "field_plus_internal", "conditions": {}, "source_ref": {}},
+        {"code": "PROGRAM_T78_0_100", "name": "Программа", "calc_type": "fixed", "value": 0,
+         "base_type": "subtotal", "conditions": {"base_cost_thousand_min": 0, "base_cost_thousand_max": 100,
+                                                 "fixed_amount": 4300}, "source_ref": {}},
+        {"code": "PROGRAM_T78_100", "name": "Программа", "calc_type": "percent", "value": 0.03,
+         "base_type": "subtotal", "conditions": {"base_cost_thousand_min": 100, "fixed_amount": 4300,
+                                                 "percent_over": 0.03}, "source_ref": {}},
+    ],
+    "regional_coeffs": [
+        {"region_name": "Москва", "salary_coeff": 1.0},
+        {"region_name": "Магаданская область", "salary_coeff": 1.7},
+    ],
+    "regional_zone_lists": [
+        {"region_name": "Магаданская область", "zone_type": "far_north"},
+    ],
+    "inflation_indices": [
+        {"period_year": 2025, "period_quarter": 3, "index_value": 6.70, "work_type": "ИГДИ",
+         "source_document": "Письмо Минстроя РФ № 41280-ИФ/09 от 16.07.2025"},
+        {"period_year": 2023, "period_quarter": 1, "index_value": 5.20, "work_type": "ИГДИ"},
+        {"period_year": 2024, "period_quarter": 1, "index_value": 5.83, "work_type": "ИГДИ",
+         "source_document": "Письмо Минстроя России от 07.03.2024 N 13023-ИФ/09"},
+        {"period_year": 2023, "period_quarter": 4, "index_value": 5.50, "work_type": "ИГДИ"},
+        {"period_year": 2025, "period_quarter": 4, "index_value": 6.87, "work_type": "ИГДИ",
+         "region": "Московская область"},
+        {"period_year": 2024, "period_quarter": 2, "index_value": 4.90, "work_type": "все"},
+    ],
+}
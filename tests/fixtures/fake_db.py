@@ -0,0 +1,85 @@
+"""
+Подмена клиента Supabase для тестов сервиса БД и калькулятора
+Поддерживает минимальный набор фильтров, используемых в DatabaseService
+"""
+
+from bot.services.database import DatabaseService
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeTable:
+    def __init__(self, rows, calls=None, name=None):
+        self._rows = rows
+        self._filters = []
+        self._limit = None
+        self._range = None
+        self._calls = calls
+        self._name = name
+
+    def select(self, _cols="*"):
+        return self
+
+    def like(self, field, pattern):
+        # very small LIKE support: prefix/suffix %
+        def _match(row):
+            val = str(row.get(field, ""))
+            pat = pattern.replace("%", "")
+            return pat in val
+        self._filters.append(_match)
+        return self
+
+    def ilike(self, field, pattern):
+        def _match(row):
+            val = str(row.get(field, "")).lower()
+            pat = pattern.replace("%", "").lower()
+            return pat in val
+        self._filters.append(_match)
+        return self
+
+    def eq(self, field, value):
+        self._filters.append(lambda row: row.get(field) == value)
+        return self
+
+    def in_(self, field, values):
+        self._filters.append(lambda row: row.get(field) in values)
+        return self
+
+    def limit(self, value):
+        self._limit = value
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def execute(self):
+        if self._calls is not None:
+            self._calls.append(self._name)
+        rows = self._rows
+        for f in self._filters:
+            rows = [r for r in rows if f(r)]
+        if self._range is not None:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return FakeResponse(rows)
+
+
+class FakeClient:
+    def __init__(self, data):
+        self._data = data
+        self.calls = []
+
+    def table(self, name):
+        return FakeTable(self._data.get(name, []), self.calls, name)
+
+
+class FakeDB(DatabaseService):
+    def __init__(self, data):
+        # bypass real supabase client
+        self.client = FakeClient(data)
+        self._init_catalog_state()
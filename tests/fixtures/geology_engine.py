@@ -0,0 +1,12 @@
+"""
+Движок правил тестового документа СБЦ ИГИ (загружается реестром по строке "модуль:Класс")
+"""
+
+from bot.services.rules import RuleEngine
+
+
+class GeologyRuleEngine(RuleEngine):
+    doc_code = "SBC_IGI_2004"
+    source = "rtf_igi"
+    k3_sections = ("п.6",)
+    work_type = "ИГИ"
@@ -0,0 +1,65 @@
+"""
+Корпус сообщений пользователей для локального разбора параметров (services/extractor.py)
+Строки реальных смет (expected_results.py) с объемом и типовые запросы из чата.
+local — ожидается ответ без LLM; expected — поля, которые должны совпасть.
+"""
+
+from tests.fixtures.expected_results import ALL_ESTIMATES
+
+TOPO = "топографическая съемка"
+NETWORK = "опорная сеть"
+
+
+def _estimate_messages():
+    messages = []
+    for estimate in ALL_ESTIMATES:
+        for line in estimate.get("field_works", []) + estimate.get("office_works", []):
+            name = line["name"]
+            expected = {"quantity": line["quantity"], "unit": line["unit"]}
+            if "кат" in name.lower():
+                expected["category"] = line["category"]
+            if "плана" in name:
+                expected["work_type"] = TOPO
+            elif "опорной" in name:
+                expected["work_type"] = NETWORK
+            if "1:" in name:
+                expected["scale"] = name[name.index("1:"):].split()[0].rstrip(",;")
+            messages.append({
+                "text": f"{name} {line['quantity']} {line['unit']}",
+                "local": "work_type" in expected,
+                "expected": expected,
+            })
+    return messages
+
+
+CHAT_MESSAGES = [
+    {"text": "топоплан 1:500 92 га промпредприятие сечение 0,5 II категория", "local": True,
+     "expected": {"work_type": TOPO, "scale": "1:500", "quantity": 92, "unit": "га", "category": "II",
+                  "height_section": 0.5, "territory_type": "промпредприятие"}},
+    {"text": "Топосъемка 50 га М 1:500 промпредприятие", "local": True,
+     "expected": {"work_type": TOPO, "scale": "1:500", "quantity": 50, "unit": "га",
+                  "territory_type": "промпредприятие"}},
+    {"text": "Топосъемка 1:2000 сечение рельефа 1 м 120 га незастроенная территория III категория", "local": True,
+     "expected": {"work_type": TOPO, "scale": "1:2000", "quantity": 120, "unit": "га", "category": "III",
+                  "height_section": 1.0, "territory_type": "незастроенная"}},
+    {"text": "инженерно-топографический план 1:1000, 35 га, застроенная, с подземными коммуникациями", "local": True,
+     "expected": {"work_type": TOPO, "scale": "1:1000", "quantity": 35, "unit": "га",
+                  "territory_type": "застроенная", "has_underground_comms": True}},
+    {"text": "плановая опорная сеть спутниковым методом 1 разряд пункт 15 категория 2", "local": True,
+     "expected": {"work_type": NETWORK, "quantity": 15, "unit": "пункт", "category": "II", "use_satellite": True}},
+    {"text": "высотная опорная сеть IV класс 12 пунктов, спутниковые приемники", "local": True,
+     "expected": {"work_type": NETWORK, "quantity": 12, "unit": "пункт", "use_satellite": False}},
+    {"text": "нивелирование IV класса 25 км II категория", "local": True,
+     "expected": {"work_type": "нивелирование", "quantity": 25, "unit": "км", "category": "II"}},
+    {"text": "Изыскания трасс автодорог III-IV категории (II кат.сложности) 12 км", "local": True,
+     "expected": {"work_type": "изыскания трасс", "quantity": 12, "unit": "км", "category": "II"}},
+    {"text": "топоплан 1:500 25 га, горный район 2500 м, неблагоприятный период 6 месяцев", "local": True,
+     "expected": {"work_type": TOPO, "quantity": 25, "unit": "га", "altitude": 2500, "unfavorable_months": 6}},
+    # Без LLM не ответить: нет объема, масштаба или они неоднозначны
+    {"text": "Нужно посчитать съемку участка под коттедж, примерно гектар", "local": False, "expected": {}},
+    {"text": "топоплан 1:500 для промплощадки, площадь уточню позже", "local": False, "expected": {}},
+    {"text": "Сколько стоит топосъемка 10 га?", "local": False, "expected": {}},
+    {"text": "съемка 1:500 и 1:2000, участки 10 га и 40 га", "local": False, "expected": {}},
+]
+
+MESSAGES = _estimate_messages() + CHAT_MESSAGES
@@ -0,0 +1,107 @@
+"""
+Тесты сметы по списку работ из одного сообщения (split_works, extract_batch, BatchEngine)
+"""
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.batch import BatchEngine
+from bot.services.calculator import CostCalculator
+from bot.services.extractor import RuleExtractor, split_works
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+from tests.fixtures.messages import MESSAGES
+
+MESSAGE = (
+    "Промпредприятие:\n"
+    "1) топоплан 1:500 10 га III категория\n"
+    "2) топоплан 1:2000 5 га II категория\n"
+    "3) съемка участка под коттедж, примерно 2 гектара\n"
+    "4) нивелирование IV класса 12 км"
+)
+
+
+def test_split_works():
+    assert split_works("1) топосъемка 1:500 97 га 2) нивелирование IV класс 12 км; 3) опорная сеть 15 пунктов") == (
+        "", ["топосъемка 1:500 97 га", "нивелирование IV класс 12 км", "опорная сеть 15 пунктов"]
+    )
+    assert split_works("Магадан, застроенная:\n- топоплан 1:500 92 га\n• нивелирование 25 км.") == (
+        "Магадан, застроенная", ["топоплан 1:500 92 га", "нивелирование 25 км"]
+    )
+    assert split_works("Промпредприятие, 1:500\nтопосъемка 10 га\nнивелирование IV класса 12 км") == (
+        "Промпредприятие, 1:500", ["топосъемка 10 га", "нивелирование IV класса 12 км"]
+    )
+    # нумерованные признаки или участки одной работы — не список
+    assert split_works("Топографическая съемка:\n1. Площадь 50 га\n2. Масштаб 1:500\n3. Промпредприятие") == ("", [])
+    assert split_works("Нивелирование IV класс 12 км; 1) участок 5 км 2) участок 7 км") == ("", [])
+    # одна работа на нескольких строках — не список
+    assert split_works("Топосъемка 50 га\nМ 1:500 промпредприятие") == ("", [])
+    assert split_works("Топосъемка 50 га М 1:500\nрайонный коэффициент 1.4") == ("", [])
+    # одиночные запросы, в том числе с «0.5», «1 разряд» и двумя масштабами, — не списки
+    for message in MESSAGES:
+        assert split_works(message["text"]) == ("", []), message["text"]
+
+
+def _agent(answer):
+    agent = AIAgent("key", "model", extractor=RuleExtractor())
+    prompts = []
+
+    async def chat_json(prompt, op_name):
+        prompts.append((op_name, prompt))
+        return answer
+
+    agent._chat_json = chat_json
+    return agent, prompts
+
+
+@pytest.mark.asyncio
+async def test_extract_batch_sends_only_uncertain_lines_in_one_call():
+    agent, prompts = _agent({"works": [
+        {"main": {"work_type": "топографическая съемка", "quantity": 2, "unit": "га"}, "scale": "1:500",
+         "category": "II", "color_plan": True},
+    ]})
+    extracted = await agent.extract_batch(MESSAGE, user_id=1)
+
+    assert [text for text, _ in extracted][0] == "топоплан 1:500 10 га III категория"
+    assert len(prompts) == 1 and prompts[0][0] == "extract_batch"
+    assert "1) съемка участка под коттедж" in prompts[0][1] and "топоплан 1:2000" not in prompts[0][1]
+    first, second, third, fourth = (params for _, params in extracted)
+    assert (first["scale"], first["quantity"], first["category"]) == ("1:500", 10, "III")
+    # общие условия из начала сообщения — в каждом пункте
+    assert first["territory_type"] == second["territory_type"] == "промпредприятие"
+    assert third["quantity"] == 2 and third["color_plan"] is None
+    assert fourth["work_type"] == "нивелирование" and fourth["quantity"] == 12
+
+    assert await agent.extract_batch("топоплан 1:500 92 га") == []
+
+
+@pytest.mark.asyncio
+async def test_batch_engine_prices_lines_together():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    agent, prompts = _agent({"works": [{"work_type": "топографическая съемка", "unit": "га"}]})
+    engine = BatchEngine(calc, agent)
+
+    estimate = await engine.from_message(MESSAGE, user_id=1)
+    assert len(prompts) == 1
+    assert [line.work["id"] if line.work else line.error for line in estimate.lines] == [
+        "t9-iii", "t9-ii-2000", "не указан объем", "Не найдены работы по запросу 'нивелирование'"
+    ]
+    assert len(estimate.result["lines"]) == 2
+    assert estimate.result["total_cost"] == pytest.approx(
+        sum(line["total_cost"] for line in estimate.result["lines"])
+    )
+
+    text = agent.format_batch(estimate)
+    assert "Смета по списку: 4 работ" in text and "⚠️ не указан объем" in text and "ИТОГО" in text
+    assert await engine.from_message("топоплан 1:500 92 га") is None
+
+
+@pytest.mark.asyncio
+async def test_batch_with_one_priced_line_falls_back_to_single_request():
+    db = FakeDB(CATALOG)
+    agent, _ = _agent({"works": []})
+    engine = BatchEngine(CostCalculator(db), agent)
+    # нивелирования в каталоге нет — расценивается только топоплан
+    message = "1) топоплан 1:500 10 га III категория промпредприятие\n2) нивелирование IV класса 12 км"
+    assert len(await agent.extract_batch(message)) == 2
+    assert await engine.from_message(message, user_id=1) is None
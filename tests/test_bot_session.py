@@ -0,0 +1,128 @@
+"""
+Тесты сессии бота: первый расчет до уточнений, инкрементальные ответы, срок жизни сессий
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+# bot.py импортирует config и services как модули верхнего уровня (запуск из bot/)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "bot"))
+for name in ("TELEGRAM_BOT_TOKEN", "SUPABASE_URL", "SUPABASE_SERVICE_ROLE_KEY", "OPENROUTER_API_KEY"):
+    os.environ.setdefault(name, "test")
+
+from bot.bot import SmetaBot, settings  # noqa: E402
+
+ROWS = {row["params"]["category"]: row for row in CATALOG["norm_items"] if row["params"]["scale"] == "1:500"}
+PARAMS = {"work_type": "топографическая съемка", "quantity": 10, "unit": "га", "scale": "1:500",
+          "region_name": "Магаданская область"}
+
+
+class Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class Formatter:
+    async def format_response(self, calculation):
+        return calculation
+
+
+def _bot():
+    bot = SmetaBot.__new__(SmetaBot)
+    bot.db = FakeDB(CATALOG)
+    bot.calculator = CostCalculator(bot.db)
+    bot.ai = Formatter()
+    bot.user_context = {}
+    return bot
+
+
+@pytest.mark.asyncio
+async def test_clarifications_recalculate_first_calculation():
+    bot = _bot()
+    bot.user_context[1] = ctx = {"params": dict(PARAMS), "work": dict(ROWS["II"]), "waiting_for": None}
+    await bot._start_state(ctx)
+    state = ctx["state"]
+    assert state is not None and "field.K1" in state.evaluated
+
+    # ответ о территории — пересчитываются только K1, не регион и не K3
+    ctx["params"]["territory_type"] = "промпредприятие"
+    assert await bot._sync_state(ctx) is state
+    assert "field.K1" in state.evaluated and "region" not in state.evaluated
+    assert not any(step.endswith("K3") for step in state.evaluated)
+
+    # категория IV — другая строка; итог как у полного расчета этой строки
+    ctx["params"]["category"] = "IV"
+    ctx["work"] = dict(ROWS["IV"])
+    message = Message()
+    await bot._perform_calculation(message, 1)
+    expected = await bot.calculator.calculate_full(
+        dict(ROWS["IV"]), 10, dict(PARAMS, territory_type="промпредприятие", category="IV"))
+    assert ctx["state"] is state and ctx["calculated"]
+    assert message.replies[0]["total_cost"] == expected["total_cost"]
+
+
+def test_sessions_expire_and_are_capped(monkeypatch):
+    bot = _bot()
+    now = [1000.0]
+    monkeypatch.setattr("bot.bot.time.time", lambda: now[0])
+    monkeypatch.setattr(settings, "session_ttl", 60.0)
+    monkeypatch.setattr(settings, "session_max", 2)
+    for user_id in range(3):
+        bot.user_context[user_id] = {"params": {}}
+        bot._touch_session(user_id)
+        now[0] += 1
+    bot._prune_sessions()
+    assert sorted(bot.user_context) == [1, 2]
+
+    now[0] += 59
+    bot._touch_session(2)
+    bot._prune_sessions()
+    assert sorted(bot.user_context) == [2]
+
+
+@pytest.mark.asyncio
+async def test_prefetch_cancelled_when_extraction_fails():
+    bot = _bot()
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def fetch_search_candidates(query, scale):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def extract_parameters(user_message, user_id=None):
+        await started.wait()
+        raise RuntimeError("LLM недоступен")
+
+    async def not_matched(*args, **kwargs):
+        return None
+
+    async def allowed(update):
+        return True
+
+    bot.db.fetch_search_candidates = fetch_search_candidates
+    bot.ai = SimpleNamespace(guess_parameters=lambda text: {"work_type": "топографическая съемка", "scale": "1:500"},
+                             extract_parameters=extract_parameters)
+    bot.templates = bot.batch = SimpleNamespace(from_message=not_matched)
+    bot._ensure_auth = allowed
+    message = Message()
+    message.text = "топосъемка 1:500 10 га"
+    update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=1))
+
+    await bot.handle_message(update, None)
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert "ошибка" in message.replies[-1]
@@ -0,0 +1,96 @@
+"""
+Тесты инкрементального пересчета (CalculationState / recalculate)
+"""
+import pytest
+
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {
+    "territory_type": "промпредприятие",
+    "region_name": "Магаданская область",
+    "expedition_duration_months": 3,
+    "include_program": True,
+}
+
+
+async def _fresh_total(params, quantity=10):
+    calc = CostCalculator(FakeDB(CATALOG))
+    result = await calc.calculate_full(dict(WORK), quantity, dict(params))
+    return result["total_cost"]
+
+
+@pytest.mark.asyncio
+async def test_session_matches_calculate_full():
+    calc = CostCalculator(FakeDB(CATALOG))
+    state = await calc.start_session(dict(WORK), 10, dict(PARAMS))
+    assert state.result["total_cost"] == await _fresh_total(PARAMS)
+    assert "region" in state.evaluated and "field.K1" in state.evaluated
+
+
+@pytest.mark.asyncio
+async def test_territory_change_reevaluates_only_k1():
+    calc = CostCalculator(FakeDB(CATALOG))
+    state = await calc.start_session(dict(WORK), 10, dict(PARAMS))
+
+    diff = await calc.recalculate(state, {"territory_type": "незастроенная"})
+    assert {"field.K1", "office.K1"} <= set(diff["evaluated"])
+    assert not any(step.endswith(("K2", "K3")) for step in diff["evaluated"])
+    assert "region" not in diff["evaluated"]
+    assert diff["stages"]["field"]["K1"] == (1.75, 1.0)
+    assert diff["changed_params"] == {"territory_type": ("промпредприятие", "незастроенная")}
+    assert diff["total_cost"]["new"] == await _fresh_total(dict(PARAMS, territory_type="незастроенная"))
+    assert diff["total_cost"]["delta"] < 0
+
+
+@pytest.mark.asyncio
+async def test_distance_change_reevaluates_only_addons():
+    calc = CostCalculator(FakeDB(CATALOG))
+    state = await calc.start_session(dict(WORK), 10, dict(PARAMS))
+
+    diff = await calc.recalculate(state, {"distance_to_base_km": 3})
+    assert diff["evaluated"]
+    assert all(step.startswith("addons.") for step in diff["evaluated"])
+    assert "addons.internal" in diff["evaluated"]
+    assert diff["stages"] == {}
+    assert [a["code"] for a in diff["addons"]["added"]] == ["INTERNAL_T4_0_5_75_150"]
+    assert diff["total_cost"]["new"] == await _fresh_total(dict(PARAMS, distance_to_base_km=3))
+
+
+@pytest.mark.asyncio
+async def test_quantity_and_region_changes():
+    calc = CostCalculator(FakeDB(CATALOG))
+    state = await calc.start_session(dict(WORK), 10, dict(PARAMS))
+
+    diff = await calc.recalculate(state, {"quantity": 40})
+    assert not any(step.startswith(("field.", "office.", "region")) for step in diff["evaluated"])
+    assert diff["total_cost"]["new"] == await _fresh_total(PARAMS, quantity=40)
+
+    diff = await calc.recalculate(state, {"region_name": "Москва"})
+    assert {"region", "field.K3"} <= set(diff["evaluated"])
+    assert "field.K1" not in diff["evaluated"]
+    assert diff["total_cost"]["new"] == await _fresh_total(dict(PARAMS, region_name="Москва"), quantity=40)
+
+    unchanged = await calc.recalculate(state, {"region_name": "Москва"})
+    assert unchanged["evaluated"] == [] and unchanged["total_cost"]["delta"] == 0
+
+
+@pytest.mark.asyncio
+async def test_category_variant_switches_row_after_calculation():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    rows = {row["params"]["category"]: row for row in CATALOG["norm_items"] if row["params"]["scale"] == "1:500"}
+    state = await calc.start_session(dict(rows["II"]), 10, dict(PARAMS, category="II"))
+
+    # кнопка категории после расчета: вариант IV — другая строка той же таблицы
+    diff = await calc.recalculate(state, {"category": "IV"}, work=dict(rows["IV"]))
+    expected = await calc.calculate_full(dict(rows["IV"]), 10, dict(PARAMS, category="IV"))
+    assert state.work["id"] == "t9-iv"
+    assert diff["total_cost"]["new"] == expected["total_cost"] > diff["total_cost"]["old"]
+    assert diff["changed_params"]["work"] == (rows["II"]["work_title"], rows["IV"]["work_title"])
+
+    # та же строка — кэш прежний, пересчета нет
+    same = await calc.recalculate(state, {}, work=dict(rows["IV"]))
+    assert same["evaluated"] == [] and same["total_cost"]["delta"] == 0
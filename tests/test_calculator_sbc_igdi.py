@@ -1,57 +1,7 @@
 import pytest
 
 from bot.services.database import DatabaseService
-
-
-class FakeResponse:
-    def __init__(self, data):
-        self.data = data
-
-
-class FakeTable:
-    def __init__(self, rows):
-        self._rows = rows
-        self._filters = []
-
-    def select(self, _cols="*"):
-        return self
-
-    def like(self, field, pattern):
-        # very small LIKE support: prefix/suffix %
-        def _match(row):
-            val = str(row.get(field, ""))
-            pat = pattern.replace("%", "")
-            return pat in val
-        self._filters.append(_match)
-        return self
-
-    def eq(self, field, value):
-        self._filters.append(lambda row: row.get(field) == value)
-        return self
-
-    def in_(self, field, values):
-        self._filters.append(lambda row: row.get(field) in values)
-        return self
-
-    def execute(self):
-        rows = self._rows
-        for f in self._filters:
-            rows = [r for r in rows if f(r)]
-        return FakeResponse(rows)
-
-
-class FakeClient:
-    def __init__(self, data):
-        self._data = data
-
-    def table(self, name):
-        return FakeTable(self._data.get(name, []))
-
-
-class FakeDB(DatabaseService):
-    def __init__(self, data):
-        # bypass real supabase client
-        self.client = FakeClient(data)
+from tests.fixtures.fake_db import FakeDB
 
 
 def test_match_bool_none_param_does_not_match_explicit_condition():
@@ -298,3 +248,62 @@ async def test_k2_missing_param_does_not_activate_false_condition():
     db = FakeDB(data)
     coeffs = await db.get_k2_coefficients({})
     assert coeffs == []
+
+
+TRANSPORT_ADDONS = [
+    {
+        "code": "INTERNAL_T4_0_10_0_75",
+        "name": "Internal",
+        "calc_type": "percent",
+        "value": 0.10,
+        "base_type": "field",
+        "conditions": {
+            "distance_from_base_km_min": 0,
+            "distance_from_base_km_max": 10,
+            "field_cost_thousand_min": 0,
+            "field_cost_thousand_max": 75,
+        },
+        "source_ref": {},
+    },
+    {
+        "code": "EXTERNAL_T5_0_100_0_3",
+        "name": "External",
+        "calc_type": "percent",
+        "value": 0.20,
+        "base_type": "field_plus_internal",
+        "conditions": {
+            "distance_oneway_km_min": 0,
+            "distance_oneway_km_max": 100,
+            "duration_months_min": 0,
+            "duration_months_max": 3,
+        },
+        "source_ref": {},
+    },
+    {
+        "code": "ORG_LIQ_6PCT",
+        "name": "Org/Liq",
+        "calc_type": "percent",
+        "value": 0.06,
+        "base_type": "field_plus_internal",
+        "conditions": {},
+        "source_ref": {},
+    },
+]
+
+
+@pytest.mark.asyncio
+async def test_transport_addons_single_pass_chain():
+    db = FakeDB({"norm_addons": TRANSPORT_ADDONS})
+    addons = await db.get_addons_by_conditions(
+        params={"distance_to_base_km": 8, "external_distance_km": 80, "expedition_duration_months": 2},
+        field_cost=70000,
+    )
+    by_code = {a["code"]: a for a in addons}
+    # внутренний 70000*0.10 = 7000 → база внешнего и орг/ликв = 77000
+    assert by_code["INTERNAL_T4_0_10_0_75"]["amount"] == pytest.approx(7000, rel=1e-6)
+    assert by_code["EXTERNAL_T5_0_100_0_3"]["base"] == pytest.approx(77000, rel=1e-6)
+    assert by_code["EXTERNAL_T5_0_100_0_3"]["amount"] == pytest.approx(15400, rel=1e-6)
+    # орг/ликв: 0.06 * 2.0 (до 75 тыс.) от 77000
+    assert by_code["ORG_LIQ_6PCT"]["amount"] == pytest.approx(9240, rel=1e-6)
+    # каждое семейство надбавок запрошено ровно один раз
+    assert db.client.calls.count("norm_addons") == 3
@@ -0,0 +1,64 @@
+"""
+Тесты объединения одинаковых запросов к LLM в полете (AIAgent._chat_json)
+"""
+import asyncio
+
+import pytest
+
+from bot.services.ai_agent import AIAgent
+
+
+def _agent(fail=False):
+    agent = AIAgent("key", "model-a")
+    calls = []
+
+    async def request_json(prompt, op_name):
+        calls.append((op_name, prompt))
+        await asyncio.sleep(0.01)
+        if fail:
+            raise TimeoutError("upstream")
+        return {"prompt": prompt, "items": [1]}
+
+    agent._request_json = request_json
+    return agent, calls
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_call():
+    agent, calls = _agent()
+    results = await asyncio.gather(
+        agent._chat_json("p1", "extract_parameters"),
+        agent._chat_json("p1", "extract_parameters"),
+        agent._chat_json("p1", "extract_parameters"),
+        agent._chat_json("p1", "select_best_work"),
+        agent._chat_json("p2", "extract_parameters"),
+    )
+    assert len(calls) == 3
+    assert agent.coalesce_stats == {"upstream": 3, "saved": 2}
+    assert results[0] == results[1] == results[2] == {"prompt": "p1", "items": [1]}
+    # ожидающие получают копии: правка одного ответа не видна другим
+    results[1]["items"].append(2)
+    assert results[0]["items"] == [1] and results[2]["items"] == [1]
+
+    # завершенный запрос не переиспользуется, другая модель — другой ключ
+    await agent._chat_json("p1", "extract_parameters")
+    agent.model = "model-b"
+    await agent._chat_json("p1", "extract_parameters")
+    assert len(calls) == 5 and not agent._inflight
+
+
+@pytest.mark.asyncio
+async def test_error_and_cancel_shared_safely():
+    agent, calls = _agent(fail=True)
+    results = await asyncio.gather(
+        agent._chat_json("p", "op"), agent._chat_json("p", "op"), return_exceptions=True
+    )
+    assert len(calls) == 1 and all(isinstance(r, TimeoutError) for r in results)
+
+    agent, calls = _agent()
+    first = asyncio.ensure_future(agent._chat_json("p", "op"))
+    second = asyncio.ensure_future(agent._chat_json("p", "op"))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == {"prompt": "p", "items": [1]}
+    assert len(calls) == 1
@@ -0,0 +1,91 @@
+"""
+Тесты кэша коэффициентов K1/K2/K3 в калькуляторе
+"""
+import copy
+
+import pytest
+
+from bot.services.cache import LRUCache
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {"territory_type": "промпредприятие", "region_name": "Магаданская область"}
+
+
+def _coeff_queries(db):
+    return db.client.calls.count("norm_coeffs")
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_param_keys_follow_rule_conditions():
+    db = FakeDB(CATALOG)
+    keys = await db.get_coefficient_param_keys(9, "field")
+    assert {"territory_type", "territory"} <= keys["K1"]
+    assert "color_plan" in keys["K2"]
+    assert "salary_coeff" in keys["K3"]
+    everything = keys["K1"] | keys["K2"] | keys["K3"]
+    assert "quantity" not in everything and "comment" not in everything
+    # правило табл. 9 не влияет на другие таблицы
+    other = await db.get_coefficient_param_keys(10, "field")
+    assert "territory_type" not in other["K1"]
+
+
+@pytest.mark.asyncio
+async def test_quantity_and_unrelated_params_reuse_coefficients():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    first = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    queries = _coeff_queries(db)
+
+    second = await calc.calculate_full(dict(WORK), 25, dict(PARAMS, comment="уточнили площадь", include_org_liq=False))
+    assert _coeff_queries(db) == queries
+    assert second["field_calculation"]["coefficients"] == first["field_calculation"]["coefficients"]
+    assert second["office_calculation"]["coefficients"] == first["office_calculation"]["coefficients"]
+
+    # результат из кэша — копия, правки не портят кэш
+    second["field_calculation"]["coefficients"]["K1"]["value"] = 99
+    third = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert third["field_calculation"]["coefficients"] == first["field_calculation"]["coefficients"]
+    assert third["total_cost"] == first["total_cost"]
+
+
+@pytest.mark.asyncio
+async def test_relevant_param_change_misses_cache():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    industrial = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    misses = calc._coeff_cache.misses
+
+    plain = await calc.calculate_full(dict(WORK), 10, dict(PARAMS, territory_type="незастроенная"))
+    assert calc._coeff_cache.misses > misses
+    assert industrial["field_calculation"]["coefficients"]["K1"]["value"] == pytest.approx(1.75)
+    assert plain["field_calculation"]["coefficients"]["K1"]["value"] == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_catalog_version_change_invalidates_cache():
+    data = copy.deepcopy(CATALOG)
+    db = FakeDB(data)
+    calc = CostCalculator(db)
+    before = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+
+    data["norm_coeffs"][0]["value"] = 2.0
+    data["norm_docs"][0]["version"] = "2"
+    assert await db.refresh_catalog_version(force=True) == 1
+
+    after = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert before["field_calculation"]["coefficients"]["K1"]["value"] == pytest.approx(1.75)
+    assert after["field_calculation"]["coefficients"]["K1"]["value"] == pytest.approx(2.0)
@@ -0,0 +1,45 @@
+"""
+Тесты локального разбора параметров без LLM (RuleExtractor)
+"""
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.extractor import PARAM_FIELDS, RuleExtractor
+from tests.fixtures.messages import MESSAGES
+
+EXTRACTOR = RuleExtractor()
+
+
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda m: m["text"][:40])
+def test_corpus(message):
+    result = EXTRACTOR.extract(message["text"])
+    assert set(result.params) == set(PARAM_FIELDS)
+    assert result.confident == message["local"], result.missing
+    for key, value in message["expected"].items():
+        assert result.params[key] == value, key
+
+
+def test_limits_and_grades_are_not_quantities():
+    result = EXTRACTOR.extract("топоплан 1:500 (небольшие участки до 5 га) 4.4 га, 2 разряд, сечение 0,5м")
+    assert (result.params["quantity"], result.params["unit"]) == (4.4, "га")
+    assert result.params["height_section"] == 0.5 and result.confident
+    # разные объемы — решает LLM
+    assert EXTRACTOR.extract("топоплан 1:500 10 га и 15 га").missing == ["quantity", "unit"]
+
+
+@pytest.mark.asyncio
+async def test_agent_calls_llm_only_when_unsure():
+    agent = AIAgent("key", "model-a", extractor=RuleExtractor())
+    calls = []
+
+    async def chat_json(prompt, op_name):
+        calls.append(prompt)
+        return {"work_type": "топографическая съемка", "quantity": 10, "unit": "га", "scale": "1:500"}
+
+    agent._chat_json = chat_json
+    params = await agent.extract_parameters("топоплан 1:500 92 га промпредприятие сечение 0,5 II категория")
+    assert not calls
+    assert params["quantity"] == 92 and params["work_stage"] == "обе" and params["color_plan"] is None
+
+    await agent.extract_parameters("Сколько стоит топосъемка 10 га?")
+    assert len(calls) == 1
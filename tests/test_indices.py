@@ -0,0 +1,80 @@
+"""
+Тесты индексов изменения стоимости: поиск по периоду и итог в текущих ценах
+"""
+import pytest
+
+from bot.services.cache import ResultStore
+from bot.services.calculator import CostCalculator
+from bot.services.indices import InflationIndexTable, parse_period
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.expected_results import KASHIRSKAYA_GRES
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {"territory_type": "застроенная", "region_name": "Магаданская область"}
+
+
+def test_parse_period():
+    assert parse_period("2025Q3") == (2025, 3)
+    assert parse_period("2025 Q3") == parse_period("2025-3") == parse_period((2025, 3)) == (2025, 3)
+    assert parse_period(2024) == parse_period("2024") == (2024, 4)
+    assert parse_period("latest") is None
+    with pytest.raises(ValueError):
+        parse_period("третий квартал")
+
+
+def test_lookup_latest_not_after_period():
+    table = InflationIndexTable(CATALOG["inflation_indices"])
+    assert table.lookup("2024Q1", "ИГДИ").value == 5.83
+    # между публикациями действует последний опубликованный индекс
+    assert table.lookup("2024Q4", "ИГДИ").value == 5.83
+    assert table.lookup("2025Q4", "ИГДИ").value == 6.70
+    assert table.lookup("latest", "ИГДИ").value == 6.70
+    assert table.lookup("2022Q4", "ИГДИ") is None
+    # региональный индекс важнее общего, тип работ без своих индексов — индексы "все"
+    assert table.lookup("2025Q4", "ИГДИ", region="Московская область").value == 6.87
+    assert table.lookup("2025Q4", "ИГИ").value == 4.90
+    assert [i.value if i else None for i in table.compare(["2023Q2", "2024Q1", "2025Q3"], "ИГДИ")] == [5.20, 5.83, 6.70]
+
+
+def test_kashirskaya_total_with_index():
+    total = CostCalculator._indexed_total(KASHIRSKAYA_GRES["total_sbc_2001"], KASHIRSKAYA_GRES["index_2025"])
+    assert total == KASHIRSKAYA_GRES["total_with_index"]
+
+
+@pytest.mark.asyncio
+async def test_calculate_full_applies_index_over_cached_base(tmp_path):
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db, result_store=ResultStore(str(tmp_path / "results.sqlite")))
+
+    base = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert "price_index" not in base
+
+    indexed = await calc.calculate_full(dict(WORK), 10, dict(PARAMS), index_period="2024Q2")
+    assert indexed["total_cost"] == base["total_cost"]
+    assert indexed["price_index"]["value"] == 5.83 and indexed["price_index"]["period"] == "I кв. 2024"
+    assert indexed["total_with_index"] == pytest.approx(base["total_cost"] * 5.83, abs=0.01)
+
+    missing = await calc.calculate_full(dict(WORK), 10, dict(PARAMS), index_period="2020Q1")
+    assert "price_index" not in missing and missing["warnings"]
+
+    calls = len(db.client.calls)
+    rows = await calc.compare_price_indices(["2023Q1", "2024Q1", "latest"], total_cost=base["total_cost"], work=WORK)
+    assert len(db.client.calls) == calls
+    assert [row["index"]["value"] for row in rows] == [5.20, 5.83, 6.70]
+    assert rows[2]["total_with_index"] == pytest.approx(base["total_cost"] * 6.70, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_sweep_applies_index():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db, index_period="latest")
+    works = await db.get_work_variants(WORK, "category", ["II", "III"])
+    result = await calc.sweep(works, [5, 50], ["Магаданская область"], params={"territory_type": "застроенная"})
+
+    assert result.price_index["value"] == 6.70
+    for row in result.rows():
+        expected = await calc.calculate_full(
+            dict(works[row["category"]]), row["quantity"], {"territory_type": "застроенная", "region_name": row["region"]}
+        )
+        assert row["total_with_index"] == pytest.approx(expected["total_with_index"], abs=0.011)
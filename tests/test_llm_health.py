@@ -0,0 +1,89 @@
+"""
+Тесты хеджирования запросов к LLM и оценки здоровья моделей (ModelHealth)
+"""
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.llm_health import MIN_SAMPLES, ModelHealth, backoff_delay
+
+
+def _client(delays, calls, fail=()):
+    async def create(model, **kwargs):
+        calls.append(model)
+        await asyncio.sleep(delays.get(model, 0))
+        if model in fail:
+            raise TimeoutError(model)
+        message = SimpleNamespace(content=f'{{"model": "{model}"}}')
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def test_backoff_is_jittered_and_capped():
+    rng = random.Random(48)
+    for attempt in range(1, 8):
+        delays = [backoff_delay(attempt, cap=8.0, rng=rng) for _ in range(50)]
+        assert all(0 <= d <= min(8.0, 2 ** (attempt - 1)) for d in delays)
+        assert len(set(delays)) > 1
+
+
+def test_health_shifts_traffic_and_recovers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("bot.services.llm_health.time.monotonic", lambda: now[0])
+    health = ModelHealth(initial_delay=8.0, min_delay=2.0, max_delay=20.0)
+    assert health.hedge_delay("main") == 8.0
+    for latency in [1.0] * (MIN_SAMPLES - 1) + [3.0]:
+        health.record("main", latency, ok=True)
+    assert health.hedge_delay("main") == 3.0
+    assert health.order("main", "cheap") == ("main", "cheap")
+    assert health.order("main", None) == ("main", "main")
+
+    for _ in range(3):
+        health.record("main", 45.0, ok=False)
+    assert health.score("main") < 0.5
+    assert health.order("main", "cheap") == ("cheap", "main")
+    # без новых сбоев основная модель возвращается
+    now[0] += 600
+    assert health.order("main", "cheap") == ("main", "cheap")
+
+    for _ in range(MIN_SAMPLES * 10):
+        health.record_slow("slow", 40.0)
+    assert health.hedge_delay("slow") == 20.0 and health.score("slow") < 0.5
+
+
+@pytest.mark.asyncio
+async def test_hedge_goes_to_fallback_after_deadline():
+    health = ModelHealth(initial_delay=0.05, min_delay=0.01)
+    agent = AIAgent("key", "main", health=health, fallback_model="cheap")
+    calls = []
+    agent.client = _client({"main": 1.0}, calls)
+
+    assert await agent._chat_json("p", "op") == {"model": "cheap"}
+    assert calls == ["main", "cheap"] and agent.hedge_stats == {"hedged": 1, "hedge_won": 1, "skipped": 0}
+    # проигравший запрос отменен и учтен как медленный
+    assert list(health.models["main"].latencies) == [pytest.approx(0.05, abs=0.05)]
+
+    agent.client = _client({}, calls)
+    assert await agent._chat_json("p2", "op") == {"model": "main"}
+    assert agent.hedge_stats["hedged"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_attempts_retry_with_backoff(monkeypatch):
+    monkeypatch.setattr("bot.services.ai_agent.backoff_delay", lambda attempt, **kwargs: 0)
+    health = ModelHealth(initial_delay=5.0)
+    agent = AIAgent("key", "main", health=health)
+    calls = []
+    agent.client = _client({}, calls, fail={"main"})
+    with pytest.raises(TimeoutError):
+        await agent._chat_json("p", "op")
+    assert calls == ["main"] * 3 and health.score("main") < 0.5
+
+    # без ModelHealth — прежний путь без дублей
+    plain = AIAgent("key", "main")
+    plain.client = _client({"main": 0.01}, calls)
+    assert await plain._chat_json("p", "op") == {"model": "main"}
@@ -0,0 +1,139 @@
+"""
+Тесты общего допуска запросов к LLM (LLMLimiter)
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.llm_health import ModelHealth
+from bot.services.llm_limiter import PRIORITY_FOLLOWUP, PRIORITY_NEW, LLMLimiter
+
+
+async def _hold(limiter, order, name, user_id, priority=PRIORITY_NEW, delay=0.0):
+    async with limiter.slot(user_id, priority):
+        order.append(name)
+        await asyncio.sleep(delay)
+
+
+@pytest.mark.asyncio
+async def test_round_robin_across_users_and_followup_first():
+    limiter = LLMLimiter(max_concurrency=1, rate=0)
+    order = []
+    gate = asyncio.Event()
+
+    async def blocker():
+        async with limiter.slot("x"):
+            await gate.wait()
+
+    first = asyncio.ensure_future(blocker())
+    await asyncio.sleep(0)
+    tasks = [asyncio.ensure_future(_hold(limiter, order, name, user)) for name, user in
+             [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]]
+    tasks.append(asyncio.ensure_future(_hold(limiter, order, "c-followup", "c", PRIORITY_FOLLOWUP)))
+    await asyncio.sleep(0)
+    assert limiter.depth == 5 and limiter.stats["max_depth"] == 5
+
+    gate.set()
+    await asyncio.gather(first, *tasks)
+    assert order == ["c-followup", "a1", "b1", "a2", "a3"]
+    assert limiter.depth == 0 and limiter.active == 0 and limiter.stats["admitted"] == 6
+
+
+@pytest.mark.asyncio
+async def test_concurrency_cap_and_token_bucket():
+    limiter = LLMLimiter(max_concurrency=3, rate=0)
+    active, peak = [0], [0]
+
+    async def call():
+        async with limiter.slot("u"):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.01)
+            active[0] -= 1
+
+    await asyncio.gather(*(call() for _ in range(12)))
+    assert peak[0] == 3
+
+    bucket = LLMLimiter(max_concurrency=10, rate=20.0, burst=2)
+    order = []
+    t0 = time.monotonic()
+    await asyncio.gather(*(_hold(bucket, order, i, i) for i in range(6)))
+    # 2 сразу, остальные 4 — по одному за 1/20 сек
+    assert time.monotonic() - t0 >= 0.18
+    assert bucket.wait_p95() > 0.1 and bucket.stats["queued"] == 4
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    limiter = LLMLimiter(max_concurrency=1, rate=0)
+    order = []
+    holder = asyncio.ensure_future(_hold(limiter, order, "h", "u", delay=0.05))
+    await asyncio.sleep(0)
+    waiter = asyncio.ensure_future(_hold(limiter, order, "w", "v"))
+    await asyncio.sleep(0)
+    assert limiter.depth == 1
+    waiter.cancel()
+    await asyncio.sleep(0)
+    assert limiter.depth == 0
+    await holder
+    await _hold(limiter, order, "next", "v")
+    assert order == ["h", "next"] and limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_agent_requests_pass_through_limiter():
+    limiter = LLMLimiter(max_concurrency=1, rate=0)
+    agent = AIAgent("key", "model", limiter=limiter)
+    seen, active = [], [0]
+
+    async def create(**kwargs):
+        active[0] += 1
+        seen.append(active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        message = SimpleNamespace(content='{"work_type": "нивелирование", "quantity": 25, "unit": "км", "index": 1}')
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    works = [{"id": i, "work_title": "Нивелирование", "params": {}} for i in range(2)]
+    await asyncio.gather(
+        agent.extract_parameters("нивелирование 25 км", user_id=1),
+        agent.extract_parameters("нивелирование 30 км", user_id=2),
+        agent.select_best_work("нивелирование", works, {}, user_id=3),
+    )
+    assert seen == [1, 1, 1] and limiter.stats["admitted"] == 3
+
+
+@pytest.mark.asyncio
+async def test_hedge_takes_its_own_slot_or_is_skipped():
+    def client(delays, calls):
+        async def create(model, **kwargs):
+            calls.append(model)
+            await asyncio.sleep(delays.get(model, 0))
+            message = SimpleNamespace(content=f'{{"model": "{model}"}}')
+            return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=message)])
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    # свободное место есть — дубль занимает его на время своего запроса
+    limiter = LLMLimiter(max_concurrency=2, rate=0)
+    agent = AIAgent("key", "main", limiter=limiter, fallback_model="cheap",
+                    health=ModelHealth(initial_delay=0.02, min_delay=0.01))
+    calls = []
+    agent.client = client({"main": 0.2}, calls)
+    assert await agent._chat_json("p", "op") == {"model": "cheap"}
+    assert calls == ["main", "cheap"] and limiter.stats["admitted"] == 2
+    await asyncio.sleep(0)
+    assert limiter.active == 0
+
+    # единственное место занято основным запросом — дубль не отправляется
+    limiter = LLMLimiter(max_concurrency=1, rate=0)
+    agent = AIAgent("key", "main", limiter=limiter, fallback_model="cheap",
+                    health=ModelHealth(initial_delay=0.02, min_delay=0.01))
+    calls = []
+    agent.client = client({"main": 0.05}, calls)
+    assert await agent._chat_json("p", "op") == {"model": "main"}
+    assert calls == ["main"] and agent.hedge_stats == {"hedged": 0, "hedge_won": 0, "skipped": 1}
+    assert limiter.active == 0
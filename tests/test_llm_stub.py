@@ -0,0 +1,45 @@
+"""
+Тесты локальной заглушки OpenRouter (scripts/llm_stub.py) с AIAgent
+"""
+import pytest
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from bot.services.ai_agent import AIAgent
+from bot.services.prompts import PromptBuilder
+from scripts.llm_stub import STUB_KEY, StubConfig, make_app
+
+
+async def _serve(config):
+    server = TestServer(make_app(config))
+    await server.start_server()
+    return server
+
+
+@pytest.mark.asyncio
+async def test_agent_round_trip_through_stub():
+    server = await _serve(StubConfig(latency=0.0, seed=1))
+    try:
+        base_url = str(server.make_url("/v1"))
+        for builder in (None, PromptBuilder()):
+            agent = AIAgent("stub", "model", prompt_builder=builder, base_url=base_url)
+            params = await agent.extract_parameters("топоплан 1:500 92 га промпредприятие")
+            assert params["work_type"] == "топографическая съемка" and params["quantity"] == 92
+            assert agent.token_stats["calls"] == 1 and agent.token_stats["prompt"] > 0
+        assert server.app[STUB_KEY].stats["ok"] == 2
+    finally:
+        await server.close()
+
+
+@pytest.mark.asyncio
+async def test_stub_failure_rates():
+    server = await _serve(StubConfig(latency=0.0, rate_limit_rate=1.0))
+    try:
+        async with ClientSession() as session:
+            url = server.make_url("/chat/completions")
+            async with session.post(url, json={"messages": [{"role": "user", "content": "x"}]}) as response:
+                assert response.status == 429 and response.headers["retry-after"] == "1"
+            async with session.get(server.make_url("/stats")) as response:
+                assert (await response.json())["rate_limited"] == 1
+    finally:
+        await server.close()
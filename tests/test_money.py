@@ -0,0 +1,64 @@
+"""
+Тесты денежного ядра (целые копейки + точные дроби)
+"""
+import random
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+from bot.services import money
+from bot.services.calculator import CostCalculator
+from tests.fixtures.expected_results import ALL_ESTIMATES
+from tests.fixtures.fake_db import FakeDB
+
+
+def decimal_line_cost(price, quantity, *coeffs) -> float:
+    """Эталонный путь через Decimal (как было в калькуляторе)"""
+    total = Decimal(str(price)) * Decimal(str(quantity))
+    for c in coeffs:
+        total *= Decimal(str(c))
+    return float(total.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+@pytest.mark.parametrize("estimate", ALL_ESTIMATES, ids=lambda e: e["name"])
+def test_line_cost_matches_decimal_on_reference_estimates(estimate):
+    for work in estimate.get("field_works", []) + estimate.get("office_works", []):
+        coeffs = (work["K1"], work["K2"], work["K3"])
+        kopecks = money.line_cost(work["base_price"], work["quantity"], money.product(coeffs))
+        assert money.from_kopecks(kopecks) == decimal_line_cost(work["base_price"], work["quantity"], *coeffs)
+
+
+def test_line_cost_matches_decimal_random():
+    rnd = random.Random(2004)
+    coeff_pool = [1.0, 1.1, 1.15, 1.2, 1.25, 1.3, 1.333, 1.5, 1.55, 1.75, 0.5, 0.8, 0.096]
+    for _ in range(2000):
+        price = round(rnd.uniform(1, 20000), 2)
+        quantity = round(rnd.uniform(0, 500), rnd.choice([0, 1, 2, 3]))
+        coeffs = rnd.sample(coeff_pool, rnd.randint(0, 4))
+        kopecks = money.line_cost(price, quantity, money.product(coeffs))
+        assert money.from_kopecks(kopecks) == decimal_line_cost(price, quantity, *coeffs)
+
+
+def test_round_half_up():
+    assert money.round_div(5, 10) == 1
+    assert money.round_div(4, 10) == 0
+    assert money.round_div(-5, 10) == -1
+    assert money.to_kopecks("1333.005") == 133301
+    assert money.to_kopecks(0.125) == 13
+
+
+def test_ratio_is_exact_decimal():
+    assert money.ratio(1.15) == (23, 20)
+    assert money.ratio("0,5") == (1, 2)
+    assert money.to_float(money.product([1.75, 1.25])) == 2.1875
+
+
+@pytest.mark.asyncio
+async def test_calculate_full_rounds_once_per_stage():
+    db = FakeDB({})
+    calc = CostCalculator(db)
+    work = {"id": "w1", "work_title": "Тест", "unit": "га", "price_field": 1000, "price_office": 333.33}
+    result = await calc.calculate_full(work, 1.5, {}, work_stage="обе")
+    assert result["field_calculation"]["total"] == 1500.0
+    assert result["office_calculation"]["total"] == 500.0  # 499.995 → 500.00
+    assert result["total_cost"] == 2000.0
@@ -0,0 +1,62 @@
+"""
+Тесты кэша параметров, извлеченных LLM (ParamsCache, AIAgent.extract_parameters)
+"""
+import time
+
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.cache import ParamsCache
+
+MESSAGE = "Топоплан 92 га, промпредприятие, сечение рельефа 0,5 м"
+
+
+def test_key_normalizes_message():
+    key = ParamsCache.make_key(MESSAGE, "m1", "p1")
+    assert key == ParamsCache.make_key("  топоплан 92 га,   Промпредприятие, сечение рельефа 0,5 м.", "m1", "p1")
+    assert key != ParamsCache.make_key(MESSAGE.replace("92", "93"), "m1", "p1")
+    assert key != ParamsCache.make_key(MESSAGE, "m2", "p1")
+    assert key != ParamsCache.make_key(MESSAGE, "m1", "p2")
+
+
+def test_disk_tier_and_ttl(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache" / "params.sqlite")
+    cache = ParamsCache(path, memory_size=2, ttl=60)
+    cache.put("k", {"quantity": 92, "unit": "га"}, "m1")
+    cache.put("empty", {}, "m1")
+    cache.close()
+
+    reopened = ParamsCache(path, memory_size=2, ttl=60)
+    assert reopened.get("k") == {"quantity": 92, "unit": "га"}
+    assert reopened.get("empty") is None
+    assert reopened.stats()["disk_hits"] == 1 and reopened.hit_ratio == 0.5
+
+    now = time.time()
+    monkeypatch.setattr("bot.services.cache.time.time", lambda: now + 61)
+    assert reopened.get("k") is None and reopened.expired == 1
+    # истекшая запись удалена и с диска
+    assert ParamsCache(path, ttl=0).get("k") is None
+
+
+@pytest.mark.asyncio
+async def test_repeat_message_skips_llm():
+    agent = AIAgent("key", "model-a", params_cache=ParamsCache())
+    calls = []
+
+    async def chat_json(prompt, op_name):
+        calls.append(prompt)
+        return {"main": {"quantity": 92, "unit": "га"}, "territory_type": "промпредприятие", "color_plan": True}
+
+    agent._chat_json = chat_json
+    first = await agent.extract_parameters(MESSAGE)
+    # флаг без триггера в тексте обнулен до записи в кэш
+    assert first["quantity"] == 92 and first["color_plan"] is None
+
+    first["quantity"] = 1
+    again = await agent.extract_parameters(MESSAGE.upper() + "  ")
+    assert len(calls) == 1
+    assert again["quantity"] == 92 and again == {**first, "quantity": 92}
+    assert agent.params_cache.stats()["hits"] == 1
+
+    await agent.extract_parameters(MESSAGE + " 1:500")
+    assert len(calls) == 2
@@ -0,0 +1,140 @@
+"""
+Тесты скомпилированных шкал формульных надбавок (табл.78-80) против перебора строк
+"""
+import random
+
+import numpy as np
+import pytest
+
+from bot.services.database import DatabaseService
+from bot.services.piecewise import PIECEWISE_FAMILIES, PiecewiseSchedule, compile_schedules, piecewise_total
+from tests.fixtures.fake_db import FakeDB
+
+FLAGS = {"include_program": True, "include_report": True, "include_registration": True}
+
+
+def reference_addons(rows, params, base_thousand):
+    """Эталон: перебор всех строк семейств, как в DatabaseService до компиляции шкал"""
+    result = []
+    for flag, prefix in PIECEWISE_FAMILIES:
+        if not params.get(flag):
+            continue
+        for row in rows:
+            if not row["code"].startswith(prefix):
+                continue
+            cond = row.get("conditions", {})
+            min_th = cond.get("base_cost_thousand_min")
+            if not DatabaseService._match_range(base_thousand, min_th, cond.get("base_cost_thousand_max")):
+                continue
+            amount = DatabaseService._piecewise_amount(
+                base_thousand, cond.get("fixed_amount"), cond.get("percent_over"), min_th
+            )
+            result.append((row["code"], round(amount, 2)))
+    return result
+
+
+def reference_total(rows, params, base_thousand):
+    """Эталон векторного пути: маска полосы по каждой строке, суммы — round(x, 2), как в DatabaseService"""
+    total = np.zeros(base_thousand.shape)
+    for flag, prefix in PIECEWISE_FAMILIES:
+        if not params.get(flag):
+            continue
+        for row in rows:
+            if not row["code"].startswith(prefix):
+                continue
+            cond = row["conditions"]
+            lo = cond.get("base_cost_thousand_min")
+            hi = cond.get("base_cost_thousand_max")
+            fixed = float(cond.get("fixed_amount") or 0.0)
+            if cond.get("percent_over") is None:
+                amount = np.full(base_thousand.shape, fixed)
+            else:
+                threshold = 0.0 if lo is None else lo
+                amount = fixed + np.maximum(base_thousand - threshold, 0.0) * 1000.0 * cond["percent_over"]
+            in_band = (base_thousand >= (-np.inf if lo is None else lo)) & (base_thousand <= (np.inf if hi is None else hi))
+            total = total + np.where(in_band, np.vectorize(lambda x: round(x, 2))(amount), 0.0)
+    return total
+
+
+def random_family(rnd, prefix, overlapping=False):
+    """Полосы с общими границами (как в СБЦ), в случайном порядке строк БД"""
+    edges = sorted(rnd.sample(range(5, 3000, 5), rnd.randint(1, 6)))
+    bounds = [None] + edges + [None] if rnd.random() < 0.5 else [0] + edges + [None]
+    rows = []
+    for i, (lo, hi) in enumerate(zip(bounds, bounds[1:])):
+        if overlapping and hi is not None:
+            hi += rnd.choice([10, 50])
+        cond = {"base_cost_thousand_min": lo, "base_cost_thousand_max": hi,
+                "fixed_amount": rnd.choice([None, 0, 1500, 4300, round(rnd.uniform(0, 90000), 2)])}
+        if rnd.random() < 0.8:
+            cond["percent_over"] = rnd.choice([0.01, 0.02, 0.03, 0.025, 0.015, 0.0125])
+        rows.append({"code": f"{prefix}{i}", "name": prefix, "calc_type": "percent",
+                     "value": cond.get("percent_over", 0), "base_type": "subtotal", "conditions": cond})
+    rnd.shuffle(rows)
+    return rows
+
+
+def random_bases(rnd, rows, n=300):
+    breakpoints = [v for row in rows for v in (row["conditions"]["base_cost_thousand_min"],
+                                               row["conditions"]["base_cost_thousand_max"]) if v is not None]
+    bases = [round(rnd.uniform(0, 3500), rnd.choice([0, 2, 5])) for _ in range(n)]
+    return bases + breakpoints + [b + 1e-5 for b in breakpoints] + [b - 1e-5 for b in breakpoints]
+
+
+@pytest.mark.parametrize("overlapping", [False, True])
+def test_schedules_match_row_scan(overlapping):
+    rnd = random.Random(78 + overlapping)
+    for _ in range(60):
+        rows = [row for _, prefix in PIECEWISE_FAMILIES for row in random_family(rnd, prefix, overlapping)]
+        schedules = compile_schedules({prefix: [r for r in rows if r["code"].startswith(prefix)]
+                                       for _, prefix in PIECEWISE_FAMILIES})
+        params = {flag: rnd.random() < 0.7 for flag in FLAGS}
+        bases = random_bases(rnd, rows)
+        for base in bases:
+            compiled = [
+                (row["code"], round(amount, 2))
+                for flag, prefix in PIECEWISE_FAMILIES if params[flag]
+                for row, amount in schedules[prefix].lookup(base)
+            ]
+            assert compiled == reference_addons(rows, params, base), base
+
+        arr = np.array(bases)
+        assert np.array_equal(piecewise_total(schedules, params, arr), reference_total(rows, params, arr))
+
+
+def test_touching_bands_and_bisectable_flag():
+    rows = [
+        {"code": "PROGRAM_T78_100", "conditions": {"base_cost_thousand_min": 100, "fixed_amount": 4300,
+                                                   "percent_over": 0.03}},
+        {"code": "PROGRAM_T78_0_100", "conditions": {"base_cost_thousand_min": 0, "base_cost_thousand_max": 100,
+                                                     "fixed_amount": 4300}},
+    ]
+    schedule = PiecewiseSchedule.compile("PROGRAM_T78_", rows)
+    assert schedule.bisectable and list(schedule.breakpoints) == [0, 100]
+    # на общей границе применяются обе полосы, в порядке строк БД
+    assert [row["code"] for row, _ in schedule.lookup(100)] == ["PROGRAM_T78_100", "PROGRAM_T78_0_100"]
+    assert [amount for _, amount in schedule.lookup(250)] == [pytest.approx(8800)]
+    assert schedule.lookup(-1) == []
+
+    overlapping = PiecewiseSchedule.compile("PROGRAM_T78_", [
+        {"code": "A", "conditions": {"base_cost_thousand_min": 0, "base_cost_thousand_max": 200}},
+        {"code": "B", "conditions": {"base_cost_thousand_min": 100}},
+    ])
+    assert not overlapping.bisectable
+    assert [row["code"] for row, _ in overlapping.lookup(150)] == ["A", "B"]
+
+
+@pytest.mark.asyncio
+async def test_database_compiles_schedules_once():
+    rnd = random.Random(80)
+    rows = [row for _, prefix in PIECEWISE_FAMILIES for row in random_family(rnd, prefix)]
+    db = FakeDB({"norm_addons": rows})
+    per_request = []
+    for base in random_bases(rnd, rows, n=50):
+        before = len(db.client.calls)
+        addons = await db.get_addons_by_conditions({**FLAGS, "base_cost_thousand": base}, field_cost=0)
+        per_request.append(db.client.calls[before:].count("norm_addons"))
+        assert [(a["code"], a["amount"]) for a in addons] == reference_addons(rows, FLAGS, base)
+    # строки семейств табл.78-80 загружаются только первым запросом
+    assert per_request[0] - per_request[1] == len(PIECEWISE_FAMILIES)
+    assert len(set(per_request[1:])) == 1
@@ -0,0 +1,97 @@
+"""
+Тесты скомпилированных планов расчета
+"""
+import copy
+import itertools
+
+import pytest
+
+from bot.services.calculator import CostCalculator
+from bot.services.plan import CalculationPlan
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {
+    "territory_type": "промпредприятие",
+    "region_name": "Магаданская область",
+    "distance_to_base_km": 3,
+    "include_program": True,
+}
+
+
+def _coeff_queries(db):
+    return db.client.calls.count("norm_coeffs")
+
+
+@pytest.mark.asyncio
+async def test_plan_holds_rule_subsets_and_keys():
+    db = FakeDB(CATALOG)
+    rules = await db.load_coeff_rules()
+    engine = db.rule_engines.get()
+    plan = CalculationPlan.compile(dict(WORK), rules, db.catalog_version, engine)
+
+    field, office = plan.stages["field"], plan.stages["office"]
+    assert [c["code"] for c in field.rules["K1"]] == ["T9_INDUSTRIAL"]
+    assert field.rules["K2"] == ()
+    assert [c["code"] for c in office.rules["K3"]] == ["SALARY_1_7"]
+    assert "territory_type" in field.param_keys["K1"]
+    assert "salary_coeff" in field.param_keys["K3"]
+    assert field.has_price and plan.matches(dict(WORK))
+    assert not plan.matches(dict(WORK, price_field=1))
+
+    # правило табл. 9 не попадает в план строки другой таблицы
+    other = CalculationPlan.compile(dict(WORK, id="t10", table_no=10), rules, db.catalog_version, engine)
+    assert other.stages["field"].rules["K1"] == ()
+
+
+@pytest.mark.asyncio
+async def test_plan_path_matches_db_path():
+    variants = {
+        "territory_type": ["промпредприятие", "незастроенная", None],
+        "salary_coeff": [1.7, None],
+        "work_stage": ["обе", "полевые", "камеральные"],
+    }
+    planned = CostCalculator(FakeDB(CATALOG))
+    direct = CostCalculator(FakeDB(CATALOG))
+    direct.plans = None
+
+    for work in CATALOG["norm_items"]:
+        for values in itertools.product(*variants.values()):
+            params = {k: v for k, v in zip(variants, values) if v is not None}
+            stage = params["work_stage"]
+            a = await planned.calculate_full(dict(work), 10, dict(PARAMS, **params), work_stage=stage)
+            b = await direct.calculate_full(dict(work), 10, dict(PARAMS, **params), work_stage=stage)
+            for key in ("field_calculation", "office_calculation"):
+                assert (a.get(key) or {}).get("coefficients") == (b.get(key) or {}).get("coefficients")
+            assert a["total_cost"] == b["total_cost"]
+
+
+@pytest.mark.asyncio
+async def test_precompiled_plans_avoid_rule_queries():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    assert await calc.plans.precompile() == len(CATALOG["norm_items"])
+    assert len(calc.plans) == len(CATALOG["norm_items"])
+
+    queries = _coeff_queries(db)
+    for work in CATALOG["norm_items"]:
+        await calc.calculate_full(dict(work), 10, dict(PARAMS))
+    assert _coeff_queries(db) == queries
+
+
+@pytest.mark.asyncio
+async def test_catalog_change_recompiles_plans():
+    data = copy.deepcopy(CATALOG)
+    db = FakeDB(data)
+    calc = CostCalculator(db)
+    await calc.plans.precompile()
+
+    data["norm_coeffs"][0]["value"] = 2.0
+    data["norm_docs"][0]["version"] = "2"
+    await db.refresh_catalog_version(force=True)
+    assert len(calc.plans) == len(data["norm_items"])
+
+    result = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert result["field_calculation"]["coefficients"]["K1"]["value"] == pytest.approx(2.0)
+    assert len(calc.plans) == 1
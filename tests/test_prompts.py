@@ -0,0 +1,58 @@
+"""
+Тесты компактного промпта extract_parameters (PromptBuilder)
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.prompts import STATIC_PREFIX, PromptBuilder, estimate_tokens, prompt_version
+from tests.fixtures.messages import MESSAGES
+
+
+def test_static_prefix_and_message_last():
+    builder = PromptBuilder()
+    for message in MESSAGES:
+        built = builder.build(message["text"])
+        assert built.text.startswith(STATIC_PREFIX)
+        assert built.text.endswith(f'Запрос: "{message["text"]}"')
+        assert len(built.examples) == 6
+
+
+def test_sections_follow_keywords():
+    builder = PromptBuilder(examples=2)
+    built = builder.build("нивелирование IV класса 25 км II категория")
+    assert built.sections == ["satellite"] and "color_plan" not in built.text
+
+    built = builder.build("топоплан 1:500 25 га, горный район 2500 м, план в цвете")
+    assert built.sections == ["k2", "k3"]
+    assert built.examples[0] == "горный район 2500м"
+
+
+def test_expected_fields_are_described_and_prompt_is_shorter():
+    builder = PromptBuilder()
+    agent = AIAgent("key", "model")
+    for message in MESSAGES:
+        built = builder.build(message["text"])
+        for key in message["expected"]:
+            assert f"- {key}:" in built.text, (key, message["text"])
+        assert built.tokens < 0.8 * estimate_tokens(agent._extract_prompt(message["text"]))
+
+
+@pytest.mark.asyncio
+async def test_agent_uses_builder_and_counts_tokens():
+    agent = AIAgent("key", "model", prompt_builder=PromptBuilder())
+    assert agent._prompt_version == prompt_version() != AIAgent("key", "model")._prompt_version
+    prompts = []
+
+    async def create(**kwargs):
+        prompts.append(kwargs["messages"][0]["content"])
+        usage = SimpleNamespace(prompt_tokens=900, completion_tokens=40,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=500))
+        message = SimpleNamespace(content='{"work_type": "нивелирование", "quantity": 25, "unit": "км"}')
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=message)])
+
+    agent.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    params = await agent.extract_parameters("нивелирование 25 км")
+    assert params["quantity"] == 25 and prompts[0].startswith(STATIC_PREFIX)
+    assert agent.token_stats == {"calls": 1, "prompt": 900, "completion": 40, "cached": 500}
@@ -0,0 +1,71 @@
+"""
+Тесты локального ранжирования строк расценок (select_best_work без LLM)
+"""
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.ranking import decisive, rank_works, road_category, voltage
+
+
+def _work(work_id, title, **params):
+    return {"id": work_id, "work_title": title, "section": 1, "params": params, "price_field": 100, "price_office": 50}
+
+
+ROADS = [
+    _work("r1", "Изыскания автомобильных дорог", road_category="I-II", category="II"),
+    _work("r2", "Изыскания автомобильных дорог", road_category="III-IV", category="II"),
+    _work("r3", "Изыскания автомобильных дорог", road_category="V", category="II"),
+    _work("r4", "Изыскания автомобильных дорог", road_category="III-IV", category="III"),
+]
+TOPO = [
+    _work("t1", "Инженерно-топографический план", scale="1:500", category="II"),
+    _work("t2", "Инженерно-топографический план", scale="1:1000", category="II"),
+    _work("t3", "Инженерно-топографический план", scale="1:500", category="III"),
+]
+
+
+def test_text_facets():
+    assert road_category("автодорог III-IV категории (II кат.сложности)") == "III-IV"
+    assert road_category("дорога V категории") == "V"
+    assert road_category("III категория сложности") is None
+    assert voltage("ЛЭП 110 кВ") == 110
+
+
+def test_facets_decide():
+    ranked = rank_works("изыскания автодорог III-IV категории, II категория сложности", ROADS, {"category": "II"})
+    selected, _ = decisive(ranked)
+    assert selected["id"] == "r2"
+
+    selected, _ = decisive(rank_works("топоплан 1:500 III кат.", TOPO, {"scale": "1:500", "category": "III"}))
+    assert selected["id"] == "t3"
+
+
+def test_ties_go_to_llm_with_tied_candidates_only():
+    ranked = rank_works("топоплан II категория", TOPO, {"category": "II"})
+    selected, tied = decisive(ranked)
+    assert selected is None and {item.work["id"] for item in tied} == {"t1", "t2"}
+
+    # популярность только упорядочивает равных
+    popular = [dict(TOPO[1], popularity_score=50), TOPO[0]]
+    ranked = rank_works("топоплан II категория", popular, {"category": "II"})
+    assert ranked[0].work["id"] == "t2" and decisive(ranked)[0] is None
+
+
+@pytest.mark.asyncio
+async def test_select_best_work_fast_path():
+    agent = AIAgent("key", "model-a")
+    prompts = []
+
+    async def chat_json(prompt, op_name):
+        prompts.append(prompt)
+        return {"index": 2}
+
+    agent._chat_json = chat_json
+    selected = await agent.select_best_work("топоплан 1:1000 II кат.", TOPO, {"scale": "1:1000", "category": "II"})
+    assert selected["id"] == "t2" and not prompts
+
+    selected = await agent.select_best_work("топоплан II категория", TOPO, {"category": "II"})
+    assert len(prompts) == 1 and selected["id"] == "t2"
+    # в LLM ушли только равные кандидаты
+    assert prompts[0].count("руб)") == 2
+    assert agent.selection_stats == {"local": 1, "llm": 1}
@@ -0,0 +1,86 @@
+"""
+Тесты кэша результатов расчета (ResultStore)
+"""
+import pytest
+
+from bot.services import money
+from bot.services.cache import ResultStore
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {"territory_type": "промпредприятие", "region_name": "Магаданская область", "include_program": True}
+
+
+def test_key_is_stable_and_content_addressed():
+    key = ResultStore.make_key(WORK, money.ratio(10), {"a": 1, "b": "x"}, "обе", "v1")
+    assert key == ResultStore.make_key(dict(WORK), money.ratio(10.0), {"b": "x", "a": 1}, "обе", "v1")
+    assert key != ResultStore.make_key(WORK, money.ratio(11), {"a": 1, "b": "x"}, "обе", "v1")
+    assert key != ResultStore.make_key(WORK, money.ratio(10), {"a": 1, "b": "x"}, "обе", "v2")
+    assert key != ResultStore.make_key(dict(WORK, price_field=1), money.ratio(10), {"a": 1, "b": "x"}, "обе", "v1")
+
+
+def test_store_survives_restart(tmp_path):
+    path = str(tmp_path / "cache" / "results.sqlite")
+    store = ResultStore(path, memory_size=2)
+    store.put("k", {"total_cost": 1.5, "addons_applied": []}, "v1")
+    store.close()
+
+    reopened = ResultStore(path, memory_size=2)
+    assert reopened.get("k") == {"total_cost": 1.5, "addons_applied": []}
+    assert reopened.disk_hits == 1
+    # повторное чтение — из памяти
+    reopened.get("k")
+    assert reopened.disk_hits == 1 and reopened.memory.hits == 1
+    assert reopened.prune("v2") == 1
+    assert reopened.get("k") is None
+
+
+@pytest.mark.asyncio
+async def test_repeated_calculation_served_from_store(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db, result_store=ResultStore(path))
+    first = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    calls = len(db.client.calls)
+
+    again = await calc.calculate_full(dict(WORK), 10.0, dict(PARAMS))
+    assert again == first
+    assert len(db.client.calls) == calls
+
+    # новый процесс: тот же файл, пустая память
+    db2 = FakeDB(CATALOG)
+    restarted = CostCalculator(db2, result_store=ResultStore(path))
+    assert await restarted.calculate_full(dict(WORK), 10, dict(PARAMS)) == first
+    assert "norm_coeffs" not in db2.client.calls
+
+
+@pytest.mark.asyncio
+async def test_catalog_change_misses_store(tmp_path):
+    data = {**CATALOG, "norm_docs": [dict(CATALOG["norm_docs"][0], version="1")]}
+    db = FakeDB(data)
+    calc = CostCalculator(db, result_store=ResultStore(str(tmp_path / "results.sqlite")))
+    await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+
+    data["norm_docs"] = [dict(CATALOG["norm_docs"][0], version="2")]
+    await db.refresh_catalog_version(force=True)
+    calls = len(db.client.calls)
+    await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert "norm_coeffs" in db.client.calls[calls:]
+
+
+@pytest.mark.asyncio
+async def test_regional_data_change_misses_store(tmp_path):
+    data = {**CATALOG, "regional_coeffs": [dict(row) for row in CATALOG["regional_coeffs"]]}
+    path = str(tmp_path / "results.sqlite")
+    first = await CostCalculator(FakeDB(data), result_store=ResultStore(path)).calculate_full(
+        dict(WORK), 10, dict(PARAMS)
+    )
+
+    # после перезапуска с новым районным коэффициентом сохраненный результат не годится
+    data["regional_coeffs"] = [dict(row, salary_coeff=float(row["salary_coeff"]) + 0.2) for row in data["regional_coeffs"]]
+    db = FakeDB(data)
+    again = await CostCalculator(db, result_store=ResultStore(path)).calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert "norm_coeffs" in db.client.calls
+    assert again["params"]["salary_coeff"] != first["params"]["salary_coeff"]
@@ -0,0 +1,124 @@
+"""
+Тесты предвычисленных exclusive_group и проверки согласованности правил norm_coeffs
+"""
+import random
+
+import pytest
+
+from bot.services.plan import CalculationPlan
+from bot.services.rule_groups import RuleGroups, filter_exclusive
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+DOC_ID = CATALOG["norm_docs"][0]["id"]
+WORK = dict(CATALOG["norm_items"][0], table_no=10)
+
+
+def _k1(code, value, group=None, **conditions):
+    return {"code": code, "name": code, "value": value, "apply_to": "price", "doc_id": DOC_ID,
+            "exclusive_group": group, "conditions": {"table_no": 10, **conditions}, "source_ref": {"table": 10}}
+
+
+def _k2(code, value, group=None, **conditions):
+    return {"code": code, "name": code, "value": value, "apply_to": "office", "doc_id": DOC_ID,
+            "exclusive_group": group, "conditions": conditions,
+            "source_ref": {"source": "rtf_2004", "section": "п.15г"}}
+
+
+# Высокогорье (группа MOUNTAIN), площадь съемки и радиоактивность (без групп)
+RULES = [
+    _k1("MOUNTAIN_1500", 1.2, "MOUNTAIN", altitude_min=1500, altitude_max=2000),
+    _k1("MOUNTAIN_1000", 1.3, "MOUNTAIN", altitude_min=1000),
+    _k1("MOUNTAIN_3000", 1.5, "MOUNTAIN", altitude_min=3000, altitude_max=3500),
+    _k1("AREA_1", 1.4, area_max=1.0),
+    _k1("AREA_1_5", 1.2, area_min=1.0, area_max=5.0),
+    _k1("SCALE_BAD", 1.1, scale_min="1:5000", scale_max="1:2000"),
+    _k2("RADIOACTIVITY_1_25", 1.25, radioactivity_msv_per_year_min=1),
+    _k2("RADIOACTIVITY_1_5", 1.5, radioactivity_msv_per_year_min=1),
+    _k2("COLOR_PLAN", 1.1, "COLOR_OR_COMPUTER", color_plan=True),
+    _k2("COMPUTER", 1.2, "COLOR_OR_COMPUTER", computer_tech=True),
+]
+
+
+def test_select_matches_regrouping():
+    rnd = random.Random(40)
+    for _ in range(300):
+        rules = [
+            {"code": f"R{i}", "value": rnd.choice([1.0, 1.1, 1.2, 1.2, None]),
+             "exclusive_group": rnd.choice([None, "A", "B", "C"]), "conditions": {}}
+            for i in range(rnd.randint(0, 12))
+        ]
+        groups = RuleGroups(rules)
+        subset = [c for c in rules if rnd.random() < 0.6]
+        assert groups.select(subset) == filter_exclusive(subset)
+    # правила другой загрузки (не из документа) отбираются перегруппировкой
+    foreign = [dict(c) for c in RULES]
+    assert RuleGroups(RULES).select(foreign) == filter_exclusive(foreign)
+
+
+def test_issues_found_once_at_load():
+    groups = RuleGroups(RULES, "SBC_IGDI_2004")
+    assert [c["code"] for c in groups.groups["MOUNTAIN"]] == ["MOUNTAIN_3000", "MOUNTAIN_1000", "MOUNTAIN_1500"]
+    issues = {issue.kind: [] for issue in groups.issues}
+    for issue in groups.issues:
+        issues[issue.kind].append(issue.codes)
+
+    # на 1500-2000 м всегда подходит и более сильное MOUNTAIN_1000
+    assert issues["dominated"] == [("MOUNTAIN_1500", "MOUNTAIN_1000")]
+    assert groups.never_wins(RULES[0]) and not groups.never_wins(RULES[2])
+    assert issues["impossible"] == [("SCALE_BAD",)]
+    # граница 1 га входит в оба диапазона; радиоактивность — одинаковые условия
+    assert sorted(issues["conflict"]) == [("AREA_1", "AREA_1_5"), ("RADIOACTIVITY_1_25", "RADIOACTIVITY_1_5")]
+
+
+@pytest.mark.asyncio
+async def test_plan_prunes_dominated_and_selects_by_rank():
+    db = FakeDB({**CATALOG, "norm_coeffs": RULES})
+    rules = await db.load_coeff_rules()
+    groups = db.rule_groups()
+    assert groups is not None and groups.rules is rules
+
+    engine = db.rule_engines.get()
+    plan = CalculationPlan.compile(dict(WORK), rules, db.catalog_version, engine, groups)
+    assert "MOUNTAIN_1500" not in [c["code"] for c in plan.stages["field"].rules["K1"]]
+    unpruned = CalculationPlan.compile(dict(WORK), rules, db.catalog_version, engine)
+
+    for altitude in (None, 900, 1000, 1700, 2500, 3200):
+        for area in (None, 0.5, 1.0, 3.0):
+            params = {"altitude_m": altitude, "area_ha": area, "color_plan": True, "use_computer": True}
+            for stage in ("field", "office"):
+                for factor in ("K1", "K2"):
+                    assert plan.match(factor, stage, params) == unpruned.match(factor, stage, params)
+    k2 = [c["code"] for c in plan.match("K2", "office", {"color_plan": True, "use_computer": True})]
+    assert "COMPUTER" in k2 and "COLOR_PLAN" not in k2
+
+    # повторная загрузка берет правила и группы из кэша
+    calls = len(db.client.calls)
+    assert await db.load_coeff_rules() is rules and db.rule_groups() is groups
+    assert len(db.client.calls) == calls
+
+
+def _k3(code, value, group=None, **conditions):
+    return {"code": code, "name": code, "value": value, "apply_to": "field", "doc_id": DOC_ID,
+            "exclusive_group": group, "conditions": conditions,
+            "source_ref": {"source": "rtf_2004", "section": "п.8а"}}
+
+
+@pytest.mark.asyncio
+async def test_k3_and_empty_conditions_not_pruned():
+    # K3 без условий match_k3 не выбирает, а групп K3 не учитывает вовсе
+    k3_rules = [
+        _k3("K3_ALL", 1.5, "SEASON"),
+        _k3("K3_6M", 1.2, "SEASON", unfavorable_months_min=6, unfavorable_months_max=7.5),
+    ]
+    db = FakeDB({**CATALOG, "norm_coeffs": k3_rules + [_k2("K2_ALL", 1.3, "MEDIA"), _k2("K2_DUAL", 1.1, "MEDIA", dual_media=True)]})
+    rules = await db.load_coeff_rules()
+    groups = db.rule_groups()
+    assert not groups.issues and not any(groups.never_wins(c) for c in rules)
+
+    engine = db.rule_engines.get()
+    plan = CalculationPlan.compile(dict(WORK), rules, db.catalog_version, engine, groups)
+    unpruned = CalculationPlan.compile(dict(WORK), rules, db.catalog_version, engine)
+    params = {"unfavorable_months": 6.5}
+    assert [c["code"] for c in plan.match("K3", "field", params)] == ["K3_6M"]
+    assert plan.match("K3", "field", params) == unpruned.match("K3", "field", params)
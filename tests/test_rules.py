@@ -0,0 +1,86 @@
+"""
+Тесты реестра движков правил по документам norm_docs
+"""
+import copy
+import sys
+
+import pytest
+
+from bot.services.calculator import CostCalculator
+from bot.services.rules import IgdiRuleEngine, RuleEngine, RuleEngineRegistry
+from tests.fixtures.catalog import CATALOG, DOC_ID
+from tests.fixtures.fake_db import FakeDB
+
+GEOLOGY_ENGINE = "tests.fixtures.geology_engine:GeologyRuleEngine"
+PARAMS = {"territory_type": "промпредприятие", "region_name": "Магаданская область"}
+
+
+def _two_documents():
+    data = copy.deepcopy(CATALOG)
+    for item in data["norm_items"]:
+        item["doc_id"] = DOC_ID
+    data["norm_docs"].append({"id": "doc-igi", "code": "SBC_IGI_2004"})
+    data["norm_items"].append(
+        {"id": "igi-t9", "doc_id": "doc-igi", "work_title": "Бурение скважин", "unit": "м", "table_no": 9,
+         "section": "1", "price_field": 1000, "price_office": 200,
+         "params": {"scale": "1:500", "category": "III"}}
+    )
+    data["norm_coeffs"] += [
+        {"code": "IGI_T9_INDUSTRIAL", "name": "Промпредприятие", "value": 1.2, "apply_to": "price",
+         "doc_id": "doc-igi", "conditions": {"table_no": 9, "territory_type": "промпредприятие"},
+         "source_ref": {"table": 9, "note": 1}},
+        {"code": "IGI_SALARY_1_7", "name": "Районный 1.7", "value": 1.4, "apply_to": "field", "doc_id": "doc-igi",
+         "conditions": {"salary_coeff": 1.7}, "source_ref": {"source": "rtf_igi", "section": "п.6б"}},
+    ]
+    return data
+
+
+def test_engines_are_loaded_lazily():
+    sys.modules.pop("tests.fixtures.geology_engine", None)
+    registry = RuleEngineRegistry({"SBC_IGI_2004": GEOLOGY_ENGINE})
+    assert registry.loaded == ()
+
+    assert isinstance(registry.get(), IgdiRuleEngine)
+    assert registry.loaded == ("SBC_IGDI_2004",)
+    assert "tests.fixtures.geology_engine" not in sys.modules
+
+    geology = registry.get("SBC_IGI_2004")
+    assert geology.k3_sections == ("п.6",) and registry.get("SBC_IGI_2004") is geology
+
+    # документ без движка — только K1 примечаний к таблицам
+    unknown = registry.get("SBC_ECO_2004")
+    assert type(unknown) is RuleEngine and unknown.doc_code == "SBC_ECO_2004"
+    assert unknown.match_k3([{"apply_to": "field", "conditions": {"salary_coeff": 1.7},
+                              "source_ref": {"source": "rtf_2004", "section": "п.8"}}], {"salary_coeff": 1.7}) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_plans", [True, False])
+async def test_each_document_uses_its_engine(use_plans):
+    data = _two_documents()
+    db = FakeDB(data)
+    db.rule_engines.register("SBC_IGI_2004", GEOLOGY_ENGINE)
+    calc = CostCalculator(db)
+    if not use_plans:
+        calc.plans = None
+
+    igdi = await calc.calculate_full(dict(data["norm_items"][0]), 10, dict(PARAMS))
+    assert db.rule_engines.loaded == ("SBC_IGDI_2004",)
+    geology = await calc.calculate_full(dict(data["norm_items"][-1]), 10, dict(PARAMS))
+    assert set(db.rule_engines.loaded) == {"SBC_IGDI_2004", "SBC_IGI_2004"}
+
+    igdi_field = igdi["field_calculation"]["coefficients"]
+    geology_field = geology["field_calculation"]["coefficients"]
+    assert igdi_field["K1"]["value"] == pytest.approx(1.75)
+    assert igdi_field["K3"]["value"] == pytest.approx(1.3)
+    assert geology_field["K1"]["value"] == pytest.approx(1.2)
+    assert geology_field["K3"]["value"] == pytest.approx(1.4)
+
+
+@pytest.mark.asyncio
+async def test_work_variants_stay_within_document():
+    data = _two_documents()
+    db = FakeDB(data)
+    # строка СБЦ ИГИ той же таблицы 9 не попадает в варианты строки СБЦ ИГДИ
+    variants = await db.get_work_variants(data["norm_items"][0], "category", ["II", "III"])
+    assert [w["id"] for w in variants.values()] == ["t9-ii", "t9-iii"]
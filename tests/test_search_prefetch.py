@@ -0,0 +1,46 @@
+"""
+Тесты спекулятивной загрузки кандидатов поиска (fetch_search_candidates, search_works_v2)
+"""
+import pytest
+
+from bot.services.ai_agent import AIAgent
+from bot.services.extractor import RuleExtractor
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+
+def _ids(result):
+    return [w["id"] for w in result.works]
+
+
+@pytest.mark.asyncio
+async def test_prefetched_candidates_skip_norm_items_queries():
+    db = FakeDB(CATALOG)
+    plain = await db.search_works_v2("План", scale="1:500", category="III")
+
+    prefetched = await db.fetch_search_candidates("План", "1:500")
+    calls = len(db.client.calls)
+    # категория известна только после LLM — фильтр применяется к готовым кандидатам
+    result = await db.search_works_v2("План", scale="1:500", category="III", prefetched=prefetched)
+    assert "norm_items" not in db.client.calls[calls:]
+    assert _ids(result) == _ids(plain) == ["t9-iii"]
+    assert result.search_terms_used == plain.search_terms_used
+
+
+@pytest.mark.asyncio
+async def test_mismatched_prefetch_is_refetched():
+    db = FakeDB(CATALOG)
+    prefetched = await db.fetch_search_candidates("План", "1:2000")
+    calls = len(db.client.calls)
+    result = await db.search_works_v2("План", scale="1:500", category="II", prefetched=prefetched)
+    assert "norm_items" in db.client.calls[calls:]
+    assert _ids(result) == ["t9-ii"]
+
+
+def test_guess_parameters_without_confidence():
+    agent = AIAgent("key", "model", extractor=RuleExtractor())
+    # объема нет — локальный разбор неуверенный, но тип работ и масштаб известны
+    guess = agent.guess_parameters("топоплан 1:500 для промплощадки, площадь уточню позже")
+    assert guess["work_type"] == "топографическая съемка" and guess["scale"] == "1:500"
+    assert agent.guess_parameters("Нужно посчитать смету") is None
+    assert AIAgent("key", "model").guess_parameters("топоплан 1:500") is None
@@ -0,0 +1,49 @@
+"""
+Тесты обратного расчета (объем под бюджет) против calculate_full
+"""
+import pytest
+
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [
+    {"territory_type": "промпредприятие", "include_program": True},
+    {"region_name": "Магаданская область", "distance_to_base_km": 3, "expedition_duration_months": 3},
+    {"region_name": "Москва", "distance_to_base_km": 20, "include_program": True},
+])
+@pytest.mark.parametrize("budget", [50_000, 300_000, 2_000_000])
+async def test_solved_quantity_is_max_within_budget(params, budget):
+    calc = CostCalculator(FakeDB(CATALOG))
+    solution = await calc.solve_quantity(dict(WORK), budget, params=dict(params))
+    assert solution.feasible and solution.quantity > 0
+
+    at = await calc.calculate_full(dict(WORK), solution.quantity, dict(params))
+    above = await calc.calculate_full(dict(WORK), round(solution.quantity + 0.01, 2), dict(params))
+    assert at["total_cost"] <= budget
+    assert above["total_cost"] > budget
+    assert solution.total_cost == pytest.approx(at["total_cost"], abs=0.011)
+
+
+@pytest.mark.asyncio
+async def test_solver_does_not_run_full_calculation(monkeypatch):
+    calc = CostCalculator(FakeDB(CATALOG))
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("calculate_full не должен вызываться")
+
+    monkeypatch.setattr(calc, "calculate_full", fail)
+    solution = await calc.solve_quantity(dict(WORK), 1_000_000, params={"distance_to_base_km": 3})
+    assert solution.feasible
+    assert solution.evaluations < 64
+
+
+@pytest.mark.asyncio
+async def test_budget_below_fixed_addons_is_infeasible():
+    calc = CostCalculator(FakeDB(CATALOG))
+    solution = await calc.solve_quantity(dict(WORK), 0.5, params={})
+    assert not solution.feasible and solution.quantity == 0
@@ -0,0 +1,48 @@
+"""
+Тесты векторного перебора вариантов (CostSweep) против calculate_full
+"""
+import itertools
+
+import pytest
+
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+
+@pytest.mark.asyncio
+async def test_work_variants_by_category():
+    db = FakeDB(CATALOG)
+    work = CATALOG["norm_items"][0]
+    variants = await db.get_work_variants(work, "category", ["II", "III", "IV", "V"])
+    assert list(variants) == ["II", "III", "IV"]
+    assert variants["IV"]["id"] == "t9-iv"
+
+
+@pytest.mark.asyncio
+async def test_sweep_matches_calculate_full(tmp_path):
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    works = await db.get_work_variants(CATALOG["norm_items"][0], "category", ["II", "III", "IV"])
+    params = {"territory_type": "промпредприятие", "expedition_duration_months": 3, "include_program": True}
+    quantities = [2, 50, 100, 150]
+    regions = ["Москва", "Магаданская область"]
+    distances = [None, 3, 20]
+
+    result = await calc.sweep(works, quantities, regions, distances, params=params)
+    assert result.shape == (4, 3, 2, 3)
+
+    for (iq, q), (ic, cat), (ir, region), (idist, d) in itertools.product(
+        enumerate(quantities), enumerate(result.categories), enumerate(regions), enumerate(distances)
+    ):
+        p = dict(params, region_name=region)
+        if d is not None:
+            p["distance_to_base_km"] = d
+        expected = await calc.calculate_full(dict(works[cat]), q, p)
+        assert result.total_cost[iq, ic, ir, idist] == expected["total_cost"], (q, cat, region, d)
+
+    out = tmp_path / "sweep.csv"
+    result.to_csv(str(out))
+    lines = out.read_text(encoding="utf-8-sig").splitlines()
+    assert lines[0].startswith("quantity;category;region")
+    assert len(lines) == 1 + 4 * 3 * 2 * 3
@@ -0,0 +1,74 @@
+"""
+Тесты шаблонов смет: разворачивание строк и пакетный расчет без LLM
+"""
+import copy
+
+import pytest
+
+from bot.services.calculator import CostCalculator
+from bot.services.templates import TemplateEngine
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+
+def _with_template():
+    data = copy.deepcopy(CATALOG)
+    data["estimate_templates"] = [{"id": "tpl-std", "name": "ИГДИ стандартный", "work_type": "ИГДИ"}]
+    rows = [
+        (1, "1. Полевые работы", "t9-ii", "Топоплан {scale}", None, {"quantity": "{area}", "scale": "{scale:1:500}"}),
+        (1, "1. Полевые работы", "t9-ii", "Топоплан, участок сложной категории", None,
+         {"quantity": "{area}", "category": "{category:IV}"}),
+        (1, "1. Полевые работы", "t9-iii", "Съемка подъездной дороги", 2, {}),
+        (2, "2. Камеральные работы", "t9-ii-2000", "Обзорный план 1:2000", None, {"quantity": "{area}"}),
+        (2, "2. Камеральные работы", "t9-iii", "Технический отчет", 1, {}),
+    ]
+    data["template_sections"] = [
+        {"id": f"row-{i}", "template_id": "tpl-std", "section_no": no, "section_name": name,
+         "norm_item_id": item, "title": title, "unit": "га", "default_qty": qty, "default_params": params}
+        for i, (no, name, item, title, qty, params) in enumerate(rows)
+    ]
+    return data
+
+
+@pytest.mark.asyncio
+async def test_template_from_one_message():
+    data = _with_template()
+    db = FakeDB(data)
+    calc = CostCalculator(db)
+    engine = TemplateEngine(calc)
+
+    estimate = await engine.from_message("Смета ИГДИ стандартный, 12 га, застроенная, Магаданская область")
+    assert estimate.priced and estimate.missing == []
+    assert [line.work["id"] for line in estimate.lines] == ["t9-ii", "t9-iv", "t9-iii", "t9-ii-2000", "t9-iii"]
+    assert [line.quantity for line in estimate.lines] == [12, 12, 2, 12, 1]
+    assert estimate.lines[0].title == "Топоплан 1:500"
+    # регион подбирается один раз на всю смету
+    assert db.client.calls.count("regional_unfavorable_periods") == 1
+
+    shared = {"territory_type": "застроенная", "region_name": "Магаданская область"}
+    expected = 0.0
+    for line, result in zip(estimate.lines, estimate.result["lines"]):
+        single = await calc.calculate_full(dict(line.work), line.quantity, {**shared, **line.params})
+        assert result["total_cost"] == pytest.approx(single["total_cost"], abs=0.001), line.title
+        expected += single["total_cost"]
+    assert estimate.result["total_cost"] == pytest.approx(expected, abs=0.011)
+
+
+@pytest.mark.asyncio
+async def test_template_asks_for_missing_values():
+    engine = TemplateEngine(CostCalculator(FakeDB(_with_template())))
+    assert await engine.from_message("Топосъемка 50 га М 1:500") is None
+
+    estimate = await engine.from_message("ИГДИ стандартный в Москве")
+    assert estimate.missing == ["area"] and not estimate.priced
+    assert estimate.values["region_name"] == "Москва"
+
+
+@pytest.mark.asyncio
+async def test_batch_applies_index_to_estimate_total():
+    data = _with_template()
+    calc = CostCalculator(FakeDB(data), index_period="2024Q1")
+    estimate = await TemplateEngine(calc).from_message("ИГДИ стандартный 3 га")
+    result = estimate.result
+    assert result["price_index"]["value"] == 5.83
+    assert result["total_with_index"] == pytest.approx(result["total_cost"] * 5.83, abs=0.01)
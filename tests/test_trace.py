@@ -0,0 +1,59 @@
+"""
+Тесты трассировки шагов calculate_full
+"""
+import pytest
+from loguru import logger
+
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {
+    "territory_type": "промпредприятие",
+    "region_name": "Магаданская область",
+    "distance_to_base_km": 3,
+    "include_program": True,
+}
+STAGE_STEPS = [f"{stage}.{k}" for stage in ("field", "office") for k in ("K1", "K2", "K3")]
+
+
+@pytest.mark.asyncio
+async def test_trace_is_opt_in():
+    calc = CostCalculator(FakeDB(CATALOG))
+    result = await calc.calculate_full(dict(WORK), 10, dict(PARAMS))
+    assert "trace" not in result
+
+
+@pytest.mark.asyncio
+async def test_trace_records_steps_and_db_calls():
+    db = FakeDB(CATALOG)
+    calc = CostCalculator(db)
+    lines = []
+    sink = logger.add(lambda m: lines.append(m.record["message"]), filter=lambda r: r["message"].startswith("trace "))
+    try:
+        result = await calc.calculate_full(dict(WORK), 10, dict(PARAMS), trace=True)
+    finally:
+        logger.remove(sink)
+
+    trace = result["trace"]
+    names = [s["step"] for s in trace["steps"]]
+    assert names[:3] == ["normalize", "region", "plan"]
+    assert names[3:9] == STAGE_STEPS
+    assert {"addons.internal", "addons.external", "addons.org_liq", "addons.piecewise"} <= set(names)
+    assert names[-1] == "total_coefficients"
+    by_name = {s["step"]: s for s in trace["steps"]}
+    assert by_name["region"]["db_calls"] > 0
+    # правила загружаются один раз при сборке плана, подбор K1/K2/K3 идет без БД
+    assert by_name["plan"]["db_calls"] > 0
+    assert by_name["field.K1"]["db_calls"] == 0 and not by_name["field.K1"].get("cached")
+    assert trace["db_calls"] >= sum(s["db_calls"] for s in trace["steps"])
+    assert trace["db_calls"] == db.query_count
+    assert all(s["ms"] >= 0 for s in trace["steps"])
+    assert len(lines) == 1 and "field.K1" in lines[0]
+
+    # повтор: коэффициенты из кэша, без запросов к БД
+    again = await calc.calculate_full(dict(WORK), 10, dict(PARAMS), trace=True)
+    cached = {s["step"]: s for s in again["trace"]["steps"]}
+    assert all(cached[name].get("cached") and cached[name]["db_calls"] == 0 for name in STAGE_STEPS)
+    assert again["total_cost"] == result["total_cost"]
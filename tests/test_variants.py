@@ -0,0 +1,46 @@
+"""
+Тесты расчета всех вариантов неоднозначного параметра против calculate_full
+"""
+import pytest
+
+from bot.services.calculator import CostCalculator
+from tests.fixtures.catalog import CATALOG
+from tests.fixtures.fake_db import FakeDB
+
+WORK = CATALOG["norm_items"][0]
+PARAMS = {"region_name": "Магаданская область", "distance_to_base_km": 3, "include_program": True}
+
+
+@pytest.mark.asyncio
+async def test_category_variants_match_calculate_full():
+    calc = CostCalculator(FakeDB(CATALOG))
+    comparison = await calc.price_variants(dict(WORK), 12, dict(PARAMS, territory_type="застроенная"), "category")
+
+    assert [v.value for v in comparison.variants] == ["II", "III", "IV"]
+    assert comparison.missing == ["I"]
+    for variant in comparison.variants:
+        expected = await calc.calculate_full(dict(variant.work), 12, dict(PARAMS, territory_type="застроенная"))
+        assert variant.total_cost == pytest.approx(expected["total_cost"], abs=0.011), variant.value
+
+    rows = comparison.rows()
+    assert rows[0]["delta"] == 0 and comparison.cheapest.value == "II"
+    assert all(row["delta"] > 0 for row in rows[1:])
+
+
+@pytest.mark.asyncio
+async def test_territory_variants_share_one_row(monkeypatch):
+    calc = CostCalculator(FakeDB(CATALOG))
+    expected = {}
+    for value in ("застроенная", "незастроенная", "промпредприятие"):
+        result = await calc.calculate_full(dict(WORK), 12, dict(PARAMS, territory_type=value))
+        expected[value] = result["total_cost"]
+
+    async def fail(*args, **kwargs):
+        raise AssertionError("calculate_full не должен вызываться")
+
+    monkeypatch.setattr(calc, "calculate_full", fail)
+    comparison = await calc.price_variants(dict(WORK), 12, dict(PARAMS, territory_type="промпредприятие"), "territory_type")
+    assert {v.work["id"] for v in comparison.variants} == {WORK["id"]}
+    for variant in comparison.variants:
+        assert variant.total_cost == pytest.approx(expected[variant.value], abs=0.011), variant.value
+    assert comparison.get("промпредприятие").total_cost > comparison.get("незастроенная").total_cost